@@ -30,8 +30,8 @@ PKPD functions
 # Pending:
 # Batch effects, Reese2013
 
-import distutils.spawn
 import os
+import shutil
 import subprocess
 import uuid
 import pwem as em
@@ -67,7 +67,7 @@ class Plugin(em.Plugin):
 
     @classmethod
     def getRscript(cls):
-        return distutils.spawn.find_executable("Rscript")
+        return shutil.which("Rscript")
 
     @classmethod
     def runRscript(cls, scriptString):
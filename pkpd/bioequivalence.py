@@ -0,0 +1,357 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (info@kinestat.com)
+# *
+# * Kinestat Pharma
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'info@kinestat.com'
+# *
+# **************************************************************************
+"""
+Power and sample size of bioequivalence studies.
+
+The formulas follow the R package PowerTOST (pa.ABE, pa.scABE and pa.NTIDFDA):
+average bioequivalence is computed exactly (Owen's Q, written as an integral
+over the distribution of the estimated standard error), scaled average
+bioequivalence and the FDA method for narrow therapeutic index drugs are
+simulated from their key statistics. All the functions accept arrays of CV and
+theta0, so that a whole power curve is computed in one call.
+"""
+
+import math
+
+import numpy as np
+from scipy import optimize, stats
+
+# Design: (degrees of freedom as a function of the number of subjects n, bkni, number of sequences)
+# The variance of the treatment difference is bkni*sum(1/ni)*mse, with ni the subjects in each sequence
+BE_DESIGNS = {
+    '2x2x2': (lambda n: n-2,   1.0/2,  2),
+    '2x2x3': (lambda n: 2*n-3, 3.0/8,  2),
+    '2x2x4': (lambda n: 3*n-4, 1.0/4,  2),
+    '2x3x3': (lambda n: 2*n-3, 1.0/6,  3),
+    '2x4x2': (lambda n: n-2,   1.0/2,  4),
+    '2x4x4': (lambda n: 3*n-4, 1.0/16, 4),
+    '3x6x3': (lambda n: 2*n-4, 1.0/18, 6),
+    '4x4':   (lambda n: 3*n-6, 1.0/8,  4),
+}
+
+# Degrees of freedom of the within-subject variances of the reference and test formulations in replicate designs
+BE_REPLICATE_DF = {
+    '2x2x3': (lambda n: n//2-1, lambda n: n//2-1),
+    '2x2x4': (lambda n: n-2,    lambda n: n-2),
+    '2x3x3': (lambda n: n-3,    lambda n: n-3),
+}
+
+# Regulatory constants of scaled average bioequivalence: (method, r_const, CVswitch, CVcap)
+BE_REGULATORS = {
+    'EMA': ('ABEL',  0.76, 0.3, 0.5),
+    'HC':  ('ABEL',  0.76, 0.3, 0.57382),
+    'FDA': ('RSABE', math.log(1.25)/0.25, 0.3, np.inf),
+    'GCC': ('ABEL',  math.log(1/0.75)/math.sqrt(math.log(1.3**2+1)), 0.3, 0.3),
+}
+
+# Number of simulations and seed for the simulated powers
+BE_NSIMS = 100000
+BE_SEED = 123456
+
+# Gauss-Legendre panels and nodes for the exact power of the TOST procedure
+_GL_PANELS = 16
+_GL_NODES, _GL_WEIGHTS = np.polynomial.legendre.leggauss(32)
+
+
+def CV2mse(CV):
+    return np.log(np.asarray(CV, dtype=np.float64)**2+1)
+
+
+def mse2CV(mse):
+    return np.sqrt(np.exp(mse)-1)
+
+
+def sequenceSizes(n, Nseq):
+    # Subjects in each sequence, as balanced as possible (the first sequences take the remainder)
+    ni = np.full(Nseq, n//Nseq)
+    ni[0:n-Nseq*(n//Nseq)] += 1
+    return ni
+
+
+def getDesignConstants(n, design):
+    """ Degrees of freedom and factor of the variance of the difference (bkni*sum(1/ni)) for n subjects """
+    if not design in BE_DESIGNS:
+        raise Exception("Unknown design %s"%design)
+    dfFunction, bkni, Nseq = BE_DESIGNS[design]
+    ni = sequenceSizes(int(n), Nseq)
+    if np.any(ni==0):
+        return 0, np.inf
+    return dfFunction(int(n)), bkni*np.sum(1.0/ni)
+
+
+def getMinimumN(design):
+    # Smallest number of subjects with at least one subject per sequence and positive degrees of freedom
+    n = BE_DESIGNS[design][2]
+    while getDesignConstants(n, design)[0]<1:
+        n += 1
+    return n
+
+
+def powerTOST(CV, theta0, n, design='2x2x2', theta1=0.8, theta2=1.25, alpha=0.05):
+    """ Exact power of the two one-sided tests procedure (average bioequivalence). CV and theta0 may be arrays.
+        Given the estimated standard error, the power is a difference of normal probabilities. It is
+        integrated over the chi distribution of the standard error (this is Owen's Q function) """
+    df, C2 = getDesignConstants(n, design)
+    CV, theta0 = np.broadcast_arrays(np.asarray(CV, dtype=np.float64), np.asarray(theta0, dtype=np.float64))
+    if df<1:
+        return np.zeros(CV.shape)
+    se = np.sqrt(C2*CV2mse(CV))[...,np.newaxis]
+    delta = np.log(theta0)[...,np.newaxis]
+    ltheta1 = math.log(theta1)
+    ltheta2 = math.log(theta2)
+    tcrit = stats.t.ppf(1-alpha, df)
+
+    # The acceptance region is not empty while s=sehat/se < smax. The integral is split in panels with the same
+    # probability of the chi2 distribution, so that its peak is always sampled
+    # (the negligible tail of the chi2 distribution beyond its 1-1e-12 quantile is not integrated)
+    smax = np.minimum((ltheta2-ltheta1)/(2*tcrit*se), math.sqrt(stats.chi2.ppf(1-1e-12, df)/df))
+    umax = stats.chi2.cdf(df*smax*smax, df)
+    edges = np.sqrt(stats.chi2.ppf(umax*np.linspace(0, 1, _GL_PANELS+1), df)/df)
+    halfWidth = (0.5*(edges[...,1:]-edges[...,:-1]))[...,np.newaxis]
+    s = (0.5*(edges[...,1:]+edges[...,:-1]))[...,np.newaxis]+halfWidth*_GL_NODES
+    density = 2*df*s*stats.chi2.pdf(df*s*s, df)
+    se = se[...,np.newaxis]
+    delta = delta[...,np.newaxis]
+    integrand = stats.norm.cdf((ltheta2-tcrit*se*s-delta)/se)-stats.norm.cdf((ltheta1+tcrit*se*s-delta)/se)
+    power = np.sum(halfWidth*_GL_WEIGHTS*np.clip(integrand, 0.0, None)*density, axis=(-2,-1))
+    return np.clip(power, 0.0, 1.0)
+
+
+class BESimulation:
+    """ Key statistics of a bioequivalence study with n subjects (point estimate of the difference, mean squared
+        error and within-subject variances of the reference and test), simulated for a CV of 1 in the log scale.
+        The same random draws are scaled for every CV and theta0 so that power curves are smooth """
+    def __init__(self, n, design, nsims=BE_NSIMS, seed=BE_SEED):
+        self.n = int(n)
+        self.df, self.C2 = getDesignConstants(n, design)
+        dfRR, dfTT = BE_REPLICATE_DF[design]
+        self.dfRR = dfRR(self.n)
+        self.dfTT = dfTT(self.n)
+        rng = np.random.RandomState(seed)
+        self.z = rng.standard_normal(nsims)
+        self.chiMse = rng.chisquare(max(self.df, 1), nsims)/max(self.df, 1)
+        self.chiRR = rng.chisquare(max(self.dfRR, 1), nsims)/max(self.dfRR, 1)
+        self.chiTT = rng.chisquare(max(self.dfTT, 1), nsims)/max(self.dfTT, 1)
+
+    def isValid(self):
+        return self.df>=1 and self.dfRR>=1 and self.dfTT>=1
+
+    def getStatistics(self, CV, theta0):
+        # Arrays with one row per value of CV/theta0 and one column per simulation
+        s2w = CV2mse(CV)[...,np.newaxis]
+        pe = np.log(theta0)[...,np.newaxis]+np.sqrt(self.C2*s2w)*self.z
+        mse = s2w*self.chiMse
+        s2wR = s2w*self.chiRR
+        s2wT = s2w*self.chiTT
+        return pe, mse, s2wR, s2wT
+
+    def power(self, CV, theta0, isBE):
+        """ Fraction of the simulations in which isBE(pe, mse, s2wR, s2wT) is True, for each value of CV and
+            theta0. The values are processed in blocks to limit the memory """
+        CV, theta0 = np.broadcast_arrays(np.asarray(CV, dtype=np.float64), np.asarray(theta0, dtype=np.float64))
+        if not self.isValid():
+            return np.zeros(CV.shape)
+        CVflat = CV.ravel()
+        theta0flat = theta0.ravel()
+        power = np.zeros(CVflat.size)
+        blockSize = max(1, 2000000//self.z.size)
+        for i0 in range(0, CVflat.size, blockSize):
+            i1 = min(i0+blockSize, CVflat.size)
+            power[i0:i1] = np.mean(isBE(*self.getStatistics(CVflat[i0:i1], theta0flat[i0:i1])), axis=-1)
+        return power.reshape(CV.shape)
+
+
+def _isABE(pe, hw, lower, upper):
+    return np.logical_and(pe-hw>=lower, pe+hw<=upper)
+
+
+def _howeBound(pe, hw, s2wR, rconst, dfRR, alpha):
+    # Upper bound of the linearized scaled criterion pe^2-rconst^2*s2wR (Howe's approximation)
+    Em = pe*pe
+    Es = rconst*rconst*s2wR
+    Cm = (np.abs(pe)+hw)**2
+    Cs = Es*dfRR/stats.chi2.ppf(1-alpha, dfRR)
+    return Em-Es+np.sqrt((Cm-Em)**2+(Cs-Es)**2)
+
+
+def powerScABE(CV, theta0, n, design='2x3x3', regulator='EMA', theta1=0.8, theta2=1.25, alpha=0.05,
+               nsims=BE_NSIMS, simulation=None):
+    """ Simulated power of scaled average bioequivalence (ABEL for EMA, HC and GCC; RSABE for FDA).
+        The within-subject CV of test and reference are assumed to be the same. CV and theta0 may be arrays """
+    if simulation is None:
+        simulation = BESimulation(n, design, nsims)
+    method, rconst, CVswitch, CVcap = BE_REGULATORS[regulator]
+    tcrit = stats.t.ppf(1-alpha, simulation.df)
+    ltheta1 = math.log(theta1)
+    ltheta2 = math.log(theta2)
+
+    def isBE(pe, mse, s2wR, s2wT):
+        hw = tcrit*np.sqrt(simulation.C2*mse)
+        if method=='ABEL':
+            swR = np.sqrt(np.minimum(s2wR, CV2mse(CVcap)))
+            scaled = _isABE(pe, hw, -rconst*swR, rconst*swR)
+        else:
+            scaled = _howeBound(pe, hw, s2wR, rconst, simulation.dfRR, alpha)<=0
+        BE = np.where(mse2CV(s2wR)<=CVswitch, _isABE(pe, hw, ltheta1, ltheta2), scaled)
+        # Point estimate constraint
+        return BE & (pe>=ltheta1) & (pe<=ltheta2)
+    return simulation.power(CV, theta0, isBE)
+
+
+def powerNTIDFDA(CV, theta0, n, design='2x2x4', theta1=0.8, theta2=1.25, alpha=0.05, nsims=BE_NSIMS,
+                 simulation=None):
+    """ Simulated power of the FDA method for narrow therapeutic index drugs: scaled criterion (without switching
+        CV), conventional ABE and upper limit of the 90% confidence interval of sWT/sWR below 2.5 """
+    if simulation is None:
+        simulation = BESimulation(n, design, nsims)
+    rconst = -math.log(0.9)/0.1
+    tcrit = stats.t.ppf(1-alpha, simulation.df)
+    ltheta1 = math.log(theta1)
+    ltheta2 = math.log(theta2)
+    Fcrit = stats.f.ppf(0.05, simulation.dfTT, simulation.dfRR) if simulation.isValid() else 1.0
+
+    def isBE(pe, mse, s2wR, s2wT):
+        hw = tcrit*np.sqrt(simulation.C2*mse)
+        scaled = _howeBound(pe, hw, s2wR, rconst, simulation.dfRR, alpha)<=0
+        return scaled & _isABE(pe, hw, ltheta1, ltheta2) & (np.sqrt(s2wT/s2wR/Fcrit)<=2.5)
+    return simulation.power(CV, theta0, isBE)
+
+
+class BEPower:
+    """ Power of one bioequivalence method as a function of CV, theta0 and the number of subjects """
+    METHOD_ABE = 'ABE'
+    METHOD_scABE = 'scABE'
+    METHOD_NTIDFDA = 'NTIDFDA'
+
+    def __init__(self, method, design, regulator='EMA', theta1=0.8, theta2=1.25, alpha=0.05, nsims=BE_NSIMS):
+        self.method = method
+        self.design = design
+        self.regulator = regulator
+        self.theta1 = theta1
+        self.theta2 = theta2
+        self.alpha = alpha
+        self.nsims = nsims
+        self.simulations = {}
+        if method!=self.METHOD_ABE and not design in BE_REPLICATE_DF:
+            raise Exception("The design %s is not valid for %s"%(design, method))
+        if method==self.METHOD_scABE and not regulator in BE_REGULATORS:
+            raise Exception("Unknown regulator %s"%regulator)
+
+    def getSimulation(self, n):
+        # Only the simulation of the last number of subjects is kept
+        if not n in self.simulations:
+            self.simulations = {n: BESimulation(n, self.design, self.nsims)}
+        return self.simulations[n]
+
+    def power(self, CV, theta0, n):
+        if self.method==self.METHOD_ABE:
+            return powerTOST(CV, theta0, n, self.design, self.theta1, self.theta2, self.alpha)
+        elif self.method==self.METHOD_scABE:
+            return powerScABE(CV, theta0, n, self.design, self.regulator, self.theta1, self.theta2, self.alpha,
+                              simulation=self.getSimulation(n))
+        else:
+            return powerNTIDFDA(CV, theta0, n, self.design, self.theta1, self.theta2, self.alpha,
+                                simulation=self.getSimulation(n))
+
+    def sampleSize(self, CV, theta0, targetPower, nmax=10000):
+        """ Smallest balanced number of subjects whose power is at least targetPower. It returns (n, power) """
+        Nseq = BE_DESIGNS[self.design][2]
+        n = getMinimumN(self.design)
+        n += (-n)%Nseq
+        # Start from the large sample approximation of average bioequivalence with the same limits
+        df, C2 = getDesignConstants(n, self.design)
+        delta = min(math.log(self.theta2)-math.log(theta0), math.log(theta0)-math.log(self.theta1))
+        if delta>0:
+            z = stats.norm.ppf(1-self.alpha)+stats.norm.ppf(1-(1-targetPower)/2 if abs(math.log(theta0))<1e-10
+                                                            else targetPower)
+            nApprox = int(math.ceil(C2*n*CV2mse(CV)*(z/delta)**2))
+            nApprox += (-nApprox)%Nseq
+            n = max(n, nApprox-2*Nseq)
+        power = float(self.power(CV, theta0, n))
+        if power>=targetPower:
+            # Go down while the target is still achieved
+            while n-Nseq>=getMinimumN(self.design):
+                powerPrevious = float(self.power(CV, theta0, n-Nseq))
+                if powerPrevious<targetPower:
+                    break
+                n -= Nseq
+                power = powerPrevious
+        else:
+            while power<targetPower:
+                n += Nseq
+                if n>nmax:
+                    raise Exception("The target power cannot be achieved with less than %d subjects"%nmax)
+                power = float(self.power(CV, theta0, n))
+        return n, power
+
+
+def _firstCrossing(x, power, minPower, powerFunction):
+    # Value of x at which the power curve falls below minPower for the first time. It is located on the grid and
+    # then refined with Brent's method
+    below = np.where(power<minPower)[0]
+    if len(below)==0:
+        return x[-1]
+    i = below[0]
+    if i==0:
+        return x[0]
+    return optimize.brentq(lambda xi: float(powerFunction(xi))-minPower, x[i-1], x[i], xtol=1e-6)
+
+
+def powerAnalysis(bePower, CV, theta0, minPower=0.7, targetPower=0.8, Npoints=50):
+    """ Sample size for the target power and deviations of CV, theta0 and the number of subjects that keep the power
+        above minPower. It returns a dictionary with the sample size and the power curves """
+    n, power = bePower.sampleSize(CV, theta0, targetPower)
+    retval = {'n': n, 'power': power, 'CV': CV, 'theta0': theta0}
+
+    # Power as a function of CV (all points in one call)
+    CVs = np.linspace(CV, 3*CV, Npoints)
+    powerCV = bePower.power(CVs, theta0, n)
+    retval['curveCV'] = (CVs, powerCV)
+    retval['CVmax'] = _firstCrossing(CVs, powerCV, minPower, lambda CVi: bePower.power(CVi, theta0, n))
+
+    # Power as a function of theta0, moving away from 1
+    if theta0<1:
+        theta0s = np.linspace(theta0, bePower.theta1, Npoints+1)[:-1]
+    else:
+        theta0s = np.linspace(theta0, bePower.theta2, Npoints+1)[:-1]
+    powerTheta0 = bePower.power(CV, theta0s, n)
+    retval['curveTheta0'] = (theta0s, powerTheta0)
+    retval['theta0lim'] = _firstCrossing(theta0s, powerTheta0, minPower,
+                                         lambda theta0i: bePower.power(CV, theta0i, n))
+
+    # Power as a function of the number of subjects (dropouts, possibly unbalanced)
+    ns = [n]
+    powerN = [power]
+    while ns[-1]-1>=getMinimumN(bePower.design) and powerN[-1]>=minPower:
+        ns.append(ns[-1]-1)
+        powerN.append(float(bePower.power(CV, theta0, ns[-1])))
+    ns = np.asarray(ns)
+    powerN = np.asarray(powerN)
+    retval['curveN'] = (ns, powerN)
+    ok = np.where(powerN>=minPower)[0]
+    retval['nmin'] = ns[ok[-1]]
+    retval['powerNmin'] = powerN[ok[-1]]
+    return retval
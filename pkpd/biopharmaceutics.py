@@ -31,8 +31,6 @@ import math
 import numpy as np
 from .pkpd_units import PKPDUnit, changeRateToWeight, divideUnits, inverseUnits
 from pkpd.utils import uniqueFloatValues, excelWriteRow
-from scipy.interpolate import InterpolatedUnivariateSpline, PchipInterpolator
-from scipy.special import lambertw, wrightomega
 
 class BiopharmaceuticsModel:
     def __init__(self):
@@ -67,8 +65,14 @@ class BiopharmaceuticsModel:
         self.parameters = parameters
 
     def getAg(self,t):
-        # Total amount of drug that is available at time t
-        return 0.0
+        # Total amount of drug that is available at time t (t may be a scalar or an array)
+        return self.returnAg(t, np.zeros(np.shape(t)))
+
+    def returnAg(self, t, Ag):
+        # Scalar times produce scalar amounts
+        if np.ndim(t)==0:
+            return float(Ag)
+        return Ag
 
     def getEquation(self):
         return ""
@@ -116,10 +120,10 @@ class BiopharmaceuticsModelOrder0(BiopharmaceuticsModel):
         return self.parameterUnits
 
     def getAg(self,t):
-        if t<0:
-            return 0.0
+        t = np.asarray(t,dtype=np.float64)
         Rin = self.parameters[0]
-        return max(self.Amax-Rin*t,0.0)
+        Ag = np.where(t<0, 0.0, np.maximum(self.Amax-Rin*t,0.0))
+        return self.returnAg(t, Ag)
 
     def getEquation(self):
         Rin = self.parameters[0]
@@ -149,16 +153,13 @@ class BiopharmaceuticsModelOrder01(BiopharmaceuticsModel):
         return self.parameterUnits
 
     def getAg(self,t):
-        if t<0:
-            return 0.0
+        t = np.asarray(t,dtype=np.float64)
         Rin = self.parameters[0]
         t0 = self.parameters[1]
         Ka = self.parameters[2]
-        if t<t0:
-            return max(self.Amax-Rin*t,0.0)
-        else:
-            A0=max(self.Amax-Rin*t0,0.0)
-            return A0*math.exp(-Ka*(t-t0))
+        A0=max(self.Amax-Rin*t0,0.0)
+        Ag = np.where(t<t0, np.maximum(self.Amax-Rin*t,0.0), A0*np.exp(-Ka*np.maximum(t-t0,0.0)))
+        return self.returnAg(t, np.where(t<0, 0.0, Ag))
 
     def getEquation(self):
         Rin = self.parameters[0]
@@ -186,19 +187,16 @@ class BiopharmaceuticsModelOrder01Tlag1(BiopharmaceuticsModel):
         return self.parameterUnits
 
     def getAg(self,t):
-        if t<0:
-            return 0.0
+        t = np.asarray(t,dtype=np.float64)
         F0 = self.parameters[0]
         Rin = self.parameters[1]
         if Rin<0.0:
-            return 0.0
+            return self.returnAg(t, np.zeros(t.shape))
         tlag1 = self.parameters[2]
         Ka = self.parameters[3]
-        A=self.Amax
-        A-=min(self.Amax*F0,Rin*t)
-        if t>tlag1:
-            A-=self.Amax*(1-F0)*(1-math.exp(-Ka*(t-tlag1)))
-        return A
+        A=self.Amax-np.minimum(self.Amax*F0,Rin*t)
+        A-=np.where(t>tlag1, self.Amax*(1-F0)*(1-np.exp(-Ka*np.maximum(t-tlag1,0.0))), 0.0)
+        return self.returnAg(t, np.where(t<0, 0.0, A))
 
     def getEquation(self):
         F0 = self.parameters[0]
@@ -225,10 +223,10 @@ class BiopharmaceuticsModelOrder1(BiopharmaceuticsModel):
         return self.parameterUnits
 
     def getAg(self,t):
-        if t<0:
-            return 0.0
+        t = np.asarray(t,dtype=np.float64)
         Ka = self.parameters[0]
-        return self.Amax*math.exp(-Ka*t)
+        Ag = np.where(t<0, 0.0, self.Amax*np.exp(-Ka*np.maximum(t,0.0)))
+        return self.returnAg(t, Ag)
 
     def getEquation(self):
         Ka = self.parameters[0]
@@ -253,15 +251,14 @@ class BiopharmaceuticsModelOrderFractional(BiopharmaceuticsModel):
         return self.paramterUnits
 
     def getAg(self,t):
-        if t<=0:
-            return 0.0
+        t = np.asarray(t,dtype=np.float64)
         Amax = self.parameters[0]
         K = self.parameters[1]
         alpha = self.parameters[2]
         aux = alpha*K*t
-        if aux>Amax:
-            return Amax
-        return Amax-math.pow(math.pow(Amax,alpha)-aux,1.0/alpha)
+        with np.errstate(invalid='ignore'):
+            Ag = np.where(aux>Amax, Amax, Amax-np.power(math.pow(Amax,alpha)-aux,1.0/alpha))
+        return self.returnAg(t, np.where(t<=0, 0.0, Ag))
 
     def getEquation(self):
         Amax = self.parameters[0]
@@ -291,11 +288,11 @@ class BiopharmaceuticsModelImmediateAndOrder1(BiopharmaceuticsModel):
         return self.parameterUnits
 
     def getAg(self,t):
-        if t<0:
-            return 0.0
+        t = np.asarray(t,dtype=np.float64)
         Ka = self.parameters[0]
         F = self.parameters[1]
-        return self.Amax*(1-F)*math.exp(-Ka*t)
+        Ag = np.where(t<0, 0.0, self.Amax*(1-F)*np.exp(-Ka*np.maximum(t,0.0)))
+        return self.returnAg(t, Ag)
 
     def getEquation(self):
         Ka = self.parameters[0]
@@ -322,17 +319,15 @@ class BiopharmaceuticsModelOrder1AndOrder1(BiopharmaceuticsModel):
         return self.parameterUnits
 
     def getAg(self,t):
-        if t<0:
-            return 0.0
+        t = np.asarray(t,dtype=np.float64)
         Ka1 = self.parameters[0]
         Ka2 = self.parameters[1]
         tlag12 = self.parameters[2]
         F1 = self.parameters[3]
-        A1=F1*math.exp(-Ka1*t)
-        A2=1-F1
-        if t>tlag12:
-            A2=(1-F1)*math.exp(-Ka2*(t-tlag12))
-        return self.Amax*(A1+A2)
+        tpos = np.maximum(t,0.0)
+        A1=F1*np.exp(-Ka1*tpos)
+        A2=np.where(t>tlag12, (1-F1)*np.exp(-Ka2*np.maximum(t-tlag12,0.0)), 1-F1)
+        return self.returnAg(t, np.where(t<0, 0.0, self.Amax*(A1+A2)))
 
     def getEquation(self):
         Ka1 = self.parameters[0]
@@ -375,8 +370,8 @@ class BiopharmaceuticsModelOrder1AndOrder1Saturable(BiopharmaceuticsModel):
         return self.parameterUnits
 
     def getAg(self,t):
-        if t<0:
-            return 0.0
+        from scipy.special import lambertw, wrightomega
+        t = np.asarray(t,dtype=np.float64)
         ka1max = self.parameters[0]
         kamt150 = self.parameters[1]
         gamma = self.parameters[2]
@@ -384,33 +379,34 @@ class BiopharmaceuticsModelOrder1AndOrder1Saturable(BiopharmaceuticsModel):
         kamt350 = self.parameters[4]
         F3 = self.parameters[5]
         if gamma<0 or F3<0 or F3>1:
-            return 0.0
-
-        try:
-            A50 = kamt150
-            Ka = ka1max
-            A0 = F3*self.Amax
-            arg = math.exp(-(Ka * t - A50 * math.log(A0 * math.exp(A0 / A50))) / A50) / A50
-            Aslow = A50 * lambertw(arg)
-        except:
-            Aslow = 0.0
-
-        try:
-            A50 = kamt350
-            Ka = ka3max
-            A0 = (1-F3)*self.Amax
-            A0gamma = math.pow(A0,gamma)
-            A50gamma = math.pow(A50,gamma)
-            A0log = math.log(A0)
-            Arapid = math.exp(((A0gamma + A50gamma * gamma * A0log) / gamma - Ka * t) / A50gamma -
-                         wrightomega(math.log(1 / A50gamma) +
-                                    (gamma * ((A0gamma + A50gamma * gamma * A0log) / gamma - Ka * t)) / A50gamma) / gamma)
-        except:
-            Arapid = 0.0
-        retval = Aslow+Arapid
-        if np.iscomplexobj(retval):
-            retval = np.real(retval)
-        return retval
+            return self.returnAg(t, np.zeros(t.shape))
+
+        # Amounts that cannot be computed (overflows, invalid logarithms, ...) are taken as 0
+        with np.errstate(all='ignore'):
+            try:
+                A50 = kamt150
+                Ka = ka1max
+                A0 = F3*self.Amax
+                arg = np.exp(-(Ka * t - A50 * math.log(A0 * math.exp(A0 / A50))) / A50) / A50
+                Aslow = np.real(A50 * lambertw(arg))
+                Aslow = np.where(np.isfinite(arg) & np.isfinite(Aslow), Aslow, 0.0)
+            except (ValueError, OverflowError, ZeroDivisionError):
+                Aslow = np.zeros(t.shape)
+
+            try:
+                A50 = kamt350
+                Ka = ka3max
+                A0 = (1-F3)*self.Amax
+                A0gamma = math.pow(A0,gamma)
+                A50gamma = math.pow(A50,gamma)
+                A0log = math.log(A0)
+                Arapid = np.exp(((A0gamma + A50gamma * gamma * A0log) / gamma - Ka * t) / A50gamma -
+                             wrightomega(math.log(1 / A50gamma) +
+                                        (gamma * ((A0gamma + A50gamma * gamma * A0log) / gamma - Ka * t)) / A50gamma) / gamma)
+                Arapid = np.where(np.isfinite(Arapid), np.real(Arapid), 0.0)
+            except (ValueError, OverflowError, ZeroDivisionError):
+                Arapid = np.zeros(t.shape)
+        return self.returnAg(t, np.where(t<0, 0.0, Aslow+Arapid))
 
     def getEquation(self):
         ka1max = self.parameters[0]
@@ -462,8 +458,7 @@ class BiopharmaceuticsModelDoubleWeibull(BiopharmaceuticsModel):
         return self.parameterUnits
 
     def getAg(self,t):
-        if t<0:
-            return 0.0
+        t = np.asarray(t,dtype=np.float64)
         td1 = self.parameters[0]
         b1 = self.parameters[1]
         F1 = self.parameters[2]
@@ -472,12 +467,9 @@ class BiopharmaceuticsModelDoubleWeibull(BiopharmaceuticsModel):
         tlag2 = self.parameters[5]
 
         t2 = t-tlag2
-        f1 = F1*math.exp(-math.pow(t/td1,b1))
-        if t2>=0:
-            f2=(1-F1)*math.exp(-math.pow(t2/td2,b2))
-        else:
-            f2=(1-F1)
-        return max(self.Amax*(f1+f2),0.0)
+        f1 = F1*np.exp(-np.power(np.maximum(t,0.0)/td1,b1))
+        f2 = np.where(t2>=0, (1-F1)*np.exp(-np.power(np.maximum(t2,0.0)/td2,b2)), 1-F1)
+        return self.returnAg(t, np.where(t<0, 0.0, np.maximum(self.Amax*(f1+f2),0.0)))
 
     def getEquation(self):
         td1 = self.parameters[0]
@@ -515,8 +507,7 @@ class BiopharmaceuticsModelTripleWeibull(BiopharmaceuticsModel):
         return self.parameterUnits
 
     def getAg(self,t):
-        if t<=0:
-            return 0.0
+        t = np.asarray(t,dtype=np.float64)
         td1 = self.parameters[0]
         b1 = self.parameters[1]
         F1 = self.parameters[2]
@@ -528,18 +519,12 @@ class BiopharmaceuticsModelTripleWeibull(BiopharmaceuticsModel):
         b3 = self.parameters[8]
         tlag3 = self.parameters[9]
 
-        f1 = F1*math.exp(-math.pow(t/td1,b1))
+        f1 = F1*np.exp(-np.power(np.maximum(t,0.0)/td1,b1))
         t2 = t-tlag2
-        if t2>0:
-            f2=F2*math.exp(-math.pow(t2/td2,b2))
-        else:
-            f2=0
+        f2 = np.where(t2>0, F2*np.exp(-np.power(np.maximum(t2,0.0)/td2,b2)), 0.0)
         t3 = t-tlag3
-        if t3>0:
-            f3=(1-F1-F2)*math.exp(-math.pow(t3/td3,b3))
-        else:
-            f3=0
-        return self.Amax*(f1+f2+f3)
+        f3 = np.where(t3>0, (1-F1-F2)*np.exp(-np.power(np.maximum(t3,0.0)/td3,b3)), 0.0)
+        return self.returnAg(t, np.where(t<=0, 0.0, self.Amax*(f1+f2+f3)))
 
     def getEquation(self):
         td1 = self.parameters[0]
@@ -589,19 +574,19 @@ class BiopharmaceuticsModelOrder1Multiple4(BiopharmaceuticsModel):
         return self.parameterUnits
 
     def getAg(self,t):
-        if t<0:
-            return 0.0
+        t = np.asarray(t,dtype=np.float64)
         F1 = self.parameters[0]
         Ka1 = self.parameters[1]
         Fmed = self.parameters[2]
         Kamed = self.parameters[3]
         Fslow = self.parameters[4]
         Kaslow = self.parameters[5]
-        via1 = F1*math.exp(-Ka1*t)
+        tpos = np.maximum(t,0.0)
+        via1 = F1*np.exp(-Ka1*tpos)
         viafast = (1-F1)*(1-Fmed-Fslow)
-        viamed = (1-F1)*Fmed*math.exp(-Kamed*t)
-        viaslow = (1-F1)*Fslow*math.exp(-Kaslow*t)
-        return self.Amax*(via1 + viafast + viamed + viaslow)
+        viamed = (1-F1)*Fmed*np.exp(-Kamed*tpos)
+        viaslow = (1-F1)*Fslow*np.exp(-Kaslow*tpos)
+        return self.returnAg(t, np.where(t<0, 0.0, self.Amax*(via1 + viafast + viamed + viaslow)))
 
     def getEquation(self):
         F1 = self.parameters[0]
@@ -646,12 +631,8 @@ class BiopharmaceuticsModelSplineGeneric(BiopharmaceuticsModel):
         retval[1:]=np.sort(retval[1:])
         return retval
 
-    def getAg(self,t):
-        if t<=0:
-            return self.Amax
-        self.tmax=self.parameters[0]
-        if t>=self.tmax or self.tmax<=0:
-            return 0.0
+    def prepareSpline(self):
+        from scipy.interpolate import PchipInterpolator
         if self.parametersPrepared is None or not np.array_equal(self.parametersPrepared,self.parameters):
             self.knots = np.linspace(0, self.tmax, self.nknots+2)
             self.parameters[1:] = np.sort(self.parameters[1:])
@@ -668,10 +649,18 @@ class BiopharmaceuticsModelSplineGeneric(BiopharmaceuticsModel):
                 print("Error en spline",self.knots, self.knotsY, knotsUnique, knotsYUnique)
                 raise Exception("Bug in spline")
             self.parametersPrepared=copy.copy(self.parameters)
-        fraction=self.B(t)
-        fraction=np.clip(fraction,0.0,1.0)
-        #print("getAg t= %f B(t)= %f fraction= %f Ag= %f"%(t,self.B(t),fraction,self.Amax*(1-fraction)))
-        return self.Amax*(1-fraction)
+
+    def getAg(self,t):
+        t = np.asarray(t,dtype=np.float64)
+        self.tmax=self.parameters[0]
+        Ag = np.zeros(t.shape)
+        inside = (t>0) & (t<self.tmax)
+        if self.tmax>0 and np.any(inside):
+            self.prepareSpline()
+            fraction=np.clip(self.B(t[inside]),0.0,1.0)
+            Ag[inside] = self.Amax*(1-fraction)
+        Ag[t<=0] = self.Amax
+        return self.returnAg(t, Ag)
 
     def getEquation(self):
         self.knotsY=np.sort(self.knotsY)
@@ -809,12 +798,8 @@ class BiopharmaceuticsModelSplineXYGeneric(BiopharmaceuticsModel):
         retval[2::2]=np.sort(retval[2::2])
         return retval
 
-    def getAg(self,t):
-        if t<=0:
-            return self.Amax
-        self.tmax=self.parameters[0]
-        if t>=self.tmax or self.tmax<=0:
-            return 0.0
+    def prepareSpline(self):
+        from scipy.interpolate import PchipInterpolator
         if self.parametersPrepared is None or not np.array_equal(self.parametersPrepared,self.parameters):
             self.parameters[1::2]=np.sort(self.parameters[1::2])
             self.parameters[2::2]=np.sort(self.parameters[2::2])
@@ -833,10 +818,18 @@ class BiopharmaceuticsModelSplineXYGeneric(BiopharmaceuticsModel):
                 print("Error en splineXY",self.knots, self.knotsY, knotsUnique, knotsYUnique)
                 raise Exception("Bug in spline")
             self.parametersPrepared=copy.copy(self.parameters)
-        fraction=self.B(t)
-        fraction=np.clip(fraction,0.0,1.0)
-        #print("getAg t= %f B(t)= %f fraction= %f Ag= %f"%(t,self.B(t),fraction,self.Amax*(1-fraction)))
-        return self.Amax*(1-fraction)
+
+    def getAg(self,t):
+        t = np.asarray(t,dtype=np.float64)
+        self.tmax=self.parameters[0]
+        Ag = np.zeros(t.shape)
+        inside = (t>0) & (t<self.tmax)
+        if self.tmax>0 and np.any(inside):
+            self.prepareSpline()
+            fraction=np.clip(self.B(t[inside]),0.0,1.0)
+            Ag[inside] = self.Amax*(1-fraction)
+        Ag[t<=0] = self.Amax
+        return self.returnAg(t, Ag)
 
     def getEquation(self):
         self.knotsY=np.sort(self.knotsY)
@@ -901,10 +894,17 @@ class BiopharmaceuticsModelSplineXY10(BiopharmaceuticsModelSplineXYGeneric):
 
 class BiopharmaceuticsModelNumerical(BiopharmaceuticsModel):
     def setXYValues(self,t,A):
-        # A is the accumulated fraction released
-        tUnique, Aunique = uniqueFloatValues(t,np.asarray(A,dtype=np.float64)/100.0)
-        # self.B = InterpolatedUnivariateSpline(tUnique, Aunique,k=1)
-        self.B = PchipInterpolator(tUnique, Aunique)
+        from scipy.interpolate import PchipInterpolator
+        # A is the accumulated fraction released. It may also be a matrix with one profile per row, then getAg
+        # returns one column per profile
+        A = np.asarray(A,dtype=np.float64)
+        if A.ndim==1:
+            tUnique, Aunique = uniqueFloatValues(t,A/100.0)
+            # self.B = InterpolatedUnivariateSpline(tUnique, Aunique,k=1)
+            self.B = PchipInterpolator(tUnique, Aunique)
+        else:
+            tUnique, idx = uniqueFloatValues(t,np.arange(len(t)))
+            self.B = PchipInterpolator(tUnique, A[:,idx.astype(int)]/100.0, axis=1)
         self.tmin=np.min(t)
         self.tmax=np.max(t)
 
@@ -919,14 +919,13 @@ class BiopharmaceuticsModelNumerical(BiopharmaceuticsModel):
         return self.parameterUnits
 
     def getAg(self,t):
-        if t<=0:
-            return self.Amax
-        tToUse=t
-        if t>=self.tmax:
-            tToUse=self.tmax
-        fraction=self.B(tToUse)
-        fraction=np.clip(fraction,0.0,1.0)
-        return self.Amax*(1-fraction)
+        t = np.asarray(t,dtype=np.float64)
+        fraction=np.clip(self.B(np.minimum(t,self.tmax)),0.0,1.0)
+        if fraction.ndim>t.ndim:
+            # Several profiles
+            fraction=np.moveaxis(fraction,0,-1)
+            return np.where(t[...,np.newaxis]<=0, self.Amax, self.Amax*(1-fraction))
+        return self.returnAg(t, np.where(t<=0, self.Amax, self.Amax*(1-fraction)))
 
     def getEquation(self):
         return 'Numerical source with t and A'
@@ -1396,6 +1395,32 @@ class PKPDDose:
         # print("t0=%f self.t0=%f self.tlag=%f self.dt=%f -> released=%f"%(t0,self.t0,self.via.tlag,dt,doseAmount))
         return doseAmount
 
+    def getDoseOnGrid(self,tgrid,dt):
+        """Dose between tgrid[i]<=t<tgrid[i]+dt[i], vectorized version of getDoseAt"""
+        t0=tgrid-self.via.tlag
+        t1=t0+dt-self.via.tlag
+        if self.doseType == PKPDDose.TYPE_BOLUS:
+            return np.where((t0<=self.t0) & (self.t0<t1), self.doseAmount, 0.0)
+        elif self.doseType == PKPDDose.TYPE_REPEATED_BOLUS:
+            doseAmount=np.zeros(t0.shape)
+            for t in np.arange(self.t0,self.tF,self.every):
+                doseAmount+=np.where((t0<=t) & (t<t1), self.doseAmount, 0.0)
+            return doseAmount
+        elif self.doseType == PKPDDose.TYPE_INFUSION:
+            tLeft=np.maximum(t0,self.t0)
+            tRight=np.minimum(t1,self.tF)
+            return np.where((t0>self.tF) | (t1<self.t0), 0.0, self.doseAmount*(tRight-tLeft))
+
+    def getAmountReleasedOnGrid(self,tgrid,dt):
+        """Amount released between tgrid[i] and tgrid[i]+dt[i]"""
+        if self.via.viaProfile == None or self.doseType==PKPDDose.TYPE_INFUSION:
+            doseAmount = self.getDoseOnGrid(tgrid,dt)
+        else:
+            self.via.viaProfile.Amax = self.via.bioavailability*self.doseAmount
+            tRelative = tgrid-self.t0-self.via.tlag
+            doseAmount = self.via.viaProfile.getAg(tRelative)-self.via.viaProfile.getAg(tRelative+dt)
+        return np.maximum(doseAmount,0.0)
+
     def getAmountReleasedUpTo(self, t0):
         doseAmount = 0.0
         if self.via.viaProfile == None:
@@ -1493,6 +1518,67 @@ class DrugSource:
             doseAmount+=dose.getAmountReleasedUpTo(t0)
         return doseAmount
 
+    def getAmountReleasedOnGrid(self,tgrid,dt=None,doseList=None):
+        """ Amount released between tgrid[i] and tgrid[i]+dt for all the time points at once.
+            dt may be a scalar or an array, by default it is the grid spacing (0 for the last point).
+            If a via has several release profiles (see BiopharmaceuticsModelNumerical.setXYValues), there is one
+            column per profile. By default, all the parsed doses are released """
+        if doseList is None:
+            doseList = self.parsedDoseList
+        tgrid = np.asarray(tgrid,dtype=np.float64)
+        if dt is None:
+            dt = np.append(np.diff(tgrid),0.0)
+        dt = np.broadcast_to(np.asarray(dt,dtype=np.float64),tgrid.shape)
+        doseAmount = np.zeros(tgrid.shape)
+        for dose in doseList:
+            released = dose.getAmountReleasedOnGrid(tgrid,dt)
+            if released.ndim>doseAmount.ndim:
+                doseAmount = doseAmount[:,np.newaxis]
+            doseAmount = doseAmount+released
+        return doseAmount
+
+    def getAmountReleasedOnUniformGrid(self,t0,deltaT,Nsamples,dt):
+        """ Same as getAmountReleasedOnGrid(t0+i*deltaT, dt) with a scalar dt. The boluses of the same via and
+            amount given at grid points release the same profile, only shifted. This profile is calculated once
+            and convolved (by FFT) with the number of boluses at each grid point, so that the cost does not
+            depend on the number of boluses """
+        from scipy.fftpack import next_fast_len
+        tgrid = t0 + np.arange(Nsamples)*deltaT
+        groups = {}
+        otherDoses = []
+        for dose in self.parsedDoseList:
+            k = (dose.t0-t0)/deltaT
+            idx = int(round(k))
+            if dose.doseType==PKPDDose.TYPE_BOLUS and abs(k-idx)<1e-9 and 0<=idx<Nsamples:
+                groups.setdefault((id(dose.via),dose.doseAmount),[]).append((dose,idx))
+            else:
+                otherDoses.append(dose)
+
+        doseAmount = np.zeros(Nsamples)
+        for doseIdx in groups.values():
+            if len(doseIdx)<3:
+                otherDoses += [dose for dose, _ in doseIdx]
+                continue
+            # Profile of a bolus at t0, for the grid points before (in case of negative lags) and after it
+            dose = copy.copy(doseIdx[0][0])
+            dose.t0 = t0
+            tExtended = t0 + np.arange(-(Nsamples-1),Nsamples)*deltaT
+            released = dose.getAmountReleasedOnGrid(tExtended,np.full(tExtended.shape,dt))
+            if released.ndim>1:
+                otherDoses += [dose for dose, _ in doseIdx]
+                continue
+            boluses = np.bincount([idx for _, idx in doseIdx],minlength=Nsamples).astype(np.float64)
+            Nfft = next_fast_len(3*Nsamples-2)
+            released = np.fft.irfft(np.fft.rfft(boluses,Nfft)*np.fft.rfft(released,Nfft),Nfft)
+            doseAmount += np.maximum(released[Nsamples-1:2*Nsamples-1],0.0)
+
+        if len(otherDoses)>0:
+            released = self.getAmountReleasedOnGrid(tgrid,dt,otherDoses)
+            if released.ndim>1:
+                doseAmount = doseAmount[:,np.newaxis]
+            doseAmount = doseAmount+released
+        return doseAmount
+
     def getEquation(self):
         retval = ""
         for via,_ in self.vias:
@@ -1557,10 +1643,4 @@ class DrugSource:
         return self.vias[0][0] # Only the first one is accessible through this function
 
     def getDprofile(self,t):
-        D = np.zeros(t.shape)
-        Nsamples = D.shape
-        if type(Nsamples)==tuple:
-            Nsamples=Nsamples[0]
-        for i in range(0,Nsamples-1):
-            D[i]=self.getAmountReleasedAt(t[i],t[i+1]-t[i])
-        return D
+        return self.getAmountReleasedOnGrid(t)
@@ -0,0 +1,177 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (info@kinestat.com)
+# *
+# * Kinestat Pharma
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'info@kinestat.com'
+# *
+# **************************************************************************
+"""
+Operating characteristics of dose escalation designs.
+
+The decision rules of ProtPKPDDoseEscalation (3+3, best of 5, up and down,
+Storer's C and Storer's two-stage BC) are applied to many virtual trials at
+once: every trial is a row of the state arrays and each step of the loop
+treats the next cohort (or patient) of all the trials that are still running.
+"""
+
+import numpy as np
+
+DESIGN_3PLUS3 = '3+3'
+DESIGN_BESTOF5 = 'Best of 5'
+DESIGN_UPANDDOWN = 'Up and down'
+DESIGN_STORERC = "Storer's C"
+DESIGN_STORERBC = "Storer's BC"
+DOSE_ESCALATION_DESIGNS = [DESIGN_3PLUS3, DESIGN_BESTOF5, DESIGN_UPANDDOWN, DESIGN_STORERC, DESIGN_STORERBC]
+
+# Cohort designs: patients at the current dose -> (escalate if DLTs<=, add patients if DLTs<=, patients to add)
+# With more DLTs the escalation is stopped and the previous dose is the MTD
+COHORT_RULES = {
+    DESIGN_3PLUS3:  {3: (0, 1, 3), 6: (1, 1, 0)},
+    DESIGN_BESTOF5: {3: (0, 1, 1), 4: (1, 2, 1), 5: (2, 2, 0)}
+}
+COHORT_SIZE = 3
+
+
+class DoseEscalationTrials:
+    """ Result of the simulation of Ntrials dose escalation trials. mtd is the index of the recommended dose
+        (-1 if the escalation stopped below the first dose), patientsPerDose and dltsPerDose are (Ntrials x Ndoses) """
+    def __init__(self, Ntrials, Ndoses):
+        self.mtd = np.full(Ntrials, -1, dtype=int)
+        self.patientsPerDose = np.zeros((Ntrials, Ndoses), dtype=int)
+        self.dltsPerDose = np.zeros((Ntrials, Ndoses), dtype=int)
+
+    def treat(self, rng, idx, level, Npatients, ptox):
+        # Treat Npatients at the given dose level in the trials idx and return their number of DLTs
+        dlts = rng.binomial(Npatients, ptox[level])
+        np.add.at(self.patientsPerDose, (idx, level), Npatients)
+        np.add.at(self.dltsPerDose, (idx, level), dlts)
+        return dlts
+
+
+def simulateCohortDesign(design, ptox, Ntrials, rng):
+    rules = COHORT_RULES[design]
+    Ndoses = len(ptox)
+    trials = DoseEscalationTrials(Ntrials, Ndoses)
+    idx = np.arange(Ntrials)                      # Trials still running
+    level = np.zeros(Ntrials, dtype=int)
+    Nlevel = np.zeros(Ntrials, dtype=int)         # Patients and DLTs at the current dose
+    Klevel = np.zeros(Ntrials, dtype=int)
+    cohort = np.full(Ntrials, COHORT_SIZE, dtype=int)
+    while idx.size>0:
+        Klevel += trials.treat(rng, idx, level, cohort, ptox)
+        Nlevel += cohort
+
+        escalate = np.zeros(idx.size, dtype=bool)
+        addPatients = np.zeros(idx.size, dtype=bool)
+        for N, (upMax, continueMax, Nadd) in rules.items():
+            atN = Nlevel==N
+            escalate |= atN & (Klevel<=upMax)
+            addPatients |= atN & ~escalate & (Klevel<=continueMax) & (Nadd>0)
+            cohort[atN] = Nadd
+        stop = ~escalate & ~addPatients
+
+        # Escalation beyond the last dose finishes the trial with the last dose as MTD
+        finished = escalate & (level==Ndoses-1)
+        trials.mtd[idx[finished]] = Ndoses-1
+        trials.mtd[idx[stop]] = level[stop]-1
+        escalate &= ~finished
+        level[escalate] += 1
+        Nlevel[escalate] = 0
+        Klevel[escalate] = 0
+        cohort[escalate] = COHORT_SIZE
+
+        running = escalate | addPatients
+        idx, level, Nlevel, Klevel, cohort = idx[running], level[running], Nlevel[running], Klevel[running], \
+                                             cohort[running]
+    return trials
+
+
+def simulateSequentialDesign(design, ptox, Ntrials, Npatients, rng):
+    # One patient at a time up to a prespecified total number of patients
+    Ndoses = len(ptox)
+    trials = DoseEscalationTrials(Ntrials, Ndoses)
+    idx = np.arange(Ntrials)
+    level = np.zeros(Ntrials, dtype=int)
+    one = np.ones(Ntrials, dtype=int)
+    run0 = np.zeros(Ntrials, dtype=int)           # Consecutive patients without DLT at the current dose
+    previousDLT = np.zeros(Ntrials, dtype=bool)
+    Ndlts = np.zeros(Ntrials, dtype=int)
+    for n in range(Npatients):
+        dlt = trials.treat(rng, idx, level, one, ptox)>0
+        Ndlts += dlt
+        run0 = np.where(dlt, 0, run0+1)
+        if design==DESIGN_UPANDDOWN:
+            step = np.where(dlt, -1, 1)
+        else:
+            # Storer's C: down after a DLT, up after two consecutive patients without DLT at the same dose
+            step = np.where(dlt, -1, np.where(run0>=2, 1, 0))
+            if design==DESIGN_STORERBC:
+                stage1 = Ndlts==0
+                step[stage1] = 1
+                step[dlt & previousDLT & (Ndlts>1)] = -2
+        newLevel = np.clip(level+step, 0, Ndoses-1)
+        run0[newLevel!=level] = 0
+        level = newLevel
+        previousDLT = dlt
+    trials.mtd[:] = level
+    return trials
+
+
+def simulateDoseEscalation(design, ptox, Ntrials=10000, Npatients=24, seed=None):
+    """ Simulate Ntrials of a dose escalation design. ptox is the true probability of DLT at each dose and
+        Npatients the total number of patients of the up and down and Storer's designs """
+    ptox = np.asarray(ptox, dtype=np.float64)
+    rng = np.random.RandomState(seed)
+    if design in COHORT_RULES:
+        return simulateCohortDesign(design, ptox, Ntrials, rng)
+    elif design in DOSE_ESCALATION_DESIGNS:
+        return simulateSequentialDesign(design, ptox, Ntrials, Npatients, rng)
+    else:
+        raise Exception("Unknown dose escalation design %s" % design)
+
+
+def getTrueMTD(ptox, targetToxicity):
+    # Index of the highest dose whose probability of DLT does not exceed the target (-1 if none)
+    acceptable = np.nonzero(np.asarray(ptox)<=targetToxicity)[0]
+    return acceptable[-1] if acceptable.size>0 else -1
+
+
+def operatingCharacteristics(trials, ptox, targetToxicity):
+    """ Summary of the simulated trials: probability of selecting each dose as MTD (the first entry is the
+        probability of stopping below the first dose), expected sample size and DLTs, and overdosing rates """
+    ptox = np.asarray(ptox, dtype=np.float64)
+    Ndoses = len(ptox)
+    trueMTD = getTrueMTD(ptox, targetToxicity)
+    overdose = ptox>targetToxicity
+    Npatients = np.sum(trials.patientsPerDose, axis=1)
+    Noverdosed = np.sum(trials.patientsPerDose[:, overdose], axis=1)
+    selected = np.bincount(trials.mtd+1, minlength=Ndoses+1)/float(trials.mtd.size)
+    return {'trueMTD': trueMTD,
+            'selection': selected,
+            'correctSelection': selected[trueMTD+1],
+            'overdoseSelection': np.sum(selected[1:][overdose]),
+            'patientsPerDose': np.mean(trials.patientsPerDose, axis=0),
+            'dltsPerDose': np.mean(trials.dltsPerDose, axis=0),
+            'sampleSize': np.mean(Npatients),
+            'sampleSizeStd': np.std(Npatients),
+            'dlts': np.mean(np.sum(trials.dltsPerDose, axis=1)),
+            'overdosedFraction': np.mean(Noverdosed/np.maximum(Npatients, 1).astype(np.float64)),
+            'overdosedTrials': np.mean(Noverdosed>0)}
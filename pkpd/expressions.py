@@ -0,0 +1,208 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (info@kinestat.com)
+# *
+# * Kinestat Pharma
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'info@kinestat.com'
+# *
+# **************************************************************************
+"""
+Compiled expressions over experiment variables.
+
+User expressions such as $(weight)<200 and $(sex)=="female" are parsed once
+into a restricted Python AST and compiled. The compiled expression is then
+evaluated on whole columns (one value per sample or per measurement), so that
+"and", "or", "not", chained comparisons, "in" and "x if c else y" are
+translated into their elementwise NumPy equivalents.
+"""
+
+import ast
+import re
+
+import numpy as np
+
+# Values that are considered as missing in labels and measurements
+MISSING_VALUES = ("NA", "NS", "LLOQ", "ULOQ", "None", "")
+_MISSING_SET = frozenset(MISSING_VALUES+(None,))
+
+_ALLOWED_NODES = (ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.BinOp, ast.UnaryOp, ast.Compare,
+                  ast.Call, ast.keyword, ast.Attribute, ast.Name, ast.Load, ast.Constant,
+                  ast.Tuple, ast.List, ast.IfExp,
+                  ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+                  ast.UAdd, ast.USub, ast.Not, ast.Invert,
+                  ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn)
+
+_CONSTANT_NAMES = ("True", "False", "None")
+
+
+def _npCall(funcName, args):
+    return ast.Call(func=ast.Attribute(value=ast.Name(id="np", ctx=ast.Load()), attr=funcName, ctx=ast.Load()),
+                    args=args, keywords=[])
+
+
+class _Vectorizer(ast.NodeTransformer):
+    # Rewrite the scalar Python constructs into elementwise NumPy calls
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        funcName = "logical_and" if isinstance(node.op, ast.And) else "logical_or"
+        retval = node.values[0]
+        for value in node.values[1:]:
+            retval = _npCall(funcName, [retval, value])
+        return retval
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return _npCall("logical_not", [node.operand])
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        terms = []
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            if isinstance(op, (ast.In, ast.NotIn)):
+                term = _npCall("isin", [left, right])
+                if isinstance(op, ast.NotIn):
+                    term = _npCall("logical_not", [term])
+            else:
+                term = ast.Compare(left=left, ops=[op], comparators=[right])
+            terms.append(term)
+            left = right
+        retval = terms[0]
+        for term in terms[1:]:
+            retval = _npCall("logical_and", [retval, term])
+        return retval
+
+    def visit_IfExp(self, node):
+        self.generic_visit(node)
+        return _npCall("where", [node.test, node.body, node.orelse])
+
+
+class PKPDExpression:
+    """ Expression on experiment variables ($(varName)) and coefficients ($[coeffName]) compiled once
+        and evaluated on NumPy columns """
+    def __init__(self, expression, prefix=""):
+        self.expression = expression.strip()
+        self.prefix = prefix
+        self.varList = []
+        self.coeffList = []
+        self._identifiers = {}
+
+        def substitute(match, nameList, template):
+            name = match.group(1).strip()
+            if name not in nameList:
+                nameList.append(name)
+            return template % nameList.index(name)
+        parsedExpression = re.sub(r"\$%s\(([^()]*)\)" % re.escape(prefix),
+                                  lambda m: substitute(m, self.varList, "__var%d"), self.expression)
+        parsedExpression = re.sub(r"\$\[([^\[\]]*)\]",
+                                  lambda m: substitute(m, self.coeffList, "__coeff%d"), parsedExpression)
+        for i, varName in enumerate(self.varList):
+            self._identifiers[varName] = "__var%d" % i
+        for i, coeffName in enumerate(self.coeffList):
+            self._identifiers[coeffName] = "__coeff%d" % i
+
+        try:
+            tree = ast.parse(parsedExpression, mode="eval")
+        except SyntaxError:
+            raise Exception("Cannot parse the expression %s" % self.expression)
+        self._validate(tree)
+        tree = ast.fix_missing_locations(_Vectorizer().visit(tree))
+        self.code = compile(tree, "<expression>", "eval")
+
+    def _validate(self, tree):
+        identifiers = set(self._identifiers.values())
+        for node in ast.walk(tree):
+            if not isinstance(node, _ALLOWED_NODES):
+                raise Exception("%s is not allowed in the expression %s" % (node.__class__.__name__, self.expression))
+            if isinstance(node, ast.Attribute):
+                if not isinstance(node.value, ast.Name) or node.value.id != "np" or node.attr.startswith("_"):
+                    raise Exception("Only numpy functions (np.*) are allowed in the expression %s" % self.expression)
+            elif isinstance(node, ast.Name):
+                if node.id not in identifiers and node.id not in _CONSTANT_NAMES and node.id != "np":
+                    raise Exception("Unknown name %s in the expression %s (variables are written as $(name))" %
+                                    (node.id, self.expression))
+
+    def evaluate(self, values, N=None):
+        """ values is a dictionary variable/coefficient name -> value (scalar or array).
+            If N is given, the result is broadcasted to an array of N elements """
+        namespace = {}
+        for name, identifier in self._identifiers.items():
+            if name not in values:
+                raise Exception("Cannot find the value of %s for the expression %s" % (name, self.expression))
+            namespace[identifier] = values[name]
+        retval = eval(self.code, {"__builtins__": {}, "np": np}, namespace)
+        if N is not None:
+            retval = np.asarray(retval)
+            if retval.ndim == 0:
+                retval = np.full(N, retval.item(), dtype=retval.dtype)
+            elif retval.shape != (N,):
+                raise Exception("The expression %s does not produce one value per element" % self.expression)
+        return retval
+
+
+_compiledExpressions = {}
+
+def compileExpression(expression, prefix=""):
+    """ Compiled expressions are cached so that repeated evaluations do not parse again """
+    key = (expression, prefix)
+    if key not in _compiledExpressions:
+        _compiledExpressions[key] = PKPDExpression(expression, prefix)
+    return _compiledExpressions[key]
+
+
+def toColumn(values, numeric):
+    """ Convert a list of strings into a column (float64 or str) and a mask of valid entries """
+    if numeric and not any(value is None for value in values):
+        try:
+            # Fast path, all values are numbers
+            return np.asarray(values, dtype=np.float64), np.ones(len(values), dtype=bool)
+        except (TypeError, ValueError):
+            pass
+    if numeric:
+        # Values with blanks around a missing code are caught when converted to float
+        valid = np.fromiter((value not in _MISSING_SET for value in values), dtype=bool, count=len(values))
+    else:
+        valid = np.fromiter((value not in _MISSING_SET and (value.__class__ is not str or value.strip() not in _MISSING_SET)
+                             for value in values), dtype=bool, count=len(values))
+    if numeric:
+        column = np.full(len(values), np.nan)
+        idx = np.flatnonzero(valid)
+        try:
+            column[idx] = np.asarray([values[i] for i in idx], dtype=np.float64)
+        except (TypeError, ValueError):
+            for i in idx:
+                try:
+                    column[i] = float(values[i])
+                except (TypeError, ValueError):
+                    valid[i] = False
+    else:
+        # Missing texts are kept as written (NA, NS, ...), the mask tells them apart
+        column = np.array(["" if value is None else str(value) for value in values], dtype=str)
+    return column, valid
+
+
+def toMask(values):
+    """ Truth value of each element of an evaluated expression """
+    values = np.asarray(values)
+    if values.dtype.kind in "USO":
+        return np.array([bool(value) for value in values], dtype=bool)
+    return values.astype(bool)
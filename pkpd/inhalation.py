@@ -31,8 +31,6 @@ predictions of orally inhaled drugs. PLOS Computational Biology, 16: e1008466 (2
 """
 import math
 import numpy as np
-import scipy.linalg
-from scipy.interpolate import interp1d, interp2d
 from pwem.objects import EMObject
 from pyworkflow.object import String, Integer
 from .utils import int_dx, int_dx1dx2
@@ -342,6 +340,7 @@ class PKCiliarySpeed(EMObject):
         self.lungParams = None
 
     def prepare(self, lungParams, ciliarySpeedType):
+        from scipy.interpolate import interp1d
         self.type.set(ciliarySpeedType)
 
         self.lungParams = lungParams
@@ -433,6 +432,7 @@ class PKLung(EMObject):
         self.inhalationDissolutionAlveoli = None
 
     def prepare(self, substanceParams, lungParams, pkParams, pkMultiplier, ciliarySpeedType):
+        from scipy.interpolate import interp1d
         self.substanceParams = substanceParams
         self.lungParams = lungParams
 
@@ -487,6 +487,7 @@ class PKLung(EMObject):
         return self.lungParams.multiplier[0] * self.ciliarySpeed.cilspeed(x)
 
 def conserving_projection(X1, V1, X2):
+    from scipy.interpolate import interp1d
     # Hartung2020_MATLAB/functions/conserving_projection.m
     #   V2 = CONSERVING_PROJECTION(X1,V1,X2) projects quantity V1 from location
     #   grid X1 to grid X2, ensuring int_x^y(v2(z)dz) = int_x^y(v1(z)dz) holds
@@ -515,6 +516,7 @@ def P_aTis(lungData, Xbnd):
     return np.divide(V_Xctr, np.diff(Xbnd))
 
 def P_hELF(lungData, Xctr):
+    from scipy.interpolate import interp1d
     # Hartung2020_MATLAB/functions/P_hELF.m
     #   Input:  center gridpoints of computational location grid
     #   Output: ELF heights at (ctr) grid points (h_Xctr), in cm.
@@ -533,6 +535,7 @@ def P_Qbr(lungData, systemicData, Xbnd):
     return np.divide(Q_Xctr,np.diff(Xbnd));
 
 def project_deposition_2D(depositionData,X,S,lungData):
+    from scipy.interpolate import interp1d, interp2d
     #   Project deposition data on 2D computational grid
     #   Strategy for projection on 2D grid:
     #     - Uniform distribution of dose in data location-size gridcells
@@ -587,6 +590,7 @@ def project_deposition_2D(depositionData,X,S,lungData):
     return (rho0br, rho0alv)
 
 def saturable_2D_upwind_IE(lungParams, pkLung, depositionParams, tt, Sbnd):
+    import scipy.linalg
     # Hartung2020_MATLAB/models/saturable_2D_upwind_IE.m
     #   Algorithm features:
     #   - Conducting airways, peripheral airways and systemic circulation fully coupled
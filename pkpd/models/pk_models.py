@@ -487,7 +487,7 @@ class PK_Twocompartments(PKPDODEModel):
 
     def G(self, t, dD):
         V=self.parameters[1]
-        return np.array([dD/V,0.0],np.double)
+        return np.array([dD/V,0.0*dD],np.double)
 
     def getResponseDimension(self):
         return 1
@@ -643,7 +643,7 @@ class PK_TwocompartmentsClint(PKPDODEModel):
 
     def G(self, t, dD):
         V=self.parameters[2]
-        return np.array([dD/V,0.0],np.double)
+        return np.array([dD/V,0.0*dD],np.double)
 
     def getResponseDimension(self):
         return 1
@@ -758,7 +758,7 @@ class PK_TwocompartmentsClintCl(PKPDODEModel):
 
     def G(self, t, dD):
         V=self.parameters[3]
-        return np.array([dD/V,0.0],np.double)
+        return np.array([dD/V,0.0*dD],np.double)
 
     def getResponseDimension(self):
         return 1
@@ -888,7 +888,7 @@ class PK_TwocompartmentsClintMetabolite(PKPDODEModel):
 
     def G(self, t, dD):
         V=self.parameters[2]
-        return np.array([dD/V,0.0,0.0],np.double)
+        return np.array([dD/V,0.0*dD,0.0*dD],np.double)
 
     def getResponseDimension(self):
         return 2
@@ -1028,7 +1028,7 @@ class PK_TwocompartmentsAutoinduction(PKPDODEModel):
 
     def G(self, t, dD):
         V=self.parameters[3]
-        return np.array([dD/V,0.0,0.0],np.double)
+        return np.array([dD/V,0.0*dD,0.0*dD],np.double)
 
     def getResponseDimension(self):
         return 1
@@ -1144,7 +1144,7 @@ class PK_MonocompartmentUrine(PKPDODEModel):
 
     def G(self, t, dD):
         V=self.parameters[1]
-        return np.array([dD/V,0.0],np.double)
+        return np.array([dD/V,0.0*dD],np.double)
 
     def getResponseDimension(self):
         return 2
@@ -1229,7 +1229,7 @@ class PK_MonocompartmentLinkPD(PKPDODEModel):
 
     def G(self, t, dD):
         V=self.parameters[1]
-        return np.array([dD/V,0.0,0.0],np.double)
+        return np.array([dD/V,0.0*dD,0.0*dD],np.double)
 
     def H(self, y):
         Cb = y[2]
@@ -1309,7 +1309,7 @@ class PK_MonocompartmentPD(PKPDODEModel):
 
     def G(self, t, dD):
         V=self.parameters[1]
-        return np.array([dD/V,0.0],np.double)
+        return np.array([dD/V,0.0*dD],np.double)
 
     def H(self, y):
         C = y[0]
@@ -1393,7 +1393,7 @@ class PK_TwocompartmentsUrine(PKPDODEModel):
 
     def G(self, t, dD):
         V=self.parameters[1]
-        return np.array([dD/V,0.0,0.0],np.double)
+        return np.array([dD/V,0.0*dD,0.0*dD],np.double)
 
     def getResponseDimension(self):
         return 2
@@ -1518,7 +1518,7 @@ class PK_TwocompartmentsBothPD(PKPDODEModel):
 
     def G(self, t, dD):
         V=self.parameters[1]
-        return np.array([dD/V,0.0,0.0],np.double)
+        return np.array([dD/V,0.0*dD,0.0*dD],np.double)
 
     def H(self, y):
         Cp = y[1]
@@ -1603,7 +1603,7 @@ class PK_Threecompartments(PKPDODEModel):
 
     def G(self, t, dD):
         V=self.parameters[1]
-        return np.array([dD/V,0.0,0.0],np.double)
+        return np.array([dD/V,0.0*dD,0.0*dD],np.double)
 
     def getResponseDimension(self):
         return 1
@@ -25,6 +25,9 @@
 # **************************************************************************
 
 import copy
+import io
+import os
+import shutil
 import sys
 
 from scipion.install.plugin_funcs import PluginInfo
@@ -36,7 +39,6 @@ except ImportError:
 import math
 from os.path import join
 
-import openpyxl
 # from pyworkflow.plugin import PluginInfo
 #
 # from .pkpd_units import (PKPDUnit, convertUnits, changeRateToMinutes,
@@ -45,7 +47,8 @@ from .pkpd_units import PKPDUnit, convertUnits, changeRateTo, changeRateToWeight
 import pyworkflow as pw
 import pyworkflow.utils as pwutils
 from pwem.objects import *
-from .utils import (writeMD5, verifyMD5, excelWriteRow, excelFillCells,
+from .expressions import compileExpression, toColumn, toMask
+from .utils import (writeMD5, verifyMD5, excelWriteRow, excelFillCells, ExcelStreamWriter, excelExportEnabled,
                     excelAdjustColumnWidths, computeXYmean)
 from .biopharmaceutics import (PKPDDose, PKPDVia, DrugSource, createDeltaDose,
                                createVia)
@@ -313,13 +316,10 @@ class PKPDSample:
             self.measurementPattern = []
         if not varName in self.measurementPattern:
             self.measurementPattern.append(varName)
-        setattr(self, "measurement_%s"%varName, [])
-        if type(values)==list:
-            for value in values:
-                exec("self.measurement_%s.append('%s')"%(varName,str(float(value))))
-        elif type(values)==np.ndarray:
-            for i in range(values.size):
-                exec("self.measurement_%s.append('%s')"%(varName,str(float(values[i]))))
+        if type(values)==list or type(values)==np.ndarray:
+            setattr(self, "measurement_%s"%varName, [str(float(value)) for value in np.ravel(values)])
+        else:
+            setattr(self, "measurement_%s"%varName, [])
 
     def getNumberOfVariables(self):
         return len(self.measurementPattern)
@@ -468,25 +468,30 @@ class PKPDSample:
         return expressionPython
 
     def evaluateExpression(self, expression, prefix=""):
-        expressionPython=self.substituteValuesInExpression(expression,prefix)
-        return eval(expressionPython, {"__builtins__" : {"True": True, "False": False, "None": None} }, {})
-
-    def evaluateParsedExpression(self, parsedOperation, varList):
-        ldict = {}
-        for varName in varList:
+        # Labels with missing values (NA, LLOQ, ...) make the expression evaluate to None
+        compiledExpression = compileExpression(str(expression), prefix)
+        values, valid = evaluateLabelExpression(compiledExpression, [self], self.variableDictPtr)
+        if not valid[0]:
+            return None
+        value = values[0]
+        return value.item() if isinstance(value, np.generic) else value
+
+    def evaluateParsedExpression(self, expression):
+        # Labels are scalars and measurements are arrays with all the values of this sample
+        compiledExpression = compileExpression(expression)
+        values = {}
+        for varName in compiledExpression.varList:
+            if varName not in self.variableDictPtr:
+                raise Exception("Unknown variable %s in %s"%(varName,expression))
             variable = self.variableDictPtr[varName]
             if variable.isLabel():
-                exec ("%s=self.getDescriptorValue('%s')" % (varName, varName), locals(), ldict)
+                values[varName] = self.getDescriptorValue(varName)
                 if variable.isNumeric():
-                    exec ("%s=float(%s)" % (varName, varName), locals(), ldict)
+                    values[varName] = float(values[varName])
             else:
                 # Measurement or time
-                exec ("%s=np.asarray(self.getValues('%s'),dtype=np.float32)" % (varName, varName),
-                      dict(locals(), **globals()), ldict)
-        aux = None
-        exec ("aux=%s" % parsedOperation, dict(locals(), **globals()), ldict)
-        aux=ldict['aux']
-        return aux
+                values[varName] = np.asarray(self.getValues(varName),dtype=np.float32)
+        return compiledExpression.evaluate(values)
 
     def getVariableValues(self, varList):
         varDict = {}
@@ -542,6 +547,81 @@ class PKPDGroup():
         return ",".join(self.sampleList)
 
 
+class PKPDDescriptorTable:
+    """ Typed columnar view of the sample labels. Every label is a float64 (numeric labels) or str (text labels)
+        array with one entry per sample and a mask of the entries that are not missing """
+    def __init__(self, sampleNames):
+        self.sampleNames = list(sampleNames)
+        self.columns = {}
+        self.valid = {}
+
+    def __len__(self):
+        return len(self.sampleNames)
+
+    def addColumn(self, varName, column, valid):
+        self.columns[varName] = column
+        self.valid[varName] = valid
+
+    def getColumn(self, varName):
+        if varName=="sampleName":
+            return np.array(self.sampleNames, dtype=str), np.ones(len(self.sampleNames), dtype=bool)
+        if varName not in self.columns:
+            raise Exception("Cannot find the label %s in the table"%varName)
+        return self.columns[varName], self.valid[varName]
+
+    def getValid(self, varNames):
+        """ Mask of the samples in which none of the labels is missing """
+        valid = np.ones(len(self.sampleNames), dtype=bool)
+        for varName in varNames:
+            valid = np.logical_and(valid, self.getColumn(varName)[1])
+        return valid
+
+    def getMatrix(self, varNames):
+        """ Numeric labels as a matrix with one row per sample and one column per label """
+        return np.column_stack([self.getColumn(varName)[0] for varName in varNames]).astype(np.double) \
+            if len(varNames)>0 else np.zeros((len(self.sampleNames),0))
+
+    def select(self, idx):
+        """ New table with the samples selected by idx (boolean mask or indexes) """
+        idx = np.arange(len(self.sampleNames))[idx]
+        newTable = PKPDDescriptorTable([self.sampleNames[i] for i in idx])
+        for varName in self.columns:
+            newTable.addColumn(varName, self.columns[varName][idx], self.valid[varName][idx])
+        return newTable
+
+    def groupby(self, varNames, dropMissing=True):
+        """ Groups of samples sharing the values of the labels in varNames. It returns the list of group keys
+            (tuples of values, in order of first appearance) and the group index of each sample (-1 for the samples
+            with missing labels if dropMissing) """
+        if isinstance(varNames, str):
+            varNames = [varNames]
+        N = len(self.sampleNames)
+        code = np.zeros(N, dtype=np.int64)
+        for varName in varNames:
+            varUnique, varCode = np.unique(self.getColumn(varName)[0], return_inverse=True)
+            code = code*len(varUnique)+varCode.reshape(-1)
+        keep = self.getValid(varNames) if dropMissing else np.ones(N, dtype=bool)
+        groupIdx = np.full(N, -1, dtype=np.int64)
+        if not np.any(keep):
+            return [], groupIdx
+        _, firstIdx, inverse = np.unique(code[keep], return_index=True, return_inverse=True)
+        order = np.argsort(firstIdx)
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        groupIdx[keep] = rank[inverse.reshape(-1)]
+        rows = np.flatnonzero(keep)[firstIdx[order]]
+        keys = list(zip(*[self.getColumn(varName)[0][rows].tolist() for varName in varNames]))
+        return keys, groupIdx
+
+    def evaluate(self, compiledExpression):
+        """ Evaluate a compiled expression on all samples. It returns the values and the mask of samples whose
+            labels used in the expression are not missing """
+        columns = {}
+        for varName in compiledExpression.varList:
+            columns[varName] = self.getColumn(varName)[0]
+        return compiledExpression.evaluate(columns, len(self.sampleNames)), \
+               self.getValid([varName for varName in compiledExpression.varList if varName!="sampleName"])
+
 class PKPDExperiment(EMObject):
     READING_GENERAL = 1
     READING_VARIABLES = 2
@@ -562,6 +642,7 @@ class PKPDExperiment(EMObject):
         self.doses = {}
         self.vias = {}
         self.groups = {}
+        self._descriptorColumns = {}
 
     def __str__(self):
         if not self.infoStr.hasValue():
@@ -687,7 +768,7 @@ class PKPDExperiment(EMObject):
         self.fnPKPD.set(fnExperiment)
         writeMD5(fnExperiment)
         self.infoStr.set("variables: %d, samples: %d" % (len(self.variables), len(self.samples)))
-        if writeToExcel:
+        if writeToExcel and excelExportEnabled():
             self.writeToExcel(os.path.splitext(fnExperiment)[0]+".xlsx")
 
     def _printToStream(self,fh):
@@ -726,9 +807,21 @@ class PKPDExperiment(EMObject):
             self.samples[key]._printMeasurements(fh)
         fh.write("\n")
 
+    def getSampleText(self, sampleName):
+        """ Entry of a sample with its measurements, doses and vias as written in the experiment file """
+        fh = io.StringIO()
+        sample = self.samples[sampleName]
+        sample._printToStream(fh)
+        sample._printMeasurements(fh)
+        for doseName in sample.doseList:
+            dose = self.doses[doseName]
+            dose._printToStream(fh)
+            if dose.via is not None:
+                dose.via._printToStream(fh)
+        return fh.getvalue()
+
     def writeToExcel(self, fnXls):
-        wb = openpyxl.Workbook()
-        wb.active.title = "Experiment"
+        wb = ExcelStreamWriter("Experiment")
 
         currentRow = 1
         excelWriteRow("EXPERIMENT",wb,currentRow,bold=True); excelFillCells(wb,currentRow); currentRow+=1
@@ -782,31 +875,22 @@ class PKPDExperiment(EMObject):
 
     def sampleSummary(self):
         summary=[]
+        table = self.getDescriptorTable()
         for varName, var in self.variables.items():
             if var.role == PKPDVariable.ROLE_LABEL:
                 toAdd = varName+": "
                 if var.varType==PKPDVariable.TYPE_NUMERIC:
-                    listOfValues=[]
-                else:
-                    listOfValues={}
-                for sampleName, sample in self.samples.items():
-                    value = sample.descriptors[varName]
-                    if var.varType==PKPDVariable.TYPE_NUMERIC:
-                        listOfValues.append(float(value))
-                    else:
-                        if value in listOfValues:
-                            listOfValues[value]+=1
-                        else:
-                            listOfValues[value]=1
-                if var.varType==PKPDVariable.TYPE_NUMERIC:
-                    listOfValuesNp = np.array(listOfValues)
+                    values, valid = table.getColumn(varName)
+                    listOfValuesNp = values[valid]
                     toAdd += " mean=%f std=%f 5%%=%f 25%%=%f 50%%=%f 75%%=%f 95%%=%f"%\
                              (np.mean(listOfValuesNp),np.std(listOfValuesNp),np.percentile(listOfValuesNp,5),\
                               np.percentile(listOfValuesNp,25),np.percentile(listOfValuesNp,50),\
                               np.percentile(listOfValuesNp,75),np.percentile(listOfValuesNp,95))
                 else:
-                    for value in listOfValues:
-                        toAdd += value + "(" + str(listOfValues[value]) + ") "
+                    keys, groupIdx = table.groupby(varName, dropMissing=False)
+                    counts = np.bincount(groupIdx, minlength=len(keys))
+                    for key, count in izip(keys, counts):
+                        toAdd += key[0] + "(" + str(count) + ") "
                 summary.append(toAdd)
         return summary
 
@@ -831,6 +915,14 @@ class PKPDExperiment(EMObject):
         return listOfSamples[0].getDoseUnits()
 
     def addParameterToSample(self, sampleName, varName, varUnits, varDescr, varValue, rewrite=False):
+        self._defineParameter(varName, varUnits, varDescr, rewrite)
+        if sampleName in self.samples:
+            sample = self.samples[sampleName]
+            if sample.descriptors==None:
+                sample.descriptors={}
+            sample.descriptors[varName] = varValue
+
+    def _defineParameter(self, varName, varUnits, varDescr, rewrite):
         if not varName in self.variables:
             varX = PKPDVariable()
             varX.varName = varName
@@ -853,13 +945,15 @@ class PKPDExperiment(EMObject):
                 if varPresent.comment!=varDescr or varPresent.units.unit!=varUnits:
                     raise Exception("%s is already a variable in the experiment with a different purpose"%varName)
 
+    def addLabelToSample(self, sampleName, varName, varDescr, varValue, rewrite=False):
+        self._defineLabel(varName, varDescr, rewrite)
         if sampleName in self.samples:
             sample = self.samples[sampleName]
             if sample.descriptors==None:
                 sample.descriptors={}
             sample.descriptors[varName] = varValue
 
-    def addLabelToSample(self, sampleName, varName, varDescr, varValue, rewrite=False):
+    def _defineLabel(self, varName, varDescr, rewrite):
         if not varName in self.variables:
             varX = PKPDVariable()
             varX.varName = varName
@@ -882,27 +976,98 @@ class PKPDExperiment(EMObject):
                 if varPresent.comment!=varDescr:
                     raise Exception("%s is already a variable in the experiment with a different purpose"%varName)
 
-        if sampleName in self.samples:
+    def addParameterColumn(self, varName, varUnits, varDescr, values, valid=None, sampleNames=None, rewrite=False):
+        """ Same as addParameterToSample for all the samples at once, values has one entry per sample """
+        self._defineParameter(varName, varUnits, varDescr, rewrite)
+        self.setDescriptorColumn(varName, values, valid, sampleNames)
+
+    def addLabelColumn(self, varName, varDescr, values, valid=None, sampleNames=None, rewrite=False):
+        """ Same as addLabelToSample for all the samples at once, values has one entry per sample """
+        self._defineLabel(varName, varDescr, rewrite)
+        self.setDescriptorColumn(varName, values, valid, sampleNames)
+
+    def getDescriptorTable(self, varNames=None, sampleNames=None):
+        """ Columnar table of the labels in varNames (all labels by default) for the samples in sampleNames (all
+            samples by default). Each column is parsed once and reused while the descriptors it comes from do not
+            change """
+        if sampleNames is None:
+            sampleNames = list(self.samples.keys())
+        if varNames is None:
+            varNames = [varName for varName, variable in self.variables.items() if variable.isLabel()]
+        descriptorList = [self.samples[sampleName].descriptors or {} for sampleName in sampleNames]
+        table = PKPDDescriptorTable(sampleNames)
+        for varName in varNames:
+            if varName=="sampleName":
+                continue
+            if varName not in self.variables:
+                raise Exception("Cannot find the variable %s in the experiment"%varName)
+            numeric = self.variables[varName].isNumeric()
+            rawValues = [descriptors.get(varName) for descriptors in descriptorList]
+            cached = self._descriptorColumns.get(varName)
+            if cached is not None and cached[0]==numeric and cached[1]==rawValues:
+                column, valid = cached[2], cached[3]
+            else:
+                column, valid = toColumn(rawValues, numeric)
+                self._descriptorColumns[varName] = (numeric, rawValues, column, valid)
+            table.addColumn(varName, column, valid)
+        return table
+
+    def setDescriptorColumn(self, varName, values, valid=None, sampleNames=None):
+        """ Bulk update of a label. The entries that are not valid are written as missing (None) """
+        if varName not in self.variables:
+            raise Exception("Cannot find the variable %s in the experiment"%varName)
+        if sampleNames is None:
+            sampleNames = list(self.samples.keys())
+        values = np.asarray(values)
+        if values.shape!=(len(sampleNames),):
+            raise Exception("There must be one value of %s per sample"%varName)
+        rawValues = values.tolist()
+        if valid is not None:
+            rawValues = [value if ok else None for value, ok in izip(rawValues, valid)]
+        for sampleName, value in izip(sampleNames, rawValues):
             sample = self.samples[sampleName]
-            if sample.descriptors==None:
-                sample.descriptors={}
-            sample.descriptors[varName] = varValue
+            if sample.descriptors is None:
+                sample.descriptors = {}
+            sample.descriptors[varName] = value
+        numeric = self.variables[varName].isNumeric()
+        self._descriptorColumns[varName] = (numeric, rawValues) + toColumn(rawValues, numeric)
+
+    def evaluateExpression(self, expression, sampleNames=None, prefix=""):
+        """ Evaluate a label expression for all samples at once. It returns the array of values and the
+            mask of samples whose labels used in the expression are not missing """
+        compiledExpression = compileExpression(expression, prefix)
+        for varName in compiledExpression.varList:
+            if varName!="sampleName" and varName not in self.variables:
+                raise Exception("Unknown variable %s in %s"%(varName,compiledExpression.expression))
+        return self.getDescriptorTable(compiledExpression.varList, sampleNames).evaluate(compiledExpression)
+
+    def getSubGroupMask(self, condition, sampleNames=None):
+        if sampleNames is None:
+            sampleNames = list(self.samples.keys())
+        if condition=="":
+            return np.ones(len(sampleNames),dtype=bool)
+        values, valid = self.evaluateExpression(condition, sampleNames)
+        return np.logical_and(valid, toMask(values))
 
     def getSubGroup(self,condition):
         if condition=="":
             return self.samples
-        samplesSubGroup = {}
-        for sampleName, sample in self.samples.items():
-            if sample.evaluateExpression(condition):
-                samplesSubGroup[sampleName] = sample
-        return samplesSubGroup
+        sampleNames = list(self.samples.keys())
+        mask = self.getSubGroupMask(condition, sampleNames)
+        return {sampleName: self.samples[sampleName] for sampleName, ok in izip(sampleNames, mask) if ok}
 
     def getSubGroupLabels(self,condition,labelName):
-        subgroupLabels = []
-        for sampleName, sample in self.samples.items():
-            if condition!="" and sample.evaluateExpression(condition) or condition=="":
-                subgroupLabels.append(sample.descriptors[labelName])
-        return subgroupLabels
+        sampleNames = list(self.samples.keys())
+        mask = self.getSubGroupMask(condition, sampleNames)
+        return [self.samples[sampleName].descriptors[labelName] for sampleName, ok in izip(sampleNames, mask) if ok]
+
+    def getSubGroupColumns(self, condition, labelNames):
+        """ Matrix with the numeric labels (columns) of the samples (rows) that meet the condition. Samples
+            with any of the labels missing are skipped """
+        sampleNames = list(self.samples.keys())
+        table = self.getDescriptorTable(labelNames, sampleNames)
+        mask = np.logical_and(self.getSubGroupMask(condition, sampleNames), table.getValid(labelNames))
+        return table.getMatrix(labelNames)[mask,:]
 
     def getNonBolusDoses(self):
         nonBolusList = []
@@ -1242,17 +1407,20 @@ class PKPDODEModel(PKPDModelBase2):
         else:
             yt = 0.0
             Yt = np.zeros(Nsamples)
-        Xt = np.zeros(Yt.shape[0])
+        Xt = self.t0 + np.arange(Nsamples)*self.deltaT # More accurate than t+= self.deltaT
         delta_2 = 0.5*self.deltaT
         K = self.deltaT/3
+
+        # Drug released in each half and full step, computed for the whole time grid at once
+        allD1 = drugSource.getAmountReleasedOnGrid(Xt,delta_2)
+        allD = drugSource.getAmountReleasedOnGrid(Xt,self.deltaT)
         for i in range(0,Nsamples):
-            t = self.t0 + i*self.deltaT # More accurate than t+= self.deltaT
-            Xt[i]=t
+            t = Xt[i]
 
             # Internal evolution
             # Runge Kutta's 4th order (http://lpsa.swarthmore.edu/NumInt/NumIntFourth.html)
             k1 = self.F(t,yt)
-            dD1 = drugSource.getAmountReleasedAt(t,delta_2)
+            dD1 = allD1[i]
             dyD1 = self.G(t, dD1)
             y1 = yt+k1*delta_2+dyD1
             # print("t=",t," y0=",yt," k1=",k1," dD1=",dD1," dyD1=",dyD1," y1=",y1)
@@ -1262,7 +1430,7 @@ class PKPDODEModel(PKPDModelBase2):
             y2 = yt+k2*delta_2+dyD1
             # print("k2=",k2," y2=",y2)
 
-            dD = drugSource.getAmountReleasedAt(t,self.deltaT)
+            dD = allD[i]
             dyD = self.G(t, dD)
             k3 = self.F(t_delta_2,y2)
             y3 = yt+k3*self.deltaT+dyD
@@ -1304,6 +1472,177 @@ class PKPDODEModel(PKPDModelBase2):
                 self.yPredicted.append(np.interp(x[j],Xt,Yt[:,j]))
         return self.yPredicted
 
+    def forwardModelBatch(self, parameters, x, drugSource=None):
+        """ Simulate N parameter vectors at once. parameters is a matrix with one row per simulation and
+            the drug source may release a different profile for each simulation (one column per simulation in
+            getAmountReleasedOnGrid). The integration is the same Runge-Kutta of forwardModel, but each
+            parameter is a column of N values so that F, G and H operate on all the simulations at once.
+            It returns a list (one per response) of matrices with one row per simulation. As in forwardModel,
+            the constraints and the measurement transformation are only applied to multidimensional states.
+            Models whose equations are not elementwise raise an exception here, the caller should then use
+            forwardModel for each simulation """
+        parameters = np.atleast_2d(np.asarray(parameters,dtype=np.float64))
+        N = parameters.shape[0]
+        if drugSource is None:
+            drugSource=self.drugSource
+        self.parameters = [parameters[:,n] for n in range(parameters.shape[1])]
+
+        Nsamples = int(math.ceil((self.tF-self.t0)/self.deltaT))+1
+        stateDim = self.getStateDimension()
+        if stateDim>1:
+            yt = np.zeros((stateDim,N),np.double)
+        else:
+            yt = np.zeros(N,np.double)
+        Yt = np.zeros((Nsamples,)+yt.shape,np.double)
+        Xt = self.t0 + np.arange(Nsamples)*self.deltaT
+        delta_2 = 0.5*self.deltaT
+        K = self.deltaT/3
+
+        allD1 = np.broadcast_to(drugSource.getAmountReleasedOnGrid(Xt,delta_2).reshape(Nsamples,-1),(Nsamples,N))
+        allD = np.broadcast_to(drugSource.getAmountReleasedOnGrid(Xt,self.deltaT).reshape(Nsamples,-1),(Nsamples,N))
+        for i in range(0,Nsamples):
+            t = Xt[i]
+            k1 = self.F(t,yt)
+            dyD1 = self.G(t, allD1[i])
+            y1 = yt+k1*delta_2+dyD1
+
+            t_delta_2=t+delta_2
+            k2 = self.F(t_delta_2,y1)
+            y2 = yt+k2*delta_2+dyD1
+
+            dyD = self.G(t, allD[i])
+            k3 = self.F(t_delta_2,y2)
+            y3 = yt+k3*self.deltaT+dyD
+
+            k4 = self.F(t+self.deltaT,y3)
+
+            yt = yt+(0.5*(k1+k4)+k2+k3)*K+dyD
+            if yt.shape!=Yt.shape[1:]:
+                raise Exception("The equations of %s cannot be evaluated for several simulations at once"%
+                                self.__class__.__name__)
+            if stateDim>1:
+                # In forwardModel a one-dimensional state is a scalar, that imposeConstraints and H cannot modify
+                self.imposeConstraints(yt)
+                self.H(yt)
+            Yt[i]=yt
+
+        # Linear interpolation at x as np.interp, with constant extrapolation
+        retval = []
+        for j in range(0,self.getResponseDimension()):
+            xj = np.clip(np.asarray(x[j],dtype=np.float64),Xt[0],Xt[-1])
+            idx = np.clip(np.searchsorted(Xt,xj,side="right")-1,0,max(Nsamples-2,0))
+            w = (xj-Xt[idx])/self.deltaT if Nsamples>1 else np.zeros(xj.shape)
+            Yj = Yt if stateDim==1 else Yt[:,j,:]
+            Y0 = Yj[idx]
+            Y1 = Yj[np.minimum(idx+1,Nsamples-1)]
+            retval.append(np.transpose(Y0+(Y1-Y0)*w[:,np.newaxis]))
+        return retval
+
+    def _rungeKuttaStep(self, t, yt, dD1, dD):
+        # One step of the integration in forwardModel, without constraints nor measurement transformation
+        delta_2 = 0.5*self.deltaT
+        k1 = self.F(t,yt)
+        dyD1 = self.G(t,dD1)
+        k2 = self.F(t+delta_2,yt+k1*delta_2+dyD1)
+        k3 = self.F(t+delta_2,yt+k2*delta_2+dyD1)
+        dyD = self.G(t,dD)
+        k4 = self.F(t+self.deltaT,yt+k3*self.deltaT+dyD)
+        return np.asarray(yt+(0.5*(k1+k4)+k2+k3)*self.deltaT/3+dyD,dtype=np.float64).reshape(-1)
+
+    def getLinearStep(self):
+        """ If the model is linear and time invariant (F and G linear in the state and the input, and H does not
+            modify the state), one integration step of forwardModel is
+               y[i+1] = M*y[i] + B1*dD1[i] + B*dD[i]
+            and (M, B1, B) are returned. Otherwise, None is returned. The linearity is tested numerically on
+            states and inputs of very different magnitudes and at different times """
+        stateDim = max(self.getStateDimension(),1)
+        zero = np.zeros(stateDim)
+        try:
+            M = np.column_stack([self._rungeKuttaStep(self.t0,np.eye(stateDim)[j],0.0,0.0)
+                                 for j in range(stateDim)])
+            B1 = self._rungeKuttaStep(self.t0,zero,1.0,0.0)
+            B = self._rungeKuttaStep(self.t0,zero,0.0,1.0)
+            for t, scale in [(self.t0,1e-3),(self.t0+7.3*self.deltaT,1e3),(self.tF,1.0)]:
+                y = scale*np.linspace(1.0,2.0,stateDim)
+                dD1 = 0.7*scale
+                dD = 1.3*scale
+                yNext = self._rungeKuttaStep(t,y.copy(),dD1,dD)
+                yLinear = np.dot(M,y)+B1*dD1+B*dD
+                if yNext.shape!=(stateDim,) or \
+                   not np.all(np.abs(yNext-yLinear)<=1e-9*(np.abs(yNext)+np.abs(yLinear))+1e-300):
+                    return None
+                if stateDim>1:
+                    yH = y.copy()
+                    self.H(yH)
+                    if not np.array_equal(yH,y):
+                        return None
+        except Exception:
+            return None
+        if not (np.all(np.isfinite(M)) and np.all(np.isfinite(B1)) and np.all(np.isfinite(B))):
+            return None
+        return M, B1, B
+
+    def getUnitResponses(self, Nsamples):
+        """ Response of the linear model to a unit input in dD1 and in dD at the first step (one row per step,
+            one column per state variable), or None if the model is not linear.
+            They are cached for the current parameters and time step """
+        key = (tuple(np.asarray(self.parameters,dtype=np.float64).ravel()), self.deltaT, self.t0, self.tF)
+        if getattr(self,"_unitResponseKey",None)!=key:
+            self._unitResponseKey = key
+            self._unitResponses = None
+            linearStep = self.getLinearStep()
+            if linearStep is not None:
+                M, B1, B = linearStep
+                # The responses are M^k*B1 and M^k*B, computed by doubling the number of steps each time
+                h = np.vstack([B1,B])
+                Mk = M
+                while h.shape[0]<2*Nsamples:
+                    h = np.vstack([h,np.dot(h,Mk.T)])
+                    Mk = np.dot(Mk,Mk)
+                self._unitResponses = (h[0::2],h[1::2])
+        if self._unitResponses is None or self._unitResponses[0].shape[0]<Nsamples:
+            return None
+        return self._unitResponses[0][:Nsamples], self._unitResponses[1][:Nsamples]
+
+    def forwardModelBySuperposition(self, parameters, x=None, drugSource=None):
+        """ Same result as forwardModel. For linear models, the response to any dosing regimen is the
+            convolution (by FFT) of the drug released at each step with the unit responses, so that the cost
+            does not depend on the number of doses. Nonlinear models, and linear models whose state would
+            become negative (and then be clipped by imposeConstraints), are integrated with forwardModel """
+        self.parameters = parameters
+        if drugSource is None:
+            drugSource=self.drugSource
+
+        Nsamples = int(math.ceil((self.tF-self.t0)/self.deltaT))+1
+        unitResponses = self.getUnitResponses(Nsamples)
+        if unitResponses is None:
+            return self.forwardModel(parameters, x, drugSource)
+        h1, h = unitResponses
+
+        from scipy.fftpack import next_fast_len
+        Xt = self.t0 + np.arange(Nsamples)*self.deltaT
+        allD1 = drugSource.getAmountReleasedOnUniformGrid(self.t0,self.deltaT,Nsamples,0.5*self.deltaT)
+        allD = drugSource.getAmountReleasedOnUniformGrid(self.t0,self.deltaT,Nsamples,self.deltaT)
+        if allD.ndim>1:
+            return self.forwardModel(parameters, x, drugSource)
+        Nfft = next_fast_len(2*Nsamples-1)
+        Yt = np.fft.irfft(np.fft.rfft(h1,Nfft,axis=0)*np.fft.rfft(allD1,Nfft)[:,np.newaxis]+
+                          np.fft.rfft(h,Nfft,axis=0)*np.fft.rfft(allD,Nfft)[:,np.newaxis],Nfft,axis=0)[:Nsamples]
+
+        # The rounding errors of the FFT are of the order of eps*max; below that, negative values are zeros
+        tolerance = 1e-10*max(np.max(np.abs(Yt)),1e-300)
+        if np.any(Yt<-tolerance):
+            return self.forwardModel(parameters, x, drugSource)
+        Yt[Yt<0] = 0
+
+        if x is None:
+            x = self.x
+
+        self.yPredicted = []
+        for j in range(0,self.getResponseDimension()):
+            self.yPredicted.append(np.interp(x[j],Xt,Yt[:,j]))
+        return self.yPredicted
+
     def getImpulseResponse(self, parameters, tImpulse):
         if self.tFImpulse is None:
             self.tFImpulse = self.tF
@@ -1322,14 +1661,10 @@ class PKPDODEModel(PKPDModelBase2):
 
         # Simulate the system response
         Nsamples = int(math.ceil(self.tF/self.deltaT))+1
-        Xt = np.zeros(Nsamples)
+        Xt = np.arange(Nsamples)*self.deltaT # More accurate than t+= self.deltaT
 
         # Get the drug input
-        D = copy.copy(Xt)
-        for i in range(0,Nsamples):
-            t = i*self.deltaT # More accurate than t+= self.deltaT
-            Xt[i]=t
-            D[i]=self.drugSource.getAmountReleasedAt(t,self.deltaT)
+        D = self.drugSource.getAmountReleasedOnGrid(Xt,self.deltaT)
 
         # Get the model impulse response
         if self.thImpulse is None:
@@ -1677,22 +2012,17 @@ class PKPDSampleFit:
 
         self.multiOutputSeries = False
 
-    def printForPopulation(self,fh,observations):
-        outputStr = ""
-        for parameter in self.parameters:
-            outputStr += "%f "%parameter
-        observations = np.vstack([observations, self.parameters])
-        outputStr += " # %f %f %f %f %f"%(self.R2,self.R2adj,self.AIC,self.AICc,self.BIC)
-        fh.write(outputStr+"\n")
-        return observations
+    def printForPopulation(self,fh,n0=0):
+        fh.write(("%f "*len(self.parameters)+" # %f %f %f %f %f\n")%
+                 (tuple(self.parameters)+(self.R2,self.R2adj,self.AIC,self.AICc,self.BIC)))
+        return 1
 
-    def printForPopulationExcel(self,wb, row, observations):
+    def printForPopulationExcel(self,wb, row, n0=0):
         toPrint = []
         for parameter in self.parameters:
             toPrint.append("%f "%parameter)
-        observations = np.vstack([observations, self.parameters])
         excelWriteRow(toPrint+[self.R2,self.R2adj,self.AIC,self.AICc,self.BIC], wb, row)
-        return observations, row+1
+        return row+1
 
     def getBasicInfo(self):
         """ Return a string with some basic information of the fitting. """
@@ -1773,6 +2103,9 @@ class PKPDSampleFit:
     def restartReadingState(self):
         self.state = PKPDSampleFit.READING_SAMPLEFITTINGS_NAME
 
+    def finishReading(self):
+        pass
+
     def readFromLine(self, line):
         if self.state==PKPDSampleFit.READING_SAMPLEFITTINGS_NAME:
             tokens = line.split(':')
@@ -1880,58 +2213,49 @@ class PKPDSampleFitBootstrap:
         self.AICc = []
         self.BIC = []
         self.parameters = None
-        self.xB = []
+        self.xB = [] # One array of resampled X values per bootstrap replicate
         self.yB = []
 
-    def _printSample(self,fh,n, n0=0):
-        outputStr = "%d: "%(n+n0)
-        for parameter in self.parameters[n,:]:
-            outputStr += "%f "%parameter
-        outputStr += " # %f %f %f %f %f"%(self.R2[n],self.R2adj[n],self.AIC[n],self.AICc[n],self.BIC[n])
-        fh.write(outputStr+"\n")
-
-    def _printSampleExcel(self,wb, row, n, n0=0):
-        toPrint = ["Sample %d"%(n+n0)]
-        for parameter in self.parameters[n,:]:
-            toPrint.append(parameter)
-        excelWriteRow(toPrint+[self.R2[n],self.R2adj[n],self.AIC[n],self.AICc[n],self.BIC[n]],wb,row)
-        return row+1
+    def _getQuality(self):
+        return np.column_stack([self.R2,self.R2adj,self.AIC,self.AICc,self.BIC])
 
-    def printForPopulation(self,fh,observations):
-        for n in range(0,self.parameters.shape[0]):
-            self._printSample(fh,n,observations.shape[0])
-        observations = np.vstack([observations, self.parameters])
-        return observations
+    def _formatPopulation(self, n0):
+        # All rows are formatted with a single format string
+        N, Nparameters = self.parameters.shape
+        rowFormat = "%d: "+"%f "*Nparameters+" # %f %f %f %f %f\n"
+        table = np.column_stack([np.arange(n0,n0+N),self.parameters,self._getQuality()]).tolist()
+        return "".join([rowFormat%tuple(row) for row in table])
+
+    def printForPopulation(self,fh,n0=0):
+        fh.write(self._formatPopulation(n0))
+        return self.parameters.shape[0]
 
-    def printForPopulationExcel(self,wb,row,observations):
+    def printForPopulationExcel(self,wb,row,n0=0):
+        quality = self._getQuality()
         for n in range(0,self.parameters.shape[0]):
-            row=self._printSampleExcel(wb,row,n,observations.shape[0])
-        observations = np.vstack([observations, self.parameters])
-        return observations,row+1
+            excelWriteRow(["Sample %d"%(n+n0)]+self.parameters[n,:].tolist()+quality[n,:].tolist(),wb,row)
+            row+=1
+        return row+1
 
     def _printToStream(self,fh):
         fh.write("Sample name: %s\n"%self.sampleName)
-        for n in range(0,self.parameters.shape[0]):
-            fh.write("xB: %s\n"%self.xB[n])
-            fh.write("yB: %s\n"%self.yB[n])
-
-            outputStr = ""
-            for parameter in self.parameters[n,:]:
-                outputStr += "%f "%parameter
-            outputStr += " # %f %f %f %f %f"%(self.R2[n],self.R2adj[n],self.AIC[n],self.AICc[n],self.BIC[n])
-            fh.write(outputStr+"\n")
+        rowFormat = "xB: %s\nyB: %s\n"+"%f "*self.parameters.shape[1]+" # %f %f %f %f %f\n"
+        table = np.column_stack([self.parameters,self._getQuality()]).tolist()
+        fh.write("".join([rowFormat%((formatBootstrapValues(xB),formatBootstrapValues(yB))+tuple(row))
+                          for xB, yB, row in izip(self.xB,self.yB,table)]))
         fh.write("\n")
 
     def _printToExcel(self,wb,row,parameterNames):
         excelWriteRow(["Sample name:",self.sampleName],wb,row,bold=True); row+=1
         for n in range(0,self.parameters.shape[0]):
             excelWriteRow("Sample %d"%n, wb, row); row+=1
-            excelWriteRow(["xB:"]+self.xB[n][1:-1].split(), wb, row); row+=1
-            excelWriteRow(["yB:"]+self.yB[n][1:-1].split(), wb, row); row+=1
+            excelWriteRow(["xB:"]+np.asarray(self.xB[n]).tolist(), wb, row); row+=1
+            excelWriteRow(["yB:"]+np.asarray(self.yB[n]).tolist(), wb, row); row+=1
         return row+1
 
     def restartReadingState(self):
         self.state = PKPDSampleFitBootstrap.READING_SAMPLEFITTINGS_NAME
+        self.parameterRows = []
 
     def readFromLine(self, line):
         if self.state==PKPDSampleFitBootstrap.READING_SAMPLEFITTINGS_NAME:
@@ -1945,9 +2269,9 @@ class PKPDSampleFitBootstrap:
                 tokens = line.split(':')
                 self.strRead += tokens[1].strip()
             else:
-                self.strRead += line
+                self.strRead += " "+line
             if "]" in self.strRead:
-                self.xB.append(self.strRead.strip())
+                self.xB.append(parseBootstrapValues(self.strRead))
                 self.strRead=""
                 self.state = PKPDSampleFitBootstrap.READING_SAMPLEFITTINGS_YB
 
@@ -1956,19 +2280,16 @@ class PKPDSampleFitBootstrap:
                 tokens = line.split(':')
                 self.strRead += tokens[1].strip()
             else:
-                self.strRead += line
+                self.strRead += " "+line
             if "]" in self.strRead:
-                self.yB.append(self.strRead.strip())
+                self.yB.append(parseBootstrapValues(self.strRead))
                 self.strRead=""
                 self.state = PKPDSampleFitBootstrap.READING_SAMPLEFITTINGS_PARAMETERS
 
         elif self.state==PKPDSampleFitBootstrap.READING_SAMPLEFITTINGS_PARAMETERS:
             tokens = line.split('#')
-            tokensParameters = tokens[0].strip().split(' ')
-            tokensQuality = tokens[1].strip().split(' ')
-            if self.parameters is None:
-                self.parameters = np.empty((0,len(tokensParameters)),np.double)
-            self.parameters = np.vstack([self.parameters, [float(prm) for prm in tokensParameters]])
+            tokensQuality = tokens[1].split()
+            self.parameterRows.append([float(prm) for prm in tokens[0].split()])
 
             self.R2.append(float(tokensQuality[0]))
             self.R2adj.append(float(tokensQuality[1]))
@@ -1978,6 +2299,12 @@ class PKPDSampleFitBootstrap:
 
             self.state = PKPDSampleFitBootstrap.READING_SAMPLEFITTINGS_XB
 
+    def finishReading(self):
+        # The parameter matrix is allocated once all the replicates have been read
+        if len(self.parameterRows)>0:
+            self.parameters = np.asarray(self.parameterRows,dtype=np.double)
+        self.parameterRows = []
+
     def copyFromOptimizer(self,optimizer):
         self.R2.append(optimizer.R2)
         self.R2adj.append(optimizer.R2adj)
@@ -1985,6 +2312,178 @@ class PKPDSampleFitBootstrap:
         self.AICc.append(optimizer.AICc)
         self.BIC.append(optimizer.BIC)
 
+    def getColumns(self, parameterNames):
+        """ Dictionary name -> array with one value per replicate, for the parameters and the quality measures """
+        columns = {"R2": np.asarray(self.R2), "R2adj": np.asarray(self.R2adj), "AIC": np.asarray(self.AIC),
+                   "AICc": np.asarray(self.AICc), "BIC": np.asarray(self.BIC)}
+        for j, parameterName in enumerate(parameterNames):
+            columns[parameterName] = self.parameters[:,j]
+        return columns
+
+    def selectReplicates(self, idx):
+        """ New population with the replicates selected by idx (boolean mask or indexes) """
+        idx = np.arange(self.parameters.shape[0])[idx]
+        newSampleFit = PKPDSampleFitBootstrap()
+        newSampleFit.sampleName = self.sampleName
+        newSampleFit.parameters = self.parameters[idx,:]
+        newSampleFit.xB = [self.xB[i] for i in idx]
+        newSampleFit.yB = [self.yB[i] for i in idx]
+        newSampleFit.R2 = np.asarray(self.R2)[idx].tolist()
+        newSampleFit.R2adj = np.asarray(self.R2adj)[idx].tolist()
+        newSampleFit.AIC = np.asarray(self.AIC)[idx].tolist()
+        newSampleFit.AICc = np.asarray(self.AICc)[idx].tolist()
+        newSampleFit.BIC = np.asarray(self.BIC)[idx].tolist()
+        return newSampleFit
+
+
+def concatenateBootstrapFits(sampleFits, sampleName):
+    """ Single population with all the replicates of a list of PKPDSampleFitBootstrap """
+    newSampleFit = PKPDSampleFitBootstrap()
+    newSampleFit.sampleName = sampleName
+    newSampleFit.parameters = np.vstack([sampleFit.parameters for sampleFit in sampleFits])
+    for sampleFit in sampleFits:
+        newSampleFit.xB += sampleFit.xB
+        newSampleFit.yB += sampleFit.yB
+        newSampleFit.R2 += list(sampleFit.R2)
+        newSampleFit.R2adj += list(sampleFit.R2adj)
+        newSampleFit.AIC += list(sampleFit.AIC)
+        newSampleFit.AICc += list(sampleFit.AICc)
+        newSampleFit.BIC += list(sampleFit.BIC)
+    return newSampleFit
+
+
+def formatSampleFit(sampleFit):
+    """ Text of a sample fit as written in the fitting files """
+    fh = io.StringIO()
+    sampleFit._printToStream(fh)
+    return fh.getvalue()
+
+def readSampleFit(sampleFitClass, lines):
+    sampleFit = sampleFitClass()
+    sampleFit.restartReadingState()
+    for line in lines:
+        line = line.strip()
+        if line!="":
+            sampleFit.readFromLine(line)
+    sampleFit.finishReading()
+    return sampleFit
+
+def getSampleFitClass(className):
+    sampleFitClass = globals().get(className)
+    if sampleFitClass is None:
+        raise Exception("Unknown sample fitting class %s"%className)
+    return sampleFitClass
+
+class PKPDSampleFitList:
+    """ List of the sample fits of an indexed fitting file. Every fit is parsed from its byte offset the first
+        time it is accessed, fits added afterwards are kept in memory """
+    def __init__(self, fnFitting, sampleFitClass, index):
+        self.fnFitting = fnFitting
+        self.sampleFitClass = sampleFitClass
+        self._index = list(index) # (sampleName, offset, length) of each fit in the file, None if not in the file
+        self._fits = [None]*len(self._index)
+        self._positions = None
+
+    def __len__(self):
+        return len(self._fits)
+
+    def _position(self, i):
+        N = len(self._fits)
+        if i<0:
+            i += N
+        if i<0 or i>=N:
+            raise IndexError("Sample fit index out of range")
+        return i
+
+    def _readText(self, i, fh=None):
+        _, offset, length = self._index[i]
+        fhIn = fh or open(self.fnFitting,"rb")
+        fhIn.seek(offset)
+        text = fhIn.read(length).decode("utf-8")
+        if fh is None:
+            fhIn.close()
+        return text
+
+    def _load(self, i, fh=None):
+        if self._fits[i] is None:
+            self._fits[i] = readSampleFit(self.sampleFitClass, self._readText(i, fh).split("\n"))
+        return self._fits[i]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self._fits)))]
+        return self._load(self._position(i))
+
+    def __setitem__(self, i, sampleFit):
+        i = self._position(i)
+        self._fits[i] = sampleFit
+        self._index[i] = None
+
+    def __iter__(self):
+        fh = None
+        try:
+            for i in range(len(self._fits)):
+                if self._fits[i] is None and fh is None:
+                    fh = open(self.fnFitting,"rb")
+                yield self._load(i, fh)
+        finally:
+            if fh is not None:
+                fh.close()
+
+    def __copy__(self):
+        newList = PKPDSampleFitList(self.fnFitting, self.sampleFitClass, self._index)
+        newList._fits = list(self._fits)
+        return newList
+
+    def append(self, sampleFit):
+        self._fits.append(sampleFit)
+        self._index.append(None)
+        self._positions = None
+
+    def extend(self, sampleFits):
+        for sampleFit in sampleFits:
+            self.append(sampleFit)
+
+    def getSampleNames(self):
+        """ Names of the samples without parsing their fits """
+        return [sampleFit.sampleName if sampleFit is not None else entry[0]
+                for sampleFit, entry in izip(self._fits, self._index)]
+
+    def _getPositions(self):
+        if self._positions is None:
+            self._positions = {}
+            for i, name in enumerate(self.getSampleNames()):
+                self._positions.setdefault(name, i)
+        return self._positions
+
+    def find(self, sampleName):
+        """ Fit of a sample (None if it is not in the list) """
+        i = self._getPositions().get(sampleName)
+        if i is None:
+            # The sample may have been renamed after the positions were computed
+            self._positions = None
+            i = self._getPositions().get(sampleName)
+            if i is None:
+                return None
+        sampleFit = self._load(i)
+        if sampleFit.sampleName!=sampleName:
+            # The fit was renamed after the index was built
+            self._positions = None
+            return next((sampleFit for sampleFit in self if sampleFit.sampleName==sampleName), None)
+        return sampleFit
+
+    def relocate(self, fnFitting, offsets, lengths):
+        """ The fits have been written to fnFitting at the given offsets """
+        self.fnFitting = fnFitting
+        self._index = [(sampleName, offset, length) for sampleName, offset, length in
+                       izip(self.getSampleNames(), offsets, lengths)]
+
+    def getText(self, i):
+        """ Text of a fit, copied from the file if it has not been modified """
+        i = self._position(i)
+        if self._fits[i] is None:
+            return self._readText(i)
+        return formatSampleFit(self._fits[i])
 
 class PKPDFitting(EMObject):
     READING_FITTING_EXPERIMENT = 1
@@ -1996,6 +2495,7 @@ class PKPDFitting(EMObject):
     READING_POPULATION = 7
     READING_SAMPLEFITTINGS_BEGIN = 8
     READING_SAMPLEFITTINGS_CONTINUE = 9
+    READING_SAMPLE_INDEX = 10
 
     def __init__(self, cls="", **args):
         EMObject.__init__(self, **args)
@@ -2012,27 +2512,84 @@ class PKPDFitting(EMObject):
             self.sampleFittingClass = "PKPDSampleFit"
         else:
             self.sampleFittingClass = cls
+        self._streamFn = None
+        self._streamFh = None
+        self._streamedFits = []
+        self._streamedLengths = []
 
     def isPopulation(self):
         if self.fnFitting.get() is None:
             return False
         return self.fnFitting.get().endswith("bootstrapPopulation.pkpd")
 
+    def startStreaming(self, fnFitting):
+        """ The sample fits added from now on with addSampleFit are written to disk as soon as they are added.
+            write(fnFitting) puts them after the header without formatting them again """
+        self._streamFn = fnFitting
+        self._streamFh = open(fnFitting+".samples","wb")
+        self._streamedFits = []
+        self._streamedLengths = []
+
+    def addSampleFit(self, sampleFit):
+        self.sampleFits.append(sampleFit)
+        if self._streamFh is not None:
+            block = formatSampleFit(sampleFit).encode("utf-8")
+            self._streamFh.write(block)
+            self._streamFh.flush()
+            self._streamedFits.append(sampleFit)
+            self._streamedLengths.append(len(block))
+
+    def _stopStreaming(self):
+        if self._streamFh is None:
+            return False
+        self._streamFh.close()
+        self._streamFh = None
+        # The streamed blocks can only be used if nobody has touched the list of fits
+        return len(self._streamedFits)==len(self.sampleFits) and \
+               all(streamedFit is sampleFit for streamedFit, sampleFit in izip(self._streamedFits, self.sampleFits))
+
     def write(self, fnFitting, writeToExcel=True):
-        fh=open(fnFitting,'w')
-        self._printToStream(fh)
+        fnStream = self._streamFn+".samples" if self._streamFn is not None else None
+        useStream = self._stopStreaming() and self._streamFn==fnFitting
+        if useStream:
+            blocks = None
+            lengths = self._streamedLengths
+        else:
+            blocks = [self._getSampleFitText(i).encode("utf-8") for i in range(len(self.sampleFits))]
+            lengths = [len(block) for block in blocks]
+        header = self._formatHeader().encode("utf-8")
+        index, offsets = self._formatSampleIndex(self.getSampleNames(), lengths, len(header))
+
+        fh=open(fnFitting,'wb')
+        fh.write(header)
+        fh.write(index)
+        if useStream:
+            fhStream = open(fnStream,"rb")
+            shutil.copyfileobj(fhStream, fh)
+            fhStream.close()
+        else:
+            for block in blocks:
+                fh.write(block)
         fh.close()
+
+        if fnStream is not None and os.path.exists(fnStream):
+            os.remove(fnStream)
+        self._streamFn = None
+        self._streamedFits = []
+        self._streamedLengths = []
+        if isinstance(self.sampleFits, PKPDSampleFitList):
+            self.sampleFits.relocate(fnFitting, offsets, lengths)
         self.fnFitting.set(fnFitting)
         writeMD5(fnFitting)
 
-        if writeToExcel:
+        if writeToExcel and excelExportEnabled():
             self.writeToExcel(os.path.splitext(fnFitting)[0] + ".xlsx")
 
     def getAllParameters(self):
-        allParameters = np.empty((0,len(self.modelParameters)),np.double)
-        for sampleFitting in self.sampleFits:
-            allParameters = np.vstack([allParameters, sampleFitting.parameters])
-        return allParameters
+        if len(self.sampleFits)==0:
+            return np.empty((0,len(self.modelParameters)),np.double)
+        return np.vstack([np.reshape(sampleFitting.parameters,(-1,len(self.modelParameters)))
+                          for sampleFitting in self.sampleFits])
 
     def getStats(self, observations=None):
         if observations is None:
@@ -2044,7 +2601,46 @@ class PKPDFitting(EMObject):
         percentiles = np.percentile(observations,[0, 2.5, 25, 50, 75, 97.5, 100],axis=0)
         return mu, sigma, R, percentiles
 
+    def getSampleNames(self):
+        if isinstance(self.sampleFits, PKPDSampleFitList):
+            return self.sampleFits.getSampleNames()
+        return [sampleFit.sampleName for sampleFit in self.sampleFits]
+
+    def _getSampleFitText(self, i):
+        if isinstance(self.sampleFits, PKPDSampleFitList):
+            return self.sampleFits.getText(i)
+        return formatSampleFit(self.sampleFits[i])
+
+    def _formatHeader(self):
+        fh = io.StringIO()
+        self._printHeaderToStream(fh)
+        return fh.getvalue()
+
+    def _formatSampleIndex(self, sampleNames, lengths, offset0):
+        """ [SAMPLE INDEX] section with the byte offset and length of each sample fit, offset0 is the position
+            of this section in the file. Numbers have a fixed width so that the size of the section does not
+            depend on them """
+        lineFormat = "%s %012d %012d\n"
+        sectionBegin = "[SAMPLE INDEX] ======================\n".encode("utf-8")
+        sectionEnd = "\n[SAMPLE FITTINGS] ===================\n".encode("utf-8")
+        size = len(sectionBegin)+len(sectionEnd)+sum([len((lineFormat%(sampleName,0,0)).encode("utf-8"))
+                                                        for sampleName in sampleNames])
+        offsets = (offset0+size+np.concatenate([[0],np.cumsum(lengths,dtype=np.int64)])[:-1]).tolist()
+        lines = "".join([lineFormat%(sampleName,offset,length)
+                         for sampleName, offset, length in izip(sampleNames, offsets, lengths)])
+        return sectionBegin+lines.encode("utf-8")+sectionEnd, offsets
+
     def _printToStream(self,fh):
+        header = self._formatHeader()
+        blocks = [self._getSampleFitText(i) for i in range(len(self.sampleFits))]
+        index, _ = self._formatSampleIndex(self.getSampleNames(), [len(block.encode("utf-8")) for block in blocks],
+                                           len(header.encode("utf-8")))
+        fh.write(header)
+        fh.write(index.decode("utf-8"))
+        for block in blocks:
+            fh.write(block)
+
+    def _printHeaderToStream(self,fh):
         fh.write("[FITTING] ===========================\n")
         fh.write("Experiment: %s\n"%self.fnExperiment.get())
         fh.write("Predictor (X): ")
@@ -2065,11 +2661,13 @@ class PKPDFitting(EMObject):
             auxUnit.unit = paramUnits
             fh.write("%s [%s] "%(paramName,auxUnit._toString()))
         fh.write(" # R2 R2adj AIC AICc BIC\n")
-        observations = np.empty((0,len(self.modelParameters)),np.double)
+        n0 = 0
         for sampleFitting in self.sampleFits:
-            observations = sampleFitting.printForPopulation(fh,observations)
+            n0 += sampleFitting.printForPopulation(fh,n0)
         fh.write("\n")
 
+        observations = self.getAllParameters()
+
         mu=np.mean(observations,axis=0)
         if observations.shape[0]>2:
             C=np.cov(np.transpose(observations))
@@ -2088,13 +2686,8 @@ class PKPDFitting(EMObject):
             fh.write("Correlation matrix  =\n%s\n"%np.array_str(R,max_line_width=120))
         fh.write("\n")
 
-        fh.write("[SAMPLE FITTINGS] ===================\n")
-        for sampleFitting in self.sampleFits:
-            sampleFitting._printToStream(fh)
-
     def writeToExcel(self,fnXls):
-        wb = openpyxl.Workbook()
-        wb.active.title = "Experiment"
+        wb = ExcelStreamWriter("Experiment")
 
         currentRow = 1
         excelWriteRow("FITTING",wb,currentRow,bold=True); excelFillCells(wb,currentRow); currentRow+=1
@@ -2119,11 +2712,14 @@ class PKPDFitting(EMObject):
             auxUnit.unit = paramUnits
             toPrint.append("%s [%s] "%(paramName,auxUnit._toString()))
         excelWriteRow(toPrint+["R2","R2adj","AIC","AICc","BIC"],wb,currentRow); currentRow+=1
-        observations = np.empty((0,len(self.modelParameters)),np.double)
+        n0 = 0
         for sampleFitting in self.sampleFits:
-            observations, currentRow = sampleFitting.printForPopulationExcel(wb,currentRow,observations)
+            currentRow = sampleFitting.printForPopulationExcel(wb,currentRow,n0)
+            n0 += np.reshape(sampleFitting.parameters,(-1,len(self.modelParameters))).shape[0]
         currentRow+=1
 
+        observations = self.getAllParameters()
+
         mu=np.mean(observations,axis=0)
         if observations.shape[0]>2:
             excelWriteRow(["Mean   parameters  =",np.array_str(mu)], wb, currentRow); currentRow+=1
@@ -2150,7 +2746,9 @@ class PKPDFitting(EMObject):
         self.fnFitting.set(fnFitting)
 
         auxUnit = PKPDUnit()
-        for line in fh.readlines():
+        sampleFitClass = getSampleFitClass(self.sampleFittingClass)
+        sampleIndex = None
+        for line in fh:
             line=line.strip()
             if line=="":
                 if state==PKPDFitting.READING_SAMPLEFITTINGS_CONTINUE:
@@ -2164,7 +2762,13 @@ class PKPDFitting(EMObject):
                 elif section=="[population parameters]":
                     state=PKPDFitting.READING_POPULATION_HEADER
                     self.summaryLines.append(line)
+                elif section=="[sample index]":
+                    state=PKPDFitting.READING_SAMPLE_INDEX
+                    sampleIndex = []
                 elif section=="[sample fittings]":
+                    if sampleIndex is not None:
+                        # The fits are read on demand from their offsets
+                        break
                     state=PKPDFitting.READING_SAMPLEFITTINGS_BEGIN
                 else:
                     print("Skipping: ",line)
@@ -2222,8 +2826,12 @@ class PKPDFitting(EMObject):
             elif state==PKPDFitting.READING_POPULATION:
                 self.summaryLines.append(line)
 
+            elif state==PKPDFitting.READING_SAMPLE_INDEX:
+                sampleName, offset, length = line.rsplit(' ',2)
+                sampleIndex.append((sampleName, int(offset), int(length)))
+
             elif state==PKPDFitting.READING_SAMPLEFITTINGS_BEGIN:
-                newSampleFit = eval("%s()"%self.sampleFittingClass)
+                newSampleFit = sampleFitClass()
                 self.sampleFits.append(newSampleFit)
                 self.sampleFits[-1].restartReadingState()
                 self.sampleFits[-1].readFromLine(line)
@@ -2233,8 +2841,15 @@ class PKPDFitting(EMObject):
                 self.sampleFits[-1].readFromLine(line)
 
         fh.close()
+        if sampleIndex is not None:
+            self.sampleFits = PKPDSampleFitList(fnFitting, sampleFitClass, sampleIndex)
+        else:
+            for sampleFit in self.sampleFits:
+                sampleFit.finishReading()
 
     def getSampleFit(self, sampleName):
+        if isinstance(self.sampleFits, PKPDSampleFitList):
+            return self.sampleFits.find(sampleName)
         for sampleFit in self.sampleFits:
             if sampleFit.sampleName == sampleName:
                 return sampleFit
@@ -2659,6 +3274,32 @@ class PKPDDoseResponse(EMObject):
             self.Nresponses[n]+=1
 
 
+def evaluateLabelExpression(compiledExpression, sampleList, variableDict):
+    # Build one column per label used in the expression (plus sampleName) and evaluate it on all samples
+    N = len(sampleList)
+    valid = np.ones(N, dtype=bool)
+    columns = {}
+    for varName in compiledExpression.varList:
+        if varName=="sampleName":
+            columns[varName] = np.array([sample.sampleName for sample in sampleList], dtype=str)
+            continue
+        if varName not in variableDict:
+            raise Exception("Unknown variable %s in %s"%(varName,compiledExpression.expression))
+        columns[varName], validVar = toColumn([sample.getDescriptorValue(varName) for sample in sampleList],
+                                              variableDict[varName].isNumeric())
+        valid = np.logical_and(valid, validVar)
+    return compiledExpression.evaluate(columns, N), valid
+
+def formatBootstrapValues(values):
+    """ Bootstrap resampled values as written in the population files: [v1 v2 ...] """
+    return "["+" ".join([repr(value) for value in np.asarray(values,dtype=np.double).tolist()])+"]"
+
+
+def parseBootstrapValues(valuesString):
+    """ Inverse of formatBootstrapValues, also valid for the output of str(np.array) """
+    return np.asarray(valuesString.strip()[1:-1].split(),dtype=np.double)
+
+
 def flattenArray(y):
     if type(y[0])!=list and type(y[0])!=np.ndarray:
         y = [np.array(y,dtype=np.float32)]
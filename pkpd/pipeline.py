@@ -0,0 +1,136 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (info@kinestat.com)
+# *
+# * Kinestat Pharma
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'info@kinestat.com'
+# *
+# **************************************************************************
+"""
+Protocol engines callable without a Scipion project.
+
+Each function creates the protocol object in memory (no project, database nor
+run directory), sets its form parameters from the keyword arguments and calls
+the same engine that the protocol step calls, on experiments and fittings that
+are already in memory. Nothing is read from or written to disk. The input
+experiments are modified in place, as the protocols do with the experiments
+they read.
+
+    from pkpd.pipeline import fitODE, nca
+    from pkpd.protocols import ProtPKPDMonoCompartment
+    fitting = fitODE(experiment, ProtPKPDMonoCompartment, [(0.1,10),(1,100)], predicted="Cp")
+"""
+
+import contextlib
+import os
+
+
+@contextlib.contextmanager
+def _output(verbose):
+    # The protocol engines report their progress on stdout
+    if verbose:
+        yield
+    else:
+        with open(os.devnull, "w") as fhNull, contextlib.redirect_stdout(fhNull):
+            yield
+
+
+def boundsToString(bounds):
+    """ [(lower,upper), ...] -> "(lower,upper);..." as written in the protocol forms """
+    if bounds is None or isinstance(bounds, str):
+        return bounds
+    return ";".join(["(%s,%s)" % (repr(float(lower)), repr(float(upper))) for lower, upper in bounds])
+
+
+def createProtocol(protocolClass, **kwargs):
+    """ Protocol object that does not belong to any project. The keyword arguments are the values of its
+        form parameters. If protocolClass is already a protocol object, its parameters are updated """
+    prot = protocolClass() if isinstance(protocolClass, type) else protocolClass
+    for paramName, value in kwargs.items():
+        if value is None:
+            continue
+        param = getattr(prot, paramName, None)
+        if param is None or not hasattr(param, "set"):
+            raise Exception("%s does not have a parameter called %s" % (prot.getClassName(), paramName))
+        param.set(value)
+    return prot
+
+
+def fitODE(experiment, protocolClass, bounds, reportX=None, verbose=False, **kwargs):
+    """ Fit an ODE model (protocolClass is a subclass of ProtPKPDODEBase, e.g., ProtPKPDMonoCompartment) to the
+        samples of the experiment. bounds is a list of (lower,upper) or a string as in the protocol form.
+        The other form parameters (predictor, predicted, fitType, globalSearch, confidenceInterval, ...) are
+        given as keyword arguments. The fitted parameters are added to the samples of the experiment and
+        the PKPDFitting is returned """
+    prot = createProtocol(protocolClass, bounds=boundsToString(bounds), **kwargs)
+    prot.setExperiment(experiment)
+    with _output(verbose):
+        return prot.fitExperiment(experiment.fnPKPD.get() or "", reportX)
+
+
+def fitModel(experiment, protocolClass, bounds="", verbose=False, **kwargs):
+    """ Fit an explicit model (protocolClass is a subclass of ProtPKPDFitBase, e.g., ProtPKPDDissolutionFit)
+        to each sample of the experiment. The fitted parameters are added to the samples of the experiment
+        and the PKPDFitting is returned """
+    prot = createProtocol(protocolClass, bounds=boundsToString(bounds), **kwargs)
+    prot.experiment = experiment
+    with _output(verbose):
+        return prot.fitExperiment(experiment.fnPKPD.get() or "")
+
+
+def simulateODE(models, doses, t0=0.0, tF=24*7, deltaT=0.5, verbose=False):
+    """ Add the responses of a list of fitted ODE models, each one to its own dose.
+        models is a list of (ODE protocol class or object, experiment, fitting), and doses has one dose
+        per line, as in the form of ProtPKPDODESimulate2 (Bolus0; via=Oral; bolus; t=0 h; d=60 mg).
+        The simulated experiment is returned """
+    from pkpd.protocols import ProtPKPDODESimulate2
+    prot = createProtocol(ProtPKPDODESimulate2, doses=doses, t0=t0, tF=tF, deltaT=deltaT)
+    inputs = [(createProtocol(protODE), experiment, fitting) for protODE, experiment, fitting in models]
+    with _output(verbose):
+        return prot.simulateModels(inputs)
+
+
+def nca(experiment, xVar="Cp", t0="", tF="", verbose=False):
+    """ Numerical non-compartmental analysis of each sample (ProtPKPDNCANumeric). The NCA descriptors
+        (AUC0t, AUMC0t, MRT, Cmax, Tmax) are added to the samples and the experiment is returned """
+    from pkpd.protocols import ProtPKPDNCANumeric
+    prot = createProtocol(ProtPKPDNCANumeric, xVar=xVar, t0=str(t0), tF=str(tF))
+    with _output(verbose):
+        prot.analyzeExperiment(experiment, xVar)
+    return experiment
+
+
+def ivivc(experimentInVitro, fittingInVitro, experimentInVivo, modelType=3, allowTlag=False, verbose=False,
+          **kwargs):
+    """ In vitro-in vivo correlation of all dissolution profiles with all absorption profiles
+        (ProtPKPDDissolutionIVIVC). experimentInVitro and fittingInVitro are the output of fitModel with
+        ProtPKPDDissolutionFit (modelType and allowTlag as in that fit), experimentInVivo has the absorbed
+        amount A as a function of t. The other form parameters (timeScale, kBounds, responseScale, ...) are
+        given as keyword arguments.
+        Returns the experiments with Fabs, Adissol and the single IVIVC of the average profiles """
+    from pkpd.protocols import ProtPKPDDissolutionFit, ProtPKPDDissolutionIVIVC
+    protFit = createProtocol(ProtPKPDDissolutionFit, modelType=modelType, allowTlag=allowTlag)
+    prot = createProtocol(ProtPKPDDissolutionIVIVC, **kwargs)
+    with _output(verbose):
+        prot.parametersInVitro, prot.vesselNames, _ = prot.extractInVitroModels(protFit, experimentInVitro,
+                                                                                fittingInVitro)
+        prot.profilesInVivo, prot.sampleNames = prot.extractInVivoProfiles(experimentInVivo)
+        prot.computeAllIvIvC()
+    return prot.outputExperimentFabs, prot.outputExperimentAdissol, prot.outputExperimentFabsSingle
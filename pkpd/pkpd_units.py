@@ -258,6 +258,8 @@ class PKPDUnit:
         UNIT_INVTIME2_MIN2: "1/min^2"
     }
 
+    stringDictionary = {unitString: unitCode for unitCode, unitString in sorted(unitDictionary.items(), reverse=True)}
+
     def __init__(self,unitString=""):
         self.unit = self._fromString(unitString)
 
@@ -293,9 +295,8 @@ class PKPDUnit:
         if unitString == "":
             return None
 
-        for _unitKey, _unitString in cls.unitDictionary.items():
-            if _unitString == unitString:
-                return _unitKey
+        if unitString in cls.stringDictionary:
+            return cls.stringDictionary[unitString]
         if unitString == "ug/mL":
             return PKPDUnit.UNIT_CONC_mg_L
         elif unitString == "mg/mL":
@@ -305,604 +306,205 @@ class PKPDUnit:
         return None
 
 
+# Unit registry ------------------------------------------------------------------------------------------------
+# Every unit of PKPDUnit.unitDictionary is decomposed from its string (e.g. "mg*h^2/L") into its components
+# (mg:1, h:2, L:-1). From the components we get the physical dimension (exponents of mass, amount of
+# substance, volume and time) and the scale factor with respect to g, mol, L and h. Conversions, products and
+# quotients are then resolved by tables instead of case by case.
+DIM_MASS = 0
+DIM_AMOUNT = 1
+DIM_VOLUME = 2
+DIM_TIME = 3
+
+_unitSymbols = {
+    "kg": (DIM_MASS, 1e3),
+    "g": (DIM_MASS, 1.0),
+    "mg": (DIM_MASS, 1e-3),
+    "ug": (DIM_MASS, 1e-6),
+    "ng": (DIM_MASS, 1e-9),
+    "mmol": (DIM_AMOUNT, 1e-3),
+    "umol": (DIM_AMOUNT, 1e-6),
+    "nmol": (DIM_AMOUNT, 1e-9),
+    "L": (DIM_VOLUME, 1.0),
+    "mL": (DIM_VOLUME, 1e-3),
+    "uL": (DIM_VOLUME, 1e-6),
+    "nL": (DIM_VOLUME, 1e-9),
+    "h": (DIM_TIME, 1.0),
+    "min": (DIM_TIME, 1.0/60),
+    "s": (DIM_TIME, 1.0/3600)
+}
+
+def _parseUnitString(unitString):
+    # "mg*h^2/L" -> {"mg":1, "h":2, "L":-1}
+    components = {}
+    for sign, part in zip([1, -1], unitString.split("/")):
+        for factor in part.split("*"):
+            factor = factor.strip()
+            if factor=="1":
+                continue
+            if "^" in factor:
+                symbol, exponent = factor.split("^")
+                exponent = int(exponent)
+            else:
+                symbol, exponent = factor, 1
+            if symbol not in _unitSymbols:
+                return None
+            components[symbol] = components.get(symbol, 0)+sign*exponent
+    return components
+
+def _componentsInfo(components):
+    dimension = [0, 0, 0, 0]
+    scale = 1.0
+    for symbol, exponent in components.items():
+        dim, symbolScale = _unitSymbols[symbol]
+        dimension[dim] += exponent
+        scale *= symbolScale**exponent
+    return tuple(dimension), scale
+
+def _signature(components):
+    return frozenset((symbol, exponent) for symbol, exponent in components.items() if exponent!=0)
+
+def _roundFactor(factor):
+    # Remove the rounding errors of the products of scales (1e-3/1e-6 -> 1000)
+    return float("%.14g"%factor)
+
+class PKPDUnitRegistry:
+    def __init__(self):
+        self.components = {}   # code -> components
+        self.dimension = {}    # code -> dimension
+        self.scale = {}        # code -> scale factor
+        self.bySignature = {}  # components signature -> code
+        self.byDimension = {}  # dimension -> list of codes
+        for code in sorted(PKPDUnit.unitDictionary.keys()):
+            components = _parseUnitString(PKPDUnit.unitDictionary[code])
+            if not components:
+                continue
+            dimension, scale = _componentsInfo(components)
+            self.components[code] = components
+            self.dimension[code] = dimension
+            self.scale[code] = scale
+            self.bySignature.setdefault(_signature(components), code)
+            self.byDimension.setdefault(dimension, []).append(code)
+
+        # Conversion factors between all the units of the same dimension
+        self.conversionFactor = {}
+        for codes in self.byDimension.values():
+            for codeIn in codes:
+                for codeOut in codes:
+                    self.conversionFactor[(codeIn, codeOut)] = _roundFactor(self.scale[codeIn]/self.scale[codeOut])
+
+        # Products and quotients are tabulated as they are requested
+        self.productTable = {}
+        self.quotientTable = {}
+
+    def isKnown(self, code):
+        return code in self.components
+
+    def findUnit(self, components):
+        # Exact match of the components (h*ug/mL) or, otherwise, a unit with the same dimension and scale (mL*g/L=mg)
+        components = {symbol: exponent for symbol, exponent in components.items() if exponent!=0}
+        if not components:
+            return PKPDUnit.UNIT_NONE
+        code = self.bySignature.get(_signature(components), None)
+        if code is not None:
+            return code
+        dimension, scale = _componentsInfo(components)
+        for code in self.byDimension.get(dimension, []):
+            if abs(self.scale[code]-scale)<=1e-9*scale:
+                return code
+        return PKPDUnit.UNIT_NONE
+
+    def combine(self, unitX, unitY, exponentY):
+        if not self.isKnown(unitX) or not self.isKnown(unitY):
+            return PKPDUnit.UNIT_NONE
+        components = dict(self.components[unitX])
+        for symbol, exponent in self.components[unitY].items():
+            components[symbol] = components.get(symbol, 0)+exponentY*exponent
+        return self.findUnit(components)
+
+    def multiply(self, unitX, unitY):
+        key = (unitX, unitY)
+        if key not in self.productTable:
+            self.productTable[key] = self.combine(unitX, unitY, 1)
+        return self.productTable[key]
+
+    def divide(self, unitX, unitY):
+        key = (unitX, unitY)
+        if key not in self.quotientTable:
+            self.quotientTable[key] = self.combine(unitX, unitY, -1)
+        return self.quotientTable[key]
+
+    def withoutTime(self, unit):
+        # Components of a rate (g/min) without its time part (g)
+        return {symbol: exponent for symbol, exponent in self.components[unit].items()
+                if _unitSymbols[symbol][0]!=DIM_TIME}
+
+    def isRate(self, unit):
+        if not self.isKnown(unit):
+            return False
+        dimension = self.dimension[unit]
+        return dimension[DIM_TIME]==-1 and dimension[DIM_VOLUME]==0 and \
+               (dimension[DIM_MASS], dimension[DIM_AMOUNT]) in [(1, 0), (0, 1)]
+
+    def getConversionFactor(self, unitsIn, unitsOut):
+        key = (unitsIn, unitsOut)
+        if key in self.conversionFactor:
+            return self.conversionFactor[key]
+        if self.isRate(unitsIn) and self.isKnown(unitsOut):
+            # A rate in the time units of the experiment is converted into the amount per time unit
+            components = self.withoutTime(unitsIn)
+            dimension, scale = _componentsInfo(components)
+            if dimension==self.dimension[unitsOut]:
+                factor = _roundFactor(scale/self.scale[unitsOut])
+                self.conversionFactor[key] = factor
+                return factor
+        return None
+
+unitRegistry = PKPDUnitRegistry()
+
+def getConversionFactor(unitsIn, unitsOut):
+    if unitsIn==unitsOut or unitsIn==PKPDUnit.UNIT_NONE:
+        return 1.0
+    K = unitRegistry.getConversionFactor(unitsIn, unitsOut)
+    if K is None:
+        raise Exception("Unknown unit conversion from %s to %s"%(PKPDUnit.codeToString(unitsIn),
+                                                                 PKPDUnit.codeToString(unitsOut)))
+    return K
+
 def convertUnits(x, unitsIn, unitsOut):
+    """ x may be a scalar or a numpy array """
     if unitsIn==unitsOut or unitsIn==PKPDUnit.UNIT_NONE:
         return x
-
-    if unitsIn == PKPDUnit.UNIT_WEIGHT_g:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_g:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_mg:
-            return 1e3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ug:
-            return 1e6*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ng:
-            return 1e9*x
-        else:
-            raise Exception("Unknown unit conversion from %s to %s"%(PKPDUnit.unitDictionary[unitsIn],PKPDUnit.unitDictionary[unitsOut]))
-
-    elif unitsIn == PKPDUnit.UNIT_WEIGHT_mg:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_g:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_mg:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ug:
-            return 1e3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ng:
-            return 1e6*x
-        else:
-            raise Exception("Unknown unit conversion from %s to %s"%(PKPDUnit.unitDictionary[unitsIn],PKPDUnit.unitDictionary[unitsOut]))
-
-    elif unitsIn == PKPDUnit.UNIT_WEIGHT_ug:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_g:
-            return 1e-6*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_mg:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ug:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ng:
-            return 1e3*x
-        else:
-            raise Exception("Unknown unit conversion from %s to %s"%(PKPDUnit.unitDictionary[unitsIn],PKPDUnit.unitDictionary[unitsOut]))
-
-    elif unitsIn == PKPDUnit.UNIT_WEIGHT_ng:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_g:
-            return 1e-9*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_mg:
-            return 1e-6*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ug:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ng:
-            return x
-        else:
-            raise Exception("Unknown unit conversion from %s to %s"%(PKPDUnit.unitDictionary[unitsIn],PKPDUnit.unitDictionary[unitsOut]))
-
-    elif unitsIn == PKPDUnit.UNIT_WEIGHT_mmol:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_mmol:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_umol:
-            return 1e3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_nmol:
-            return 1e6*x
-        else:
-            raise Exception("Unknown unit conversion from %s to %s"%(PKPDUnit.unitDictionary[unitsIn],PKPDUnit.unitDictionary[unitsOut]))
-
-    elif unitsIn == PKPDUnit.UNIT_WEIGHT_umol:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_mmol:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_umol:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_nmol:
-            return 1e3*x
-        else:
-            raise Exception("Unknown unit conversion from %s to %s"%(PKPDUnit.unitDictionary[unitsIn],PKPDUnit.unitDictionary[unitsOut]))
-
-    elif unitsIn == PKPDUnit.UNIT_WEIGHT_nmol:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_mmol:
-            return 1e-6*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_umol:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_nmol:
-            return x
-        else:
-            raise Exception("Unknown unit conversion from %s to %s"%(PKPDUnit.unitDictionary[unitsIn],PKPDUnit.unitDictionary[unitsOut]))
-
-    elif unitsIn == PKPDUnit.UNIT_CONC_g_L:
-        if unitsOut == PKPDUnit.UNIT_CONC_mg_L or unitsOut==PKPDUnit.UNIT_CONC_ug_mL:
-            return 1e3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_ug_L:
-            return 1e6*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_ng_L:
-            return 1e9*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_g_mL:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_g_uL:
-            return 1e-6*x
-
-    elif unitsIn == PKPDUnit.UNIT_CONC_mg_L  or unitsIn==PKPDUnit.UNIT_CONC_ug_mL:
-        if unitsOut == PKPDUnit.UNIT_CONC_g_L:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_mg_L  or unitsOut==PKPDUnit.UNIT_CONC_ug_mL:
-            return 1
-        elif unitsOut == PKPDUnit.UNIT_CONC_ug_L:
-            return 1e3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_ng_L:
-            return 1e6*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_g_mL:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_CONC_g_uL:
-            return 1e-3*x
-
-    elif unitsIn == PKPDUnit.UNIT_CONC_ug_L:
-        if unitsOut == PKPDUnit.UNIT_CONC_g_L:
-            return 1e-6*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_mg_L  or unitsOut==PKPDUnit.UNIT_CONC_ug_mL:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_ng_L:
-            return 1e3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_g_mL:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_g_uL:
-            return x
-
-    elif unitsIn == PKPDUnit.UNIT_CONC_ng_L:
-        if unitsOut == PKPDUnit.UNIT_CONC_g_L:
-            return 1e-9*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_mg_L or unitsOut==PKPDUnit.UNIT_CONC_ug_mL:
-            return 1e-6*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_ug_L:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_g_mL:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_CONC_g_uL:
-            return 1e3*x
-
-    elif unitsIn == PKPDUnit.UNIT_CONC_g_mL:
-        if unitsOut == PKPDUnit.UNIT_CONC_g_L:
-            return 1e3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_mg_L or unitsOut==PKPDUnit.UNIT_CONC_ug_mL:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_CONC_ug_L:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_ng_L:
-            return 1e-6*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_g_uL:
-            return 1e-3*x
-
-    elif unitsIn == PKPDUnit.UNIT_CONC_g_uL:
-        if unitsOut == PKPDUnit.UNIT_CONC_g_L:
-            return 1e6*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_mg_L or unitsOut==PKPDUnit.UNIT_CONC_ug_mL:
-            return 1e3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_ug_L:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_CONC_ng_L:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_CONC_g_mL:
-            return 1e3*x
-
-    elif unitsIn == PKPDUnit.UNIT_TIME_H:
-        if unitsOut == PKPDUnit.UNIT_TIME_MIN:
-            return 60*x
-        elif unitsOut == PKPDUnit.UNIT_TIME_SEC:
-            return 3600*x
-
-    elif unitsIn == PKPDUnit.UNIT_TIME_MIN:
-        if unitsOut == PKPDUnit.UNIT_TIME_H:
-            return x/60
-        elif unitsOut == PKPDUnit.UNIT_TIME_SEC:
-            return 60*x
-
-    elif unitsIn == PKPDUnit.UNIT_TIME_SEC:
-        if unitsOut == PKPDUnit.UNIT_TIME_H:
-            return x/3600
-        elif unitsOut == PKPDUnit.UNIT_TIME_MIN:
-            return x/60
-
-    elif unitsIn == PKPDUnit.UNIT_TIMECONC_MIN_mg_L:
-        if unitsOut == PKPDUnit.UNIT_TIMECONC_H_mg_L:
-            return x/60
-
-    elif unitsIn == PKPDUnit.UNIT_WEIGHTINVTIME_g_MIN:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_g:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_mg:
-            return 1e3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ug:
-            return 1e6*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ng:
-            return 1e9*x
-
-    elif unitsIn == PKPDUnit.UNIT_WEIGHTINVTIME_mg_MIN:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_g:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_mg:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ug:
-            return 1e3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ng:
-            return 1e6*x
-
-    elif unitsIn == PKPDUnit.UNIT_WEIGHTINVTIME_ug_MIN:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_g:
-            return 1e-6*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_mg:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ug:
-            return x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ng:
-            return 1e3*x
-
-    elif unitsIn == PKPDUnit.UNIT_WEIGHTINVTIME_ng_MIN:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_g:
-            return 1e-9*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_mg:
-            return 1e-6*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ug:
-            return 1e-3*x
-        elif unitsOut == PKPDUnit.UNIT_WEIGHT_ng:
-            return x
-
-    elif unitsIn == PKPDUnit.UNIT_WEIGHTINVTIME_umol_MIN:
-        if unitsOut == PKPDUnit.UNIT_WEIGHT_umol:
-            return x
-
-    return None
+    return getConversionFactor(unitsIn, unitsOut)*x
 
 def changeRateTo(targetUnit, amount,unit):
-    if targetUnit==PKPDUnit.UNIT_TIME_MIN:
-        if unit==PKPDUnit.UNIT_WEIGHTINVTIME_g_H:
-            return (amount/60,PKPDUnit.UNIT_WEIGHTINVTIME_g_MIN)
-        elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_g_SEC:
-            return (amount*60,PKPDUnit.UNIT_WEIGHTINVTIME_g_MIN)
-
-        elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_mg_H:
-            return (amount/60,PKPDUnit.UNIT_WEIGHTINVTIME_mg_MIN)
-        elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_mg_SEC:
-            return (amount*60,PKPDUnit.UNIT_WEIGHTINVTIME_mg_MIN)
-
-        elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_ug_H:
-            return (amount/60,PKPDUnit.UNIT_WEIGHTINVTIME_ug_MIN)
-        elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_ug_SEC:
-            return (amount*60,PKPDUnit.UNIT_WEIGHTINVTIME_ug_MIN)
-
-        elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_ng_H:
-            return (amount/60,PKPDUnit.UNIT_WEIGHTINVTIME_ng_MIN)
-        elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_ng_SEC:
-            return (amount*60,PKPDUnit.UNIT_WEIGHTINVTIME_ng_MIN)
-
-        elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_umol_H:
-            return (amount/60,PKPDUnit.UNIT_WEIGHTINVTIME_umol_MIN)
-        elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_umol_SEC:
-            return (amount*60,PKPDUnit.UNIT_WEIGHTINVTIME_umol_MIN)
-
-        else:
-            return (amount,unit)
-    elif targetUnit==PKPDUnit.UNIT_TIME_H:
-        if unit == PKPDUnit.UNIT_WEIGHTINVTIME_g_MIN:
-            return (amount * 60, PKPDUnit.UNIT_WEIGHTINVTIME_g_H)
-        elif unit == PKPDUnit.UNIT_WEIGHTINVTIME_g_SEC:
-            return (amount * 3600, PKPDUnit.UNIT_WEIGHTINVTIME_g_H)
-
-        elif unit == PKPDUnit.UNIT_WEIGHTINVTIME_mg_MIN:
-            return (amount * 60, PKPDUnit.UNIT_WEIGHTINVTIME_mg_H)
-        elif unit == PKPDUnit.UNIT_WEIGHTINVTIME_mg_SEC:
-            return (amount * 3600, PKPDUnit.UNIT_WEIGHTINVTIME_mg_H)
-
-        elif unit == PKPDUnit.UNIT_WEIGHTINVTIME_ug_MIN:
-            return (amount * 60, PKPDUnit.UNIT_WEIGHTINVTIME_ug_H)
-        elif unit == PKPDUnit.UNIT_WEIGHTINVTIME_ug_SEC:
-            return (amount * 3600, PKPDUnit.UNIT_WEIGHTINVTIME_ug_H)
-
-        elif unit == PKPDUnit.UNIT_WEIGHTINVTIME_ng_MIN:
-            return (amount * 60, PKPDUnit.UNIT_WEIGHTINVTIME_ng_H)
-        elif unit == PKPDUnit.UNIT_WEIGHTINVTIME_ng_SEC:
-            return (amount * 3600, PKPDUnit.UNIT_WEIGHTINVTIME_ng_H)
-
-        elif unit == PKPDUnit.UNIT_WEIGHTINVTIME_umol_MIN:
-            return (amount * 60, PKPDUnit.UNIT_WEIGHTINVTIME_umol_H)
-        elif unit == PKPDUnit.UNIT_WEIGHTINVTIME_umol_SEC:
-            return (amount * 3600, PKPDUnit.UNIT_WEIGHTINVTIME_umol_H)
-
-        else:
-            return (amount, unit)
+    """ Express a rate (weight/time) in the time units given by targetUnit """
+    if not unitRegistry.isRate(unit) or not unitRegistry.isKnown(targetUnit):
+        return (amount,unit)
+    components = unitRegistry.withoutTime(unit)
+    for symbol, exponent in unitRegistry.components[targetUnit].items():
+        components[symbol] = components.get(symbol, 0)-exponent
+    newUnit = unitRegistry.findUnit(components)
+    if newUnit==PKPDUnit.UNIT_NONE or newUnit==unit:
+        return (amount,unit)
+    return (convertUnits(amount,unit,newUnit),newUnit)
 
 def changeRateToWeight(unit):
-    if unit==PKPDUnit.UNIT_WEIGHTINVTIME_g_MIN:
-        return PKPDUnit.UNIT_WEIGHT_g
-    elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_mg_MIN:
-        return PKPDUnit.UNIT_WEIGHT_mg
-    elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_ug_MIN:
-        return PKPDUnit.UNIT_WEIGHT_ug
-    elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_ng_MIN:
-        return PKPDUnit.UNIT_WEIGHT_ng
-    elif unit==PKPDUnit.UNIT_WEIGHTINVTIME_umol_MIN:
-        return PKPDUnit.UNIT_WEIGHT_umol
-    else:
+    if not unitRegistry.isRate(unit):
         return unit
+    weightUnit = unitRegistry.findUnit(unitRegistry.withoutTime(unit))
+    return unit if weightUnit==PKPDUnit.UNIT_NONE else weightUnit
 
 def multiplyUnits(unitX,unitY):
-    if unitX==PKPDUnit.UNIT_TIME_H:
-        if unitY==PKPDUnit.UNIT_CONC_g_L:
-            return PKPDUnit.UNIT_TIMECONC_H_g_L
-        elif unitY==PKPDUnit.UNIT_CONC_mg_L:
-            return PKPDUnit.UNIT_TIMECONC_H_mg_L
-        elif unitY==PKPDUnit.UNIT_CONC_ug_L:
-            return PKPDUnit.UNIT_TIMECONC_H_ug_L
-        elif unitY==PKPDUnit.UNIT_CONC_ng_L:
-            return PKPDUnit.UNIT_TIMECONC_H_ng_L
-        elif unitY==PKPDUnit.UNIT_CONC_g_mL:
-            return PKPDUnit.UNIT_TIMECONC_H_g_mL
-        elif unitY==PKPDUnit.UNIT_CONC_g_uL:
-            return PKPDUnit.UNIT_TIMECONC_H_g_uL
-        elif unitY==PKPDUnit.UNIT_CONC_ug_mL:
-            return PKPDUnit.UNIT_TIMECONC_H_ug_mL
-        elif unitY==PKPDUnit.UNIT_CONC_mmol_L:
-            return PKPDUnit.UNIT_TIMECONC_H_mmol_L
-        elif unitY==PKPDUnit.UNIT_CONC_umol_L:
-            return PKPDUnit.UNIT_TIMECONC_H_umol_L
-        elif unitY==PKPDUnit.UNIT_CONC_nmol_L:
-            return PKPDUnit.UNIT_TIMECONC_H_nmol_L
-
-        elif unitY==PKPDUnit.UNIT_TIMECONC_H_g_L:
-            return PKPDUnit.UNIT_TIME2CONC_H2_g_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_H_mg_L:
-            return PKPDUnit.UNIT_TIME2CONC_H2_mg_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_H_ug_L:
-            return PKPDUnit.UNIT_TIME2CONC_H2_ug_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_H_ng_L:
-            return PKPDUnit.UNIT_TIME2CONC_H2_ng_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_H_g_mL:
-            return PKPDUnit.UNIT_TIME2CONC_H2_g_mL
-        elif unitY==PKPDUnit.UNIT_TIMECONC_H_g_uL:
-            return PKPDUnit.UNIT_TIME2CONC_H2_g_uL
-        elif unitY==PKPDUnit.UNIT_TIMECONC_H_ug_mL:
-            return PKPDUnit.UNIT_TIME2CONC_H2_ug_mL
-        elif unitY==PKPDUnit.UNIT_TIMECONC_H_mmol_L:
-            return PKPDUnit.UNIT_TIME2CONC_H2_mmol_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_H_umol_L:
-            return PKPDUnit.UNIT_TIME2CONC_H2_umol_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_H_nmol_L:
-            return PKPDUnit.UNIT_TIME2CONC_H2_nmol_L
-
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_TIME_MIN:
-        if unitY==PKPDUnit.UNIT_CONC_g_L:
-            return PKPDUnit.UNIT_TIMECONC_MIN_g_L
-        elif unitY==PKPDUnit.UNIT_CONC_mg_L:
-            return PKPDUnit.UNIT_TIMECONC_MIN_mg_L
-        elif unitY==PKPDUnit.UNIT_CONC_ug_L:
-            return PKPDUnit.UNIT_TIMECONC_MIN_ug_L
-        elif unitY==PKPDUnit.UNIT_CONC_ng_L:
-            return PKPDUnit.UNIT_TIMECONC_MIN_ng_L
-        elif unitY==PKPDUnit.UNIT_CONC_g_mL:
-            return PKPDUnit.UNIT_TIMECONC_MIN_g_mL
-        elif unitY==PKPDUnit.UNIT_CONC_g_uL:
-            return PKPDUnit.UNIT_TIMECONC_MIN_g_uL
-        elif unitY==PKPDUnit.UNIT_CONC_ug_mL:
-            return PKPDUnit.UNIT_TIMECONC_MIN_ug_mL
-        elif unitY==PKPDUnit.UNIT_CONC_mmol_L:
-            return PKPDUnit.UNIT_TIMECONC_MIN_mmol_L
-        elif unitY==PKPDUnit.UNIT_CONC_umol_L:
-            return PKPDUnit.UNIT_TIMECONC_MIN_umol_L
-        elif unitY==PKPDUnit.UNIT_CONC_nmol_L:
-            return PKPDUnit.UNIT_TIMECONC_MIN_nmol_L
-
-        elif unitY==PKPDUnit.UNIT_TIMECONC_MIN_g_L:
-            return PKPDUnit.UNIT_TIME2CONC_MIN2_g_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_MIN_mg_L:
-            return PKPDUnit.UNIT_TIME2CONC_MIN2_mg_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_MIN_ug_L:
-            return PKPDUnit.UNIT_TIME2CONC_MIN2_ug_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_MIN_ng_L:
-            return PKPDUnit.UNIT_TIME2CONC_MIN2_ng_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_MIN_g_mL:
-            return PKPDUnit.UNIT_TIME2CONC_MIN2_g_mL
-        elif unitY==PKPDUnit.UNIT_TIMECONC_MIN_g_uL:
-            return PKPDUnit.UNIT_TIME2CONC_MIN2_g_uL
-        elif unitY==PKPDUnit.UNIT_TIMECONC_MIN_ug_mL:
-            return PKPDUnit.UNIT_TIME2CONC_MIN2_ug_mL
-        elif unitY==PKPDUnit.UNIT_TIMECONC_MIN_mmol_L:
-            return PKPDUnit.UNIT_TIME2CONC_MIN2_mmol_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_MIN_umol_L:
-            return PKPDUnit.UNIT_TIME2CONC_MIN2_umol_L
-        elif unitY==PKPDUnit.UNIT_TIMECONC_MIN_nmol_L:
-            return PKPDUnit.UNIT_TIME2CONC_MIN2_nmol_L
-
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_VOLUMEINVTIME_mL_MIN:
-        if unitY==PKPDUnit.UNIT_CONC_g_mL:
-            return PKPDUnit.UNIT_WEIGHTINVTIME_g_MIN
-        elif unitY==PKPDUnit.UNIT_CONC_g_L:
-            return PKPDUnit.UNIT_WEIGHTINVTIME_mg_MIN
-        elif unitY==PKPDUnit.UNIT_CONC_ug_mL:
-            return PKPDUnit.UNIT_WEIGHTINVTIME_ug_MIN
-
-    elif unitX==PKPDUnit.UNIT_VOLUMEINVTIME_L_MIN:
-        if unitY==PKPDUnit.UNIT_CONC_g_L:
-            return PKPDUnit.UNIT_WEIGHTINVTIME_g_MIN
-        elif unitY==PKPDUnit.UNIT_CONC_mg_L:
-            return PKPDUnit.UNIT_WEIGHTINVTIME_mg_MIN
-        elif unitY==PKPDUnit.UNIT_CONC_ug_L:
-            return PKPDUnit.UNIT_WEIGHTINVTIME_ug_MIN
-        elif unitY==PKPDUnit.UNIT_CONC_umol_L:
-            return PKPDUnit.UNIT_WEIGHTINVTIME_umol_MIN
-
-    elif unitX==PKPDUnit.UNIT_INVTIME_MIN:
-        if unitY==PKPDUnit.UNIT_INVTIME_MIN:
-            return PKPDUnit.UNIT_INVTIME2_MIN2
-        else:
-            return PKPDUnit.UNIT_NONE
-
+    return unitRegistry.multiply(unitX,unitY)
 
 def divideUnits(unitX,unitY):
-    if unitX==PKPDUnit.UNIT_WEIGHT_g:
-        if unitY==PKPDUnit.UNIT_CONC_g_L:
-            return PKPDUnit.UNIT_VOLUME_L
-        elif unitY==PKPDUnit.UNIT_CONC_mg_L:
-            return PKPDUnit.UNIT_NONE
-        elif unitY==PKPDUnit.UNIT_CONC_ug_L:
-            return PKPDUnit.UNIT_NONE
-        elif unitY==PKPDUnit.UNIT_CONC_ng_L:
-            return PKPDUnit.UNIT_NONE
-
-        elif unitY==PKPDUnit.UNIT_CONC_g_mL:
-            return PKPDUnit.UNIT_VOLUME_mL
-
-        elif unitY==PKPDUnit.UNIT_CONC_g_uL:
-            return PKPDUnit.UNIT_VOLUME_uL
-
-        elif unitY == PKPDUnit.UNIT_TIME_MIN:
-            return PKPDUnit.UNIT_WEIGHTINVTIME_g_MIN
-
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_WEIGHT_mg:
-        if unitY==PKPDUnit.UNIT_CONC_g_L:
-            return PKPDUnit.UNIT_VOLUME_mL
-        elif unitY==PKPDUnit.UNIT_CONC_mg_L:
-            return PKPDUnit.UNIT_VOLUME_L
-        elif unitY==PKPDUnit.UNIT_CONC_ug_L:
-            return PKPDUnit.UNIT_NONE
-        elif unitY==PKPDUnit.UNIT_CONC_ng_L:
-            return PKPDUnit.UNIT_NONE
-
-        elif unitY == PKPDUnit.UNIT_VOLUME_L:
-            return PKPDUnit.UNIT_CONC_mg_L
-
-        elif unitY==PKPDUnit.UNIT_CONC_g_mL:
-            return PKPDUnit.UNIT_VOLUME_uL
-
-        elif unitY==PKPDUnit.UNIT_CONC_g_uL:
-            return PKPDUnit.UNIT_VOLUME_nL
-
-        elif unitY==PKPDUnit.UNIT_TIME_MIN:
-            return PKPDUnit.UNIT_WEIGHTINVTIME_mg_MIN
-
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_WEIGHT_ug:
-        if unitY==PKPDUnit.UNIT_CONC_g_L:
-            return PKPDUnit.UNIT_VOLUME_uL
-        elif unitY==PKPDUnit.UNIT_CONC_mg_L:
-            return PKPDUnit.UNIT_VOLUME_mL
-        elif unitY==PKPDUnit.UNIT_CONC_ug_L:
-            return PKPDUnit.UNIT_VOLUME_L
-        elif unitY==PKPDUnit.UNIT_CONC_ng_L:
-            return PKPDUnit.UNIT_NONE
-
-        elif unitY == PKPDUnit.UNIT_VOLUME_L:
-            return PKPDUnit.UNIT_CONC_ug_L
-
-        elif unitY==PKPDUnit.UNIT_CONC_g_mL:
-            return PKPDUnit.UNIT_VOLUME_nL
-        elif unitY==PKPDUnit.UNIT_CONC_g_uL:
-            return PKPDUnit.UNIT_NONE
-
-        elif unitY==PKPDUnit.UNIT_CONC_ug_mL:
-            return PKPDUnit.UNIT_VOLUME_mL
-
-        elif unitY == PKPDUnit.UNIT_TIME_MIN:
-            return PKPDUnit.UNIT_WEIGHTINVTIME_ug_MIN
-
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_WEIGHT_ng:
-        if unitY==PKPDUnit.UNIT_CONC_g_L:
-            return PKPDUnit.UNIT_VOLUME_nL
-        elif unitY==PKPDUnit.UNIT_CONC_mg_L:
-            return PKPDUnit.UNIT_VOLUME_uL
-        elif unitY==PKPDUnit.UNIT_CONC_ug_L:
-            return PKPDUnit.UNIT_VOLUME_mL
-        elif unitY==PKPDUnit.UNIT_CONC_ng_L:
-            return PKPDUnit.UNIT_VOLUME_L
-
-        elif unitY == PKPDUnit.UNIT_VOLUME_L:
-            return PKPDUnit.UNIT_CONC_ng_L
-
-        elif unitY==PKPDUnit.UNIT_CONC_g_mL:
-            return PKPDUnit.UNIT_NONE
-
-        elif unitY==PKPDUnit.UNIT_CONC_g_uL:
-            return PKPDUnit.UNIT_NONE
-
-        elif unitY == PKPDUnit.UNIT_TIME_MIN:
-            return PKPDUnit.UNIT_WEIGHTINVTIME_ng_MIN
-
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_WEIGHT_mmol:
-        if unitY==PKPDUnit.UNIT_CONC_mmol_L:
-            return PKPDUnit.UNIT_VOLUME_L
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_WEIGHT_umol:
-        if unitY==PKPDUnit.UNIT_CONC_umol_L:
-            return PKPDUnit.UNIT_VOLUME_L
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_WEIGHT_nmol:
-        if unitY==PKPDUnit.UNIT_CONC_nmol_L:
-            return PKPDUnit.UNIT_VOLUME_L
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_VOLUME_L:
-        if unitY==PKPDUnit.UNIT_TIME_H:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_L_H
-        elif unitY==PKPDUnit.UNIT_TIME_MIN:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_L_MIN
-        elif unitY==PKPDUnit.UNIT_TIME_SEC:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_L_SEC
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_VOLUME_mL:
-        if unitY==PKPDUnit.UNIT_TIME_H:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_mL_H
-        elif unitY==PKPDUnit.UNIT_TIME_MIN:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_mL_MIN
-        elif unitY==PKPDUnit.UNIT_TIME_SEC:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_mL_SEC
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_VOLUME_uL:
-        if unitY==PKPDUnit.UNIT_TIME_H:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_uL_H
-        elif unitY==PKPDUnit.UNIT_TIME_MIN:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_uL_MIN
-        elif unitY==PKPDUnit.UNIT_TIME_SEC:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_uL_SEC
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_VOLUME_nL:
-        if unitY==PKPDUnit.UNIT_TIME_H:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_nL_H
-        elif unitY==PKPDUnit.UNIT_TIME_MIN:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_nL_MIN
-        elif unitY==PKPDUnit.UNIT_TIME_SEC:
-            return PKPDUnit.UNIT_VOLUMEINVTIME_nL_SEC
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_VOLUMEINVTIME_L_MIN:
-        if unitY==PKPDUnit.UNIT_VOLUME_L:
-            return PKPDUnit.UNIT_INVTIME_MIN
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    elif unitX==PKPDUnit.UNIT_VOLUMEINVTIME_L_H:
-        if unitY==PKPDUnit.UNIT_VOLUME_L:
-            return PKPDUnit.UNIT_INVTIME_H
-        else:
-            return PKPDUnit.UNIT_NONE
-
-    else:
-        return PKPDUnit.UNIT_NONE
-
+    return unitRegistry.divide(unitX,unitY)
 
 def inverseUnits(unit):
-    if unit == PKPDUnit.UNIT_TIME_H:
-        return PKPDUnit.UNIT_INVTIME_H
-    elif unit == PKPDUnit.UNIT_TIME_MIN:
-        return PKPDUnit.UNIT_INVTIME_MIN
-    elif unit == PKPDUnit.UNIT_TIME_SEC:
-        return PKPDUnit.UNIT_INVTIME_SEC
-
-    else:
-        return PKPDUnit.UNIT_NONE
+    if unitRegistry.isKnown(unit) and unitRegistry.dimension[unit]==(0, 0, 0, 1):
+        return unitRegistry.findUnit({symbol: -exponent for symbol, exponent in unitRegistry.components[unit].items()})
+    return PKPDUnit.UNIT_NONE
 
 def createUnit(unitNameOrCode):
     unit = PKPDUnit()
@@ -25,108 +25,143 @@
 # *  e-mail address 'info@kinestat.com'
 # *
 # **************************************************************************
+"""
+Protocols of the plugin. The base classes of protocol_pkpd are imported here, the rest of the protocols are
+imported the first time that they are accessed (from pkpd.protocols import ProtPKPDMonoCompartment), so that
+a program that only uses a few protocols does not import all of them and their dependencies.
+"""
+import importlib
+
 from .protocol_pkpd import *
-from .protocol_batch_create_experiment import BatchProtCreateExperiment
-from .protocol_pkpd_absorption_rate import ProtPKPDAbsorptionRate
-from .protocol_pkpd_allometric_scaling import ProtPKPDAllometricScaling
-from .protocol_pkpd_apply_allometric_scaling import ProtPKPDApplyAllometricScaling
-from .protocol_pkpd_average_sample import ProtPKPDAverageSample
-from .protocol_pkpd_bootstrap_simulate import ProtPKPDODESimulate
-from .protocol_pkpd_bootstrap_simulate2 import ProtPKPDODESimulate2
-from .protocol_pkpd_BE_power_analysis import ProtPKPDBEPowerAnalysis
-from .protocol_pkpd_change_units import ProtPKPDChangeUnits
-from .protocol_pkpd_change_via import ProtPKPDChangeVia
-from .protocol_pkpd_compare_experiments import ProtPKPDCompareExperiments
-from .protocol_pkpd_create_experiment import ProtPKPDCreateExperiment
-from .protocol_pkpd_create_label import ProtPKPDCreateLabel
-from .protocol_pkpd_create_label_2exps import ProtPKPDCreateLabel2Exps
-from .protocol_pkpd_cumulated_dose import ProtPKPDCumulatedDose
-from .protocol_pkpd_dissolution_deconvolve import ProtPKPDDeconvolve
-from .protocol_pkpd_dissolution_deconvolve_Fourier import ProtPKPDDeconvolveFourier
-from .protocol_pkpd_dissolution_fit import ProtPKPDDissolutionFit
-from .protocol_pkpd_dissolution_f2 import ProtPKPDDissolutionF2
-from .protocol_pkpd_dissolution_ivivc import ProtPKPDDissolutionIVIVC
-from .protocol_pkpd_dissolution_ivivc_generic import ProtPKPDDissolutionIVIVCGeneric
-from .protocol_pkpd_dissolution_ivivc_internal_validity import ProtPKPDIVIVCInternalValidity
-from .protocol_pkpd_dissolution_ivivc_join_recalculate import ProtPKPDDissolutionIVIVCJoinRecalculate
-from .protocol_pkpd_dissolution_ivivc_join import ProtPKPDDissolutionIVIVCJoin
-from .protocol_pkpd_dissolution_ivivc_splines import ProtPKPDDissolutionIVIVCSplines
-from .protocol_pkpd_dissolution_levyplot import ProtPKPDDissolutionLevyPlot
-from .protocol_pkpd_dissolution_levyplot_join import ProtPKPDDissolutionLevyPlotJoin
-from .protocol_pkpd_dissolution_loo_riegelman import ProtPKPDDeconvolutionLooRiegelman
-from .protocol_pkpd_dissolution_loo_riegelman_inverse import ProtPKPDDeconvolutionLooRiegelmanInverse
-from .protocol_pkpd_dissolution_simulate import ProtPKPDDissolutionSimulate
-from .protocol_pkpd_dissolution_simulation import ProtPKPDDissolutionPKSimulation
-from .protocol_pkpd_dissolution_wagner_nelson import ProtPKPDDeconvolutionWagnerNelson
-from .protocol_pkpd_dissolution_target import ProtPKPDDissolutionTarget
-from .protocol_pkpd_dose_escalation import *
-from .protocol_pkpd_drop_measurements import ProtPKPDDropMeasurements
-from .protocol_pkpd_elimination_rate import ProtPKPDEliminationRate
-from .protocol_pkpd_estimate_bioavailability import ProtPKPDNCAEstimateBioavailability
-from .protocol_pkpd_exponential_fit import ProtPKPDExponentialFit
-from .protocol_pkpd_export_to_csv import ProtPKPDExportToCSV
-from .protocol_pkpd_filter_measurements import ProtPKPDFilterMeasurements
-from .protocol_pkpd_filter_population import ProtPKPDFilterPopulation
-from .protocol_pkpd_filter_samples import ProtPKPDFilterSamples
-from .protocol_pkpd_fit_base import ProtPKPDFitBase
-from .protocol_pkpd_fit_bootstrap import ProtPKPDFitBootstrap
-from .protocol_pkpd_gather_fitting import ProtPKPDGatherFitting
-from .protocol_pkpd_import_from_table import ProtPKPDImportFromTable
-from .protocol_pkpd_import_from_csv import *
-from .protocol_pkpd_import_from_winnonlin import ProtPKPDImportFromWinnonlin
-from .protocol_pkpd_inhalation_import_deposition import ProtPKPDInhImportDepositionProperties
-from .protocol_pkpd_inhalation_lung_physiology import ProtPKPDInhLungPhysiology
-from .protocol_pkpd_inhalation_simulate import ProtPKPDInhSimulate
-from .protocol_pkpd_inhalation_substance_properties import ProtPKPDInhSubstanceProperties
-from .protocol_pkpd_iv_two_compartments import ProtPKPDIVTwoCompartments
-from .protocol_pkpd_join_samples import ProtPKPDJoinSamples
-from .protocol_pkpd_merge_labels import ProtPKPDMergeLabels
-from .protocol_pkpd_merge_populations import ProtPKPDMergePopulations
-from .protocol_pkpd_monocompartment import ProtPKPDMonoCompartment
-from .protocol_pkpd_monocompartment_clint import ProtPKPDMonoCompartmentClint
-from .protocol_pkpd_monocompartment_conv import ProtPKPDMonoCompartmentConv
-from .protocol_pkpd_monocompartment_linkpd import ProtPKPDMonoCompartmentLinkPD
-from .protocol_pkpd_monocompartment_pd import ProtPKPDMonoCompartmentPD
-from .protocol_pkpd_monocompartment_urine import ProtPKPDMonoCompartmentUrine
-from .protocol_pkpd_nca_iv_exp import ProtPKPDNCAIVExp
-from .protocol_pkpd_nca_iv_obs import ProtPKPDNCAIVObs
-from .protocol_pkpd_nca_niv import ProtPKPDNCAEV
-from .protocol_pkpd_nca_numeric import ProtPKPDNCANumeric
-from .protocol_pkpd_ode_base import ProtPKPDODEBase
-from .protocol_pkpd_ode_bootstrap import ProtPKPDODEBootstrap
-from .protocol_pkpd_ode_refine import ProtPKPDODERefine
-from .protocol_pkpd_ode_two_vias import ProtPKPDODETwoVias
-from .protocol_pkpd_operate_experiment import ProtPKPDOperateExperiment
-from .protocol_pkpd_particle_size import ProtPKPDParticleSize
-from .protocol_pkpd_pdgeneric_fit import ProtPKPDGenericFit
-from .protocol_pkpd_regression_labels import ProtPKPDRegressionLabel
-from .protocol_pkpd_sa_base import ProtPKPDSABase
-from .protocol_pkpd_scale_to_common_dose import ProtPKPDScaleToCommonDose
-from .protocol_pkpd_simulate_dose_escalation import ProtPKPDSimulateDoseEscalation
-from .protocol_pkpd_simulate_drug_interactions import ProtPKPDSimulateDrugInteractions
-from .protocol_pkpd_simulate_generic_pd import ProtPKPDSimulateGenericPD
-from .protocol_pkpd_simulate_liver_flow import (PKPDLiver, PKPDLiverEV1, ProtPKPDSimulateLiverFlow)
-from .protocol_pkpd_split_gather import ProtPKPDSplitGather
-from .protocol_pkpd_statistics_labels import ProtPKPDStatisticsLabel
-from .protocol_pkpd_stats_mahalanobis import ProtPKPDStatsMahalanobis
-from .protocol_pkpd_stats_oneExperiment_twoSubgroups_mean import ProtPKPDStatsExp1Subgroups2Mean
-from .protocol_pkpd_stats_twoExperiments_twoSubgroups_mean import ProtPKPDStatsExp2Subgroups2Mean
-from .protocol_pkpd_stats_twoExperiments_twoSubgroups_kolmogorov import ProtPKPDStatsExp2Subgroups2Kolmogorov
-from .protocol_pkpd_three_compartments import ProtPKPDThreeCompartments
-from .protocol_pkpd_two_compartments import ProtPKPDTwoCompartments
-from .protocol_pkpd_two_compartments_autoinduction import ProtPKPDTwoCompartmentsAutoinduction
-from .protocol_pkpd_two_compartments_clint import ProtPKPDTwoCompartmentsClint
-from .protocol_pkpd_two_compartments_clint_cl import ProtPKPDTwoCompartmentsClintCl
-from .protocol_pkpd_two_compartments_conv import ProtPKPDTwoCompartmentsConv
-from .protocol_pkpd_two_compartments_metabolite import ProtPKPDTwoCompartmentsClintMetabolite
-from .protocol_pkpd_twocompartments_both import ProtPKPDTwoCompartmentsBoth
-from .protocol_pkpd_twocompartments_both_pd import ProtPKPDTwoCompartmentsBothPD
-from .protocol_pkpd_twocompartments_urine import ProtPKPDTwoCompartmentsUrine
-from .protocol_batch_create_experiment import BatchProtCreateExperiment
-from .import_experiment import ProtImportExperiment
 
-# Pending:
-# Batch effects, Reese2013
+# Name -> module that defines it
+_LAZY_IMPORTS = {
+    'BatchProtCreateExperiment':               'protocol_batch_create_experiment',
+    'ProtPKPDAbsorptionRate':                  'protocol_pkpd_absorption_rate',
+    'ProtPKPDAllometricScaling':               'protocol_pkpd_allometric_scaling',
+    'ProtPKPDApplyAllometricScaling':          'protocol_pkpd_apply_allometric_scaling',
+    'ProtPKPDAverageSample':                   'protocol_pkpd_average_sample',
+    'ProtPKPDODESimulate':                     'protocol_pkpd_bootstrap_simulate',
+    'ProtPKPDODESimulate2':                    'protocol_pkpd_bootstrap_simulate2',
+    'ProtPKPDBEPowerAnalysis':                 'protocol_pkpd_BE_power_analysis',
+    'ProtPKPDChangeUnits':                     'protocol_pkpd_change_units',
+    'ProtPKPDChangeVia':                       'protocol_pkpd_change_via',
+    'ProtPKPDCompareExperiments':              'protocol_pkpd_compare_experiments',
+    'ProtPKPDCreateExperiment':                'protocol_pkpd_create_experiment',
+    'ProtPKPDCreateLabel':                     'protocol_pkpd_create_label',
+    'ProtPKPDCreateLabel2Exps':                'protocol_pkpd_create_label_2exps',
+    'ProtPKPDCumulatedDose':                   'protocol_pkpd_cumulated_dose',
+    'ProtPKPDDeconvolve':                      'protocol_pkpd_dissolution_deconvolve',
+    'ProtPKPDDeconvolveFourier':               'protocol_pkpd_dissolution_deconvolve_Fourier',
+    'ProtPKPDDissolutionFit':                  'protocol_pkpd_dissolution_fit',
+    'ProtPKPDDissolutionF2':                   'protocol_pkpd_dissolution_f2',
+    'ProtPKPDDissolutionIVIVC':                'protocol_pkpd_dissolution_ivivc',
+    'ProtPKPDDissolutionIVIVCGeneric':         'protocol_pkpd_dissolution_ivivc_generic',
+    'ProtPKPDIVIVCInternalValidity':           'protocol_pkpd_dissolution_ivivc_internal_validity',
+    'ProtPKPDDissolutionIVIVCJoinRecalculate': 'protocol_pkpd_dissolution_ivivc_join_recalculate',
+    'ProtPKPDDissolutionIVIVCJoin':            'protocol_pkpd_dissolution_ivivc_join',
+    'ProtPKPDDissolutionIVIVCSplines':         'protocol_pkpd_dissolution_ivivc_splines',
+    'ProtPKPDDissolutionLevyPlot':             'protocol_pkpd_dissolution_levyplot',
+    'ProtPKPDDissolutionLevyPlotJoin':         'protocol_pkpd_dissolution_levyplot_join',
+    'ProtPKPDDeconvolutionLooRiegelman':       'protocol_pkpd_dissolution_loo_riegelman',
+    'ProtPKPDDeconvolutionLooRiegelmanInverse':'protocol_pkpd_dissolution_loo_riegelman_inverse',
+    'ProtPKPDDissolutionSimulate':             'protocol_pkpd_dissolution_simulate',
+    'ProtPKPDDissolutionPKSimulation':         'protocol_pkpd_dissolution_simulation',
+    'ProtPKPDDeconvolutionWagnerNelson':       'protocol_pkpd_dissolution_wagner_nelson',
+    'ProtPKPDDissolutionTarget':               'protocol_pkpd_dissolution_target',
+    'ClopperPearson':                          'protocol_pkpd_dose_escalation',
+    'ProtPKPDDoseEscalation':                  'protocol_pkpd_dose_escalation',
+    'ProtPKPDDoseEscalationDesigns':           'protocol_pkpd_dose_escalation_designs',
+    'ProtPKPDDropMeasurements':                'protocol_pkpd_drop_measurements',
+    'ProtPKPDEliminationRate':                 'protocol_pkpd_elimination_rate',
+    'ProtPKPDNCAEstimateBioavailability':      'protocol_pkpd_estimate_bioavailability',
+    'ProtPKPDExponentialFit':                  'protocol_pkpd_exponential_fit',
+    'ProtPKPDExportToCSV':                     'protocol_pkpd_export_to_csv',
+    'ProtPKPDFilterMeasurements':              'protocol_pkpd_filter_measurements',
+    'ProtPKPDFilterPopulation':                'protocol_pkpd_filter_population',
+    'ProtPKPDFilterSamples':                   'protocol_pkpd_filter_samples',
+    'ProtPKPDFitBase':                         'protocol_pkpd_fit_base',
+    'ProtPKPDFitBootstrap':                    'protocol_pkpd_fit_bootstrap',
+    'ProtPKPDGatherFitting':                   'protocol_pkpd_gather_fitting',
+    'ProtPKPDImportFromTable':                 'protocol_pkpd_import_from_table',
+    'ProtPKPDImportFromText':                  'protocol_pkpd_import_from_csv',
+    'ProtPKPDImportFromCSV':                   'protocol_pkpd_import_from_csv',
+    'ProtPKPDImportFromExcel':                 'protocol_pkpd_import_from_csv',
+    'validSampleName':                         'protocol_pkpd_import_from_csv',
+    'groupBySample':                           'protocol_pkpd_import_from_csv',
+    'readCSVColumns':                          'protocol_pkpd_import_from_csv',
+    'scanCSVfile':                             'protocol_pkpd_import_from_csv',
+    'getSampleNamesFromCSVfile':               'protocol_pkpd_import_from_csv',
+    'getVarNamesFromCSVfile':                  'protocol_pkpd_import_from_csv',
+    'ProtPKPDImportFromWinnonlin':             'protocol_pkpd_import_from_winnonlin',
+    'ProtPKPDInhImportDepositionProperties':   'protocol_pkpd_inhalation_import_deposition',
+    'ProtPKPDInhLungPhysiology':               'protocol_pkpd_inhalation_lung_physiology',
+    'ProtPKPDInhSimulate':                     'protocol_pkpd_inhalation_simulate',
+    'ProtPKPDInhSubstanceProperties':          'protocol_pkpd_inhalation_substance_properties',
+    'ProtPKPDIVTwoCompartments':               'protocol_pkpd_iv_two_compartments',
+    'ProtPKPDJoinSamples':                     'protocol_pkpd_join_samples',
+    'ProtPKPDMergeLabels':                     'protocol_pkpd_merge_labels',
+    'ProtPKPDMergePopulations':                'protocol_pkpd_merge_populations',
+    'ProtPKPDMonoCompartment':                 'protocol_pkpd_monocompartment',
+    'ProtPKPDMonoCompartmentClint':            'protocol_pkpd_monocompartment_clint',
+    'ProtPKPDMonoCompartmentConv':             'protocol_pkpd_monocompartment_conv',
+    'ProtPKPDMonoCompartmentLinkPD':           'protocol_pkpd_monocompartment_linkpd',
+    'ProtPKPDMonoCompartmentPD':               'protocol_pkpd_monocompartment_pd',
+    'ProtPKPDMonoCompartmentUrine':            'protocol_pkpd_monocompartment_urine',
+    'ProtPKPDNCAIVExp':                        'protocol_pkpd_nca_iv_exp',
+    'ProtPKPDNCAIVObs':                        'protocol_pkpd_nca_iv_obs',
+    'ProtPKPDNCAEV':                           'protocol_pkpd_nca_niv',
+    'ProtPKPDNCANumeric':                      'protocol_pkpd_nca_numeric',
+    'ProtPKPDODEBase':                         'protocol_pkpd_ode_base',
+    'ProtPKPDODEBootstrap':                    'protocol_pkpd_ode_bootstrap',
+    'ProtPKPDODERefine':                       'protocol_pkpd_ode_refine',
+    'ProtPKPDODETwoVias':                      'protocol_pkpd_ode_two_vias',
+    'ProtPKPDOperateExperiment':               'protocol_pkpd_operate_experiment',
+    'ProtPKPDParticleSize':                    'protocol_pkpd_particle_size',
+    'ProtPKPDGenericFit':                      'protocol_pkpd_pdgeneric_fit',
+    'ProtPKPDRegressionLabel':                 'protocol_pkpd_regression_labels',
+    'ProtPKPDSABase':                          'protocol_pkpd_sa_base',
+    'ProtPKPDScaleToCommonDose':               'protocol_pkpd_scale_to_common_dose',
+    'ProtPKPDSimulateDoseEscalation':          'protocol_pkpd_simulate_dose_escalation',
+    'ProtPKPDSimulateDrugInteractions':        'protocol_pkpd_simulate_drug_interactions',
+    'ProtPKPDSimulateGenericPD':               'protocol_pkpd_simulate_generic_pd',
+    'PKPDLiver':                               'protocol_pkpd_simulate_liver_flow',
+    'PKPDLiverEV1':                            'protocol_pkpd_simulate_liver_flow',
+    'ProtPKPDSimulateLiverFlow':               'protocol_pkpd_simulate_liver_flow',
+    'ProtPKPDSplitGather':                     'protocol_pkpd_split_gather',
+    'ProtPKPDStatisticsLabel':                 'protocol_pkpd_statistics_labels',
+    'ProtPKPDStatsMahalanobis':                'protocol_pkpd_stats_mahalanobis',
+    'ProtPKPDStatsExp1Subgroups2Mean':         'protocol_pkpd_stats_oneExperiment_twoSubgroups_mean',
+    'ProtPKPDStatsExp2Subgroups2Mean':         'protocol_pkpd_stats_twoExperiments_twoSubgroups_mean',
+    'ProtPKPDStatsExp2Subgroups2Kolmogorov':   'protocol_pkpd_stats_twoExperiments_twoSubgroups_kolmogorov',
+    'ProtPKPDThreeCompartments':               'protocol_pkpd_three_compartments',
+    'ProtPKPDTwoCompartments':                 'protocol_pkpd_two_compartments',
+    'ProtPKPDTwoCompartmentsAutoinduction':    'protocol_pkpd_two_compartments_autoinduction',
+    'ProtPKPDTwoCompartmentsClint':            'protocol_pkpd_two_compartments_clint',
+    'ProtPKPDTwoCompartmentsClintCl':          'protocol_pkpd_two_compartments_clint_cl',
+    'ProtPKPDTwoCompartmentsConv':             'protocol_pkpd_two_compartments_conv',
+    'ProtPKPDTwoCompartmentsClintMetabolite':  'protocol_pkpd_two_compartments_metabolite',
+    'ProtPKPDTwoCompartmentsBoth':             'protocol_pkpd_twocompartments_both',
+    'ProtPKPDTwoCompartmentsBothPD':           'protocol_pkpd_twocompartments_both_pd',
+    'ProtPKPDTwoCompartmentsUrine':            'protocol_pkpd_twocompartments_urine',
+    'ProtImportExperiment':                    'import_experiment',
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_IMPORTS:
+        value = getattr(importlib.import_module("." + _LAZY_IMPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module %s has no attribute %s" % (__name__, name))
 
 
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_IMPORTS))
 
+
+# from pkpd.protocols import * still imports everything
+__all__ = [name for name in globals() if not name.startswith('_') and name != 'importlib'] + list(_LAZY_IMPORTS)
+
+# Pending:
+# Batch effects, Reese2013
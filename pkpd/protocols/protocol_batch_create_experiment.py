@@ -58,5 +58,6 @@ class BatchProtCreateExperiment(BatchProtocol, ProtPKPD):
         newExperiment.general["comment"]=self.newComment.get().strip()
 
         self.writeExperiment(newExperiment,self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
         self._defineOutputs(outputExperiment=newExperiment)
         self._defineSourceRelation(self.inputExperiment, newExperiment)
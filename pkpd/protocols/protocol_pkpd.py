@@ -31,9 +31,27 @@ import sys
 import os
 from pwem.protocols import *
 from pkpd.objects import PKPDExperiment, PKPDFitting
+from pkpd.utils import PKPDResultCache, excelWaitForExports
 import pyworkflow.protocol.params as params
+from pyworkflow.object import Scalar
+from pyworkflow.protocol.constants import LEVEL_ADVANCED
 
 class ProtPKPD(EMProtocol):
+    def _defineExcelParams(self, form):
+        # Protocols whose outputs may be large let the user skip their Excel export
+        form.addParam('writeToExcel', params.BooleanParam, label="Export to Excel", default=True,
+                      expertLevel=LEVEL_ADVANCED,
+                      help='The output experiments and fittings are also written as Excel files')
+
+    @property
+    def _writeToExcel(self):
+        return self.getAttributeValue('writeToExcel', True)
+
+    def waitForExcelExports(self):
+        """ Wait for the Excel files written in the background (see PKPD_EXCEL_EXPORT), so that they are complete
+            before the outputs are registered. Their errors make the step fail """
+        excelWaitForExports()
+
     def printSection(self, msg):
         print("**********************************************************************************************")
         print("Section: %s"%msg)
@@ -50,7 +68,7 @@ class ProtPKPD(EMProtocol):
     def writeExperiment(self, experiment, fnOut):
         self.printSection("Writing %s"%fnOut)
         experiment._printToStream(sys.stdout)
-        experiment.write(fnOut)
+        experiment.write(fnOut, writeToExcel=self._writeToExcel)
 
     def readFitting(self, fnIn, show=True, cls=""):
         fitting = PKPDFitting(cls)
@@ -71,6 +89,24 @@ class ProtPKPD(EMProtocol):
                 msg.append(line.strip())
             fh.close()
 
+    def getResultCache(self):
+        """ Sample results of previous executions of this protocol """
+        return PKPDResultCache(self._getExtraPath("resultCache"))
+
+    def getCacheDependencies(self):
+        """ What the results of all samples depend on: the protocol, the values of its form (pointers excluded)
+            and the units of the experiment variables """
+        formValues = [(paramName, attr.get()) for paramName, attr in self.iterDefinitionAttributes()
+                      if isinstance(attr, Scalar) and paramName not in ("runName", "runMode", "writeToExcel")]
+        units = [(varName, variable.units.unit if variable.units is not None else None)
+                 for varName, variable in sorted(self.experiment.variables.items())]
+        return [self.getClassName(), formValues, units]
+
+    def getSampleCacheDependencies(self, sampleName):
+        """ What the result of a sample depends on: its experiment entry (measurements, doses, vias and
+            descriptors). Protocols taking per sample values from other protocols must add them """
+        return [sampleName, self.experiment.getSampleText(sampleName)]
+
     def loadInputExperiment(self):
         """ If the protocol has an attribute 'inputExperiment',
         load that experiment from file. If not, return None. """
@@ -28,11 +28,11 @@ import os
 
 import pyworkflow.protocol.params as params
 from .protocol_pkpd import ProtPKPD
-from pkpd import Plugin as pkpdPlugin
+from pkpd.bioequivalence import BEPower, powerAnalysis
 from pyworkflow.protocol.constants import LEVEL_ADVANCED
 
 class ProtPKPDBEPowerAnalysis(ProtPKPD):
-    """ Power analysis for Bioequivalence studies.\n
+    """ Power analysis for Bioequivalence studies. The calculations follow the R package PowerTOST.\n
         For further help, see https://cran.r-project.org/web/packages/PowerTOST/vignettes/PA.html
         https://cran.r-project.org/web/packages/PowerTOST/PowerTOST.pdf
         https://cran.r-project.org/web/packages/PowerTOST/index.html
@@ -92,47 +92,69 @@ class ProtPKPDBEPowerAnalysis(ProtPKPD):
         self._insertFunctionStep('runPA')
 
     #--------------------------- STEPS functions --------------------------------------------
-    def runPA(self):
-        fnPlot = self._getPath('plot.png')
-
-        rScript = "library(PowerTOST)\n"
-        extraArgs = ""
-        design = ""
-        if self.method==self.METHOD_ABE:
-            rfunc = "pa.ABE"
-            design = self.DESIGNSABE[self.designABE.get()]
-        elif self.method==self.METHOD_scABE:
-            rfunc = "pa.scABE"
-            design = self.DESIGNSscABE[self.designscABE.get()]
-            extraArgs = ', regulator="%s"'%self.REGULATORS[self.regulator.get()]
+    def getBEPower(self):
+        if self.method.get()==self.METHOD_ABE:
+            return BEPower(BEPower.METHOD_ABE, self.DESIGNSABE[self.designABE.get()],
+                           theta1=self.theta1.get(), theta2=self.theta2.get())
+        elif self.method.get()==self.METHOD_scABE:
+            return BEPower(BEPower.METHOD_scABE, self.DESIGNSscABE[self.designscABE.get()],
+                           regulator=self.REGULATORS[self.regulator.get()],
+                           theta1=self.theta1.get(), theta2=self.theta2.get())
         else:
-            rfunc = "pa.NTIDFDA"
-            design = self.DESIGNSNTID[self.designNTID.get()]
-        rScript+='x=%s(CV=%f, theta0=%f, theta1=%f, theta2=%f, minpower=%f, targetpower=%f, design="%s"%s)\n'%\
-                 (rfunc, self.CV, self.theta0, self.theta1, self.theta2, self.minPower, self.targetPower,
-                  design, extraArgs)
-        rScript+="print(x)\n"
-        rScript+='png(file="%s")\n'%fnPlot
-        rScript+='plot(x)\n'
-        rScript+='dummy=dev.off()\n'
-        response=pkpdPlugin.runRscript(rScript)
-        print("Running in R ======")
-        print(rScript)
-        print("R response ========")
-        print(response)
+            return BEPower(BEPower.METHOD_NTIDFDA, self.DESIGNSNTID[self.designNTID.get()],
+                           theta1=self.theta1.get(), theta2=self.theta2.get())
+
+    def plotPA(self, pa, fnPlot):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        fig = Figure(figsize=(12, 4))
+        FigureCanvasAgg(fig)
+        for i, (curve, xlabel) in enumerate([('curveCV', 'CV'), ('curveTheta0', 'theta0'),
+                                             ('curveN', 'Number of subjects')]):
+            x, power = pa[curve]
+            ax = fig.add_subplot(1, 3, i+1)
+            ax.plot(x, power, 'b-')
+            ax.axhline(self.minPower.get(), color='r', linestyle='--')
+            ax.axhline(self.targetPower.get(), color='g', linestyle='--')
+            ax.set_xlabel(xlabel)
+            ax.set_ylabel('Power')
+            ax.grid(True)
+        fig.tight_layout()
+        fig.savefig(fnPlot)
+
+    def runPA(self):
+        bePower = self.getBEPower()
+        pa = powerAnalysis(bePower, self.CV.get(), self.theta0.get(), self.minPower.get(), self.targetPower.get())
 
+        if bePower.method==BEPower.METHOD_scABE:
+            title = "scABE (%s)"%bePower.regulator
+        elif bePower.method==BEPower.METHOD_NTIDFDA:
+            title = "NTID (FDA)"
+        else:
+            title = "ABE"
         fh = open(self._getPath('summary.txt'),'w')
-        fh.write(response)
+        self.doublePrint(fh, "Sample size plan %s"%title)
+        self.doublePrint(fh, "Design=%s alpha=%f CV=%f theta0=%f theta1=%f theta2=%f"%\
+                         (bePower.design, bePower.alpha, pa['CV'], pa['theta0'], bePower.theta1, bePower.theta2))
+        self.doublePrint(fh, "Sample size=%d Achieved power=%f"%(pa['n'], pa['power']))
+        self.doublePrint(fh, " ")
+        self.doublePrint(fh, "Power analysis")
+        self.doublePrint(fh, "CV, theta0 and number of subjects leading to min. acceptable power of ~%f:"%\
+                         self.minPower.get())
+        self.doublePrint(fh, "CV=%f, theta0=%f"%(pa['CVmax'], pa['theta0lim']))
+        self.doublePrint(fh, "n=%d (power=%f)"%(pa['nmin'], pa['powerNmin']))
         fh.close()
 
+        self.plotPA(pa, self._getPath('plot.png'))
+
     #--------------------------- INFO functions --------------------------------------------
     def _validate(self):
         retval = []
-        if pkpdPlugin.getRscript() is None:
-            retval.append("Cannot find Rscript in the system PATH")
-        else:
-            if not pkpdPlugin.checkRPackage('PowerTOST'):
-                retval.append("PowerTOST package is not installed in R")
+        if self.theta0.get()<=self.theta1.get() or self.theta0.get()>=self.theta2.get():
+            retval.append("theta0 must be between the lower and upper limits")
+        if self.minPower.get()>=self.targetPower.get():
+            retval.append("The minimum power must be smaller than the target power")
         return retval
 
     def _summary(self):
@@ -99,6 +99,10 @@ class ProtPKPDAbsorptionRate(ProtPKPDFitBase):
 
         return True
 
+    def getSampleCacheDependencies(self, sampleName):
+        return ProtPKPDFitBase.getSampleCacheDependencies(self, sampleName)+\
+               [self.model.C0, self.model.C0units, self.model.Ke, self.model.KeUnits]
+
     def postSampleAnalysis(self, sampleName):
         xunits = self.experiment.getVarUnits(self.varNameX)
         Cunits = self.experiment.getVarUnits(self.varNameY)
@@ -88,6 +88,7 @@ class ProtPKPDApplyAllometricScaling(ProtPKPD):
         self.experiment.write(self._getPath("experiment.pkpd"))
         self.population.fnExperiment.set(self._getPath("experiment.pkpd"))
         self.population.write(self._getPath("bootstrapPopulation.pkpd"))
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputExperiment=self.experiment)
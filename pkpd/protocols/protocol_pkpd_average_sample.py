@@ -25,13 +25,16 @@
 # **************************************************************************
 
 import copy
+try:
+    from itertools import izip
+except ImportError:
+    izip = zip
 import numpy as np
-from scipy.interpolate import InterpolatedUnivariateSpline
 
 import pyworkflow.protocol.params as params
 from .protocol_pkpd import ProtPKPD
 from pkpd.objects import PKPDExperiment, PKPDSample
-from pkpd.utils import uniqueFloatValues
+from pkpd.utils import uniqueFloatValues, averageProfiles, interpLinear
 
 # Tested in test_workflow_dissolution_f2.py
 
@@ -42,6 +45,7 @@ class ProtPKPDAverageSample(ProtPKPD):
 
     MODE_MEAN = 0
     MODE_MEDIAN = 1
+    MODE_GEOMEAN = 2
 
     #--------------------------- DEFINE param functions --------------------------------------------
 
@@ -50,8 +54,11 @@ class ProtPKPDAverageSample(ProtPKPD):
         form.addParam('inputExperiment', params.PointerParam, label="Input experiment",
                       pointerClass='PKPDExperiment',
                       help='Select an experiment with samples')
-        form.addParam('mode', params.EnumParam, label='Aggregation mode', choices=['Mean','Median'],
+        form.addParam('mode', params.EnumParam, label='Aggregation mode', choices=['Mean','Median','Geometric mean'],
                       default=self.MODE_MEAN)
+        form.addParam('percentiles', params.StringParam, label="Percentiles", default="",
+                      help='Percentiles of the profiles to add to the average sample, e.g. 5 95. For each measurement '
+                           'X, the variables X_P5 and X_P95 are added. Leave it empty for none.')
         form.addParam('resampleT', params.FloatParam, label="Resample profiles (time step)", default=-1,
                       help='Resample the input profiles at this time step (make sure it is in the same units as the input). '
                            'Leave it to -1 for no resampling. This is only valid when the label to compare is a measurement.')
@@ -106,63 +113,47 @@ class ProtPKPDAverageSample(ProtPKPD):
         self.experiment.samples["avg"].parseTokens(tokens, self.experiment.variables, self.experiment.doses,
                                                    self.experiment.groups)
 
+        subgroup = experiment.getSubGroup(self.condition.get())
+        for sampleName in subgroup:
+            print("%s participates in the average"%sampleName)
+        mode = {self.MODE_MEAN: "mean", self.MODE_MEDIAN: "median", self.MODE_GEOMEAN: "geomean"}[self.mode.get()]
+        percentiles = self.getPercentiles()
         for mvarName in mvarNames:
-            allt = {}
-            for sampleName, sample in experiment.getSubGroup(self.condition.get()).items():
-                t, _ = sample.getXYValues(tvarName,mvarName)
-                t=t[0] # [[...]] -> [...]
-                for i in range(len(t)):
-                    ti = float(t[i])
-                    if not ti in allt:
-                        allt[ti] = True
-            allt = sorted(allt.keys())
-
-            observations={}
-            for sampleName, sample in experiment.getSubGroup(self.condition.get()).items():
-                for ti in allt:
-                    observations[ti] = []
-
-            for sampleName, sample in experiment.getSubGroup(self.condition.get()).items():
-                print("%s participates in the average"%sampleName)
+            tList = []
+            yList = []
+            for sample in subgroup.values():
                 t, y = sample.getXYValues(tvarName,mvarName)
-                t=t[0] # [array]
-                y=y[0] # [array]
-                tUnique, yUnique = uniqueFloatValues(t,y)
-                B = InterpolatedUnivariateSpline(tUnique, yUnique, k=1)
-
-                mint = np.min(t)
-                maxt = np.max(t)
-
-                for ti in allt:
-                    if ti>=mint and ti<=maxt:
-                        observations[ti].append(B(ti))
-
-            for ti in observations:
-                if len(observations[ti])>0:
-                    if self.mode.get()==self.MODE_MEAN:
-                        observations[ti]=np.mean(observations[ti])
-                    else:
-                        observations[ti] = np.median(observations[ti])
-                else:
-                    observations[ti]=np.nan
-
-            t=[]
-            yavg=[]
-            for ti in sorted(observations):
-                t.append(ti)
-                yavg.append(observations[ti])
+                tList.append(t[0]) # [array] -> array
+                yList.append(y[0])
+            t, yavg, yPercentiles = averageProfiles(tList, yList, mode, percentiles)
+            if mode=="geomean" and np.any(np.isnan(yavg)):
+                print("The geometric mean of %s is missing at %d time points with zero or negative values"%\
+                      (mvarName,np.sum(np.isnan(yavg))))
 
             if self.resampleT.get()>0:
-                t,yavg=uniqueFloatValues(t,yavg)
-                B = InterpolatedUnivariateSpline(t, yavg, k=1)
-                t = np.arange(np.min(t), np.max(t) + self.resampleT.get(), self.resampleT.get())
-                yavg = B(t)
+                tGrid = t
+                tUnique, yUnique = uniqueFloatValues(tGrid,yavg)
+                t = np.arange(np.min(tUnique), np.max(tUnique) + self.resampleT.get(), self.resampleT.get())
+                yavg = interpLinear(t, tUnique, yUnique)
+                if yPercentiles is not None:
+                    yPercentiles = np.asarray([interpLinear(t, *uniqueFloatValues(tGrid, yp))
+                                               for yp in yPercentiles])
             self.experiment.samples["avg"].addMeasurementColumn(tvarName,t)
             self.experiment.samples["avg"].addMeasurementColumn(mvarName,yavg)
+            for percentile, yp in izip(percentiles, yPercentiles if yPercentiles is not None else []):
+                varName = "%s_P%g"%(mvarName,percentile)
+                self.experiment.variables[varName] = copy.copy(experiment.variables[mvarName])
+                self.experiment.variables[varName].varName = varName
+                self.experiment.variables[varName].comment = "Percentile %g of %s"%(percentile,mvarName)
+                self.experiment.samples["avg"].addMeasurementColumn(varName,yp)
         print(" ")
 
         # Print and save
         self.writeExperiment(self.experiment,self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
+
+    def getPercentiles(self):
+        return [float(token) for token in self.percentiles.get().replace(',',' ').split()]
 
     def createOutputStep(self):
         self._defineOutputs(outputExperiment=self.experiment)
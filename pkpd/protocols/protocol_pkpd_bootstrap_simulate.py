@@ -26,7 +26,6 @@
 
 import math
 import numpy as np
-import openpyxl
 import random
 from scipy.interpolate import InterpolatedUnivariateSpline
 
@@ -35,7 +34,7 @@ from pkpd.objects import PKPDExperiment, PKPDDose, PKPDSample, PKPDVariable
 from pyworkflow.protocol.constants import LEVEL_ADVANCED
 from .protocol_pkpd_ode_base import ProtPKPDODEBase
 from pkpd.pkpd_units import createUnit, multiplyUnits, divideUnits, strUnit, PKPDUnit, unitFromString
-from pkpd.utils import find_nearest, excelWriteRow
+from pkpd.utils import find_nearest, excelWriteRow, ExcelStreamWriter, excelExportEnabled
 from pkpd.biopharmaceutics import PKPDVia
 from pkpd.models.pk_models import PK_Monocompartment, PK_Twocompartments, PK_TwocompartmentsClintCl
 
@@ -166,6 +165,7 @@ class ProtPKPDODESimulate(ProtPKPDODEBase):
                       condition="addStats and paramsSource==0 and odeSource==0")
         form.addParam('addIndividuals', params.BooleanParam, label="Add individual simulations", default=False,
                       expertLevel=LEVEL_ADVANCED, help="Individual simulations are added to the output")
+        self._defineExcelParams(form)
 
     #--------------------------- INSERT steps functions --------------------------------------------
     def _insertAllSteps(self):
@@ -483,8 +483,10 @@ class ProtPKPDODESimulate(ProtPKPDODEBase):
         fluctuationArray = np.zeros(Nsimulations)
         percentageAccumulationArray = np.zeros(Nsimulations)
 
-        wb = openpyxl.Workbook()
-        wb.active.title = "Simulations"
+        if self._writeToExcel and excelExportEnabled():
+            wb = ExcelStreamWriter("Simulations")
+        else:
+            wb = None
         for i in range(0,Nsimulations):
             self.setTimeRange(None)
 
@@ -600,25 +602,27 @@ class ProtPKPDODESimulate(ProtPKPDODEBase):
                     self.outputExperiment.variables["Tmin"] = Tminvar
                     self.outputExperiment.variables["Cavg"] = Cavgvar
 
-                excelWriteRow(["simulationName", "fromSample", "doseNumber",
-                               "AUC [%s]" % strUnit(self.AUCunits),
-                               "AUMC [%s]" % strUnit(self.AUMCunits),
-                               "Cmin [%s]" % strUnit(self.Cunits.unit),
-                               "Cavg [%s]" % strUnit(self.Cunits.unit),
-                               "Cmax [%s]" % strUnit(self.Cunits.unit),
-                               "Ctau [%s]" % strUnit(self.Cunits.unit),
-                               "Tmin [%s]" % strUnit(self.outputExperiment.getTimeUnits().unit),
-                               "Tmax [%s]" % strUnit(self.outputExperiment.getTimeUnits().unit),
-                               "Ttau [%s]" % strUnit(self.outputExperiment.getTimeUnits().unit)],
-                              wb, 1, bold=True)
+                if wb is not None:
+                    excelWriteRow(["simulationName", "fromSample", "doseNumber",
+                                   "AUC [%s]" % strUnit(self.AUCunits),
+                                   "AUMC [%s]" % strUnit(self.AUMCunits),
+                                   "Cmin [%s]" % strUnit(self.Cunits.unit),
+                                   "Cavg [%s]" % strUnit(self.Cunits.unit),
+                                   "Cmax [%s]" % strUnit(self.Cunits.unit),
+                                   "Ctau [%s]" % strUnit(self.Cunits.unit),
+                                   "Tmin [%s]" % strUnit(self.outputExperiment.getTimeUnits().unit),
+                                   "Tmax [%s]" % strUnit(self.outputExperiment.getTimeUnits().unit),
+                                   "Ttau [%s]" % strUnit(self.outputExperiment.getTimeUnits().unit)],
+                                  wb, 1, bold=True)
                 wbRow = 2
 
             # Evaluate AUC, AUMC and MRT in the last full period
             AUClist, AUMClist, Cminlist, Cavglist, Cmaxlist, Ctaulist, Tmaxlist, Tminlist, Ttaulist = self.NCA(self.model.x,y[0])
             for doseNo in range(0,len(AUClist)):
-                excelWriteRow(["Simulation_%d"%i, self.fromSample, doseNo, AUClist[doseNo], AUMClist[doseNo],
-                               Cminlist[doseNo], Cavglist[doseNo], Cmaxlist[doseNo], Ctaulist[doseNo],
-                               Tminlist[doseNo], Tmaxlist[doseNo], Ttaulist[doseNo]], wb, wbRow)
+                if wb is not None:
+                    excelWriteRow(["Simulation_%d"%i, self.fromSample, doseNo, AUClist[doseNo], AUMClist[doseNo],
+                                   Cminlist[doseNo], Cavglist[doseNo], Cmaxlist[doseNo], Ctaulist[doseNo],
+                                   Tminlist[doseNo], Tmaxlist[doseNo], Ttaulist[doseNo]], wb, wbRow)
                 wbRow+=1
 
             # Keep results
@@ -699,8 +703,10 @@ class ProtPKPDODESimulate(ProtPKPDODEBase):
                 self.fromSample="UpperLimit"
                 self.addSample("UpperLimit", dosename, simulationsX, limits[1])
 
-        self.outputExperiment.write(self._getPath("experiment.pkpd"))
-        wb.save(self._getPath("nca.xlsx"))
+        self.outputExperiment.write(self._getPath("experiment.pkpd"), writeToExcel=self._writeToExcel)
+        if wb is not None:
+            wb.save(self._getPath("nca.xlsx"))
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputExperiment=self.outputExperiment)
@@ -73,6 +73,7 @@ class ProtPKPDODESimulate2(ProtPKPDODEBase):
                       help="Same units as input experiment")
         form.addParam('deltaT', params.FloatParam, label="Time step (see help)", default=0.5, expertLevel=LEVEL_ADVANCED,
                       help="Same units as input experiment")
+        self._defineExcelParams(form)
 
     #--------------------------- INSERT steps functions --------------------------------------------
     def _insertAllSteps(self):
@@ -100,20 +101,33 @@ class ProtPKPDODESimulate2(ProtPKPDODEBase):
         self.outputExperiment.samples[sampleName] = newSample
 
     def runSimulate(self):
-        # Take first experiment
-        self.protODE = self.inputODEs[0].get()
+        inputs = []
+        for protODEPtr in self.inputODEs:
+            protODE = protODEPtr.get()
 
-        if hasattr(self.protODE, "outputExperiment"):
-            self.experiment = self.readExperiment(self.protODE.outputExperiment.fnPKPD, show=False)
-        elif hasattr(self.protODE, "outputExperiment1"):
-            self.experiment = self.readExperiment(self.protODE.outputExperiment1.fnPKPD, show=False)
-        else:
-            raise Exception("Cannot find an outputExperiment in the input ODE")
+            if hasattr(protODE, "outputExperiment"):
+                experiment = self.readExperiment(protODE.outputExperiment.fnPKPD, show=False)
+            elif hasattr(protODE, "outputExperiment1"):
+                experiment = self.readExperiment(protODE.outputExperiment1.fnPKPD, show=False)
+            else:
+                raise Exception("Cannot find an outputExperiment in the input ODE")
+
+            fitting = inputs[-1][2] if len(inputs)>0 else None
+            if hasattr(protODE, "outputFitting"):
+                fitting = self.readFitting(protODE.outputFitting.fnFitting, show=False)
+            elif hasattr(protODE, "outputFitting1"):
+                fitting = self.readFitting(protODE.outputFitting1.fnFitting, show=False)
+            inputs.append((protODE, experiment, fitting))
 
-        if hasattr(self.protODE, "outputFitting"):
-            self.fitting = self.readFitting(self.protODE.outputFitting.fnFitting, show=False)
-        elif hasattr(self.protODE, "outputFitting1"):
-            self.fitting = self.readFitting(self.protODE.outputFitting1.fnFitting, show=False)
+        self.simulateModels(inputs)
+        self.outputExperiment.write(self._getPath("experiment.pkpd"), writeToExcel=self._writeToExcel)
+        self.waitForExcelExports()
+
+    def simulateModels(self, inputs):
+        """ inputs is a list of (ODE protocol, experiment, fitting), one per dose (no file is read or written).
+            The simulated experiment is returned (also kept in self.outputExperiment) """
+        # Take first experiment
+        self.protODE, self.experiment, self.fitting = inputs[0]
 
         self.varNameX = self.fitting.predictor.varName
         if type(self.fitting.predicted)!=list:
@@ -150,21 +164,7 @@ class ProtPKPDODESimulate2(ProtPKPDODEBase):
         doseIdx = 0
         simulationsY = None
         doseList = []
-        for protODEPtr in self.inputODEs:
-            self.protODE = protODEPtr.get()
-
-            if hasattr(self.protODE, "outputExperiment"):
-                self.experiment = self.readExperiment(self.protODE.outputExperiment.fnPKPD, show=False)
-            elif hasattr(self.protODE, "outputExperiment1"):
-                self.experiment = self.readExperiment(self.protODE.outputExperiment1.fnPKPD, show=False)
-            else:
-                raise Exception("Cannot find an outputExperiment in the input ODE")
-
-            if hasattr(self.protODE, "outputFitting"):
-                self.fitting = self.readFitting(self.protODE.outputFitting.fnFitting, show=False)
-            elif hasattr(self.protODE, "outputFitting1"):
-                self.fitting = self.readFitting(self.protODE.outputFitting1.fnFitting, show=False)
-
+        for self.protODE, self.experiment, self.fitting in inputs:
             for viaName in self.experiment.vias:
                 if not viaName in self.outputExperiment.vias:
                     self.outputExperiment.vias[viaName]=copy.copy(self.experiment.vias[viaName])
@@ -216,8 +216,8 @@ class ProtPKPDODESimulate2(ProtPKPDODEBase):
             self.protODE.configureSource(self.drugSource)
             parameterNames = self.getParameterNames() # Necessary to count the number of source and PK parameters
 
-            # Prepare the model
-            y = self.forwardModel(parameters, [simulationsX]*self.getResponseDimension())
+            # Prepare the model. Linear models are simulated by superposition of their unit responses
+            y = self.forwardModelBySuperposition(parameters, [simulationsX]*self.getResponseDimension())
 
             # Keep results
             if simulationsY is None:
@@ -229,8 +229,7 @@ class ProtPKPDODESimulate2(ProtPKPDODEBase):
             doseIdx += 1
 
         self.addSample("Simulation", doseList, simulationsX, simulationsY[0])
-
-        self.outputExperiment.write(self._getPath("experiment.pkpd"))
+        return self.outputExperiment
 
     def createOutputStep(self):
         self._defineOutputs(outputExperiment=self.outputExperiment)
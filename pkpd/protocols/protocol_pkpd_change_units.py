@@ -24,10 +24,17 @@
 # *
 # **************************************************************************
 
+import numpy as np
+try:
+    from itertools import izip
+except ImportError:
+    izip = zip
+
 import pyworkflow.protocol.params as params
 from .protocol_pkpd import ProtPKPD
+from pkpd.expressions import toColumn
 from pkpd.objects import PKPDVariable
-from pkpd.pkpd_units import unitFromString, convertUnits, strUnit, PKPDUnit
+from pkpd.pkpd_units import unitFromString, convertUnits, getConversionFactor, strUnit, PKPDUnit
 
 # TESTED in test_workflow_gabrielsson_pk01.py
 # TESTED in test_workflow_gabrielsson_pk03.py
@@ -113,7 +120,7 @@ class ProtPKPDChangeUnits(ProtPKPD):
 
         currentUnit = self.experiment.getVarUnits(self.labelToChange.get())
         newUnit = unitFromString(self._getNewUnit())
-        K=convertUnits(1.0,currentUnit,newUnit)
+        K=getConversionFactor(currentUnit,newUnit)
 
         variable = self.experiment.variables[self.labelToChange.get()]
 
@@ -124,23 +131,20 @@ class ProtPKPDChangeUnits(ProtPKPD):
                 if variable.role == PKPDVariable.ROLE_LABEL:
                     varValue = float(sample.descriptors[variable.varName])
                     sample.descriptors[variable.varName] = K*varValue
-                elif variable.role == PKPDVariable.ROLE_MEASUREMENT:
-                    newValues = []
-                    for x in sample.getValues(variable.varName):
-                        if x=="NA" or x=="LLOQ" or x=="ULOQ" or x=="None":
-                            newValues.append(x)
-                        else:
-                            newValues.append(str(K*float(x)))
-                    sample.setValues(variable.varName,newValues)
-                elif variable.role == PKPDVariable.ROLE_TIME:
-                    newValues = []
-                    for x in sample.getValues(variable.varName):
-                        newValues.append(str(K*float(x)))
-                    sample.setValues(variable.varName,newValues)
+                elif variable.role == PKPDVariable.ROLE_MEASUREMENT or variable.role == PKPDVariable.ROLE_TIME:
+                    # All the values of the sample are converted at once, missing values are kept as they are
+                    values = sample.getValues(variable.varName)
+                    column, valid = toColumn(values, True)
+                    if variable.role == PKPDVariable.ROLE_TIME and not np.all(valid):
+                        raise Exception("Time measurements cannot be NA")
+                    newValues = (K*column).tolist()
+                    sample.setValues(variable.varName,[str(newValue) if ok else value
+                                                       for newValue, ok, value in izip(newValues, valid, values)])
         variable.units = PKPDUnit()
         variable.units.unit = newUnit
 
         self.writeExperiment(self.experiment,self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputExperiment=self.experiment)
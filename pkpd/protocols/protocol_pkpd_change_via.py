@@ -102,6 +102,7 @@ class ProtPKPDChangeVia(ProtPKPD):
                 del via.paramsUnitsToOptimize[idx]
             via.bioavailability=float(bioavailability)
         self.experiment.write(self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputExperiment=self.experiment)
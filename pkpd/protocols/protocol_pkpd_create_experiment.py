@@ -105,4 +105,5 @@ class ProtPKPDCreateExperiment(ProtPKPD):
         experiment.load(fnTmp, verifyIntegrity=False)
 
         self.writeExperiment(experiment,self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
         self._defineOutputs(outputExperiment=experiment)
@@ -75,12 +75,13 @@ class ProtPKPDCreateLabel(ProtPKPD):
         for label, expression, unit, comment in zip_longest(labels,expressions,units,comments,fillvalue=""):
             labelToAdd = label.strip().replace(' ',"_")
             units = PKPDUnit(unit.strip())
-            for sampleName, sample in self.experiment.samples.items():
-                varValue = sample.evaluateExpression(expression.strip())
-                self.experiment.addParameterToSample(sampleName, labelToAdd, units.unit, comment.strip(), varValue,
-                                                     self.rewrite.get())
+            sampleNames = list(self.experiment.samples.keys())
+            values, valid = self.experiment.evaluateExpression(expression.strip(), sampleNames)
+            self.experiment.addParameterColumn(labelToAdd, units.unit, comment.strip(), values, valid, sampleNames,
+                                               self.rewrite.get())
 
         self.writeExperiment(self.experiment,self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputExperiment=self.experiment)
@@ -81,6 +81,7 @@ class ProtPKPDCreateLabel2Exps(ProtPKPD):
                 self.experiment1.samples.pop(sampleName)
 
         self.writeExperiment(self.experiment1,self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputExperiment=self.experiment1)
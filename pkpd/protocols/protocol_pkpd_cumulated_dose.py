@@ -67,6 +67,7 @@ class ProtPKPDCumulatedDose(ProtPKPD):
             self.experiment.addParameterToSample(sampleName, labelToAdd, Dunits, comment, varValue)
 
         self.writeExperiment(self.experiment,self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputExperiment=self.experiment)
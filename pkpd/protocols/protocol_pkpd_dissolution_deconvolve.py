@@ -133,17 +133,11 @@ class ProtPKPDDeconvolve(ProtPKPDODEBase):
                     tlag=float(sample.getDescriptorValue(paramName))
             drugSource.setParameters(p)
 
-            cumulatedDose=0.0
-            A=t*0.0 # Allocate memory
+            A = np.cumsum(drugSource.getAmountReleasedOnGrid(t,deltaT))
             totalReleased = drugSource.getAmountReleasedUpTo(10*t[-1])
-            print("t(min) A(%s)"%Avar.units._toString())
-            for i in range(t.size):
-                cumulatedDose+=drugSource.getAmountReleasedAt(t[i],deltaT)
-                A[i]=cumulatedDose
-                if self.normalize.get():
-                    A[i] *= 100.0/totalReleased
-                print("%f %f"%(t[i],A[i]))
-                # print("%f %f %f %f"%(t[i], A[i], drugSource.getAmountReleasedAt(t[i], 0.5), drugSource.getAmountReleasedUpTo(t[i] + 0.5)))
+            print("Total amount released: %f"%totalReleased)
+            if self.normalize.get():
+                A *= 100.0/totalReleased
             if self.saturate.get() and self.normalize.get():
                 A = np.clip(A,None,100.0)
             if self.considerBioaval.get()==self.BIOAVAIL_DIV:
@@ -153,6 +147,7 @@ class ProtPKPDDeconvolve(ProtPKPDODEBase):
             self.addSample(sampleName,t-tlag,A)
 
         self.outputExperiment.write(self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputExperiment=self.outputExperiment)
@@ -26,9 +26,10 @@
 
 import numpy as np
 from scipy.interpolate import InterpolatedUnivariateSpline
-from scipy.fftpack import fft, ifft
+from scipy.fftpack import next_fast_len
 
 import pyworkflow.protocol.params as params
+from pyworkflow.protocol.constants import LEVEL_ADVANCED
 from pkpd.objects import PKPDExperiment, PKPDSample, PKPDVariable
 from pkpd.pkpd_units import createUnit
 from pkpd.utils import uniqueFloatValues
@@ -55,6 +56,8 @@ class ProtPKPDDeconvolveFourier(ProtPKPDODEBase):
     BIOAVAIL_MULT = 1
     BIOAVAIL_DIV = 2
 
+    blockSize = 64 # Number of samples deconvolved at once
+
     #--------------------------- DEFINE param functions --------------------------------------------
     def _defineParams(self, form):
         form.addSection('Input')
@@ -82,6 +85,11 @@ class ProtPKPDDeconvolveFourier(ProtPKPDODEBase):
         form.addParam('removeTlag', params.BooleanParam, label="Remove tlag effect", default=True,
                       help='If set to True, then the deconvolution is performed ignoring the the tlag in the absorption.'
                            'This homogeneizes the different responses.')
+        form.addParam('regularization', params.FloatParam, label="Regularization", default=0.0,
+                      expertLevel=LEVEL_ADVANCED,
+                      help='The Fourier division C/H is computed as C*conj(H)/(|H|^2+r*max|H|^2). With r=0 it is the '
+                           'plain division, larger values of r damp the frequencies at which the impulse response is '
+                           'small (and the noise is amplified).')
 
     #--------------------------- INSERT steps functions --------------------------------------------
     def _insertAllSteps(self):
@@ -99,6 +107,34 @@ class ProtPKPDDeconvolveFourier(ProtPKPDODEBase):
         newSample.addMeasurementColumn("A",y)
         self.outputExperiment.samples[sampleName] = newSample
 
+    def computeInverseFilters(self, model, t, sampleParameters, Nfft):
+        # The impulse response only depends on the model parameters, it is simulated once per parameter set
+        if not hasattr(self,"inverseFilterCache"):
+            self.inverseFilterCache = {}
+        newParameters = [key for key in dict.fromkeys(sampleParameters) if key not in self.inverseFilterCache]
+        if len(newParameters)==0:
+            return
+        h = None
+        if len(newParameters)>1:
+            try:
+                h = model.forwardModelBatch(np.asarray(newParameters),[t])[0]
+                model.setParameters(list(newParameters[0]))
+                href = model.forwardModel(list(newParameters[0]), [t]*model.getResponseDimension())[0]
+                if not np.allclose(h[0],href,rtol=1e-6,atol=1e-12,equal_nan=True):
+                    h = None
+            except Exception:
+                h = None
+        if h is None:
+            h = np.zeros((len(newParameters),t.size))
+            for i, parameters in enumerate(newParameters):
+                model.setParameters(list(parameters))
+                h[i,:] = model.forwardModel(list(parameters), [t]*model.getResponseDimension())[0]
+        H = np.fft.rfft(h,Nfft)
+        H2 = np.abs(H)**2
+        inverseFilters = np.conj(H)/(H2+self.regularization.get()*np.max(H2,axis=1,keepdims=True))
+        for parameters, inverseFilter in zip(newParameters, inverseFilters):
+            self.inverseFilterCache[parameters] = inverseFilter
+
     def deconvolve(self, objId):
         self.protODE = self.inputODE.get()
         self.experiment = self.readExperiment(self.protODE.outputExperiment.fnPKPD)
@@ -172,9 +208,13 @@ class ProtPKPDDeconvolveFourier(ProtPKPDODEBase):
             for _, sampleFrom in anotherExperiment.samples.items(): # Take the first sample from the reference
                 break
 
-        # Simulate the different responses
-        for sampleName, sample in self.experiment.samples.items():
-            self.printSection("Deconvolving "+sampleName)
+        # Collect the input of all samples
+        sampleNames = []
+        sampleParameters = []
+        allC = np.zeros((len(self.experiment.samples),t.size))
+        tlags = []
+        totalReleased = []
+        for i, (sampleName, sample) in enumerate(self.experiment.samples.items()):
             drugSourceSample = DrugSource()
             drugSourceSample.setDoses(sample.parsedDoseList, 0.0, timeRange[1])
 
@@ -188,43 +228,45 @@ class ProtPKPDDeconvolveFourier(ProtPKPDODEBase):
 
             if self.externalIV.get()==self.SAME_INPUT:
                 sampleFrom = sample
-            parameters=[]
-            for prmName in prmNames:
-                parameters.append(float(sampleFrom.descriptors[prmName]))
-            model.setParameters(parameters)
-            h = model.forwardModel(parameters, [t]*model.getResponseDimension())[0]
+            sampleParameters.append(tuple(float(sampleFrom.descriptors[prmName]) for prmName in prmNames))
 
             ts,Cs = sample.getXYValues(self.varNameX,self.varNameY)
             ts=np.insert(ts,0,0.0)
             Cs=np.insert(Cs,0,0.0)
             ts, Cs = uniqueFloatValues(ts,Cs)
             B=InterpolatedUnivariateSpline(ts, Cs, k=1)
-            C=np.clip(B(t),0.0,None)
-
-            Fabs=np.clip(np.real(ifft(np.divide(fft(C),fft(h)))),0.0,None)
-
-            cumulatedDose=0.0
-            A=t*0.0 # Allocate memory
-            totalReleased = drugSourceSample.getAmountReleasedUpTo(10*t[-1]) # Divided by 100 to have a number between 0 and 100
-            print("Total amount released: %f"%totalReleased)
-            print("t(min) A(%s)"%Avar.units._toString())
-            for i in range(t.size):
-                cumulatedDose+=Fabs[i]
-                A[i]=cumulatedDose
+            allC[i,:]=np.clip(B(t),0.0,None)
+
+            sampleNames.append(sampleName)
+            tlags.append(tlag)
+            totalReleased.append(drugSourceSample.getAmountReleasedUpTo(10*t[-1]))
+
+        # Deconvolve all samples at once, zero padding avoids the wrap around of the circular convolution
+        Nfft = next_fast_len(2*t.size)
+        self.computeInverseFilters(model, t, sampleParameters, Nfft)
+        for i0 in range(0,len(sampleNames),self.blockSize):
+            i1 = min(i0+self.blockSize,len(sampleNames))
+            inverseFilters = np.asarray([self.inverseFilterCache[key] for key in sampleParameters[i0:i1]])
+            Fabs = np.fft.irfft(np.fft.rfft(allC[i0:i1],Nfft)*inverseFilters,Nfft)[:,:t.size]
+            allA = np.cumsum(np.clip(Fabs,0.0,None),axis=1)
+            for i in range(i0,i1):
+                sample = self.experiment.samples[sampleNames[i]]
+                self.printSection("Deconvolving "+sampleNames[i])
+                print("Total amount released: %f"%totalReleased[i])
+                A = allA[i-i0]
                 if self.normalize.get():
-                    A[i] *= 100.0/totalReleased
-                print("%f %f"%(t[i],A[i]))
-                # print("%f %f %f %f"%(t[i], A[i], drugSource.getAmountReleasedAt(t[i], 0.5), drugSource.getAmountReleasedUpTo(t[i] + 0.5)))
-            if self.saturate.get() and self.normalize.get():
-                A = np.clip(A,None,100.0)
-            if self.considerBioaval.get()==self.BIOAVAIL_DIV:
-                A /= sample.getBioavailability()
-            elif self.considerBioaval.get()==self.BIOAVAIL_MULT:
-                A *= sample.getBioavailability()
-            As, ts = uniqueFloatValues(np.clip(A,0,None),t-tlag)
-            self.addSample(sampleName,ts,As)
+                    A *= 100.0/totalReleased[i]
+                if self.saturate.get() and self.normalize.get():
+                    A = np.clip(A,None,100.0)
+                if self.considerBioaval.get()==self.BIOAVAIL_DIV:
+                    A /= sample.getBioavailability()
+                elif self.considerBioaval.get()==self.BIOAVAIL_MULT:
+                    A *= sample.getBioavailability()
+                As, ts = uniqueFloatValues(np.clip(A,0,None),t-tlags[i])
+                self.addSample(sampleNames[i],ts,As)
 
         self.outputExperiment.write(self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputExperiment=self.outputExperiment)
@@ -104,6 +104,7 @@ class ProtPKPDDissolutionF2(ProtPKPD):
         if self.resampleT.get()>0 and self.keepResample.get():
             self.experiment = experiment
             self.experiment.write(self._getPath("experiment.pkpd"))
+            self.waitForExcelExports()
         return allY
 
     def randomIdx(self,pRef,pTest):
@@ -187,6 +187,7 @@ are independent, which are not. Use Bootstrap estimates instead.\n
     def postAnalysis(self):
         if self.resampleT.get()>0:
             self.experimentSimulated.write(self._getPath("experimentSimulated.pkpd"))
+            self.waitForExcelExports()
 
     def createOutputStep(self):
         ProtPKPDFitBase.createOutputStep(self)
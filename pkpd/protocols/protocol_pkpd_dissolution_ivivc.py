@@ -182,10 +182,13 @@ class ProtPKPDDissolutionIVIVC(ProtPKPDDissolutionLevyPlot):
             self.outputExperimentAdissol.samples[sampleName] = newSampleAdissol
             self.addParametersToExperiment(self.outputExperimentAdissol, sampleName, individualFrom, vesselFrom, optimum, R)
 
+    def summaryLine(self,x,msg):
+        p = np.percentile(x,[2.5, 50, 97.5],axis=0)
+        return "%s: median=%f; 95%% Confidence interval=[%f,%f]"%(msg,p[1],p[0],p[2])
+
     def summarize(self,fh,x,msg):
         if len(x)>0:
-            p = np.percentile(x,[2.5, 50, 97.5],axis=0)
-            self.doublePrint(fh,"%s: median=%f; 95%% Confidence interval=[%f,%f]"%(msg,p[1],p[0],p[2]))
+            self.doublePrint(fh,self.summaryLine(x,msg))
 
     def guaranteeMonotonicity(self):
         idx = np.isnan(self.FabsUnique)
@@ -401,6 +404,20 @@ class ProtPKPDDissolutionIVIVC(ProtPKPDDissolutionLevyPlot):
         self.parametersInVitro, self.vesselNames, _=self.getInVitroModels()
         self.profilesInVivo, self.sampleNames=self.getInVivoProfiles()
 
+        summary = self.computeAllIvIvC()
+        fh=open(self._getPath("summary.txt"),"w")
+        for line in summary:
+            self.doublePrint(fh,line)
+        fh.close()
+
+        self.outputExperimentFabs.write(self._getPath("experimentFabs.pkpd"))
+        self.outputExperimentAdissol.write(self._getPath("experimentAdissol.pkpd"))
+        self.outputExperimentFabsSingle.write(self._getPath("experimentFabsSingle.pkpd"))
+        self.waitForExcelExports()
+
+    def computeAllIvIvC(self):
+        """ Correlate all the in vitro models with all the in vivo profiles, and their averages (no file is read
+            or written). The results are kept in the output experiments and the summary lines are returned """
         self.createOutputExperiments(set=1)
 
         i=1
@@ -505,15 +522,14 @@ class ProtPKPDDissolutionIVIVC(ProtPKPDDissolutionLevyPlot):
                 invivoIdx+=1
             invitroIdx+=1
 
-        fh=open(self._getPath("summary.txt"),"w")
-        self.summarize(fh,allt0,"t0")
-        self.summarize(fh,allk,"k")
-        self.summarize(fh,allalpha,"alpha")
-        self.summarize(fh,allA,"A")
-        self.summarize(fh,allB,"B")
-        self.doublePrint(fh," ")
-        self.summarize(fh,allR,"Correlation coefficient (R)")
-        self.doublePrint(fh," ")
+        summary = []
+        for x, msg in [(allt0,"t0"), (allk,"k"), (allalpha,"alpha"), (allA,"A"), (allB,"B")]:
+            if len(x)>0:
+                summary.append(self.summaryLine(x,msg))
+        summary.append(" ")
+        if len(allR)>0:
+            summary.append(self.summaryLine(allR,"Correlation coefficient (R)"))
+        summary.append(" ")
 
         if self.timeScale.get() == 0:
             timeStr = "t"
@@ -533,11 +549,7 @@ class ProtPKPDDissolutionIVIVC(ProtPKPDDissolutionLevyPlot):
             eqStr = "Fabs(t)=A*Adissol(%s)" % timeStr
         elif self.responseScale.get() == 2:
             eqStr = "Fabs(t)=A*Adissol(%s)+B" % timeStr
-        self.doublePrint(fh,"IVIVC equation: %s"%eqStr)
-        fh.close()
-
-        self.outputExperimentFabs.write(self._getPath("experimentFabs.pkpd"))
-        self.outputExperimentAdissol.write(self._getPath("experimentAdissol.pkpd"))
+        summary.append("IVIVC equation: %s"%eqStr)
 
         # Compute single
         print("Single IVIVC")
@@ -558,7 +570,7 @@ class ProtPKPDDissolutionIVIVC(ProtPKPDDissolutionLevyPlot):
         R = self.calculateR()
         self.createOutputExperiments(set=2)
         self.addSample("ivivc_single", "AvgVivo", "AvgVitro", x, R, set=2)
-        self.outputExperimentFabsSingle.write(self._getPath("experimentFabsSingle.pkpd"))
+        return summary
 
     def createOutputStep(self):
         self._defineOutputs(outputExperimentFabs=self.outputExperimentFabs)
@@ -33,7 +33,9 @@ from scipy.interpolate import InterpolatedUnivariateSpline
 from scipy.optimize import differential_evolution
 
 import pyworkflow.protocol.params as params
-from pkpd.utils import uniqueFloatValues, parseOperation, computeXYmean
+from pkpd.expressions import compileExpression
+from pkpd.utils import (uniqueFloatValues, uniqueFloatRows, parseOperation, computeXYmean, interpLinear,
+                        interpLinearRows, smoothPchip)
 from pkpd.pkpd_units import PKPDUnit
 
 
@@ -96,34 +98,86 @@ class ProtPKPDDissolutionIVIVCGeneric(ProtPKPDDissolutionIVIVC):
         self.outputExperimentFabs.addLabelToSample(sampleName, "from", "individual---vesel", "%s---%s"%(individualFrom,vesselFrom))
         self.outputExperimentAdissol.addLabelToSample(sampleName, "from", "individual---vesel", "%s---%s"%(individualFrom,vesselFrom))
 
+    def predictPopulation(self, X):
+        """ Forward and backward predictions of a population of coefficient vectors (one column per individual,
+            as in differential_evolution with vectorized=True). It returns the predictions (one row per
+            individual) and whether each individual is feasible """
+        Npop = X.shape[1]
+        values = {"t": self.tvivoUnique}
+        for i, prm in enumerate(self.parameters):
+            values[prm] = X[i][:,np.newaxis]
+        with np.errstate(all="ignore"):
+            tvitro = np.broadcast_to(self.timeExpression.evaluate(values),(Npop,self.tvivoUnique.size))
+            tvitroReinterpolated = np.clip(tvitro,self.tvitroMin,self.tvitroMax)
+            AdissolReinterpolated = interpLinear(tvitroReinterpolated,self.tvitroUnique,self.AdissolUnique)
+            values["Adissol"] = AdissolReinterpolated
+            FabsPredicted = np.clip(np.broadcast_to(self.responseExpression.evaluate(values),tvitro.shape),0.0,100)
+
+            tvitroAux, tvivoAux, validT = uniqueFloatRows(tvitro,self.tvivoUnique)
+            tvivoReinterpolated = np.clip(interpLinearRows(self.tvitroUnique,tvitroAux,tvivoAux,validT),
+                                          self.tvivoMin,self.tvivoMax)
+            FabsReinterpolated = interpLinear(tvivoReinterpolated,self.tvivoUnique,self.FabsUnique)
+            FabsPredictedAux, AdissolAux, validF = uniqueFloatRows(FabsPredicted,AdissolReinterpolated)
+            AdissolPredicted = np.clip(interpLinearRows(FabsReinterpolated,FabsPredictedAux,AdissolAux,validF),
+                                       0.0,100)
+
+        # The inverse interpolations need at least two points and finite times
+        feasible = np.logical_and(np.sum(validT,axis=1)>=2,np.sum(validF,axis=1)>=2)
+        feasible = np.logical_and(feasible,np.logical_not(np.any(np.isinf(tvitro),axis=1)))
+        return (tvitroReinterpolated, AdissolReinterpolated, FabsPredicted, tvivoReinterpolated,
+                FabsReinterpolated, AdissolPredicted), feasible
+
     def goalFunction(self,x):
-        i=0
+        X = np.zeros((0,1)) if x is None else np.reshape(np.asarray(x,dtype=np.float64),(-1,1))
         try:
-            for prm in self.parameters:
-                exec ("%s=%f" % (prm, x[i]))
-                i+=1
-
-            t=self.tvivoUnique
-            tvitroUnique=eval(self.parsedTimeOperation)
-            self.tvitroReinterpolated=np.clip(tvitroUnique,self.tvitroMin,self.tvitroMax)
-            self.AdissolReinterpolated = self.BAdissol(self.tvitroReinterpolated)
-            Adissol = self.AdissolReinterpolated
-            FabsPredicted = eval(self.parsedResponseOperation)
-            self.FabsPredicted = np.clip(FabsPredicted,0.0,100)
-
-            tvitroAux, tvivoAux = uniqueFloatValues(tvitroUnique,self.tvivoUnique)
-            Btinv = InterpolatedUnivariateSpline(tvitroAux, tvivoAux, k=1)
-            self.tvivoReinterpolated = np.clip(Btinv(self.tvitroUnique), self.tvivoMin, self.tvivoMax)
-            self.FabsReinterpolated = self.BFabs(self.tvivoReinterpolated)
-            FabsPredictedAux, AdissolAux = uniqueFloatValues(self.FabsPredicted, self.AdissolReinterpolated)
-            Bfinv = InterpolatedUnivariateSpline(FabsPredictedAux, AdissolAux, k=1)
-            self.AdissolPredicted = np.clip(Bfinv(self.FabsReinterpolated), 0.0, 100)
-
+            prediction, feasible = self.predictPopulation(X)
+            if not feasible[0]:
+                return 1e38
+            self.tvitroReinterpolated, self.AdissolReinterpolated, self.FabsPredicted, self.tvivoReinterpolated, \
+                self.FabsReinterpolated, self.AdissolPredicted = [np.array(y[0]) for y in prediction]
             error = self.calculateError(x, self.tvitroReinterpolated, self.tvivoReinterpolated)
         except:
            return 1e38
         return error
 
+    def goalFunctionPopulation(self,X):
+        """ Error of all the individuals of a population at once, the error of each one is the same as in
+            goalFunction """
+        X = np.asarray(X,dtype=np.float64)
+        if X.ndim==1:
+            return self.goalFunction(X)
+        try:
+            prediction, feasible = self.predictPopulation(X)
+        except:
+            return np.full(X.shape[1],1e38)
+        _, _, FabsPredicted, _, _, AdissolPredicted = prediction
+        with np.errstate(all="ignore"):
+            FabsPredicted = np.clip(smoothPchip(self.FabsUnique,FabsPredicted),0,100)
+            AdissolPredicted = np.clip(smoothPchip(self.AdissolUnique,AdissolPredicted),0,100)
+            residualsForward = FabsPredicted-self.FabsUnique
+            residualsBackward = self.AdissolUnique-AdissolPredicted
+            idx = np.isnan(residualsForward)
+            residualsForward[idx] = np.broadcast_to(self.FabsUnique,idx.shape)[idx]
+            idx = np.isnan(residualsBackward)
+            residualsBackward[idx] = np.broadcast_to(self.AdissolUnique,idx.shape)[idx]
+            error = 0.5*(np.sqrt(np.mean(residualsBackward**2,axis=1))+np.sqrt(np.mean(residualsForward**2,axis=1)))
+
+        # Predictions with missing values are only smoothed on the available values
+        for n in np.where(np.logical_and(feasible,np.logical_or(np.any(np.isnan(prediction[2]),axis=1),
+                                                                 np.any(np.isnan(prediction[5]),axis=1))))[0]:
+            error[n] = self.goalFunction(X[:,n])
+        error[np.logical_not(np.logical_and(feasible,np.isfinite(error)))] = 1e38
+
+        # Keep the state of the best individual, as goalFunction does
+        best = np.argmin(error)
+        if error[best]<self.bestError:
+            self.goalFunction(X[:,best])
+        return error
+
+    def optimizeCoefficients(self):
+        return differential_evolution(self.goalFunctionPopulation,self.bounds,popsize=50,vectorized=True,
+                                      updating='deferred')
+
     def constructBounds(self, coeffList, boundsStr):
         boundsDict = {}
         def parseBounds(allBoundsStr):
@@ -153,6 +207,14 @@ class ProtPKPDDissolutionIVIVCGeneric(ProtPKPDDissolutionIVIVC):
 
         return boundList
 
+    def compileScaling(self, formula, varList):
+        expression = compileExpression(formula)
+        for varName in expression.varList:
+            if not varName in varList:
+                raise Exception("Unknown variable $(%s) in %s, only %s can be used"%
+                                (varName, formula, ", ".join(["$(%s)"%v for v in varList])))
+        return expression
+
     def calculateAllIvIvC(self, objId1, objId2):
         self.parametersInVitro, self.vesselNames, _=self.getInVitroModels()
         self.profilesInVivo, self.sampleNames=self.getInVivoProfiles()
@@ -161,6 +223,8 @@ class ProtPKPDDissolutionIVIVCGeneric(ProtPKPDDissolutionIVIVC):
 
         self.parsedTimeOperation, self.varTimeList, self.coeffTimeList = parseOperation(self.timeScale.get())
         self.parsedResponseOperation, self.varResponseList, self.coeffResponseList = parseOperation(self.responseScale.get())
+        self.timeExpression = self.compileScaling(self.timeScale.get(), ["t"])
+        self.responseExpression = self.compileScaling(self.responseScale.get(), ["t","Adissol"])
 
         self.parameters = self.coeffTimeList + self.coeffResponseList
         self.bounds = self.constructBounds(self.coeffTimeList, self.timeBounds.get()) + \
@@ -204,7 +268,7 @@ class ProtPKPDDissolutionIVIVCGeneric(ProtPKPDDissolutionIVIVC):
                 self.BFabs = InterpolatedUnivariateSpline(self.tvivoUnique, self.FabsUnique, k=1)
 
                 self.bestError = 1e38
-                optimum = differential_evolution(self.goalFunction,self.bounds,popsize=50)
+                optimum = self.optimizeCoefficients()
                 # self.verbose=True
                 allCoeffs.append(optimum.x.tolist())
 
@@ -245,7 +309,7 @@ class ProtPKPDDissolutionIVIVCGeneric(ProtPKPDDissolutionIVIVC):
         self.BFabs = InterpolatedUnivariateSpline(self.tvivoUnique, self.FabsUnique, k=1)
         self.bestError = 1e38
         if len(self.bounds) > 0:
-            optimum = differential_evolution(self.goalFunction, self.bounds, popsize=50)
+            optimum = self.optimizeCoefficients()
             x = optimum.x
         else:
             x = None
@@ -254,6 +318,7 @@ class ProtPKPDDissolutionIVIVCGeneric(ProtPKPDDissolutionIVIVC):
         self.createOutputExperiments(set=2)
         self.addSample("ivivc_single", "AvgVivo", "AvgVitro", x, R, set=2)
         self.outputExperimentFabsSingle.write(self._getPath("experimentFabsSingle.pkpd"))
+        self.waitForExcelExports()
 
     def printFormulas(self, fh):
         self.doublePrint(fh,"Time scale: tvitro=%s"%self.timeScale.get().replace('$(t)','$(tvivo)'))
@@ -26,7 +26,9 @@
 
 import numpy as np
 import pyworkflow.protocol.params as params
+from pyworkflow.protocol.constants import LEVEL_ADVANCED
 from .protocol_pkpd import ProtPKPD
+from pkpd.expressions import toColumn
 
 # Tested in test_workflow_levyplot.py
 # Tested in test_workflow_deconvolution2.py
@@ -50,11 +52,22 @@ class ProtPKPDIVIVCInternalValidity(ProtPKPD):
                       pointerClass='PKPDExperiment',
                       help='Select the experiment with the measurements you want to analyze. It must have Cmax and AUC0t'
                             'and it is the output of a IVIVC+PK simulation')
+        form.addParam('Nbootstrap', params.IntParam, label="Bootstrap samples", default=0, expertLevel=LEVEL_ADVANCED,
+                      help='Number of bootstrap samples for the confidence interval of the mean errors. The in vivo samples '
+                           'are resampled together with all their simulations. Set to 0 for no bootstrapping')
 
     #--------------------------- STEPS functions --------------------------------------------
     def _insertAllSteps(self):
         self._insertFunctionStep('runAnalysis',self.inputExperiment.getObjId(),self.inputSimulated.getObjId())
 
+    def getDescriptorColumns(self, experiment):
+        # AUC0t and Cmax of all samples as float columns. As in the row-wise reading, a Cmax is only
+        # considered when the AUC0t of the same sample could also be read
+        sampleList = list(experiment.samples.values())
+        AUC, validAUC = toColumn([sample.getDescriptorValue("AUC0t") for sample in sampleList], True)
+        Cmax, validCmax = toColumn([sample.getDescriptorValue("Cmax") for sample in sampleList], True)
+        return sampleList, AUC, validAUC, Cmax, np.logical_and(validAUC, validCmax)
+
     def runAnalysis(self,objId1,objId2):
         trueExp = self.readExperiment(self.inputExperiment.get().fnPKPD,False)
         simExp = self.readExperiment(self.inputSimulated.get().fnPKPD,False)
@@ -64,51 +77,41 @@ class ProtPKPDIVIVCInternalValidity(ProtPKPD):
         if not "AUC0t" in simExp.variables or not "Cmax" in simExp.variables or not "from" in simExp.variables:
             raise Exception("Cannot find AUC0t, Cmax or from in the simulated experiment")
 
-        trueAUC = {}
-        trueCmax = {}
-        for sampleName, sample in trueExp.samples.items():
-            try:
-                trueAUC[sampleName]=float(sample.descriptors["AUC0t"])
-                trueCmax[sampleName]=float(sample.descriptors["Cmax"])
-            except:
-                pass
-
-        simAUC = {}
-        simCmax = {}
-        simNames = []
-        for sampleName, sample in simExp.samples.items():
-            fromNames=sample.descriptors["from"]
-            sampleName=fromNames.split("---")[0]
-            if not sampleName in simNames:
-                simNames.append(sampleName)
-            if not sampleName in simAUC:
-                simAUC[sampleName]=[]
-                simCmax[sampleName]=[]
-            try:
-                simAUC[sampleName].append(float(sample.descriptors["AUC0t"]))
-                simCmax[sampleName].append(float(sample.descriptors["Cmax"]))
-            except:
-                pass
-
-        errorAUC=[]
-        errorCmax=[]
-        for sampleName in trueAUC:
-            tAUC = trueAUC[sampleName]
-            tCmax = trueCmax[sampleName]
-            sampleNameSim = sampleName
-            if len(trueAUC)==1 and len(simAUC)==1:
-                sampleNamesSim = [x for x in simAUC]
-                sampleNameSim = sampleNamesSim[0]
-            if sampleNameSim in simAUC:
-                if tAUC>0:
-                    for sAUC in simAUC[sampleNameSim]:
-                        errorAUC.append((tAUC-sAUC)/tAUC*100)
-                if tCmax>0:
-                    for sCmax in simCmax[sampleNameSim]:
-                        errorCmax.append((tCmax-sCmax)/tCmax*100)
-
-        np.savetxt(self._getExtraPath("errorAUC.txt"),errorAUC)
-        np.savetxt(self._getExtraPath("errorCmax.txt"),errorCmax)
+        # True samples with both descriptors
+        trueList, trueAUC, _, trueCmax, trueValid = self.getDescriptorColumns(trueExp)
+        trueNames = np.array([sample.sampleName for sample in trueList], dtype=str)[trueValid]
+        trueAUC = trueAUC[trueValid]
+        trueCmax = trueCmax[trueValid]
+
+        # Simulated samples are keyed by the in vivo sample they come from
+        simList, simAUC, simValidAUC, simCmax, simValidCmax = self.getDescriptorColumns(simExp)
+        simKeys = np.array([str(sample.getDescriptorValue("from")).partition("---")[0] for sample in simList], dtype=str)
+        simNames, firstIdx = np.unique(simKeys, return_index=True)
+        simNames = simNames[np.argsort(firstIdx)].tolist()
+
+        # Join simulated and true samples
+        if len(trueNames)==1 and len(simNames)==1:
+            trueIdx = np.zeros(len(simKeys), dtype=int)
+        else:
+            order = np.argsort(trueNames)
+            pos = np.clip(np.searchsorted(trueNames[order], simKeys), 0, max(len(trueNames)-1,0))
+            trueIdx = order[pos] if len(trueNames)>0 else np.zeros(len(simKeys), dtype=int)
+            matched = trueNames[trueIdx]==simKeys if len(trueNames)>0 else np.zeros(len(simKeys), dtype=bool)
+            trueIdx = np.where(matched, trueIdx, -1)
+        # Errors are listed by true sample and then in the order of the simulated experiment
+        simOrder = np.argsort(trueIdx, kind="stable")
+        simOrder = simOrder[trueIdx[simOrder]>=0]
+        trueIdx = trueIdx[simOrder]
+
+        def predictionErrors(trueValues, simValues, simValid):
+            idx = np.logical_and(simValid[simOrder], trueValues[trueIdx]>0)
+            tValues = trueValues[trueIdx[idx]]
+            return (tValues-simValues[simOrder][idx])/tValues*100, trueIdx[idx]
+        errorAUC, subjectAUC = predictionErrors(trueAUC, simAUC, simValidAUC)
+        errorCmax, subjectCmax = predictionErrors(trueCmax, simCmax, simValidCmax)
+
+        writeErrors(self._getExtraPath("errorAUC.txt"),errorAUC)
+        writeErrors(self._getExtraPath("errorCmax.txt"),errorCmax)
 
         if len(errorAUC)==0:
             print("Cannot find any matching name between the true experiment (%s) and the simulated names (%s)"%\
@@ -120,11 +123,58 @@ class ProtPKPDIVIVCInternalValidity(ProtPKPD):
             self.doublePrint(fhSummary,"error AUC (normalized to 100, (true-sim)/true) %f%% confidence interval=[%f,%f] mean=%f"%(95,limits[0],limits[1],np.mean(errorAUC)))
             limits = np.percentile(errorCmax,[alpha_2,100-alpha_2])
             self.doublePrint(fhSummary,"error Cmax (normalized to 100, (true-sim)/true) %f%% confidence interval=[%f,%f] mean=%f"%(95,limits[0],limits[1],np.mean(errorCmax)))
+            Nbootstrap = self.Nbootstrap.get()
+            if Nbootstrap>0:
+                for label, errors, subjects in [("AUC", errorAUC, subjectAUC), ("Cmax", errorCmax, subjectCmax)]:
+                    if len(errors)>0:
+                        limits = np.percentile(bootstrapMeanError(errors, subjects, Nbootstrap),[alpha_2,100-alpha_2])
+                        self.doublePrint(fhSummary,"error %s mean %f%% bootstrap confidence interval=[%f,%f]"%(label,95,limits[0],limits[1]))
             fhSummary.close()
 
+            fhSubjects=open(self._getExtraPath("errorSubjects.txt"),"w")
+            fhSubjects.write("# sampleName NAUC meanErrorAUC stdErrorAUC NCmax meanErrorCmax stdErrorCmax\n")
+            statsAUC = subjectStatistics(errorAUC, subjectAUC, len(trueNames))
+            statsCmax = subjectStatistics(errorCmax, subjectCmax, len(trueNames))
+            for i in np.flatnonzero(statsAUC[0]+statsCmax[0]>0):
+                fhSubjects.write("%s %d %f %f %d %f %f\n"%(trueNames[i],statsAUC[0][i],statsAUC[1][i],statsAUC[2][i],
+                                                          statsCmax[0][i],statsCmax[1][i],statsCmax[2][i]))
+            fhSubjects.close()
+
     #--------------------------- INFO functions --------------------------------------------
     def _summary(self):
         msg=[]
         self.addFileContentToMessage(msg,self._getPath("summary.txt"))
         return msg
 
+
+def writeErrors(fnOut, errors):
+    """ Same text as np.savetxt, formatted in a single operation """
+    fh=open(fnOut,"w")
+    fh.write(("%.18e\n"*len(errors))%tuple(errors.tolist()))
+    fh.close()
+
+def subjectStatistics(errors, subjects, Nsubjects):
+    """ Number of errors, mean and standard deviation per subject """
+    N = np.bincount(subjects, minlength=Nsubjects)
+    Nsafe = np.maximum(N, 1)
+    mean = np.bincount(subjects, weights=errors, minlength=Nsubjects)/Nsafe
+    var = np.bincount(subjects, weights=(errors-mean[subjects])**2, minlength=Nsubjects)/Nsafe
+    return N, mean, np.sqrt(var)
+
+def bootstrapMeanError(errors, subjects, Nbootstrap, maxSize=10000000):
+    """ Bootstrap distribution of the pooled mean error. Subjects are resampled with replacement with all their
+        errors. If there is a single subject, the errors themselves are resampled """
+    subjects = np.unique(subjects, return_inverse=True)[1]
+    if subjects.max()==0:
+        subjects = np.arange(len(errors))
+    Nsubjects = subjects.max()+1
+    sums = np.bincount(subjects, weights=errors, minlength=Nsubjects)
+    counts = np.bincount(subjects, minlength=Nsubjects).astype(np.double)
+    p = np.full(Nsubjects, 1.0/Nsubjects)
+    means = np.zeros(Nbootstrap)
+    chunk = max(1, maxSize//Nsubjects)
+    for i0 in range(0, Nbootstrap, chunk):
+        # Each row of W tells how many times every subject is drawn
+        W = np.random.multinomial(Nsubjects, p, size=min(chunk, Nbootstrap-i0)).astype(np.double)
+        means[i0:i0+W.shape[0]] = np.dot(W,sums)/np.dot(W,counts)
+    return means
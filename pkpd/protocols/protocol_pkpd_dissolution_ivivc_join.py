@@ -138,6 +138,7 @@ class ProtPKPDDissolutionIVIVCJoin(ProtPKPD):
         self.outputExperimentFabsSingle.addLabelToSample(sampleName, "from", "individual---vesel", "AvgVivo---AvgVitro")
 
         self.outputExperimentFabsSingle.write(self._getPath("experimentFabsSingle.pkpd"))
+        self.waitForExcelExports()
     def createOutputStep(self):
         self._defineOutputs(outputExperimentFabsSingle=self.outputExperimentFabsSingle)
         for ptrExperiment in self.inputIVIVCs:
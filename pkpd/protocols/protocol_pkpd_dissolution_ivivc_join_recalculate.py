@@ -443,6 +443,7 @@ class ProtPKPDDissolutionIVIVCJoinRecalculate(ProtPKPDDissolutionIVIVCSplines):
                 pass
         self.outputExperimentFabs.write(self._getPath("experimentFabs.pkpd"))
         self.outputExperimentAdissol.write(self._getPath("experimentAdissol.pkpd"))
+        self.waitForExcelExports()
 
     def printFormulas(self, fh):
         self.doublePrint(fh, "Time scale: %s" % self.getTimeMsg())
@@ -26,6 +26,7 @@
 
 import numpy as np
 from scipy.interpolate import InterpolatedUnivariateSpline
+from scipy.optimize import differential_evolution
 
 import pyworkflow.protocol.params as params
 from pkpd.utils import uniqueFloatValues
@@ -138,6 +139,10 @@ class ProtPKPDDissolutionIVIVCSplines(ProtPKPDDissolutionIVIVCGeneric):
            return 1e38
         return error
 
+    def optimizeCoefficients(self):
+        # The spline knots are sorted in goalFunction, one individual at a time
+        return differential_evolution(self.goalFunction,self.bounds,popsize=50)
+
     def constructBounds(self, coeffList, boundsStr):
         return [(0,1)]*len(coeffList)
 
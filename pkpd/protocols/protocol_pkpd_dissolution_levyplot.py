@@ -30,13 +30,11 @@ try:
 except ImportError:
     izip = zip
 
-from scipy.interpolate import InterpolatedUnivariateSpline
-
 import pyworkflow.protocol.params as params
 from pkpd.objects import PKPDExperiment, PKPDSample, PKPDVariable
 from pkpd.utils import uniqueFloatValues, twoWayUniqueFloatValues
 from pkpd.pkpd_units import createUnit
-from pkpd.utils import computeXYmean
+from pkpd.utils import computeXYmean, interpLinear, polyfitAllDegrees
 from .protocol_pkpd import ProtPKPD
 
 
@@ -73,7 +71,9 @@ class ProtPKPDDissolutionLevyPlot(ProtPKPD):
             fnPKPD = self.inputInVivo.get().fnPKPD
         else:
             raise Exception("Cannot find a suitable filename for reading the experiment")
-        experiment = self.readExperiment(fnPKPD)
+        return self.extractInVivoProfiles(self.readExperiment(fnPKPD))
+
+    def extractInVivoProfiles(self, experiment):
         allY = []
         sampleNames = []
         for sampleName, sample in experiment.samples.items():
@@ -85,10 +85,14 @@ class ProtPKPDDissolutionLevyPlot(ProtPKPD):
         return allY, sampleNames
 
     def getInVitroModels(self):
+        protFit = self.inputInVitro.get()
+        return self.extractInVitroModels(protFit, self.readExperiment(protFit.outputExperiment.fnPKPD),
+                                         self.readFitting(protFit.outputFitting.fnFitting))
+
+    def extractInVitroModels(self, protFit, experiment, fitting):
         allParameters = []
-        self.protFit = self.inputInVitro.get()
-        experiment = self.readExperiment(self.protFit.outputExperiment.fnPKPD)
-        self.fitting = self.readFitting(self.protFit.outputFitting.fnFitting)
+        self.protFit = protFit
+        self.fitting = fitting
         self.varNameX = self.fitting.predictor.varName
         self.varNameY = self.fitting.predicted.varName
 
@@ -117,19 +121,26 @@ class ProtPKPDDissolutionLevyPlot(ProtPKPD):
         self.experimentInVitro = experiment
         return allParameters, vesselNames, tvitroMax
 
-    def produceLevyPlot(self,tvivo,parameterInVitro,Avivo,tvitroMax):
-        Avivounique, tvivoUnique=uniqueFloatValues(Avivo,tvivo)
-        B = InterpolatedUnivariateSpline(Avivounique, tvivoUnique, k=1)
+    def buildInVivoInverse(self, tvivo, Avivo):
+        # Monotone table A -> tvivo, built once per in vivo profile
+        return uniqueFloatValues(Avivo,tvivo)
+
+    def evaluateInVitro(self, parameterInVitro, tmax):
+        tvitro = np.arange(0, tmax, 1)
+        self.protFit.model.x=tvitro
+        Avitro = np.asarray(self.protFit.model.forwardModel(parameterInVitro)[0],dtype=np.float64)
+        return tvitro, Avitro
+
+    def getTvitroMax(self, tvivo, tvitroMax):
         tmax = 10*np.max(tvivo)
         if self.limitTvitro.get():
             tmax=np.min([tmax,tvitroMax])
-        tvitro = np.arange(0, tmax, 1)
-        self.protFit.model.x=tvitro
-        Avitro = self.protFit.model.forwardModel(parameterInVitro)[0]
-        tvivo=[]
-        for i in range(tvitro.shape[0]):
-            tvivo.append(B(Avitro[i]))
-        return (tvitro,np.asarray(tvivo,dtype=np.float64),Avitro)
+        return tmax
+
+    def produceLevyPlot(self,tvivo,parameterInVitro,Avivo,tvitroMax):
+        Avivounique, tvivoUnique=self.buildInVivoInverse(tvivo,Avivo)
+        tvitro, Avitro = self.evaluateInVitro(parameterInVitro, self.getTvitroMax(tvivo, tvitroMax))
+        return (tvitro,interpLinear(Avitro,Avivounique,tvivoUnique),Avitro)
 
     def addSample(self, outputExperiment, sampleName, tvitro, tvivo, individualFrom, vesselFrom):
         newSample = PKPDSample()
@@ -143,8 +154,7 @@ class ProtPKPDDissolutionLevyPlot(ProtPKPD):
 
     def makeSuggestions(self, levyName, tvitro, tvivo):
         print("Polynomial fitting suggestions for %s"%levyName)
-        for degree in range(1,10):
-            coeffs =np.polyfit(tvivo,tvitro,degree)
+        for degree, coeffs in enumerate(polyfitAllDegrees(tvivo,tvitro,9),1):
             p=np.poly1d(coeffs, variable='tvivo')
             residuals=tvitro-p(tvivo)
             R2=1-np.var(residuals)/np.var(tvivo)
@@ -157,8 +167,7 @@ class ProtPKPDDissolutionLevyPlot(ProtPKPD):
         idx=np.logical_and(np.isfinite(logtvitro),np.isfinite(logtvivo))
         logtvivo=logtvivo[idx]
         logtvitro=logtvitro[idx]
-        for degree in range(1,10):
-            coeffs =np.polyfit(logtvivo,logtvitro,degree)
+        for degree, coeffs in enumerate(polyfitAllDegrees(logtvivo,logtvitro,9),1):
             p=np.poly1d(coeffs, variable='log10(tvivo)')
             residuals=logtvitro-p(logtvivo)
             R2=1-np.var(residuals)/np.var(logtvivo)
@@ -188,12 +197,19 @@ class ProtPKPDDissolutionLevyPlot(ProtPKPD):
         self.outputExperiment.general["title"] = "Levy plots"
         self.outputExperiment.general["comment"] = "Time in vivo vs time in vitro"
 
+        # The in vivo inverses do not depend on the vessel and the in vitro profile does not
+        # depend on the individual (except for its length), so both are computed only once
+        inverseInVivo = [self.buildInVivoInverse(t,profileInVivo) for t, profileInVivo in profilesInVivo]
         i=1
         levyList = []
         for parameterInVitro, vesselFrom, tvitroMaxi in izip(parametersInVitro,vesselNames,tvitroMax):
-            for aux, sampleFrom in izip(profilesInVivo,sampleNames):
-                t, profileInVivo = aux
-                tvitro, tvivo, _ = self.produceLevyPlot(t,parameterInVitro,profileInVivo,tvitroMaxi)
+            tmaxList = [self.getTvitroMax(t,tvitroMaxi) for t, _ in profilesInVivo]
+            tvitroAll, AvitroAll = self.evaluateInVitro(parameterInVitro, np.max(tmaxList))
+            for aux, sampleFrom, tmax in izip(inverseInVivo,sampleNames,tmaxList):
+                Avivounique, tvivoUnique = aux
+                N = np.searchsorted(tvitroAll, tmax)
+                tvitro = tvitroAll[:N]
+                tvivo = interpLinear(AvitroAll[:N], Avivounique, tvivoUnique)
                 tvitroUnique, tvivoUnique = twoWayUniqueFloatValues(tvitro, tvivo)
                 idx = np.logical_and(tvitroUnique>0,tvivoUnique>0)
                 tvitroUnique=tvitroUnique[idx]
@@ -229,6 +245,7 @@ class ProtPKPDDissolutionLevyPlot(ProtPKPD):
         self.addSample(self.outputExperimentSingle, "levyAvg", tvitroUnique, tvivoUnique, "vivoAvg", "vitroAvg")
 
         self.outputExperimentSingle.write(self._getPath("experimentSingle.pkpd"))
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputExperiment=self.outputExperiment)
@@ -91,6 +91,7 @@ class ProtPKPDDissolutionLevyPlotJoin(ProtPKPD):
         self.outputExperimentSingle.addLabelToSample(sampleName, "from", "individual---vesel", "meanVivo---meanVitro")
 
         self.outputExperimentSingle.write(self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputExperiment=self.outputExperimentSingle)
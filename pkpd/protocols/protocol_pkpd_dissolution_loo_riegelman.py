@@ -31,7 +31,7 @@ import pyworkflow.protocol.params as params
 from .protocol_pkpd import ProtPKPD
 from pkpd.objects import PKPDExperiment, PKPDSample, PKPDVariable
 from pkpd.pkpd_units import createUnit
-from pkpd.utils import uniqueFloatValues, calculateAUC0t, smoothPchip
+from pkpd.utils import uniqueFloatValues, stackProfiles, calculateLooRiegelman, smoothPchip
 
 # tested in test_workflow_levyplot.py
 
@@ -107,18 +107,6 @@ class ProtPKPDDeconvolutionLooRiegelman(ProtPKPD):
         newSample.addMeasurementColumn("A",y)
         self.outputExperiment.samples[sampleName] = newSample
 
-    def calculateCperipheral(self,t,Cp,k12,k21):
-        Cperipheral=np.zeros(t.shape)
-        for n in range(1,Cperipheral.size):
-            DeltaCp=np.abs(Cp[n]-Cp[n-1])
-            DeltaT=t[n]-t[n-1]
-            Cperipheral[n] = k12*DeltaCp*DeltaT*0.5 + \
-                             k12 / k21 * Cp[n-1]*(1 - np.exp(-k21 * DeltaT)) + \
-                             Cperipheral[n-1] * np.exp(-k21 * DeltaT)
-            if Cperipheral[n]<0.0:
-                Cperipheral[n]=0.0
-        return Cperipheral
-
     def deconvolve(self, objId1):
         self.experiment = self.readExperiment(self.inputExperiment.get().fnPKPD)
 
@@ -149,6 +137,13 @@ class ProtPKPDDeconvolutionLooRiegelman(ProtPKPD):
                 break
 
         timeRange = self.experiment.getRange(self.timeVar.get())
+        sampleNames = []
+        tList = []
+        CpList = []
+        Cl = []
+        V = []
+        Clp = []
+        Vp = []
         for sampleName, sample in self.experiment.samples.items():
             # Get t, Cp
             t=np.asarray(sample.getValues(self.timeVar.get()),dtype=np.float64)
@@ -161,25 +156,29 @@ class ProtPKPDDeconvolutionLooRiegelman(ProtPKPD):
                 B = InterpolatedUnivariateSpline(t, Cp, k=1)
                 t = np.arange(np.min(t),np.max(t)+self.resampleT.get(),self.resampleT.get())
                 Cp = B(t)
+            sampleNames.append(sampleName)
+            tList.append(t)
+            CpList.append(Cp)
 
-            # Calculate AUC0t
-            AUC0t=calculateAUC0t(t,Cp)
-            AUC0inf = float(AUC0t[-1])
-
-            # Calculate peripheral
             if self.externalIV.get()==self.SAME_INPUT:
                 sampleFrom = sample
-            Cl=float(sampleFrom.descriptors['Cl'])
-            V=float(sampleFrom.descriptors['V'])
-            Clp=float(sampleFrom.descriptors['Clp'])
-            Vp=float(sampleFrom.descriptors['Vp'])
-            k12 = Clp / V
-            k21 = Clp / Vp
-            Cperipheral = self.calculateCperipheral(t,Cp,k12,k21)
-
-            # Deconvolve
-            k10=Cl/V
-            A = (Cp + Cperipheral + k10 * AUC0t) / k10
+            Cl.append(float(sampleFrom.descriptors['Cl']))
+            V.append(float(sampleFrom.descriptors['V']))
+            Clp.append(float(sampleFrom.descriptors['Clp']))
+            Vp.append(float(sampleFrom.descriptors['Vp']))
+
+        if len(sampleNames)>0:
+            # Deconvolve all profiles at once
+            t, Cp, _ = stackProfiles(tList, CpList)
+            Cl, V, Clp, Vp = [np.asarray(x) for x in (Cl, V, Clp, Vp)]
+            allA, allAUC0t = calculateLooRiegelman(t, Cp, Cl/V, Clp/V, Clp/Vp)
+
+        for i, sampleName in enumerate(sampleNames):
+            sample = self.experiment.samples[sampleName]
+            t = tList[i]
+            Cp = CpList[i]
+            A = allA[i,:t.size]
+            AUC0inf = float(allAUC0t[i,t.size-1])
             if self.normalize.get():
                 A *= 100/AUC0inf
                 if self.saturate.get():
@@ -200,6 +199,7 @@ class ProtPKPDDeconvolutionLooRiegelman(ProtPKPD):
             self.addSample(sampleName,t,A)
 
         self.outputExperiment.write(self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputExperiment=self.outputExperiment)
@@ -32,7 +32,7 @@ import pyworkflow.protocol.params as params
 from .protocol_pkpd import ProtPKPD
 from pkpd.objects import PKPDExperiment, PKPDSample, PKPDVariable
 from pkpd.pkpd_units import createUnit, divideUnits
-from pkpd.utils import uniqueFloatValues, calculateAUC0t, smoothPchip
+from pkpd.utils import uniqueFloatValues, stackProfiles, calculateInverseLooRiegelman
 
 class ProtPKPDDeconvolutionLooRiegelmanInverse(ProtPKPD):
     """ Given a profile of amount absorbed, find the central and peripheral concentrations that gave raise to it.
@@ -126,43 +126,9 @@ class ProtPKPDDeconvolutionLooRiegelmanInverse(ProtPKPD):
         return C, Cp
 
     def calculateConcentrations2(self,t,A):
-        k10 = float(self.k10.get())
-        k12 = float(self.k12.get())
-        k21 = float(self.k21.get())
-        V = float(self.V.get())
-        Vp = float(self.Vp.get())
-
-        C = np.zeros(t.shape)
-        Cp = np.zeros(t.shape)
-
-        # Clp = k12*V
-
-        for n in range(1,C.size):
-            DeltaA=np.abs(A[n]-A[n-1])
-            DeltaT=t[n]-t[n-1]
-
-            # Q12 = Clp*(C[n-1]-Cp[n-1])
-            # C[n]=C[n-1]+(-Cl*C[n-1]/V-Q12/V)*DeltaT+DeltaA/V
-            # Cp[n]=Cp[n-1]+Q12/Vp*DeltaT
-
-            # Q12 = Clp*(C[n-1]-Cp[n-1])
-            # C[n]=C[n-1]-k10*C[n-1]*DeltaT-Q12/V*DeltaT+DeltaA/V
-            # Cp[n]=Cp[n-1]+Q12/Vp*DeltaT
-
-            # C[n]=C[n-1]-k10*C[n-1]*DeltaT-(Clp*(C[n-1]-Cp[n-1]))/V*DeltaT+DeltaA/V
-            # Cp[n]=Cp[n-1]+(Clp*(C[n-1]-Cp[n-1]))/Vp*DeltaT
-
-            # C[n]=C[n-1]-k10*C[n-1]*DeltaT-Clp/V*C[n-1]*DeltaT+Clp/V*Cp[n-1]*DeltaT+DeltaA/V
-            # Cp[n]=Cp[n-1]+Clp/Vp*C[n-1]*DeltaT-Clp/Vp*Cp[n-1]*DeltaT
-
-            C[n]=C[n-1]-k10*C[n-1]*DeltaT-k12*C[n-1]*DeltaT+k21*Vp/V*Cp[n-1]*DeltaT+DeltaA/V
-            Cp[n]=Cp[n-1]+k12*V/Vp*C[n-1]*DeltaT-k21*Cp[n-1]*DeltaT
-
-            if C[n]<0.0:
-                C[n]=0.0
-            if Cp[n]<0.0:
-                Cp[n]=0.0
-        return C, Cp
+        # One profile per row
+        return calculateInverseLooRiegelman(t, A, float(self.k10.get()), float(self.k12.get()),
+                                            float(self.k21.get()), float(self.V.get()), float(self.Vp.get()))
 
     def solve(self, objId1):
         self.experiment = self.readExperiment(self.inputExperiment.get().fnPKPD)
@@ -171,6 +137,9 @@ class ProtPKPDDeconvolutionLooRiegelmanInverse(ProtPKPD):
         self.outputExperiment = None
 
         timeRange = self.experiment.getRange(self.timeVar.get())
+        sampleNames = []
+        tList = []
+        AList = []
         for sampleName, sample in self.experiment.samples.items():
             # Get t, A
             t=np.asarray(sample.getValues(self.timeVar.get()),dtype=np.float64)
@@ -184,8 +153,17 @@ class ProtPKPDDeconvolutionLooRiegelmanInverse(ProtPKPD):
                 t = np.arange(np.min(t),np.max(t)+self.resampleT.get(),self.resampleT.get())
                 A = B(t)
 
-            # Find C and Cp
-            C, Cp = self.calculateConcentrations2(t,A)
+            sampleNames.append(sampleName)
+            tList.append(t)
+            AList.append(A)
+
+        # Find C and Cp of all profiles at once
+        if len(sampleNames)>0:
+            allC, allCp = self.calculateConcentrations2(*stackProfiles(tList, AList)[0:2])
+        for i, sampleName in enumerate(sampleNames):
+            t = tList[i]
+            C = allC[i,:t.size]
+            Cp = allCp[i,:t.size]
 
             if self.outputExperiment is None:
                 self.outputExperiment = PKPDExperiment()
@@ -219,6 +197,7 @@ class ProtPKPDDeconvolutionLooRiegelmanInverse(ProtPKPD):
             self.addSample(sampleName,t,C,Cp)
 
         self.outputExperiment.write(self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputExperiment=self.outputExperiment)
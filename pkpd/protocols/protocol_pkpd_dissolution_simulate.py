@@ -98,6 +98,7 @@ class ProtPKPDDissolutionSimulate(ProtPKPD):
         form.addParam('noiseSigma', params.FloatParam, label="Noise sigma",
                       default=0.0, expertLevel=LEVEL_ADVANCED, condition="noiseType>0",
                       help='See help of Type of noise to add\n')
+        self._defineExcelParams(form)
 
     # --------------------------- STEPS functions --------------------------------------------
     def _insertAllSteps(self):
@@ -202,7 +203,7 @@ class ProtPKPDDissolutionSimulate(ProtPKPD):
 
         self.experimentSimulated.samples[newSample.sampleName] = newSample
         fnExperiment = self._getPath("experimentSimulated.pkpd")
-        self.experimentSimulated.write(fnExperiment)
+        self.experimentSimulated.write(fnExperiment, writeToExcel=self._writeToExcel)
 
         self.fittingSimulated = PKPDFitting()
         self.fittingSimulated.fnExperiment.set(fnExperiment)
@@ -234,7 +235,8 @@ class ProtPKPDDissolutionSimulate(ProtPKPD):
         self.fittingSimulated.sampleFits.append(sampleFit)
 
         fnFitting = self._getPath("fittingSimulated.pkpd")
-        self.fittingSimulated.write(fnFitting)
+        self.fittingSimulated.write(fnFitting, writeToExcel=self._writeToExcel)
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputExperiment=self.experimentSimulated)
@@ -25,7 +25,6 @@
 # **************************************************************************
 
 import random
-from scipy.interpolate import InterpolatedUnivariateSpline, interp1d
 
 import pyworkflow.protocol.params as params
 from pkpd.objects import PKPDExperiment, PKPDSample, PKPDVariable, PKPDFitting
@@ -35,6 +34,7 @@ from pkpd.models.dissolution_models import *
 from pkpd.models.pk_models import *
 from pkpd.biopharmaceutics import DrugSource, createDeltaDose, createVia
 from pkpd.pkpd_units import createUnit, multiplyUnits, strUnit
+from pkpd.utils import uniqueFloatValues, interpLinear
 
 # tested in test_workflow_levyplot
 # tested in test_workflow_deconvolution2
@@ -189,7 +189,7 @@ class ProtPKPDDissolutionPKSimulation(ProtPKPD):
                     break
                 i += 1
 
-    def addSample(self, sampleName, t, y, fromSamples):
+    def addSample(self, sampleName, t, y, fromSamples, i):
         newSample = PKPDSample()
         newSample.sampleName = sampleName
         newSample.variableDictPtr = self.outputExperiment.variables
@@ -200,20 +200,18 @@ class ProtPKPDDissolutionPKSimulation(ProtPKPD):
         newSample.addMeasurementColumn("t", t)
         newSample.addMeasurementColumn(self.fittingPK.predicted.varName,y)
 
-        newSample.descriptors["AUC0t"] = self.AUC0t
-        newSample.descriptors["AUMC0t"] = self.AUMC0t
-        newSample.descriptors["MRT"] = self.MRT
-        newSample.descriptors["Cmax"] = self.Cmax
-        newSample.descriptors["Tmax"] = self.Tmax
+        newSample.descriptors["AUC0t"] = self.AUC0t[i]
+        newSample.descriptors["AUMC0t"] = self.AUMC0t[i]
+        newSample.descriptors["MRT"] = self.MRT[i]
+        newSample.descriptors["Cmax"] = self.Cmax[i]
+        newSample.descriptors["Tmax"] = self.Tmax[i]
 
         self.outputExperiment.samples[sampleName] = newSample
         self.outputExperiment.addLabelToSample(sampleName, "from", "individual---vesel", fromSamples)
 
     def NCA(self, t, C):
-        self.AUC0t = 0
-        self.AUMC0t = 0
-        t0 = t[0]
-        tperiod0=0 # Time at which the dose was given
+        # C has one simulation per row, all of them are analyzed at once
+        C = np.atleast_2d(C)
         T0=0;
         TF=np.max(t)
         if self.NCAt0.get()!="" and self.NCAtF.get()!="":
@@ -223,34 +221,80 @@ class ProtPKPDDissolutionPKSimulation(ProtPKPD):
                 T0*=60
                 TF*=60
 
-        for idx in range(0,t.shape[0]-1):
-            if t[idx]>=T0 and t[idx]<=TF:
-                dt = (t[idx+1]-t[idx])
-                if C[idx+1]>=C[idx]: # Trapezoidal in the raise
-                    self.AUC0t  += 0.5*dt*(C[idx]+C[idx+1])
-                    self.AUMC0t += 0.5*dt*(C[idx]*t[idx]+C[idx+1]*t[idx+1])
-                else: # Log-trapezoidal in the decay
-                    decrement = C[idx]/C[idx+1]
-                    K = math.log(decrement)
-                    B = K/dt
-                    self.AUC0t  += dt*(C[idx]-C[idx+1])/K
-                    self.AUMC0t += (C[idx]*(t[idx]-tperiod0)-C[idx+1]*(t[idx+1]-tperiod0))/B-(C[idx+1]-C[idx])/(B*B)
-
-                if idx==0:
-                    self.Cmax=C[idx]
-                    self.Tmax=t[idx]-t0
-                else:
-                    if C[idx]>self.Cmax:
-                        self.Cmax=C[idx]
-                        self.Tmax=t[idx]-t0
-
-        self.MRT = self.AUMC0t/self.AUC0t
-
-        print("   Cmax=%f [%s]"%(self.Cmax,strUnit(self.Cunits.unit)))
-        print("   Tmax=%f [%s]"%(self.Tmax,strUnit(self.timeUnits)))
-        print("   AUC0t=%f [%s]"%(self.AUC0t,strUnit(self.AUCunits)))
-        print("   AUMC0t=%f [%s]"%(self.AUMC0t,strUnit(self.AUMCunits)))
-        print("   MRT=%f [%s]"%(self.MRT,strUnit(self.timeUnits)))
+        tperiod0=0 # Time at which the dose was given
+        idx = np.where(np.logical_and(t[:-1]>=T0, t[:-1]<=TF))[0]
+        tl = t[idx]
+        tr = t[idx+1]
+        dt = tr-tl
+        Cl = C[:,idx]
+        Cr = C[:,idx+1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Trapezoidal in the raise, log-trapezoidal in the decay
+            K = np.log(Cl/Cr)
+            B = K/dt
+            AUC = np.where(Cr>=Cl, 0.5*dt*(Cl+Cr), dt*(Cl-Cr)/K)
+            AUMC = np.where(Cr>=Cl, 0.5*dt*(Cl*tl+Cr*tr),
+                            (Cl*(tl-tperiod0)-Cr*(tr-tperiod0))/B-(Cr-Cl)/(B*B))
+            self.AUC0t = np.sum(AUC,axis=1)
+            self.AUMC0t = np.sum(AUMC,axis=1)
+            self.MRT = self.AUMC0t/self.AUC0t
+        imax = np.argmax(Cl,axis=1)
+        self.Cmax = Cl[np.arange(C.shape[0]),imax]
+        self.Tmax = tl[imax]-t[0]
+
+    def printNCA(self, i):
+        print("   Cmax=%f [%s]"%(self.Cmax[i],strUnit(self.Cunits.unit)))
+        print("   Tmax=%f [%s]"%(self.Tmax[i],strUnit(self.timeUnits)))
+        print("   AUC0t=%f [%s]"%(self.AUC0t[i],strUnit(self.AUCunits)))
+        print("   AUMC0t=%f [%s]"%(self.AUMC0t[i],strUnit(self.AUMCunits)))
+        print("   MRT=%f [%s]"%(self.MRT[i],strUnit(self.timeUnits)))
+
+    def getTimeScaling(self, t, keyToUse, nfit):
+        # The reinterpolated in vitro times and the IVIVC table only depend on the scaling, not on the simulation
+        key = (keyToUse, nfit)
+        if not key in self.scalingCache:
+            tvitroLevy, tvivoLevy = self.allTimeScalings[keyToUse][nfit]
+            tvivoLevyUnique, tvitroLevyUnique = uniqueFloatValues(tvivoLevy, tvitroLevy)
+            tvitro = interpLinear(t, tvivoLevyUnique, tvitroLevyUnique)
+            responseTable = None
+            if self.conversionType.get()==0:
+                Adissol, Fabs = self.allResponseScalings[keyToUse][nfit]
+                responseTable = uniqueFloatValues(Adissol, Fabs)
+            self.scalingCache[key] = (tvitro, responseTable)
+        return self.scalingCache[key]
+
+    def simulatePK(self, t, A, pkPrm):
+        # Response of the PK model to one dissolution profile (row of A) per simulation
+        N = A.shape[0]
+        C = np.zeros((N,t.size))
+        viaProfile = self.pkModel.drugSource.getVia().viaProfile
+        batchIdx = np.where(np.all(np.isfinite(A),axis=1))[0] if self.batchPK is not False else []
+        if len(batchIdx)>0 and self.batchPK is None:
+            # Check once that the model equations can be evaluated for several simulations at once, every
+            # simulation of the batch must be equal to the one computed separately
+            idx = batchIdx[:2] if len(batchIdx)>1 else batchIdx[[0,0]]
+            try:
+                viaProfile.setXYValues(t,A[idx,:])
+                Cbatch = self.pkModel.forwardModelBatch(pkPrm[idx,:],[t])[0]
+                self.batchPK = True
+                for row, i in enumerate(idx):
+                    viaProfile.setXYValues(t,A[i,:])
+                    Cref = self.pkModel.forwardModel(pkPrm[i,:],[t])[0]
+                    self.batchPK = self.batchPK and bool(np.allclose(Cbatch[row],Cref,rtol=1e-6,atol=1e-12,
+                                                                     equal_nan=True))
+            except Exception:
+                self.batchPK = False
+            if not self.batchPK:
+                print("The PK model cannot be simulated in batches, each simulation is computed separately")
+                batchIdx = []
+        for i0 in range(0,len(batchIdx),self.batchSize):
+            idx = batchIdx[i0:i0+self.batchSize]
+            viaProfile.setXYValues(t,A[idx,:])
+            C[idx,:] = self.pkModel.forwardModelBatch(pkPrm[idx,:],[t])[0]
+        for i in np.setdiff1d(np.arange(N),batchIdx):
+            viaProfile.setXYValues(t,A[i,:])
+            C[i,:] = self.pkModel.forwardModel(pkPrm[i,:],[t])[0] # forwardModel returns a list of arrays
+        return C
 
     def simulate(self, objId1, objId2, inputDose, inputN):
         import sys
@@ -335,12 +379,14 @@ class ProtPKPDDissolutionPKSimulation(ProtPKPD):
         if self.allCombinations:
             inputN = NPKFits * NDissolFits
 
-        AUCarray = np.zeros(inputN)
-        AUMCarray = np.zeros(inputN)
-        MRTarray = np.zeros(inputN)
-        CmaxArray = np.zeros(inputN)
-        TmaxArray = np.zeros(inputN)
-
+        # Draw all the simulations before computing them, the random choices are done in the same order as
+        # when they were simulated one by one
+        self.scalingCache = {}
+        pkPrm = np.zeros((inputN,self.pkNParams))
+        tlag = np.zeros(inputN)
+        bioavailability = np.ones(inputN)
+        A = np.zeros((inputN,t.size))
+        fromSamples = []
         for i in range(0,inputN):
             print("Simulation no. %d ----------------------"%i)
 
@@ -356,17 +402,15 @@ class ProtPKPDDissolutionPKSimulation(ProtPKPD):
                 pkPrmAll= sampleFitVivo.parameters[nbootstrap,:]
             else:
                 pkPrmAll = sampleFitVivo.parameters
-            pkPrm=pkPrmAll[-self.pkNParams:] # Get the last Nparams
-            print("PK parameters: ",pkPrm)
+            pkPrm[i,:]=pkPrmAll[-self.pkNParams:] # Get the last Nparams
+            print("PK parameters: ",pkPrm[i,:])
 
-            tlag=0
             if self.includeTlag.get() and (not self.tlagIdx is None):
-                tlag=pkPrmAll[self.tlagIdx]
-                print("tlag: ",tlag)
-            bioavailability=1
+                tlag[i]=pkPrmAll[self.tlagIdx]
+                print("tlag: ",tlag[i])
             if not self.bioavailabilityIdx is None:
-                bioavailability=pkPrmAll[self.bioavailabilityIdx]
-                print("bioavailability: ",bioavailability)
+                bioavailability[i]=pkPrmAll[self.bioavailabilityIdx]
+                print("bioavailability: ",bioavailability[i])
 
             # Get a dissolution profile
             if self.allCombinations:
@@ -390,38 +434,35 @@ class ProtPKPDDissolutionPKSimulation(ProtPKPD):
                 raise Exception("Cannot find %s in the scaling keys"%sampleFitVivo.sampleName)
             nfit = int(random.uniform(0, len(self.allTimeScalings[keyToUse])))
 
-            tvitroLevy, tvivoLevy = self.allTimeScalings[keyToUse][nfit]
-            tvivoLevyUnique, tvitroLevyUnique = uniqueFloatValues(tvivoLevy, tvitroLevy)
-            BLevy = InterpolatedUnivariateSpline(tvivoLevyUnique, tvitroLevyUnique, k=1)
-
-            tvitro = np.asarray(BLevy(t), dtype=np.float64)
-            A = np.clip(self.dissolutionModel.forwardModel(dissolutionPrm, tvitro)[0],0,100)
-
-            if self.conversionType.get()==0:
+            tvitro, responseTable = self.getTimeScaling(t, keyToUse, nfit)
+            Ai = np.clip(self.dissolutionModel.forwardModel(dissolutionPrm, tvitro)[0],0,100)
+            if responseTable is not None:
                 # In vitro-in vivo correlation
-                Adissol, Fabs = self.allResponseScalings[keyToUse][nfit]
-                AdissolUnique, FabsUnique = uniqueFloatValues(Adissol, Fabs)
-                B=InterpolatedUnivariateSpline(AdissolUnique, FabsUnique,k=1)
-                A=np.asarray(B(A),dtype=np.float64)
-
-            # Set the dissolution profile
-            self.pkModel.drugSource.getVia().viaProfile.setXYValues(t,A)
-            C=self.pkModel.forwardModel(pkPrm,[t])[0] # forwardModel returns a list of arrays
-            if tlag!=0.0:
-                B=interp1d(t,C)
-                C=B(np.clip(t-tlag,0.0,None))
-                C[0:int(tlag)]=0.0
-            C*=bioavailability
-
-            self.NCA(t,C)
-            AUCarray[i] = self.AUC0t
-            AUMCarray[i] = self.AUMC0t
-            MRTarray[i] = self.MRT
-            CmaxArray[i] = self.Cmax
-            TmaxArray[i] = self.Tmax
-
+                Ai = interpLinear(Ai, responseTable[0], responseTable[1])
+            A[i,:] = Ai
+            fromSamples.append("%s---%s"%(sampleFitVivo.sampleName,sampleFitVitro.sampleName))
+
+        # Simulate the PK responses
+        self.batchPK = None
+        self.batchSize = 256
+        C = self.simulatePK(t, A, pkPrm)
+        for i in np.where(tlag!=0.0)[0]:
+            Ci = np.interp(np.clip(t-tlag[i],0.0,None),t,C[i,:])
+            Ci[0:int(tlag[i])]=0.0
+            C[i,:] = Ci
+        C *= bioavailability[:,np.newaxis]
+
+        self.NCA(t,C)
+        AUCarray = self.AUC0t
+        AUMCarray = self.AUMC0t
+        MRTarray = self.MRT
+        CmaxArray = self.Cmax
+        TmaxArray = self.Tmax
+        for i in range(0,inputN):
+            print("Simulation no. %d (%s)"%(i,fromSamples[i]))
+            self.printNCA(i)
             if self.addIndividuals:
-                self.addSample("Simulation_%d"%i, t, C, "%s---%s"%(sampleFitVivo.sampleName,sampleFitVitro.sampleName))
+                self.addSample("Simulation_%d"%i, t, C[i,:], fromSamples[i], i)
 
         # Report NCA statistics
         alpha_2 = (100-95)/2
@@ -32,11 +32,11 @@ except ImportError:
 from math import sqrt
 import numpy as np
 import sys
-from scipy.interpolate import InterpolatedUnivariateSpline
 
 import pyworkflow.protocol.params as params
 from pkpd.objects import PKPDExperiment, PKPDSample, PKPDVariable
-from pkpd.utils import uniqueFloatValues, computeXYmean, smoothPchip
+from pkpd.utils import (uniqueFloatRows, interpLinearRows, stackProfiles, factorialGrid, factorialGridSize,
+                        computeXYmean, smoothPchip)
 from pkpd.pkpd_units import createUnit, PKPDUnit
 from .protocol_pkpd import ProtPKPD
 
@@ -48,6 +48,8 @@ class ProtPKPDDissolutionTarget(ProtPKPD):
 
     _label = 'dissol target'
 
+    SCALING_PARAMETERS = ['t0', 'k', 'alpha', 'A', 'B']
+
     #--------------------------- DEFINE param functions --------------------------------------------
     def _defineParams(self, form):
         form.addSection('Input')
@@ -55,14 +57,21 @@ class ProtPKPDDissolutionTarget(ProtPKPD):
                       pointerClass='ProtPKPDDeconvolve,ProtPKPDDeconvolutionWagnerNelson,ProtPKPDDeconvolutionLooRiegelman, PKPDExperiment',
                       help='Select an experiment with dissolution profiles')
         ts = form.addGroup("Time scaling (Delayed power scale (Fabs(t)=Adissol(k*(t-t0)^alpha))")
-        ts.addParam('t0',params.FloatParam,label='t0',default=0,
-                    help='Make sure it is in the same time units as the inputs')
-        ts.addParam('k',params.FloatParam,label='k',default=1)
-        ts.addParam('alpha',params.FloatParam,label='alpha',default=1)
+        ts.addParam('t0',params.StringParam,label='t0',default="0",
+                    help='Make sure it is in the same time units as the inputs. Several values can be given separated '
+                         'by space, e.g., 0 5 10')
+        ts.addParam('k',params.StringParam,label='k',default="1",
+                    help='Several values can be given separated by space, e.g., 0.9 1 1.1')
+        ts.addParam('alpha',params.StringParam,label='alpha',default="1",
+                    help='Several values can be given separated by space, e.g., 0.9 1 1.1')
 
         rs = form.addGroup("Response scaling (Affine transformation (Fabs(t)=A*Adissol(t)+B))")
-        rs.addParam('A',params.FloatParam,label='A',default=1)
-        rs.addParam('B',params.FloatParam,label='B',default=0)
+        rs.addParam('A',params.StringParam,label='A',default="1",
+                    help='Several values can be given separated by space, e.g., 0.9 1 1.1')
+        rs.addParam('B',params.StringParam,label='B',default="0",
+                    help='Several values can be given separated by space, e.g., -5 0 5. If several values are given '
+                         'for any of the scaling parameters, a target is calculated for each in vivo profile and each '
+                         'combination of values, and the values are stored as labels of the target')
         rs.addParam('saturate', params.BooleanParam, label='Saturate at 100%', default=True,
                     help='Saturate the calculated Adissol at 100%')
 
@@ -90,14 +99,18 @@ class ProtPKPDDissolutionTarget(ProtPKPD):
         self.experimentInVivo = experiment
         return allY, sampleNames
 
-    def addSample(self, sampleName):
+    def addSample(self, sampleName, tvitro, Adissol, scaling=None):
         newSampleAdissol = PKPDSample()
         newSampleAdissol.sampleName = sampleName
         newSampleAdissol.variableDictPtr = self.outputExperiment.variables
         newSampleAdissol.descriptors = {}
-        newSampleAdissol.addMeasurementColumn("tvitro", self.tvitroUnique)
-        newSampleAdissol.addMeasurementColumn("Adissol",self.AdissolUnique)
+        newSampleAdissol.addMeasurementColumn("tvitro", tvitro)
+        newSampleAdissol.addMeasurementColumn("Adissol",Adissol)
         self.outputExperiment.samples[sampleName] = newSampleAdissol
+        if scaling is not None:
+            for varName, value in izip(self.SCALING_PARAMETERS, scaling):
+                self.outputExperiment.addParameterToSample(sampleName, varName, PKPDUnit.UNIT_NONE,
+                                                           "Target scaling parameter", value)
 
     def produceAdissol(self,parameterInVitro,tmax):
         deltaT=np.min([(tmax+1)/1000,1.0])
@@ -133,33 +146,76 @@ class ProtPKPDDissolutionTarget(ProtPKPD):
         self.outputExperiment.general["title"] = "In-vitro target simulation"
         self.outputExperiment.general["comment"] = ""
 
+    def parseList(self, strList):
+        return [float(v) for v in strList.replace(',',' ').split()]
+
+    blockElements = 4*1024*1024 # Target points computed at once
+
+    def getScalingValues(self):
+        """ Values of t0, k, alpha, A and B, all their combinations are evaluated """
+        return [self.parseList(getattr(self,prm).get()) for prm in self.SCALING_PARAMETERS]
+
+    def interpolateInVivo(self, profilesInVivo):
+        """ In vivo profiles (tvivo, Fabs), sorted and interpolated to a grid of at most 1000 points (1 time unit at
+            most). They are returned as matrices with one row per profile, padded with nan """
+        tvivo, Fabs, mask = stackProfiles([t for t, _ in profilesInVivo], [y for _, y in profilesInVivo])
+        FabsUnique, tvivoUnique, valid = uniqueFloatRows(np.where(mask,Fabs,np.nan), tvivo)
+        tvivoUnique = np.where(valid,tvivoUnique,np.inf)
+        order = np.argsort(tvivoUnique,axis=1,kind="stable")
+        tvivoUnique = np.take_along_axis(tvivoUnique,order,axis=1)
+        FabsUnique = np.take_along_axis(FabsUnique,order,axis=1)
+        valid = np.take_along_axis(valid,order,axis=1)
+
+        tmax = np.max(np.where(valid,tvivoUnique,-np.inf),axis=1)
+        deltaT = np.minimum((tmax+1)/1000,1.0)
+        Nt = np.ceil((tmax+1)/deltaT).astype(int)
+        j = np.arange(np.max(Nt))
+        tvivop = np.where(j<Nt[:,np.newaxis], j*deltaT[:,np.newaxis], np.nan)
+        return tvivop, interpLinearRows(tvivop, tvivoUnique, FabsUnique, valid)
+
+    def computeTargets(self, tvivop, Fabsp, grid):
+        """ Target in vitro profiles of the interpolated in vivo profiles (see interpolateInVivo) for the combinations
+            of the scaling parameters in grid (t0, k, alpha, A, B columns). They are returned as matrices with one row
+            per target (all in vivo profiles for the first combination, then for the second, ...), sorted by Adissol,
+            and a mask of the valid entries of each row """
+        t0, k, alpha, A, B = [np.reshape(column,(-1,1,1)) for column in grid]
+        with np.errstate(invalid="ignore"):
+            tvitro = k*np.power(tvivop-t0,alpha)
+        Adissol = np.clip((Fabsp-B)/A,0,None)
+        if self.saturate:
+            Adissol = np.clip(Adissol,None,100.0)
+        tvitro, Adissol = [np.broadcast_to(x,np.broadcast(tvitro,Adissol).shape).reshape(-1,tvivop.shape[1])
+                           for x in (tvitro, Adissol)]
+        AdissolUnique, tvitroUnique, valid = uniqueFloatRows(Adissol, tvitro)
+        return tvitroUnique, AdissolUnique, valid
+
     def calculateTarget(self, objId1):
         self.profilesInVivo, self.sampleNames=self.getInVivoProfiles()
 
         self.createOutputExperiment()
 
-        # Compute all pairs
-        for profileInVivo, sampleName in izip(self.profilesInVivo,self.sampleNames):
-            tvivo=profileInVivo[0]
-            Fabs=profileInVivo[1]
-            FabsUnique, tvivoUnique = uniqueFloatValues(Fabs, tvivo)
-            BFabs = InterpolatedUnivariateSpline(tvivoUnique, FabsUnique, k=1)
-
-            tmax = np.max(tvivoUnique)
-            deltaT = np.min([(tmax + 1) / 1000, 1.0])
-            tvivop = np.arange(0, tmax + 1, deltaT)
-            Fabsp = BFabs(tvivop)
-
-            tvitro = self.k.get()*np.power(tvivop-self.t0.get(),self.alpha.get())
-            Adissol = np.clip((Fabsp-self.B.get())/self.A.get(),0,None)
-            if self.saturate:
-                Adissol = np.clip(Adissol,None,100.0)
-
-            self.AdissolUnique, self.tvitroUnique = uniqueFloatValues(Adissol, tvitro)
-
-            self.addSample("target_%s" % sampleName)
+        # Compute all pairs. The combinations are evaluated in blocks, so that the memory used does not grow with
+        # the size of the grid
+        tvivop, Fabsp = self.interpolateInVivo(self.profilesInVivo)
+        valueLists = self.getScalingValues()
+        Nsamples = len(self.sampleNames)
+        Ncombinations = factorialGridSize(valueLists)
+        blockSize = max(1, self.blockElements//tvivop.size)
+        for n0 in range(0, Ncombinations, blockSize):
+            n1 = min(n0+blockSize, Ncombinations)
+            grid = factorialGrid(valueLists, n0, n1)
+            tvitro, Adissol, valid = self.computeTargets(tvivop, Fabsp, grid)
+            for n in range(n0, n1):
+                for i, sampleName in enumerate(self.sampleNames):
+                    row = (n-n0)*Nsamples+i
+                    if Ncombinations==1:
+                        self.addSample("target_%s" % sampleName, tvitro[row,valid[row]], Adissol[row,valid[row]])
+                    else:
+                        self.addSample("target_%s_%04d" % (sampleName, n), tvitro[row,valid[row]],
+                                       Adissol[row,valid[row]], [column[n-n0] for column in grid])
 
         self.outputExperiment.write(self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputExperiment=self.outputExperiment)
@@ -31,7 +31,7 @@ import pyworkflow.protocol.params as params
 from .protocol_pkpd import ProtPKPD
 from pkpd.objects import PKPDExperiment, PKPDSample, PKPDVariable
 from pkpd.pkpd_units import createUnit
-from pkpd.utils import uniqueFloatValues, calculateAUC0t, smoothPchip
+from pkpd.utils import uniqueFloatValues, stackProfiles, calculateWagnerNelson, smoothPchip
 
 # tested in test_workflow_levyplot.py
 # tested in test_workflow_ivivc.py
@@ -149,6 +149,11 @@ class ProtPKPDDeconvolutionWagnerNelson(ProtPKPD):
                 break
 
         timeRange = self.experiment.getRange(self.timeVar.get())
+        sampleNames = []
+        tList = []
+        CpList = []
+        Cl = []
+        V = []
         for sampleName, sample in self.experiment.samples.items():
             # Get t, Cp
             t=np.asarray(sample.getValues(self.timeVar.get()),dtype=np.float64)
@@ -161,18 +166,26 @@ class ProtPKPDDeconvolutionWagnerNelson(ProtPKPD):
                 B = InterpolatedUnivariateSpline(t, Cp, k=1)
                 t = np.arange(np.min(t),np.max(t)+self.resampleT.get(),self.resampleT.get())
                 Cp = B(t)
+            sampleNames.append(sampleName)
+            tList.append(t)
+            CpList.append(Cp)
 
-            # Calculate AUC0t
-            AUC0t=calculateAUC0t(t,Cp)
-
-            # Deconvolve
             if self.externalIV.get()==self.SAME_INPUT:
                 sampleFrom = sample
-            Cl=float(sampleFrom.descriptors['Cl'])
-            V=float(sampleFrom.descriptors['V'])
-            Ke=Cl/V
-            AUC0inf = float(AUC0t[-1])+self.estimateAUCrightTail(t,Cp, Cl, V)
-            A = (Cp + Ke * AUC0t) / Ke
+            Cl.append(float(sampleFrom.descriptors['Cl']))
+            V.append(float(sampleFrom.descriptors['V']))
+
+        if len(sampleNames)>0:
+            # Deconvolve all profiles at once
+            t, Cp, _ = stackProfiles(tList, CpList)
+            allA, allAUC0t = calculateWagnerNelson(t, Cp, np.asarray(Cl)/np.asarray(V))
+
+        for i, sampleName in enumerate(sampleNames):
+            sample = self.experiment.samples[sampleName]
+            t = tList[i]
+            Cp = CpList[i]
+            A = allA[i,:t.size]
+            AUC0inf = float(allAUC0t[i,t.size-1])+self.estimateAUCrightTail(t,Cp, Cl[i], V[i])
             if self.normalize.get():
                 A *= 100/AUC0inf
                 if self.saturate.get():
@@ -195,6 +208,7 @@ class ProtPKPDDeconvolutionWagnerNelson(ProtPKPD):
             self.addSample(sampleName,t,A)
 
         self.outputExperiment.write(self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputExperiment=self.outputExperiment)
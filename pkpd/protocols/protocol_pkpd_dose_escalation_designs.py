@@ -0,0 +1,133 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (info@kinestat.com)
+# *
+# * Kinestat Pharma
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'info@kinestat.com'
+# *
+# **************************************************************************
+
+import os
+
+import numpy as np
+
+import pyworkflow.protocol.params as params
+from .protocol_pkpd import ProtPKPD
+from .protocol_pkpd_simulate_dose_escalation import createDoseResponseModel
+from pkpd.dose_escalation import DOSE_ESCALATION_DESIGNS, simulateDoseEscalation, operatingCharacteristics
+from pyworkflow.protocol.constants import LEVEL_ADVANCED
+
+
+class ProtPKPDDoseEscalationDesigns(ProtPKPD):
+    """ Operating characteristics of the dose escalation designs (3+3, best of 5, up and down, Storer's C and
+        Storer's BC). Thousands of virtual trials are simulated with a true dose-toxicity curve and for each design
+        the protocol reports the probability of selecting each dose as MTD, the expected sample size and the
+        overdosing rates.\n
+        Protocol created by http://www.kinestatpharma.com\n"""
+    _label = 'dose escalation designs'
+
+    #--------------------------- DEFINE param functions --------------------------------------------
+
+    def _defineParams(self, form, fullForm=True):
+        form.addSection('Input')
+        form.addParam('doses', params.StringParam, label="Doses", default="",
+                      help='Doses of the escalation in increasing order. Example: 1, 2, 3.3, 5, 7')
+        form.addParam('modelType', params.EnumParam, choices=["OQuigley0","OQuigley1", "OQuigley2", "Sigmoid", "Gompertz", "Logistic", "Richards"],
+                      label="True toxicity model", default=0,
+                      help='Probability of dose limiting toxicity (DLT) as a function of the dose\n'\
+                           'OQuigley0: Y=((tanh(X)+1)/2)^a. Order: a\n'\
+                           'OQuigley1: Y=((tanh(X-X0)+1)/2)^a. Order: X0;a\n'\
+                           'OQuigley2: Y=exp(g*(X-X0))/(1+exp(g*(X-X0)). Order: X0;g\n'\
+                           'Sigmoid: Y=((X**h)/((X50**h)+(X**h))). Order X50;h\n'\
+                           'Gompertz: Y=exp(-exp(g*(X-X0))). Order: X0;g\n'\
+                           'Logistic: Y=1/(1+exp(g*(X-X0))). Order: X0;g\n'\
+                           'Richards: Y=1/((1+exp(g*(X-X0)))^(1/d)). Order: X0;g;d\n')
+        form.addParam('paramValues', params.StringParam, label="Parameter values", default="",
+                      help='Parameter values of the true toxicity model.\nExample: 3.5;-1 is 3.5 for the first parameter, -1 for the second parameter')
+        form.addParam('doLog', params.BooleanParam, label="Take log10 in the dose", default=False,
+                      help='In the formulas, X is substituted by log10(X)')
+        form.addParam('targetToxicity', params.FloatParam, label="Target toxicity", default=0.33,
+                      help='The true MTD is the highest dose whose probability of DLT is not larger than this value')
+        form.addParam('Npatients', params.IntParam, label="Number of patients", default=24,
+                      help='Total number of patients of the up and down and Storer designs. The 3+3 and best of 5 designs '
+                           'stop by themselves')
+        form.addParam('Ntrials', params.IntParam, label="Number of simulated trials", default=10000,
+                      expertLevel=LEVEL_ADVANCED)
+
+    #--------------------------- INSERT steps functions --------------------------------------------
+    def _insertAllSteps(self):
+        self._insertFunctionStep('runSimulate')
+
+    #--------------------------- STEPS functions --------------------------------------------
+    def getDoses(self):
+        return np.asarray([float(token) for token in self.doses.get().replace(',', ' ').split()])
+
+    def runSimulate(self):
+        doses = self.getDoses()
+        model = createDoseResponseModel(self.modelType.get(), self.paramValues.get())
+        X = np.log10(np.clip(doses, 0.0, None)) if self.doLog else doses
+        ptox = np.clip(model.forwardModel(model.parameters, [X])[0], 0.0, 1.0)
+        targetToxicity = self.targetToxicity.get()
+
+        fh = open(self._getPath("summary.txt"), "w")
+        self.doublePrint(fh, "True toxicity model: %s" % model.getEquation())
+        for dose, p in zip(doses, ptox):
+            self.doublePrint(fh, "Dose=%f Prob(DLT)=%f" % (dose, p))
+        for design in DOSE_ESCALATION_DESIGNS:
+            trials = simulateDoseEscalation(design, ptox, self.Ntrials.get(), self.Npatients.get())
+            oc = operatingCharacteristics(trials, ptox, targetToxicity)
+            self.doublePrint(fh, " ")
+            self.doublePrint(fh, "%s design ==============================================================" % design)
+            self.doublePrint(fh, "Probability of stopping below the first dose: %f" % oc['selection'][0])
+            for i, dose in enumerate(doses):
+                self.doublePrint(fh, "Dose=%f Prob(selected as MTD)=%f Patients=%f DLTs=%f%s" %
+                                 (dose, oc['selection'][i+1], oc['patientsPerDose'][i], oc['dltsPerDose'][i],
+                                  " (true MTD)" if i==oc['trueMTD'] else ""))
+            self.doublePrint(fh, "Probability of selecting the true MTD: %f" % oc['correctSelection'])
+            self.doublePrint(fh, "Probability of selecting a dose above the target toxicity: %f" %
+                             oc['overdoseSelection'])
+            self.doublePrint(fh, "Expected sample size: %f (std: %f)" % (oc['sampleSize'], oc['sampleSizeStd']))
+            self.doublePrint(fh, "Expected number of DLTs: %f" % oc['dlts'])
+            self.doublePrint(fh, "Fraction of patients treated above the target toxicity: %f" % oc['overdosedFraction'])
+            self.doublePrint(fh, "Fraction of trials treating patients above the target toxicity: %f" %
+                             oc['overdosedTrials'])
+        fh.close()
+
+    #--------------------------- INFO functions --------------------------------------------
+    def _validate(self):
+        retval = []
+        try:
+            doses = self.getDoses()
+            if doses.size==0 or np.any(np.diff(doses)<=0):
+                retval.append("The doses must be given in increasing order")
+        except ValueError:
+            retval.append("Cannot convert the doses %s to float" % self.doses.get())
+        if self.targetToxicity.get()<=0 or self.targetToxicity.get()>=1:
+            retval.append("The target toxicity must be between 0 and 1")
+        return retval
+
+    def _summary(self):
+        msg = []
+        fnSummary = self._getPath("summary.txt")
+        if os.path.exists(fnSummary):
+            fh = open(fnSummary, "r")
+            msg = [x.strip() for x in fh.readlines()]
+            fh.close()
+        return msg
@@ -84,6 +84,7 @@ class ProtPKPDDropMeasurements(ProtPKPD):
             filteredExperiment.samples[candidateSample.varName] = candidateSample
 
         self.writeExperiment(filteredExperiment,self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
         self.experiment = filteredExperiment
 
     def createOutputStep(self):
@@ -84,6 +84,7 @@ class ProtPKPDNCAEstimateBioavailability(ProtPKPD):
                 self.experimentEV.addParameterToSample(sampleEV.sampleName,"bioavailability",PKPDUnit.UNIT_NONE,
                                                        "bioavailability","NA")
         self.experimentEV.write(self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
         fhSummary=open(self._getPath("summary.txt"),"w")
         if len(Flist)>0:
             Fmean = np.mean(Flist)
@@ -24,9 +24,17 @@
 # *
 # **************************************************************************
 
+import copy
+import numpy as np
+try:
+    from itertools import izip
+except ImportError:
+    izip = zip
+
 import pyworkflow.protocol.params as params
 from .protocol_pkpd import ProtPKPD
-from pkpd.objects import PKPDExperiment, PKPDSample, PKPDVariable
+from pkpd.expressions import compileExpression, toColumn, toMask
+from pkpd.objects import PKPDExperiment, PKPDSample
 
 # TESTED in test_workflow_gabrielsson_pk02.py
 # TESTED in test_workflow_gabrielsson_pk04.py
@@ -63,7 +71,6 @@ class ProtPKPDFilterMeasurements(ProtPKPD):
 
     #--------------------------- STEPS functions --------------------------------------------
     def runFilter(self, objId, filterType, condition):
-        import copy
         experiment = self.readExperiment(self.inputExperiment.get().fnPKPD)
 
         self.printSection("Filtering")
@@ -87,8 +94,30 @@ class ProtPKPDFilterMeasurements(ProtPKPD):
         filteredExperiment.doses = {}
         filteredExperiment.vias = {}
 
+        samples = [sample for sample in experiment.samples.values()
+                   if len(sample.measurementPattern)>0 and sample.getNumberOfMeasurements()>0]
+
+        if filterType=="exclude" or filterType=="keep":
+            # The condition is evaluated at once on the measurements of all samples
+            compiledCondition = compileExpression(condition)
+            offsets = np.cumsum([0]+[sample.getNumberOfMeasurements() for sample in samples])
+            columns = {}
+            valid = np.ones(offsets[-1], dtype=bool)
+            for varName in compiledCondition.varList:
+                values = []
+                for sample in samples:
+                    if not varName in sample.measurementPattern:
+                        raise Exception("Cannot find %s in the measurements of %s"%(varName,sample.sampleName))
+                    values += sample.getValues(varName)
+                columns[varName], validVar = toColumn(values, experiment.variables[varName].isNumeric())
+                valid = np.logical_and(valid, validVar)
+            conditionMask = toMask(compiledCondition.evaluate(columns, offsets[-1]))
+            if filterType=="exclude":
+                conditionMask = np.logical_not(conditionMask)
+            conditionMask = np.logical_and(conditionMask, valid) # Missing values are always removed
+
         usedDoses = []
-        for sampleKey, sample in experiment.samples.items():
+        for k, sample in enumerate(samples):
             candidateSample = PKPDSample()
             candidateSample.variableDictPtr    = copy.copy(sample.variableDictPtr)
             candidateSample.doseDictPtr        = copy.copy(sample.doseDictPtr)
@@ -97,76 +126,31 @@ class ProtPKPDFilterMeasurements(ProtPKPD):
             candidateSample.descriptors        = copy.copy(sample.descriptors)
             candidateSample.measurementPattern = copy.copy(sample.measurementPattern)
 
-            N = 0 # Number of initial measurements
-            if len(sample.measurementPattern)>0:
-                aux=getattr(sample,"measurement_%s"%sample.measurementPattern[0])
-                N = len(aux)
-            if N==0:
-                continue
-
-            # Create empty output variables
-            Nvar = len(sample.measurementPattern)
-            convertToFloat = []
-            for i in range(0,Nvar):
-                exec("candidateSample.measurement_%s = []"%sample.measurementPattern[i])
-                convertToFloat.append(sample.variableDictPtr[sample.measurementPattern[i]].varType == PKPDVariable.TYPE_NUMERIC)
-
-            for n in range(0,N):
-                toAdd = []
-                okToAddTimePoint = True
-                conditionPython = copy.copy(condition)
-                for i in range(0,Nvar):
-                    ldict = {}
-                    exec("aux=sample.measurement_%s[%d]"%(sample.measurementPattern[i],n),locals(),ldict)
-                    aux = ldict['aux']
+            columns = [sample.getValues(varName) for varName in sample.measurementPattern]
+            if filterType=="exclude" or filterType=="keep":
+                sampleMask = conditionMask[offsets[k]:offsets[k+1]]
+                rows = [row for row, ok in izip(izip(*columns), sampleMask) if ok]
+            else:
+                rows = []
+                for row in izip(*columns):
                     if filterType=="rmNA":
-                        if aux=="NA" or aux=="None":
-                            okToAddTimePoint = False
-                        else:
-                            toAdd.append(aux)
+                        if "NA" in row or "None" in row:
+                            continue
                     elif filterType=="rmLL":
-                        if aux=="LLOQ" or aux=="ULOQ":
-                            okToAddTimePoint = False
-                        else:
-                            toAdd.append(aux)
+                        if "LLOQ" in row or "ULOQ" in row:
+                            continue
                     elif filterType=="subsLL":
-                        okToAddTimePoint = True
-                        if aux=="LLOQ":
-                            toAdd.append(str(self.substitute.get()))
-                        else:
-                            toAdd.append(aux)
+                        row = [str(self.substitute.get()) if value=="LLOQ" else value for value in row]
                     elif filterType=="subsUL":
-                        okToAddTimePoint = True
-                        if aux=="ULOQ":
-                            toAdd.append(str(self.substitute.get()))
-                        else:
-                            toAdd.append(aux)
-                    else:
-                        # Keep or exclude
-                        toAdd.append(aux)
-                        varString = "$(%s)"%sample.measurementPattern[i]
-                        if varString in conditionPython:
-                            if aux=="NA":
-                                okToAddTimePoint = False
-                            else:
-                                if convertToFloat[i]:
-                                    conditionPython = conditionPython.replace(varString,"%f"%float(aux))
-                                else:
-                                    conditionPython = conditionPython.replace(varString,"'%s'"%aux)
-                if (filterType=="exclude" or filterType=="keep") and okToAddTimePoint:
-                    okToAddTimePoint = eval(conditionPython, {"__builtins__" : None }, {})
-                    if filterType=="exclude":
-                        okToAddTimePoint = not okToAddTimePoint
-                if okToAddTimePoint:
-                    for i in range(0,Nvar):
-                        exec("candidateSample.measurement_%s.append('%s')"%(sample.measurementPattern[i],toAdd[i]))
-
-            N = len(getattr(sample,"measurement_%s"%sample.measurementPattern[0])) # Number of final measurements
-            if N!=0:
-                filteredExperiment.samples[candidateSample.sampleName] = candidateSample
-                for doseName in candidateSample.doseList:
-                    if not doseName in usedDoses:
-                        usedDoses.append(doseName)
+                        row = [str(self.substitute.get()) if value=="ULOQ" else value for value in row]
+                    rows.append(row)
+            for i, varName in enumerate(sample.measurementPattern):
+                candidateSample.setValues(varName, [row[i] for row in rows])
+
+            filteredExperiment.samples[candidateSample.sampleName] = candidateSample
+            for doseName in candidateSample.doseList:
+                if not doseName in usedDoses:
+                    usedDoses.append(doseName)
 
         if len(usedDoses)>0:
             for doseName in usedDoses:
@@ -176,6 +160,7 @@ class ProtPKPDFilterMeasurements(ProtPKPD):
                     filteredExperiment.vias[viaName] = copy.copy(experiment.vias[viaName])
 
         self.writeExperiment(filteredExperiment,self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
         self.experiment = filteredExperiment
 
     def createOutputStep(self):
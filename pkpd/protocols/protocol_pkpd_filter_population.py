@@ -26,9 +26,9 @@
 
 import pyworkflow.protocol.params as params
 from .protocol_pkpd import ProtPKPD
-from pkpd.objects import PKPDFitting, PKPDSampleFitBootstrap
+from pkpd.expressions import compileExpression, toMask
+from pkpd.objects import PKPDFitting, concatenateBootstrapFits
 import numpy as np
-import copy
 
 # TESTED in test_workflow_gabrielsson_pk02.py
 
@@ -52,6 +52,7 @@ class ProtPKPDFilterPopulation(ProtPKPD):
                            'The variables R2, R2adj, AIC, AICc, and BIC can be used, \n'\
                            'e.g., $(AICc)>-10 selects those elements with suspicious fitting.\n'\
                            'Confidence intervals cannot be placed on the quality parameters (R2, R2adj, ...)')
+        self._defineExcelParams(form)
 
     #--------------------------- INSERT steps functions --------------------------------------------
     def _insertAllSteps(self):
@@ -71,63 +72,38 @@ class ProtPKPDFilterPopulation(ProtPKPD):
         self.fitting.modelParameters = self.population.modelParameters
         self.fitting.modelDescription = self.population.modelDescription
 
-        newSampleFit = PKPDSampleFitBootstrap()
-        newSampleFit.parameters = None
         filterType = self.filterType.get()
+        if filterType<=1:
+            # The condition is evaluated at once on all the replicates
+            compiledCondition = compileExpression(self.condition.get())
+        else:
+            tokens=self.condition.get().strip().split(' ')
+            variable = tokens[0][2:-1]
+            confidenceLevel = float(tokens[1])
+            if not variable in self.population.modelParameters:
+                raise Exception("Cannot find %s amongst the model variables"%variable)
+            columnIdx = self.population.modelParameters.index(variable)
+
+        selectedFits = []
         for sampleFit in self.population.sampleFits:
-            newSampleFit.sampleName = sampleFit.sampleName
-            if newSampleFit.parameters == None:
-                newSampleFit.parameters = np.empty((0,sampleFit.parameters.shape[1]))
-                newSampleFit.xB = []
-                newSampleFit.yB = []
-                newSampleFit.R2 = []
-                newSampleFit.R2adj = []
-                newSampleFit.AIC = []
-                newSampleFit.AICc = []
-                newSampleFit.BIC = []
-
             if filterType<=1:
-                conditionToEvaluate = self.condition.get()
+                columns = sampleFit.getColumns(self.population.modelParameters)
+                conditionMask = toMask(compiledCondition.evaluate(columns, sampleFit.parameters.shape[0]))
+                if filterType==0:
+                    conditionMask = np.logical_not(conditionMask)
             else:
-                tokens=self.condition.get().strip().split(' ')
-                variable = tokens[0][2:-1]
-                confidenceLevel = float(tokens[1])
-                columnIdx = -1
-                for j in range(len(self.population.modelParameters)):
-                    if self.population.modelParameters[j]==variable:
-                        columnIdx = j
-                        break
-                if columnIdx==-1:
-                    raise Exception("Cannot find %s amongst the model variables"%variable)
                 values=sampleFit.parameters[:,columnIdx]
                 alpha_2 = (100-confidenceLevel)/2
                 limits = np.percentile(values,[alpha_2,100-alpha_2])
-                conditionToEvaluate = "%s>=%f and %s<=%f"%(tokens[0],limits[0],tokens[0],limits[1])
-                print("Condition to evaluate: %s"%conditionToEvaluate)
-
-            for n in range(0,len(sampleFit.R2)):
-                evaluatedCondition = copy.copy(conditionToEvaluate)
-                evaluatedCondition = evaluatedCondition.replace('$(R2)',"(%f)"%sampleFit.R2[n])
-                evaluatedCondition = evaluatedCondition.replace('$(R2adj)',"(%f)"%sampleFit.R2adj[n])
-                evaluatedCondition = evaluatedCondition.replace('$(AIC)',"(%f)"%sampleFit.AIC[n])
-                evaluatedCondition = evaluatedCondition.replace('$(AICc)',"(%f)"%sampleFit.AICc[n])
-                evaluatedCondition = evaluatedCondition.replace('$(BIC)',"(%f)"%sampleFit.BIC[n])
-
-                for j in range(len(self.population.modelParameters)):
-                    evaluatedCondition = evaluatedCondition.replace('$(%s)'%self.population.modelParameters[j],"(%f)"%sampleFit.parameters[n,j])
-                evaluatedCondition = eval(evaluatedCondition)
-                if (filterType==0 and not evaluatedCondition) or (filterType>=1 and evaluatedCondition):
-                    newSampleFit.parameters = np.vstack([newSampleFit.parameters, sampleFit.parameters[n,:]])
-                    newSampleFit.xB += sampleFit.xB
-                    newSampleFit.yB += sampleFit.yB
-                    newSampleFit.R2.append(sampleFit.R2[n])
-                    newSampleFit.R2adj.append(sampleFit.R2adj[n])
-                    newSampleFit.AIC.append(sampleFit.AIC[n])
-                    newSampleFit.AICc.append(sampleFit.AICc[n])
-                    newSampleFit.BIC.append(sampleFit.BIC[n])
+                print("Condition to evaluate: %s>=%f and %s<=%f"%(tokens[0],limits[0],tokens[0],limits[1]))
+                conditionMask = np.logical_and(values>=limits[0], values<=limits[1])
+            selectedFits.append(sampleFit.selectReplicates(conditionMask))
+            print("%s: %d out of %d replicates kept"%(sampleFit.sampleName, np.sum(conditionMask), len(conditionMask)))
 
+        newSampleFit = concatenateBootstrapFits(selectedFits, self.population.sampleFits[-1].sampleName)
         self.fitting.sampleFits.append(newSampleFit)
-        self.fitting.write(self._getPath("bootstrapPopulation.pkpd"))
+        self.fitting.write(self._getPath("bootstrapPopulation.pkpd"), writeToExcel=self._writeToExcel)
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputPopulation=self.fitting)
@@ -24,11 +24,15 @@
 # *
 # **************************************************************************
 
-import sys
+import numpy as np
+try:
+    from itertools import izip
+except ImportError:
+    izip = zip
 
 import pyworkflow.protocol.params as params
 from .protocol_pkpd import ProtPKPD
-from pkpd.objects import PKPDExperiment, PKPDVariable
+from pkpd.objects import PKPDExperiment
 
 class ProtPKPDFilterSamples(ProtPKPD):
     """ Filter samples.\n
@@ -78,37 +82,25 @@ class ProtPKPDFilterSamples(ProtPKPD):
         filteredExperiment.doses = {}
 
         # http://stackoverflow.com/questions/701802/how-do-i-execute-a-string-containing-python-code-in-python
-        safe_list = ['descriptors']
-        safe_dict = dict([ (k, locals().get(k, None)) for k in safe_list ])
-        usedDoses = []
-        for sampleKey, sample in experiment.samples.items():
-            ok = filterType=="rmNA"
+        sampleNames = list(experiment.samples.keys())
+        if filterType == "rmNA":
+            keep = np.ones(len(sampleNames), dtype=bool)
+            for i, sampleName in enumerate(sampleNames):
+                descriptors = experiment.samples[sampleName].descriptors or {}
+                keep[i] = not any(descriptors[key] in ["NA", "NS", ""] for key in experiment.variables if key in descriptors)
+        else:
+            # Samples whose labels in the condition are missing never meet the condition
             try:
-                if filterType == "rmNA":
-                    conditionPython = "True"
-                else:
-                    conditionPython = copy.copy(condition)
-                conditionPython = conditionPython.replace('$(sampleName)','"%s"'%sample.sampleName)
-                for key, variable in experiment.variables.items():
-                    if key in sample.descriptors:
-                        value = sample.descriptors[key]
-                        if value=="NA":
-                            conditionPython="False"
-                        elif value == "NS":
-                            conditionPython = "False"
-                        elif value == "":
-                            conditionPython = "False"
-                        else:
-                            if filterType!="rmNA":
-                                if variable.varType == PKPDVariable.TYPE_NUMERIC:
-                                    conditionPython = conditionPython.replace("$(%s)"%key,"%f"%float(sample.descriptors[key]))
-                                else:
-                                    conditionPython = conditionPython.replace("$(%s)"%key,"'%s'"%sample.descriptors[key])
-                ok=eval(conditionPython, {"__builtins__" : {"True": True, "False": False} }, {})
-            except:
-                print(sys.exc_info()[0])
-                pass
-            if (ok and (filterType=="keep" or filterType=="rmNA")) or (not ok and filterType=="exclude"):
+                ok = experiment.getSubGroupMask(condition, sampleNames)
+            except Exception as e:
+                print(e)
+                ok = np.zeros(len(sampleNames), dtype=bool)
+            keep = ok if filterType == "keep" else np.logical_not(ok)
+
+        usedDoses = []
+        for sampleKey, keepSample in izip(sampleNames, keep):
+            if keepSample:
+                sample = experiment.samples[sampleKey]
                 filteredExperiment.samples[sampleKey] = copy.copy(sample)
                 for doseName in sample.doseList:
                     usedDoses.append(doseName)
@@ -121,6 +113,7 @@ class ProtPKPDFilterSamples(ProtPKPD):
                 filteredExperiment.doses[doseName] = copy.copy(experiment.doses[doseName])
 
         self.writeExperiment(filteredExperiment,self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
         self.experiment = filteredExperiment
 
     def createOutputStep(self):
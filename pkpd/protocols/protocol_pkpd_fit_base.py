@@ -51,6 +51,7 @@ class ProtPKPDFitBase(ProtPKPD):
                       help='Y is predicted as an exponential function of X, Y=f(X)')
         form.addParam('predicted', params.StringParam, label="Predicted variable (Y)", default=defaultPredicted,
                       help='Y is predicted as an exponential function of X, Y=f(X)')
+        self._defineExcelParams(form)
 
     #--------------------------- INSERT steps functions --------------------------------------------
     def _insertAllSteps(self):
@@ -159,12 +160,47 @@ class ProtPKPDFitBase(ProtPKPD):
         pass
 
     def runFit(self, objId, otherDependencies):
-        self.getXYvars()
         if hasattr(self,"reportX"):
             reportX = parseRange(self.reportX.get())
         else:
             reportX = None
         self.experiment = self.readExperiment(self.getInputExperiment().fnPKPD)
+        cache = self.getResultCache()
+        self.fitExperiment(self.getInputExperiment().fnPKPD.get(), reportX,
+                           fnFitting=self._getPath("fitting.pkpd"), cache=cache)
+        cache.prune()
+
+        self.fitting.write(self._getPath("fitting.pkpd"), writeToExcel=self._writeToExcel)
+        self.experiment.write(self._getPath("experiment.pkpd"), writeToExcel=self._writeToExcel)
+        self.waitForExcelExports()
+
+        fnSummary = self._getPath("summary.txt")
+        fh=open(fnSummary,"w")
+        for line in self.getQualitySummary():
+            fh.write(line+"\n")
+        fh.close()
+
+        self.postAnalysis()
+
+    def getQualitySummary(self):
+        R2List = [sampleFit.R2 for sampleFit in self.fitting.sampleFits]
+        R2adjList = [sampleFit.R2adj for sampleFit in self.fitting.sampleFits]
+        AICList = [sampleFit.AIC for sampleFit in self.fitting.sampleFits]
+        AICcList = [sampleFit.AICc for sampleFit in self.fitting.sampleFits]
+        BICList = [sampleFit.BIC for sampleFit in self.fitting.sampleFits]
+        return ["R2    (Mean+-Std): (%f)+-(%f)"%(np.mean(R2List),np.std(R2List)),
+                "R2adj (Mean+-Std): (%f)+-(%f)"%(np.mean(R2adjList),np.std(R2adjList)),
+                "AIC   (Mean+-Std): (%f)+-(%f)"%(np.mean(AICList),np.std(AICList)),
+                "AICc  (Mean+-Std): (%f)+-(%f) Recommended"%(np.mean(AICcList),np.std(AICcList)),
+                "BIC   (Mean+-Std): (%f)+-(%f)"%(np.mean(BICList),np.std(BICList))]
+
+    def fitExperiment(self, fnExperiment="", reportX=None, fnFitting=None, cache=None):
+        """ Fit each sample of self.experiment. The fitted parameters are added to the samples of
+            self.experiment and the fitting is returned (also kept in self.fitting). No file is read or written
+            unless fnFitting is given, then each sample fit is streamed to it as soon as it is done.
+            If a PKPDResultCache is given, samples whose inputs have not changed since they were fitted are
+            not fitted again """
+        self.getXYvars()
 
         # Setup model
         self.printSection("Model setup")
@@ -177,7 +213,9 @@ class ProtPKPDFitBase(ProtPKPD):
 
         # Create output object
         self.fitting = PKPDFitting()
-        self.fitting.fnExperiment.set(self.getInputExperiment().fnPKPD.get())
+        if fnFitting is not None:
+            self.fitting.startStreaming(fnFitting)
+        self.fitting.fnExperiment.set(fnExperiment)
         self.fitting.predictor=self.experiment.variables[self.varNameX]
         self.fitting.predicted=self.experiment.variables[self.varNameY]
         self.fitting.modelDescription=self.model.getDescription()
@@ -192,11 +230,8 @@ class ProtPKPDFitBase(ProtPKPD):
         elif self.fitType.get()==2:
             fitType = "relative"
 
-        R2List=[]
-        R2adjList=[]
-        AICList=[]
-        AICcList=[]
-        BICList=[]
+        if cache is not None:
+            cacheDependencies = [self.getCacheDependencies(), self.model.__class__.__name__, fitType]
         self.prepareForAnalysis()
         for sampleName, sample in self.experiment.samples.items():
             self.printSection("Fitting "+sampleName)
@@ -215,32 +250,37 @@ class ProtPKPDFitBase(ProtPKPD):
                 continue
             print(" ")
 
-            optimizer1 = PKPDDEOptimizer(self.model,fitType)
-            optimizer1.optimize()
-            optimizer2 = PKPDLSOptimizer(self.model,fitType)
-            optimizer2.optimize()
-            optimizer2.setConfidenceInterval(self.confidenceInterval.get())
-            self.setParameters(optimizer2.optimum)
-            optimizer2.evaluateQuality()
-
-            # Keep this result
-            sampleFit = PKPDSampleFit()
-            sampleFit.sampleName = sample.sampleName
-            sampleFit.x = self.model.x
-            sampleFit.y = self.model.y
-            sampleFit.yp = self.model.yPredicted
-            sampleFit.yl = self.model.yPredictedLower
-            sampleFit.yu = self.model.yPredictedUpper
-            sampleFit.parameters = self.model.parameters
-            sampleFit.modelEquation = self.model.getEquation()
-            sampleFit.copyFromOptimizer(optimizer2)
-            self.fitting.sampleFits.append(sampleFit)
-
-            R2List.append(sampleFit.R2)
-            R2adjList.append(sampleFit.R2adj)
-            AICList.append(sampleFit.AIC)
-            AICcList.append(sampleFit.AICc)
-            BICList.append(sampleFit.BIC)
+            sampleFit = None
+            if cache is not None:
+                key = cache.getKey(cacheDependencies, self.getSampleCacheDependencies(sampleName),
+                                   self.model.bounds, x, y)
+                sampleFit = cache.get(key)
+            if sampleFit is None:
+                optimizer1 = PKPDDEOptimizer(self.model,fitType)
+                optimizer1.optimize()
+                optimizer2 = PKPDLSOptimizer(self.model,fitType)
+                optimizer2.optimize()
+                optimizer2.setConfidenceInterval(self.confidenceInterval.get())
+                self.setParameters(optimizer2.optimum)
+                optimizer2.evaluateQuality()
+
+                # Keep this result
+                sampleFit = PKPDSampleFit()
+                sampleFit.sampleName = sample.sampleName
+                sampleFit.x = self.model.x
+                sampleFit.y = self.model.y
+                sampleFit.yp = self.model.yPredicted
+                sampleFit.yl = self.model.yPredictedLower
+                sampleFit.yu = self.model.yPredictedUpper
+                sampleFit.parameters = self.model.parameters
+                sampleFit.modelEquation = self.model.getEquation()
+                sampleFit.copyFromOptimizer(optimizer2)
+                if cache is not None:
+                    cache.put(key, sampleFit)
+            else:
+                print("The inputs of %s have not changed, reusing its previous fit"%sampleName)
+                self.model.parameters = sampleFit.parameters
+            self.fitting.addSampleFit(sampleFit)
 
             # Add the parameters to the sample and experiment
             for varName, varUnits, description, varValue in izip(self.model.getParameterNames(), self.model.parameterUnits, self.model.getParameterDescriptions(), self.model.parameters):
@@ -258,19 +298,7 @@ class ProtPKPDFitBase(ProtPKPD):
                     print("%f %f %f"%(reportX[n],yreportX[n],math.log10(yreportX[n])))
                 print(' ')
 
-        self.fitting.write(self._getPath("fitting.pkpd"))
-        self.experiment.write(self._getPath("experiment.pkpd"))
-
-        fnSummary = self._getPath("summary.txt")
-        fh=open(fnSummary,"w")
-        fh.write("R2    (Mean+-Std): (%f)+-(%f)\n"%(np.mean(R2List),np.std(R2List)))
-        fh.write("R2adj (Mean+-Std): (%f)+-(%f)\n"%(np.mean(R2adjList),np.std(R2adjList)))
-        fh.write("AIC   (Mean+-Std): (%f)+-(%f)\n"%(np.mean(AICList),np.std(AICList)))
-        fh.write("AICc  (Mean+-Std): (%f)+-(%f) Recommended\n"%(np.mean(AICcList),np.std(AICcList)))
-        fh.write("BIC   (Mean+-Std): (%f)+-(%f)\n"%(np.mean(BICList),np.std(BICList)))
-        fh.close()
-
-        self.postAnalysis()
+        return self.fitting
 
     def createOutputStep(self):
         self._defineOutputs(outputFitting=self.fitting)
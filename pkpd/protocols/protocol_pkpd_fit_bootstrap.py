@@ -48,6 +48,7 @@ class ProtPKPDFitBootstrap(ProtPKPDFitBase):
                       help='Number of bootstrap realizations for each sample')
         form.addParam('confidenceInterval', params.FloatParam, label="Confidence interval", default=95, expertLevel=LEVEL_ADVANCED,
                       help='Confidence interval for the fitted parameters')
+        self._defineExcelParams(form)
 
     #--------------------------- INSERT steps functions --------------------------------------------
     def _insertAllSteps(self):
@@ -84,6 +85,7 @@ class ProtPKPDFitBootstrap(ProtPKPDFitBase):
 
         # Create output object
         self.fitting = PKPDFitting("PKPDSampleFitBootstrap")
+        self.fitting.startStreaming(self._getPath("bootstrapPopulation.pkpd"))
         self.fitting.fnExperiment.set(self.experiment.fnPKPD.get())
         self.fitting.predictor=self.experiment.variables[self.varNameX]
         self.fitting.predicted=self.experiment.variables[self.varNameY]
@@ -167,15 +169,16 @@ class ProtPKPDFitBootstrap(ProtPKPDFitBase):
 
                 # Keep this result
                 sampleFit.parameters[n,:] = optimizer2.optimum
-                sampleFit.xB.append(str(xB[0]))
-                sampleFit.yB.append(str(yB[0]))
+                sampleFit.xB.append(xB[0])
+                sampleFit.yB.append(yB[0])
                 sampleFit.copyFromOptimizer(optimizer2)
 
-            self.fitting.sampleFits.append(sampleFit)
+            self.fitting.addSampleFit(sampleFit)
 
         self.fitting.modelParameters = self.getParameterNames()
         self.fitting.modelDescription = self.model.getDescription()
-        self.fitting.write(self._getPath("bootstrapPopulation.pkpd"))
+        self.fitting.write(self._getPath("bootstrapPopulation.pkpd"), writeToExcel=self._writeToExcel)
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputPopulation=self.fitting)
@@ -56,6 +56,7 @@ class ProtPKPDGatherFitting(ProtPKPD):
         for ptrFitting in self.inputFittings:
             newFitting.gather(self.readFitting(ptrFitting.get().fnFitting), experiment)
         self.writeExperiment(newFitting, self._getPath("fitting.pkpd"))
+        self.waitForExcelExports()
         self._defineOutputs(outputFitting=newFitting)
         for ptrFitting in self.inputFittings:
             self._defineSourceRelation(ptrFitting, newFitting)
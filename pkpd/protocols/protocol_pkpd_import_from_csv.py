@@ -26,6 +26,11 @@
 
 import os
 import sys
+try:
+    from itertools import izip
+except ImportError:
+    izip = zip
+import numpy as np
 
 import pyworkflow.protocol.params as params
 from .protocol_pkpd import ProtPKPD, addDoseToForm
@@ -189,6 +194,7 @@ class ProtPKPDImportFromText(ProtPKPD):
                    self.experiment.samples[samplename].doseList.append(dosename)
 
             self.experiment.write(self._getPath("experiment.pkpd"))
+            self.waitForExcelExports()
             self.experiment._printToStream(sys.stdout)
             self._defineOutputs(outputExperiment=self.experiment)
 
@@ -227,69 +233,43 @@ class ProtPKPDImportFromCSV(ProtPKPDImportFromText):
                       label="Sample name")
 
     def readTextFile(self):
-        fh=open(self.inputFile.get())
-        lineNo = 1
-        for line in fh.readlines():
-            tokens = line.split(self.delimiter.get())
-            if len(tokens)==0:
-                continue
-            if lineNo==1:
-                listOfVariables=[]
-                listOfSkips=[]
-                if not self.noHeader:
-                    iSampleName=-1
-                    varNo=0
-                    for token in tokens:
-                        varName=token.strip()
-                        if varName=="SampleName":
-                            iSampleName=varNo
-                        listOfVariables.append(varName)
-                        listOfSkips.append(not (varName in self.experiment.variables))
-                        varNo+=1
-                    if iSampleName==-1:
-                        raise Exception("Cannot find the SampleName in: %s\n"%line)
+        if not self.noHeader:
+            listOfVariables, columns = readCSVColumns(self.inputFile.get(), self.delimiter.get())
+            if not "SampleName" in listOfVariables:
+                raise Exception("Cannot find the SampleName in: %s\n"%self.delimiter.get().join(listOfVariables))
+            sampleNames = columns[listOfVariables.index("SampleName")]
+        else:
+            listOfVariables = []
+            for line in self.variables.get().replace('\n', ';;').split(';;'):
+                tokens = line.split(';')
+                if len(tokens) != 5:
+                    print("Skipping variable: ", line)
+                    continue
+                listOfVariables.append(tokens[0].strip())
+            print("listOfVariables",listOfVariables)
+            _, columns = readCSVColumns(self.inputFile.get(), self.delimiter.get(), listOfVariables)
+            sampleNames = np.full(len(columns[0]) if columns else 0, self.sampleNameForm.get())
+
+        for sampleName, idx in groupBySample(sampleNames):
+            if not sampleName in self.experiment.samples:
+                self.addSample(sampleName,[sampleName])
+            samplePtr=self.experiment.samples[sampleName]
+            for varName, column in izip(listOfVariables, columns):
+                if not varName in self.experiment.variables:
+                    continue
+                varRole = self.experiment.variables[varName].role
+                values = column[idx]
+                if varRole == PKPDVariable.ROLE_LABEL:
+                    if samplePtr.descriptors is None:
+                        samplePtr.descriptors = {}
+                    samplePtr.descriptors[varName] = values[-1]
                 else:
-                    sampleName = self.sampleNameForm.get()
-                    for line in self.variables.get().replace('\n', ';;').split(';;'):
-                        tokens = line.split(';')
-                        if len(tokens) != 5:
-                            print("Skipping variable: ", line)
-                            ok = False
-                            continue
-                        varname = tokens[0].strip()
-                        listOfVariables.append(varname)
-                        listOfSkips.append(False)
-                    print("listOfVariables",listOfVariables)
-
-            else:
-                if len(tokens)!=len(listOfSkips):
-                    print("Skipping line: %s"%line)
-                    print("   It does not have the same number of values as the header")
-                varNo = 0
-                if not self.noHeader:
-                    sampleName = tokens[iSampleName].strip()
-                if not sampleName in self.experiment.samples:
-                    self.addSample(sampleName,[sampleName])
-                samplePtr=self.experiment.samples[sampleName]
-                for skip in listOfSkips:
-                    if not skip:
-                        varName = listOfVariables[varNo]
-                        varRole = self.experiment.variables[listOfVariables[varNo]].role
-                        if varRole == PKPDVariable.ROLE_LABEL:
-                            samplePtr.descriptors[listOfVariables[varNo]] = tokens[varNo]
-                        else:
-                            ok=True
-                            if tokens[varNo]=="NA":
-                                ok = (varRole != PKPDVariable.ROLE_TIME)
-                            if ok:
-                                if not hasattr(samplePtr,"measurement_%s"%varName):
-                                    setattr(samplePtr,"measurement_%s"%varName,[])
-                                    samplePtr.measurementPattern.append(varName)
-                                exec("samplePtr.measurement_%s.append('%s')"%(varName,tokens[varNo].strip()))
-                            else:
-                                raise Exception("Time measurements cannot be NA")
-                    varNo+=1
-            lineNo+=1
+                    if varRole == PKPDVariable.ROLE_TIME and np.any(values=="NA"):
+                        raise Exception("Time measurements cannot be NA")
+                    if not varName in samplePtr.measurementPattern:
+                        samplePtr.measurementPattern.append(varName)
+                        samplePtr.setValues(varName, [])
+                    samplePtr.getValues(varName).extend(values.tolist())
 
 
 class ProtPKPDImportFromExcel(ProtPKPDImportFromText):
@@ -304,40 +284,18 @@ class ProtPKPDImportFromExcel(ProtPKPDImportFromText):
 
     def readTextFile(self):
         import openpyxl
-        wb = openpyxl.load_workbook(self.inputFile.get())
-        sampleNames = []
-        allT = []
-        allSamples = []
-        sheet = wb.get_sheet_by_name(wb.get_sheet_names()[0]) # First sheet only
-        i0=self.skipLines.get()
-        if self.format.get()==WIDEFORMAT:
-            for i in range(i0,sheet.max_row):
-                if i-i0 > 0:
-                    allMeasurements = []
-                for j in range(sheet.max_column):
-                    cellValue = sheet.cell(row=i + 1, column=j + 1).value
-                    if cellValue is None:
-                        if 'allMeasurements' in locals():
-                            allMeasurements.append("NA")
-                        continue
-                    cellValue = str(cellValue).strip()
-                    if cellValue == "":
-                        if 'allMeasurements' in locals():
-                            allMeasurements.append("NA")
-                        continue
-                    if i-i0 == 0 and j >= 1:
-                        sampleName = cellValue
-                        if sampleName[0] in "0123456789":
-                            sampleName="d"+sampleName
-                        sampleNames.append(sampleName)
-                    elif i-i0 > 0:
-                        if j == 0:
-                            allT.append(cellValue)
-                        else:
-                            allMeasurements.append(cellValue)
-                if i-i0 > 0:
-                    allSamples.append(allMeasurements)
+        wb = openpyxl.load_workbook(self.inputFile.get(), read_only=True, data_only=True)
+        sheet = wb[wb.sheetnames[0]] # First sheet only
+        rows = sheet.iter_rows(min_row=self.skipLines.get()+1, values_only=True)
+        header = next(rows, ())
+        # Single pass over the sheet, empty cells are converted to NA and empty lines are skipped
+        table = [[("NA" if cellValue is None or str(cellValue).strip()=="" else str(cellValue).strip())
+                  for cellValue in row] for row in rows if any(cellValue is not None for cellValue in row)]
+        wb.close()
+        Ncols = max([len(header)]+[len(row) for row in table])
+        table = np.array([row+["NA"]*(Ncols-len(row)) for row in table], dtype=str).reshape((-1,Ncols))
 
+        if self.format.get()==WIDEFORMAT:
             tvarName = None
             xvarName = None
             for varName in self.experiment.variables:
@@ -346,101 +304,114 @@ class ProtPKPDImportFromExcel(ProtPKPDImportFromText):
                 elif self.experiment.variables[varName].role == PKPDVariable.ROLE_MEASUREMENT:
                     xvarName = varName
 
-            for sampleName in sampleNames:
+            table = table[table[:,0]!="NA",:] # Rows without time are not measurements
+            allT = table[:,0].tolist()
+            for j in range(1,len(header)):
+                if header[j] is None or str(header[j]).strip()=="":
+                    continue
+                sampleName = validSampleName(str(header[j]).strip())
                 self.addSample(sampleName,[sampleName])
                 samplePtr=self.experiment.samples[sampleName]
                 samplePtr.addMeasurementPattern([sampleName, tvarName, xvarName])
-                exec ("samplePtr.measurement_%s=%s" % (tvarName, allT))
-
-            for i in range(len(allT)):
-                for j in range(len(sampleNames)):
-                    samplePtr=self.experiment.samples[sampleNames[j]]
-                    exec ('samplePtr.measurement_%s.append("%s")' % (xvarName, allSamples[i][j]))
+                samplePtr.setValues(tvarName, list(allT))
+                samplePtr.setValues(xvarName, table[:,j].tolist())
 
         elif self.format.get()==LONGFORMAT:
             headerFormat=[token.strip() for token in self.header.get().split(',')]
-            if len(headerFormat)!=sheet.max_column:
+            if len(headerFormat)!=Ncols:
                 raise Exception("You have specified %d columns in the header format, but there are %d columns"\
-                                %(len(headerFormat),sheet.max_column))
+                                %(len(headerFormat),Ncols))
             if not "ID" in headerFormat:
                 raise Exception("Cannot find ID in the header format")
             idCol = headerFormat.index("ID")
 
             keepCols=[]
-            col=0
             measurementPattern=[]
-            for colName in headerFormat:
+            for col, colName in enumerate(headerFormat):
                 if colName != "SKIP" and colName !="ID":
                     keepCols.append(col)
                     measurementPattern.append(colName)
-                col+=1
             print(keepCols)
 
-            allSamples={}
-            for i in range(i0+1,sheet.max_row):
-                line=[]
-                for j in range(sheet.max_column):
-                    cellValue = str(sheet.cell(row=i + 1, column=j + 1).value).strip()
-                    line.append(cellValue)
-                sampleName = line[idCol]
-                if sampleName[0] in "0123456789":
-                    sampleName="d"+sampleName
-                if not sampleName in allSamples:
-                    allSamples[sampleName]=[]
-                    for j in range(len(keepCols)):
-                        allSamples[sampleName].append([])
-                jidx=0
-                for j in keepCols:
-                    allSamples[sampleName][jidx].append(line[j])
-                    jidx+=1
-
-            for sampleName in allSamples:
+            table = table[table[:,idCol]!="NA",:]
+            for sampleName, idx in groupBySample(table[:,idCol]):
+                sampleName = validSampleName(sampleName)
                 self.addSample(sampleName,[sampleName])
                 samplePtr=self.experiment.samples[sampleName]
                 samplePtr.addMeasurementPattern([sampleName]+measurementPattern)
-                for jidx in range(len(keepCols)):
-                    exec ("samplePtr.measurement_%s=%s" % (measurementPattern[jidx], allSamples[sampleName][jidx]))
+                for j, varName in izip(keepCols, measurementPattern):
+                    samplePtr.setValues(varName, table[idx,j].tolist())
+
+
+def validSampleName(sampleName):
+    # Sample names cannot start with a digit
+    if sampleName[0] in "0123456789":
+        sampleName="d"+sampleName
+    return sampleName
+
+
+def groupBySample(sampleNames):
+    """ Return the list of (sampleName, row indexes) in order of first appearance """
+    sampleNames = np.asarray(sampleNames)
+    if sampleNames.size==0:
+        return []
+    uniqueNames, firstIdx, inverse = np.unique(sampleNames, return_index=True, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    limits = np.cumsum(np.bincount(inverse, minlength=uniqueNames.size))
+    rowIdx = np.split(order, limits[:-1])
+    return [(str(uniqueNames[i]), rowIdx[i]) for i in np.argsort(firstIdx)]
+
+
+def readCSVColumns(fnCSV, delimiter=';', listOfVariables=None):
+    """ Read the CSV in a single pass and return the variable names and one array of stripped strings
+        per column. If listOfVariables is None, they are taken from the first line """
+    with open(fnCSV) as fh:
+        lines = [line for line in fh.read().splitlines() if line.strip()!=""]
+    if listOfVariables is None:
+        if not lines:
+            return [], []
+        listOfVariables = [token.strip() for token in lines[0].split(delimiter)]
+        lines = lines[1:]
+    Nvars = len(listOfVariables)
+    validLines = []
+    for line in lines:
+        if line.count(delimiter)!=Nvars-1:
+            print("Skipping line: %s"%line)
+            print("   It does not have the same number of values as the header")
+        else:
+            validLines.append(line)
+    if not validLines:
+        return listOfVariables, [np.empty(0, dtype=str) for _ in range(Nvars)]
+
+    # All the values are split at once and reshaped into a table
+    allValues = delimiter.join(validLines)
+    table = np.array(allValues.split(delimiter), dtype=str).reshape((len(validLines), Nvars))
+    if any(blank in allValues for blank in " \t\r"):
+        table = np.char.strip(table)
+    return listOfVariables, [table[:,j] for j in range(Nvars)]
+
+
+_csvScanCache = {}
+
+def scanCSVfile(fnCSV, delimiter=';'):
+    """ Variable and sample names of a CSV. The scan is cached while the file does not change """
+    key = (os.path.abspath(fnCSV), delimiter)
+    stamp = (os.path.getmtime(fnCSV), os.path.getsize(fnCSV))
+    if key not in _csvScanCache or _csvScanCache[key][0]!=stamp:
+        varNames, columns = readCSVColumns(fnCSV, delimiter)
+        sampleNames = None
+        if "SampleName" in varNames:
+            sampleNames = [sampleName for sampleName, _ in groupBySample(columns[varNames.index("SampleName")])]
+        _csvScanCache[key] = (stamp, varNames, sampleNames)
+    return _csvScanCache[key][1:]
 
 
 def getSampleNamesFromCSVfile(fnCSV, delimiter=';'):
-    sampleNames = []
-    fh=open(fnCSV)
-    lineNo = 1
-    for line in fh.readlines():
-        tokens = line.split(delimiter)
-        if len(tokens)==0:
-            continue
-        if lineNo==1:
-            iSampleName=-1
-            varNo = 0
-            for token in tokens:
-                varName=token.strip()
-                if varName=="SampleName":
-                    iSampleName=varNo
-                    break
-                varNo += 1
-            if iSampleName==-1:
-                fh.close()
-                return
-        else:
-            if len(tokens)>iSampleName:
-                sampleName = tokens[iSampleName]
-                if not sampleName in sampleNames:
-                    sampleNames.append(sampleName.strip())
-        lineNo+=1
-    fh.close()
-    return sampleNames
+    sampleNames = scanCSVfile(fnCSV, delimiter)[1]
+    if sampleNames is None:
+        return
+    return list(sampleNames)
 
 
 def getVarNamesFromCSVfile(fnCSV, delimiter=';'):
-    varNames = []
-    fh=open(fnCSV)
-    for line in fh.readlines():
-        tokens = line.split(delimiter)
-        if len(tokens)==0:
-            continue
-        for token in tokens:
-            varNames.append(token.strip())
-        break
-    fh.close()
-    return varNames
+    return list(scanCSVfile(fnCSV, delimiter)[0])
@@ -171,6 +171,7 @@ class ProtPKPDImportFromTable(ProtPKPD):
                     exec ('samplePtr.measurement_%s.append("%s")' % (xvarName, allMeasurements[i][j]))
 
             self.experiment.write(self._getPath("experiment%s.pkpd"%tableName))
+            self.waitForExcelExports()
             self.experiment._printToStream(sys.stdout)
             self._defineOutputs(**{"outputExperiment%s"%tableName: self.experiment})
 
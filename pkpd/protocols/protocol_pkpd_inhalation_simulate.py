@@ -373,6 +373,7 @@ class ProtPKPDInhSimulate(ProtPKPD):
         self.experimentLungRetention.samples["simulmvarNameation"] = simulationSample
 
         self.experimentLungRetention.write(self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
 
         # Plots
         import matplotlib.pyplot as plt
@@ -128,6 +128,7 @@ class ProtPKPDJoinSamples(ProtPKPD):
 
         # Print and save
         self.writeExperiment(self.experiment,self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputExperiment=self.experiment)
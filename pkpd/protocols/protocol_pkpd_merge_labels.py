@@ -73,6 +73,7 @@ class ProtPKPDMergeLabels(ProtPKPD):
                                                          varValue)
 
         self.writeExperiment(self.experiment,self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputExperiment=self.experiment)
@@ -26,9 +26,8 @@
 
 import pyworkflow.protocol.params as params
 from .protocol_pkpd import ProtPKPD
-from pkpd.objects import PKPDFitting, PKPDSampleFitBootstrap
+from pkpd.objects import PKPDFitting, concatenateBootstrapFits
 import numpy as np
-import copy
 
 
 class ProtPKPDMergePopulations(ProtPKPD):
@@ -46,6 +45,19 @@ class ProtPKPDMergePopulations(ProtPKPD):
         form.addParam('inputPopulation2', params.PointerParam, label="Population 2", important=True,
                       pointerClass='PKPDFitting', pointerCondition="isPopulation",
                       help='It must be a fitting coming from a bootstrap sample')
+        form.addParam('resampling', params.EnumParam, choices=["None","Weighted","Stratified"], label="Resampling",
+                      default=0,
+                      help='None: the merged population has all the replicates of both populations.\n'
+                           'Weighted: each replicate of the merged population is drawn (with replacement) from population 1 '
+                           'with probability w1 and from population 2 with probability 1-w1.\n'
+                           'Stratified: exactly round(w1*N) replicates are drawn (with replacement) from population 1 '
+                           'and the rest from population 2.')
+        form.addParam('weight1', params.FloatParam, label="Weight of population 1 (w1)", default=0.5,
+                      condition='resampling>0', help='Between 0 and 1')
+        form.addParam('sampleSize', params.IntParam, label="Size of the merged population (N)", default=0,
+                      condition='resampling>0',
+                      help='If 0, the size is the sum of the sizes of both populations')
+        self._defineExcelParams(form)
 
     #--------------------------- INSERT steps functions --------------------------------------------
 
@@ -67,42 +79,24 @@ class ProtPKPDMergePopulations(ProtPKPD):
         self.fitting.modelParameters = self.population1.modelParameters
         self.fitting.modelDescription = self.population1.modelDescription
 
-        newSampleFit = PKPDSampleFitBootstrap()
-        newSampleFit.sampleName = "Merged population"
-        newSampleFit.parameters = None
-        for sampleFit in self.population1.sampleFits:
-            if newSampleFit.parameters == None:
-                newSampleFit.parameters = np.copy(sampleFit.parameters)
-                newSampleFit.xB = copy.copy(sampleFit.xB)
-                newSampleFit.yB = copy.copy(sampleFit.yB)
-                newSampleFit.R2 = copy.copy(sampleFit.R2)
-                newSampleFit.R2adj = copy.copy(sampleFit.R2adj)
-                newSampleFit.AIC = copy.copy(sampleFit.AIC)
-                newSampleFit.AICc = copy.copy(sampleFit.AICc)
-                newSampleFit.BIC = copy.copy(sampleFit.BIC)
+        sampleFit1 = concatenateBootstrapFits(self.population1.sampleFits, "Merged population")
+        sampleFit2 = concatenateBootstrapFits(self.population2.sampleFits, "Merged population")
+        if self.resampling.get()>0:
+            N1 = sampleFit1.parameters.shape[0]
+            N2 = sampleFit2.parameters.shape[0]
+            N = self.sampleSize.get() if self.sampleSize.get()>0 else N1+N2
+            if self.resampling.get()==1:
+                Nfrom1 = np.random.binomial(N, self.weight1.get())
             else:
-                newSampleFit.parameters = np.vstack([newSampleFit.parameters, sampleFit.parameters])
-                newSampleFit.xB += sampleFit.xB
-                newSampleFit.yB += sampleFit.yB
-                newSampleFit.R2 += sampleFit.R2
-                newSampleFit.R2adj += sampleFit.R2adj
-                newSampleFit.AIC += sampleFit.AIC
-                newSampleFit.AICc += sampleFit.AICc
-                newSampleFit.BIC += sampleFit.BIC
-        for sampleFit in self.population2.sampleFits:
-            newSampleFit.parameters = np.vstack([newSampleFit.parameters, sampleFit.parameters])
-            print(type(newSampleFit.xB))
-            print(type(sampleFit.xB))
-            newSampleFit.xB += sampleFit.xB
-            newSampleFit.yB += sampleFit.yB
-            newSampleFit.R2 += sampleFit.R2
-            newSampleFit.R2adj += sampleFit.R2adj
-            newSampleFit.AIC += sampleFit.AIC
-            newSampleFit.AICc += sampleFit.AICc
-            newSampleFit.BIC += sampleFit.BIC
+                Nfrom1 = int(round(self.weight1.get()*N))
+            print("%d replicates from population 1 and %d from population 2"%(Nfrom1,N-Nfrom1))
+            sampleFit1 = sampleFit1.selectReplicates(np.random.randint(0,N1,Nfrom1))
+            sampleFit2 = sampleFit2.selectReplicates(np.random.randint(0,N2,N-Nfrom1))
+        newSampleFit = concatenateBootstrapFits([sampleFit1, sampleFit2], "Merged population")
         self.fitting.sampleFits.append(newSampleFit)
 
-        self.fitting.write(self._getPath("bootstrapPopulation.pkpd"))
+        self.fitting.write(self._getPath("bootstrapPopulation.pkpd"), writeToExcel=self._writeToExcel)
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputPopulation=self.fitting)
@@ -113,10 +107,14 @@ class ProtPKPDMergePopulations(ProtPKPD):
     def _summary(self):
         msg=["Populations %s and %s were merged"%(self.getObjectTag(self.inputPopulation1.get()),
                                                   self.getObjectTag(self.inputPopulation2.get()))]
+        if self.resampling.get()>0:
+            msg.append("%s resampling with w1=%f"%(["","Weighted","Stratified"][self.resampling.get()],self.weight1.get()))
         return msg
 
     def _validate(self):
         msg=[]
+        if self.resampling.get()>0 and (self.weight1.get()<0 or self.weight1.get()>1):
+            msg.append("The weight of population 1 must be between 0 and 1")
         if not self.inputPopulation1.get().fnFitting.get().endswith("bootstrapPopulation.pkpd"):
             msg.append("Population 1 must be a bootstrap sample")
         if not self.inputPopulation2.get().fnFitting.get().endswith("bootstrapPopulation.pkpd"):
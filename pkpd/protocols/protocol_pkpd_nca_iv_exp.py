@@ -100,6 +100,11 @@ class ProtPKPDNCAIVExp(ProtPKPDSABase):
 
         return True
 
+    def getSampleCacheDependencies(self, sampleName):
+        return ProtPKPDSABase.getSampleCacheDependencies(self, sampleName)+\
+               [self.analysis.lambdaz, self.analysis.lambdazUnits.unit, self.analysis.Cn, self.analysis.CnUnits.unit,
+                self.analysis.lambdan, self.analysis.lambdanUnits.unit]
+
     #--------------------------- INFO functions --------------------------------------------
     def _summary(self):
         msg=[]
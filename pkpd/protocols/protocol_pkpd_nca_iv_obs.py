@@ -87,6 +87,10 @@ class ProtPKPDNCAIVObs(ProtPKPDSABase):
         print("Elimination rate = %f [%s]"%(self.analysis.lambdaz,self.analysis.lambdazUnits._toString()))
         return True
 
+    def getSampleCacheDependencies(self, sampleName):
+        return ProtPKPDSABase.getSampleCacheDependencies(self, sampleName)+\
+               [self.analysis.lambdaz, self.analysis.lambdazUnits.unit]
+
     #--------------------------- INFO functions --------------------------------------------
     def _summary(self):
         msg=[]
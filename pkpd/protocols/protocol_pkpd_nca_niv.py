@@ -86,6 +86,9 @@ class ProtPKPDNCAEV(ProtPKPDSABase):
         self.analysis.Ke = float(sample.descriptors["Ke"])
         return True
 
+    def getSampleCacheDependencies(self, sampleName):
+        return ProtPKPDSABase.getSampleCacheDependencies(self, sampleName)+[self.analysis.F]
+
     def postAnalysis(self, sampleName):
         if self.experimentIV!=None:
             if sampleName in self.experimentIV.samples:
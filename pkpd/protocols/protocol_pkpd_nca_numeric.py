@@ -113,7 +113,19 @@ class ProtPKPDNCANumeric(ProtPKPD):
         sample.descriptors["AUMC0t"] = self.AUMC0t
 
     def runAnalysis(self,objId, xvarName):
-        self.outputExperiment = self.readExperiment(self.inputExperiment.get().fnPKPD)
+        summary = self.analyzeExperiment(self.readExperiment(self.inputExperiment.get().fnPKPD), xvarName)
+        fhSummary=open(self._getPath("summary.txt"),"w")
+        for line in summary:
+            self.doublePrint(fhSummary,line)
+        fhSummary.close()
+
+        self.outputExperiment.write(self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
+
+    def analyzeExperiment(self, experiment, xvarName):
+        """ Add the NCA descriptors to the samples of the experiment (no file is read or written).
+            The experiment is kept in self.outputExperiment and the summary lines are returned """
+        self.outputExperiment = experiment
 
         tvarName = None
         for varName in self.outputExperiment.variables:
@@ -192,19 +204,17 @@ class ProtPKPDNCANumeric(ProtPKPD):
         # Report NCA statistics
         alpha_2 = (100-95)/2
         limits = np.percentile(AUCarray,[alpha_2,100-alpha_2])
-        fhSummary=open(self._getPath("summary.txt"),"w")
-        self.doublePrint(fhSummary,"AUC %f%% confidence interval=[%f,%f] [%s] mean=%f"%(95,limits[0],limits[1],strUnit(self.AUCunits),np.mean(AUCarray)))
+        summary = []
+        summary.append("AUC %f%% confidence interval=[%f,%f] [%s] mean=%f"%(95,limits[0],limits[1],strUnit(self.AUCunits),np.mean(AUCarray)))
         limits = np.percentile(AUMCarray,[alpha_2,100-alpha_2])
-        self.doublePrint(fhSummary,"AUMC %f%% confidence interval=[%f,%f] [%s] mean=%f"%(95,limits[0],limits[1],strUnit(self.AUMCunits),np.mean(AUMCarray)))
+        summary.append("AUMC %f%% confidence interval=[%f,%f] [%s] mean=%f"%(95,limits[0],limits[1],strUnit(self.AUMCunits),np.mean(AUMCarray)))
         limits = np.percentile(MRTarray,[alpha_2,100-alpha_2])
-        self.doublePrint(fhSummary,"MRT %f%% confidence interval=[%f,%f] [min] mean=%f"%(95,limits[0],limits[1],np.mean(MRTarray)))
+        summary.append("MRT %f%% confidence interval=[%f,%f] [min] mean=%f"%(95,limits[0],limits[1],np.mean(MRTarray)))
         limits = np.percentile(CmaxArray,[alpha_2,100-alpha_2])
-        self.doublePrint(fhSummary,"Cmax %f%% confidence interval=[%f,%f] [%s] mean=%f"%(95,limits[0],limits[1],strUnit(self.Cunits.unit),np.mean(CmaxArray)))
+        summary.append("Cmax %f%% confidence interval=[%f,%f] [%s] mean=%f"%(95,limits[0],limits[1],strUnit(self.Cunits.unit),np.mean(CmaxArray)))
         limits = np.percentile(TmaxArray,[alpha_2,100-alpha_2])
-        self.doublePrint(fhSummary,"Tmax %f%% confidence interval=[%f,%f] [min] mean=%f"%(95,limits[0],limits[1],np.mean(TmaxArray)))
-        fhSummary.close()
-
-        self.outputExperiment.write(self._getPath("experiment.pkpd"))
+        summary.append("Tmax %f%% confidence interval=[%f,%f] [min] mean=%f"%(95,limits[0],limits[1],np.mean(TmaxArray)))
+        return summary
 
     def createOutputStep(self):
         self._defineOutputs(outputExperiment=self.outputExperiment)
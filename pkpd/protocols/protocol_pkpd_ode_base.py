@@ -84,6 +84,7 @@ class ProtPKPDODEBase(ProtPKPD,PKPDModelBase2):
         form.addParam('globalSearch', params.BooleanParam, label="Global search", default=True, expertLevel=LEVEL_ADVANCED,
                       help='Global search looks for the best parameters within bounds. If it is not performed, the '
                            'middle of the bounding box is used as initial parameter for a local optimization')
+        self._defineExcelParams(form)
 
     #--------------------------- INSERT steps functions --------------------------------------------
     def getListOfFormDependencies(self):
@@ -304,6 +305,16 @@ class ProtPKPDODEBase(ProtPKPD,PKPDModelBase2):
         self.yPredicted = self.mergeLists(yPredictedList)
         return copy.copy(self.yPredicted)
 
+    def forwardModelBySuperposition(self, parameters, x=None):
+        self.setParameters(parameters)
+
+        yPredictedList = []
+        for n in range(len(self.modelList)):
+            self.modelList[n].forwardModelBySuperposition(self.parametersPK,x)
+            yPredictedList.append(self.modelList[n].yPredicted)
+        self.yPredicted = self.mergeLists(yPredictedList)
+        return copy.copy(self.yPredicted)
+
     def forwardModelByConvolution(self, parameters, x=None):
         self.setParameters(parameters)
         tFImpulse = None
@@ -369,15 +380,29 @@ class ProtPKPDODEBase(ProtPKPD,PKPDModelBase2):
 
     # Really fit ---------------------------------------------------------
     def runFit(self, objId, otherDependencies):
-        reportX = parseRange(self.reportX.get())
         self.setInputExperiment()
-
+        cache = self.getResultCache()
+        self.fitExperiment(self._getPath("experiment.pkpd"), parseRange(self.reportX.get()),
+                           fnFitting=self._getPath("fitting.pkpd"), cache=cache)
+        cache.prune()
+        self.fitting.write(self._getPath("fitting.pkpd"), writeToExcel=self._writeToExcel)
+        self.experiment.write(self._getPath("experiment.pkpd"), writeToExcel=self._writeToExcel)
+        self.waitForExcelExports()
+
+    def fitExperiment(self, fnExperiment="", reportX=None, fnFitting=None, cache=None):
+        """ Fit self.experiment. The fitted parameters are added to the samples of self.experiment and the
+            fitting is returned (also kept in self.fitting). No file is read or written unless fnFitting is given,
+            then the sample fits of each group are streamed to it as soon as the group is fitted.
+            If a PKPDResultCache is given, groups whose inputs have not changed since they were fitted are not
+            fitted again """
         # Setup model
         self.getXYvars()
 
         # Create output object
         self.fitting = PKPDFitting()
-        self.fitting.fnExperiment.set(self._getPath("experiment.pkpd"))
+        if fnFitting is not None:
+            self.fitting.startStreaming(fnFitting)
+        self.fitting.fnExperiment.set(fnExperiment)
         self.fitting.predictor=self.experiment.variables[self.varNameX]
         if type(self.varNameY)==list:
             self.fitting.predicted=[]
@@ -395,6 +420,8 @@ class ProtPKPDODEBase(ProtPKPD,PKPDModelBase2):
         elif self.fitType.get()==2:
             fitType = "relative"
 
+        if cache is not None:
+            cacheDependencies = [self.getCacheDependencies(), fitType]
         for groupName, group in self.experiment.groups.items():
             self.printSection("Fitting "+groupName)
             self.clearGroupParameters()
@@ -433,48 +460,61 @@ class ProtPKPDODEBase(ProtPKPD,PKPDModelBase2):
             self.x = self.mergeLists(self.XList)
             self.y = self.mergeLists(self.YList)
 
-            if self.globalSearch:
-                optimizer1 = PKPDDEOptimizer(self,fitType)
-                optimizer1.optimize()
+            sampleFits = None
+            if cache is not None:
+                key = cache.getKey(cacheDependencies, self.model.__class__.__name__,
+                                   [self.getSampleCacheDependencies(sampleName) for sampleName in group.sampleList],
+                                   self.boundsList, self.XList, self.YList)
+                sampleFits = cache.get(key)
+            if sampleFits is None:
+                if self.globalSearch:
+                    optimizer1 = PKPDDEOptimizer(self,fitType)
+                    optimizer1.optimize()
+                else:
+                    self.parameters = np.zeros(len(self.boundsList),np.double)
+                    n = 0
+                    for bound in self.boundsList:
+                        self.parameters[n] = 0.5*(bound[0]+bound[1])
+                        n += 1
+                try:
+                    optimizer2 = PKPDLSOptimizer(self,fitType)
+                    optimizer2.optimize()
+                except Exception as e:
+                    msg="Error: "+str(e)
+                    msg+="\nErrors in the local optimizer may be caused by starting from a bad initial guess\n"
+                    msg+="Try performing a global search first or changing the bounding box"
+                    raise Exception("Error in the local optimizer\n"+msg)
+                optimizer2.setConfidenceInterval(self.getConfidenceInterval())
+                self.setParameters(optimizer2.optimum)
+                optimizer2.evaluateQuality()
+
+                self.yPredictedList=self.separateLists(self.yPredicted)
+                self.yPredictedLowerList=self.separateLists(self.yPredictedLower)
+                self.yPredictedUpperList=self.separateLists(self.yPredictedUpper)
+
+                # Keep this result
+                sampleFits = []
+                for n, sampleName in enumerate(group.sampleList):
+                    sampleFit = PKPDSampleFit()
+                    sampleFit.sampleName = self.experiment.samples[sampleName].sampleName
+                    sampleFit.x = self.XList[n]
+                    sampleFit.y = self.YList[n]
+                    sampleFit.yp = self.yPredictedList[n]
+                    sampleFit.yl = self.yPredictedLowerList[n]
+                    sampleFit.yu = self.yPredictedUpperList[n]
+                    sampleFit.parameters = self.parameters
+                    sampleFit.modelEquation = self.getEquation()
+                    sampleFit.copyFromOptimizer(optimizer2)
+                    sampleFits.append(sampleFit)
+                if cache is not None:
+                    cache.put(key, sampleFits)
             else:
-                self.parameters = np.zeros(len(self.boundsList),np.double)
-                n = 0
-                for bound in self.boundsList:
-                    self.parameters[n] = 0.5*(bound[0]+bound[1])
-                    n += 1
-            try:
-                optimizer2 = PKPDLSOptimizer(self,fitType)
-                optimizer2.optimize()
-            except Exception as e:
-                msg="Error: "+str(e)
-                msg+="\nErrors in the local optimizer may be caused by starting from a bad initial guess\n"
-                msg+="Try performing a global search first or changing the bounding box"
-                raise Exception("Error in the local optimizer\n"+msg)
-            optimizer2.setConfidenceInterval(self.getConfidenceInterval())
-            self.setParameters(optimizer2.optimum)
-            optimizer2.evaluateQuality()
+                print("The inputs of %s have not changed, reusing its previous fit"%groupName)
+                self.setParameters(sampleFits[0].parameters)
             self.model.printOtherParameterization()
 
-            self.yPredictedList=self.separateLists(self.yPredicted)
-            self.yPredictedLowerList=self.separateLists(self.yPredictedLower)
-            self.yPredictedUpperList=self.separateLists(self.yPredictedUpper)
-
-            n=0
-            for sampleName in group.sampleList:
-                sample = self.experiment.samples[sampleName]
-
-                # Keep this result
-                sampleFit = PKPDSampleFit()
-                sampleFit.sampleName = sample.sampleName
-                sampleFit.x = self.XList[n]
-                sampleFit.y = self.YList[n]
-                sampleFit.yp = self.yPredictedList[n]
-                sampleFit.yl = self.yPredictedLowerList[n]
-                sampleFit.yu = self.yPredictedUpperList[n]
-                sampleFit.parameters = self.parameters
-                sampleFit.modelEquation = self.getEquation()
-                sampleFit.copyFromOptimizer(optimizer2)
-                self.fitting.sampleFits.append(sampleFit)
+            for sampleName, sampleFit in izip(group.sampleList, sampleFits):
+                self.fitting.addSampleFit(sampleFit)
 
                 # Add the parameters to the sample and experiment
                 for varName, varUnits, description, varValue in izip(self.getParameterNames(), self.parameterUnits, self.getParameterDescriptions(), self.parameters):
@@ -500,13 +540,10 @@ class ProtPKPDODEBase(ProtPKPD,PKPDModelBase2):
                         print("%f %f %f"%(reportX[n],yreportX[n],aux))
                     print(' ')
 
-                n+=1
-
         self.fitting.modelParameters = self.getParameterNames()
         self.fitting.modelDescription=self.getDescription()
-        self.fitting.write(self._getPath("fitting.pkpd"))
         self.experiment.general['Model'] = self.getDescription()
-        self.experiment.write(self._getPath("experiment.pkpd"))
+        return self.fitting
 
     def createOutputStep(self):
         self._defineOutputs(outputFitting=self.fitting)
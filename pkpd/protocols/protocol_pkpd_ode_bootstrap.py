@@ -67,6 +67,7 @@ class ProtPKPDODEBootstrap(ProtPKPDODEBase):
         form.addParam('confidenceInterval', params.FloatParam, label="Confidence interval", default=95, expertLevel=LEVEL_ADVANCED,
                       help='Confidence interval for the fitted parameters')
         form.addParam('deltaT', params.FloatParam, default=2, label='Step (min)', expertLevel=LEVEL_ADVANCED)
+        self._defineExcelParams(form)
 
     #--------------------------- INSERT steps functions --------------------------------------------
     def _insertAllSteps(self):
@@ -122,6 +123,7 @@ class ProtPKPDODEBootstrap(ProtPKPDODEBase):
 
         # Create output object
         self.fitting = PKPDFitting("PKPDSampleFitBootstrap")
+        self.fitting.startStreaming(self._getPath("bootstrapPopulation.pkpd"))
         self.fitting.fnExperiment.set(self.experiment.fnPKPD.get())
         self.fitting.predictor=self.experiment.variables[self.varNameX]
         if type(self.varNameY)==list:
@@ -242,15 +244,16 @@ class ProtPKPDODEBootstrap(ProtPKPDODEBase):
 
                     # Keep this result
                     sampleFit.parameters[n,:] = optimizer2.optimum
-                    sampleFit.xB.append(str(xB[0]))
-                    sampleFit.yB.append(str(yB[0]))
+                    sampleFit.xB.append(xB[0])
+                    sampleFit.yB.append(yB[0])
                     sampleFit.copyFromOptimizer(optimizer2)
 
-                self.fitting.sampleFits.append(sampleFit)
+                self.fitting.addSampleFit(sampleFit)
 
         self.fitting.modelParameters = self.getParameterNames()
         self.fitting.modelDescription = self.getDescription()
-        self.fitting.write(self._getPath("bootstrapPopulation.pkpd"))
+        self.fitting.write(self._getPath("bootstrapPopulation.pkpd"), writeToExcel=self._writeToExcel)
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputPopulation=self.fitting)
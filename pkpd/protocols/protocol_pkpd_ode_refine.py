@@ -56,6 +56,7 @@ class ProtPKPDODERefine(ProtPKPDODEBase):
                            "Relative: sum ((Cobserved-Cpredicted)/Cobserved)^2")
         form.addParam('bounds', params.StringParam, label="Parameter bounds", default="",
                       help="If empty, same bounds as for the previous protocol")
+        self._defineExcelParams(form)
 
     #--------------------------- INSERT steps functions --------------------------------------------
     def _insertAllSteps(self):
@@ -237,8 +238,9 @@ class ProtPKPDODERefine(ProtPKPDODEBase):
 
         self.fitting.modelParameters = self.getParameterNames()
         self.fitting.modelDescription = self.getDescription()
-        self.fitting.write(self._getPath("fitting.pkpd"))
-        self.experiment.write(self._getPath("experiment.pkpd"))
+        self.fitting.write(self._getPath("fitting.pkpd"), writeToExcel=self._writeToExcel)
+        self.experiment.write(self._getPath("experiment.pkpd"), writeToExcel=self._writeToExcel)
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputFitting=self.fitting)
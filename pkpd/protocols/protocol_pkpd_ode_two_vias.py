@@ -415,6 +415,7 @@ class ProtPKPDODETwoVias(ProtPKPD,PKPDModelBase2):
             self.experiment2.write(self._getPath("experiment2.pkpd"))
             self.fitting1.write(self._getPath("fitting1.pkpd"))
             self.fitting2.write(self._getPath("fitting2.pkpd"))
+            self.waitForExcelExports()
 
     def createOutputStep(self):
         if self.someInCommon:
@@ -24,10 +24,15 @@
 # *
 # **************************************************************************
 
+try:
+    from itertools import izip
+except ImportError:
+    izip = zip
+
 import pyworkflow.protocol.params as params
 from .protocol_pkpd import ProtPKPD
 from pkpd.objects import PKPDVariable
-from pkpd.utils import parseOperation
+from pkpd.expressions import compileExpression
 
 # Tested in test_workflow_dissolution.py
 
@@ -72,23 +77,29 @@ class ProtPKPDOperateExperiment(ProtPKPD):
         self.experiment.variables[newVarName] = PKPDVariable()
         self.experiment.variables[newVarName].parseTokens(tokens)
 
-        parsedOperation, varList, _ = parseOperation(self.operation.get())
+        newVar = self.experiment.variables[newVarName]
+        operation = self.operation.get()
+        compiledOperation = compileExpression(operation)
 
         self.printSection("Operating")
-        print("Operation performed: %s"%parsedOperation)
-        for sampleName in self.experiment.samples:
+        print("Operation performed: %s"%operation)
+        newLabels = {}
+        if newVar.isLabel() and all(varName in self.experiment.variables and self.experiment.variables[varName].isLabel()
+                                    for varName in compiledOperation.varList):
+            # Only labels are involved, all samples are evaluated at once
+            sampleNames = list(self.experiment.samples.keys())
+            values, _ = self.experiment.evaluateExpression(operation, sampleNames)
+            newLabels = {sampleName: value.item() for sampleName, value in izip(sampleNames, values)}
+        for sampleName, sample in self.experiment.samples.items():
             print("   Sample " + sampleName)
-            sample = self.experiment.samples[sampleName]
-            exec("%s=sample.evaluateParsedExpression(parsedOperation, varList)"%newVarName)
-
-            if self.experiment.variables[newVarName].isLabel():
-                exec('sample.setDescriptorValue("%s",%s)'%(newVarName,newVarName))
+            if newVar.isLabel():
+                value = newLabels[sampleName] if newLabels else sample.evaluateParsedExpression(operation)
+                sample.setDescriptorValue(newVarName, value)
             else:
-                # Measurement or time
-                exec('sample.addMeasurementColumn("%s",%s)'%(newVarName,newVarName))
+                sample.addMeasurementColumn(newVarName, sample.evaluateParsedExpression(operation))
 
-        # Print and save
         self.writeExperiment(self.experiment,self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputExperiment=self.experiment)
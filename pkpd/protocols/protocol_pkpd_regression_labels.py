@@ -195,15 +195,11 @@ class ProtPKPDRegressionLabel(ProtPKPD):
     def getXYValues(self, printExperiment=True):
         self.experiment = self.readExperiment(self.inputExperiment.get().fnPKPD,
                                          printExperiment)
-        X = []
-        Y = []
         labelX = self.labelX.get()
         labelY = self.labelY.get()
-        for sampleName, sample in self.experiment.samples.items():
-            X.append(float(sample.descriptors[labelX]))
-            Y.append(float(sample.descriptors[labelY]))
-        X = np.asarray(X, np.double)
-        Y = np.asarray(Y, np.double)
+        XY = self.experiment.getSubGroupColumns("", [labelX, labelY])
+        X = XY[:,0]
+        Y = XY[:,1]
         logX = np.log(X)
         logY = np.log(Y)
 
@@ -50,6 +50,7 @@ class ProtPKPDSABase(ProtPKPD):
                           help='Y is predicted as an exponential function of X, Y=f(X)')
             form.addParam('predicted', params.StringParam, label="Predicted variable (Y)", default="Cp",
                           help='Y is predicted as an exponential function of X, Y=f(X)')
+        self._defineExcelParams(form)
 
     #--------------------------- INSERT steps functions --------------------------------------------
     def _insertAllSteps(self):
@@ -96,6 +97,10 @@ class ProtPKPDSABase(ProtPKPD):
         self.signalAnalysis.analysisDescription=self.analysis.getDescription()
         self.signalAnalysis.analysisParameters = self.analysis.getParameterNames()
 
+        # Samples whose inputs have not changed since the previous execution are not analyzed again
+        cache = self.getResultCache()
+        cacheDependencies = [self.getCacheDependencies(), self.analysis.__class__.__name__]
+
         self.printSection("Processing samples")
         for sampleName, sample in self.experiment.samples.items():
             print("%s -------------------"%sampleName)
@@ -106,7 +111,14 @@ class ProtPKPDSABase(ProtPKPD):
             # Actually analyze
             x, y = sample.getXYValues(self.varNameX,self.varNameY)
             self.analysis.setXYValues(x, y)
-            self.analysis.calculateParameters(show=True)
+            key = cache.getKey(cacheDependencies, self.getSampleCacheDependencies(sampleName), x, y)
+            parameters = cache.get(key)
+            if parameters is None:
+                self.analysis.calculateParameters(show=True)
+                cache.put(key, self.analysis.parameters)
+            else:
+                print("The inputs of %s have not changed, reusing its previous analysis"%sampleName)
+                self.analysis.parameters = parameters
 
             # Keep this result
             sampleAnalysis = PKPDSampleSignalAnalysis()
@@ -128,9 +140,11 @@ class ProtPKPDSABase(ProtPKPD):
             self.postAnalysis(sampleName)
 
             print(" ")
+        cache.prune()
 
         self.signalAnalysis.write(self._getPath("analysis.pkpd"))
-        self.experiment.write(self._getPath("experiment.pkpd"))
+        self.experiment.write(self._getPath("experiment.pkpd"), writeToExcel=self._writeToExcel)
+        self.waitForExcelExports()
 
     def createOutputStep(self):
         self._defineOutputs(outputAnalysis=self.signalAnalysis)
@@ -83,6 +83,7 @@ class ProtPKPDScaleToCommonDose(ProtPKPD):
                         pass
                 sample.setValues(varName,values)
         self.experiment.write(self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
 
     #--------------------------- INFO functions --------------------------------------------
     def _summary(self):
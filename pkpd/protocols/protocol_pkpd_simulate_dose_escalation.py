@@ -32,6 +32,36 @@ from pkpd.models.pd_models import *
 from numpy.random import uniform
 
 
+def createDoseResponseModel(modelType, paramValues):
+    # modelType is the index in the list of models of the form, paramValues a string like 3.5;-1
+    if modelType==0:
+        model = PDOQuigley0()
+    elif modelType==1:
+        model = PDOQuigley1()
+    elif modelType==2:
+        model = PDOQuigley2()
+    elif modelType==3:
+        model = PDSigmoid()
+    elif modelType==4:
+        model = PDGompertz()
+    elif modelType==5:
+        model = PDLogistic1()
+    elif modelType==6:
+        model = PDRichards()
+
+    # Create list of parameters
+    tokens=paramValues.split(';')
+    if len(tokens)!=model.getNumberOfParameters():
+        raise Exception("The list of parameter values has not the same number of parameters as the model")
+    model.parameters=[]
+    for token in tokens:
+        try:
+            model.parameters.append(float(token.strip()))
+        except:
+            raise Exception("Cannot convert %s to float"%token)
+    return model
+
+
 class ProtPKPDSimulateDoseEscalation(ProtPKPD):
     """ Simulate a dose escalation\n
         Protocol created by http://www.kinestatpharma.com\n"""
@@ -83,31 +113,7 @@ class ProtPKPDSimulateDoseEscalation(ProtPKPD):
 
         # Setup model
         self.printSection("Model setup")
-        if self.modelType.get()==0:
-            model = PDOQuigley0()
-        elif self.modelType.get()==1:
-            model = PDOQuigley1()
-        elif self.modelType.get()==2:
-            model = PDOQuigley2()
-        elif self.modelType.get()==3:
-            model = PDSigmoid()
-        elif self.modelType.get()==4:
-            model = PDGompertz()
-        elif self.modelType.get()==5:
-            model = PDLogistic1()
-        elif self.modelType.get()==6:
-            model = PDRichards()
-
-        # Create list of parameters
-        tokens=self.paramValues.get().split(';')
-        if len(tokens)!=model.getNumberOfParameters():
-                raise Exception("The list of parameter values has not the same number of parameters as the model")
-        model.parameters=[]
-        for token in tokens:
-            try:
-                model.parameters.append(float(token.strip()))
-            except:
-                raise Exception("Cannot convert %s to float"%token)
+        model = createDoseResponseModel(self.modelType.get(), self.paramValues.get())
         print("Simulated model: %s"%model.getEquation())
 
         if reportX!=None:
@@ -24,15 +24,12 @@
 # *
 # **************************************************************************
 
-try:
-    from itertools import izip
-except ImportError:
-    izip = zip
 import numpy as np
 import os
 
 import pyworkflow.protocol.params as params
 from .protocol_pkpd import ProtPKPD
+from pkpd.utils import factorialGrid
 from pyworkflow.protocol.constants import LEVEL_ADVANCED
 
 class ProtPKPDSimulateDrugInteractions(ProtPKPD):
@@ -187,100 +184,71 @@ class ProtPKPDSimulateDrugInteractions(ProtPKPD):
     def parseList(self, strList):
         return [float(v) for v in strList.split(' ')]
 
+    def addProfiles(self, R, plotType, I, Ri, legendPattern, grid):
+        # Ri has one row per combination of the grid, and one column per value of I
+        Ri = np.atleast_2d(Ri)
+        for n in range(Ri.shape[0]):
+            legend = legendPattern%tuple(column[n] for column in grid)
+            print("Simulating %s"%legend)
+            R.append((plotType, legend, I, Ri[n]))
+
     def runSimulate(self):
         R = []
-        Rlegends = []
-        Type = []
         if self.doReversibleLiver:
             I = np.arange(self.I0Liver.get(), self.IFLiver.get(), (self.IFLiver.get()-self.I0Liver.get())/100) # I [ng/mL]
             I /= self.MWLiver.get() # I [uM]
-            KiList = self.parseList(self.KiReversibleLiver.get())
-            for Ki in KiList:
-                legend="Liver Rev. Inh. Ki=%f [uM]"%Ki
-                print("Simulating %s"%legend)
-                R.append((I,1+I/Ki))
-                Rlegends.append(legend)
-                Type.append('ReversibleLiver')
+            Ki, = factorialGrid([self.parseList(self.KiReversibleLiver.get())])
+            self.addProfiles(R, 'ReversibleLiver', I, 1+I/Ki[:,np.newaxis],
+                             "Liver Rev. Inh. Ki=%f [uM]", [Ki])
 
         if self.doReversibleGut:
             D = np.arange(self.D0Gut.get(), self.DFGut.get(), (self.DFGut.get()-self.D0Gut.get())/100)
             I = D/(250*self.MWGut.get())*1e6 # I [uM]
-            KiList = self.parseList(self.KiReversibleGut.get())
-            for Ki in KiList:
-                legend="Gut Rev. Inh. Ki=%f [uM]"%Ki
-                print("Simulating %s"%legend)
-                R.append((I,1+I/Ki))
-                Rlegends.append(legend)
-                Type.append('ReversibleGut')
+            Ki, = factorialGrid([self.parseList(self.KiReversibleGut.get())])
+            self.addProfiles(R, 'ReversibleGut', I, 1+I/Ki[:,np.newaxis],
+                             "Gut Rev. Inh. Ki=%f [uM]", [Ki])
 
         if self.doTimeDependentLiver:
             I = np.arange(self.I0Liver.get(), self.IFLiver.get(), (self.IFLiver.get()-self.I0Liver.get())/100) # I [ng/mL]
             I /= self.MWLiver.get() # I [uM]
-            KiList = self.parseList(self.KiReversibleLiver.get())
-            kdegList = self.parseList(self.kdegLiver.get())
-            kinactList = self.parseList(self.kinactLiver.get())
-            for Ki in KiList:
-                for kdeg in kdegList:
-                    for kinact in kinactList:
-                        legend="Liver Time Dep. Inh. Ki=%f [uM], kdeg=%f [min^-1], kinact=%f [min^-1]"%(Ki,kdeg,kinact)
-                        print("Simulating %s"%legend)
-                        R.append((I,1+kinact/kdeg*I/(Ki+I)))
-                        Rlegends.append(legend)
-                        Type.append('TimeDependentLiver')
+            grid = factorialGrid([self.parseList(self.KiReversibleLiver.get()), self.parseList(self.kdegLiver.get()),
+                                  self.parseList(self.kinactLiver.get())])
+            Ki, kdeg, kinact = [column[:,np.newaxis] for column in grid]
+            self.addProfiles(R, 'TimeDependentLiver', I, 1+kinact/kdeg*I/(Ki+I),
+                             "Liver Time Dep. Inh. Ki=%f [uM], kdeg=%f [min^-1], kinact=%f [min^-1]", grid)
 
         if self.doTimeDependentGut:
             D = np.arange(self.D0Gut.get(), self.DFGut.get(), (self.DFGut.get()-self.D0Gut.get())/100)
             I = D/(250*self.MWGut.get())*1e6 # I [uM]
-            KiList = self.parseList(self.KiReversibleGut.get())
-            kdegList = self.parseList(self.kdegGut.get())
-            kinactList = self.parseList(self.kinactGut.get())
-            for Ki in KiList:
-                for kdeg in kdegList:
-                    for kinact in kinactList:
-                        legend="Gut Time Dep. Inh. Ki=%f [uM], kdeg=%f [min^-1], kinact=%f [min^-1]"%(Ki,kdeg,kinact)
-                        print("Simulating %s"%legend)
-                        R.append((I,1+kinact/kdeg*I/(Ki+I)))
-                        Rlegends.append(legend)
-                        Type.append('TimeDependentGut')
+            grid = factorialGrid([self.parseList(self.KiReversibleGut.get()), self.parseList(self.kdegGut.get()),
+                                  self.parseList(self.kinactGut.get())])
+            Ki, kdeg, kinact = [column[:,np.newaxis] for column in grid]
+            self.addProfiles(R, 'TimeDependentGut', I, 1+kinact/kdeg*I/(Ki+I),
+                             "Gut Time Dep. Inh. Ki=%f [uM], kdeg=%f [min^-1], kinact=%f [min^-1]", grid)
 
         if self.doInductionLiver:
             I = np.arange(self.I0Liver.get(), self.IFLiver.get(), (self.IFLiver.get()-self.I0Liver.get())/100) # I [ng/mL]
             I /= self.MWLiver.get() # I [uM]
-            EC50List = self.parseList(self.EC50Liver.get())
-            EmaxList = self.parseList(self.EmaxLiver.get())
-            dList = self.parseList(self.dLiver.get())
-            for EC50 in EC50List:
-                for Emax in EmaxList:
-                    for d in dList:
-                        legend="Liver Induction EC50=%f [uM], Emax=%f, d=%f"%(EC50,Emax,d)
-                        print("Simulating %s"%legend)
-                        R.append((I,1/(1+d*Emax*I/(EC50+I))))
-                        Rlegends.append(legend)
-                        Type.append('InductionLiver')
+            grid = factorialGrid([self.parseList(self.EC50Liver.get()), self.parseList(self.EmaxLiver.get()),
+                                  self.parseList(self.dLiver.get())])
+            EC50, Emax, d = [column[:,np.newaxis] for column in grid]
+            self.addProfiles(R, 'InductionLiver', I, 1/(1+d*Emax*I/(EC50+I)),
+                             "Liver Induction EC50=%f [uM], Emax=%f, d=%f", grid)
 
         if self.doInductionGut:
             D = np.arange(self.D0Gut.get(), self.DFGut.get(), (self.DFGut.get()-self.D0Gut.get())/100)
             I = D/(250*self.MWGut.get())*1e6 # I [uM]
-            EC50List = self.parseList(self.EC50Gut.get())
-            EmaxList = self.parseList(self.EmaxGut.get())
-            dList = self.parseList(self.dGut.get())
-            for EC50 in EC50List:
-                for Emax in EmaxList:
-                    for d in dList:
-                        legend="Induction EC50=%f [uM], Emax=%f, d=%f"%(EC50,Emax,d)
-                        print("Simulating %s"%legend)
-                        R.append((I,1/(1+d*Emax*I/(EC50+I))))
-                        Rlegends.append(legend)
-                        Type.append('InductionGut')
+            grid = factorialGrid([self.parseList(self.EC50Gut.get()), self.parseList(self.EmaxGut.get()),
+                                  self.parseList(self.dGut.get())])
+            EC50, Emax, d = [column[:,np.newaxis] for column in grid]
+            self.addProfiles(R, 'InductionGut', I, 1/(1+d*Emax*I/(EC50+I)),
+                             "Induction EC50=%f [uM], Emax=%f, d=%f", grid)
 
         if self.doStatic:
-            KiList = self.parseList(self.KiStatic.get())
-            EmaxList = self.parseList(self.EmaxStatic.get())
-            EC50List = self.parseList(self.EC50Static.get())
-            kinactList = self.parseList(self.kinactStatic.get())
-            dList = self.parseList(self.dStatic.get())
+            staticLists = [self.parseList(self.KiStatic.get()), self.parseList(self.EmaxStatic.get()),
+                           self.parseList(self.EC50Static.get()), self.parseList(self.kinactStatic.get()),
+                           self.parseList(self.dStatic.get())]
             if self.doStaticLiver:
-                kdeghList = self.parseList(self.kdeghStatic.get())
                 fm=self.fm.get()
                 if self.doPhysiological:
                     D = np.arange(self.D0Phys.get(), self.DFPhys.get(), (self.DFPhys.get()-self.D0Phys.get())/100)
@@ -288,25 +256,16 @@ class ProtPKPDSimulateDrugInteractions(ProtPKPD):
                 else:
                     Ih = np.arange(self.Ih0.get(), self.IhF.get(), (self.IhF.get()-self.Ih0.get())/100)
                 Ih/= self.MWStatic.get()
-                for Ki in KiList:
-                    for Emax in EmaxList:
-                        for EC50 in EC50List:
-                            for kinact in kinactList:
-                                for d in dList:
-                                    for kdegh in kdeghList:
-                                        Ah = kdegh/(kdegh+Ih*kinact/(Ih+Ki))
-                                        Bh = 1+d*Emax*Ih/(Ih+EC50)
-                                        Ch = 1/(1+Ih/Ki)
-
-                                        legend="Static Liver Ki=%f [uM], EC50=%f [uM], Emax=%f, kinact=%f [min^-1], d=%f, kdegh=%f [min^-1]"%\
-                                               (Ki,EC50,Emax,kinact,d,kdegh)
-                                        print("Simulating %s"%legend)
-                                        R.append((Ih,1/(Ah*Bh*Ch*fm+(1-fm))))
-                                        Rlegends.append(legend)
-                                        Type.append('StaticLiver')
+                grid = factorialGrid(staticLists+[self.parseList(self.kdeghStatic.get())])
+                Ki, Emax, EC50, kinact, d, kdegh = [column[:,np.newaxis] for column in grid]
+                Ah = kdegh/(kdegh+Ih*kinact/(Ih+Ki))
+                Bh = 1+d*Emax*Ih/(Ih+EC50)
+                Ch = 1/(1+Ih/Ki)
+                self.addProfiles(R, 'StaticLiver', Ih, 1/(Ah*Bh*Ch*fm+(1-fm)),
+                                 "Static Liver Ki=%f [uM], EC50=%f [uM], Emax=%f, kinact=%f [min^-1], d=%f, kdegh=%f [min^-1]",
+                                 [grid[0],grid[2],grid[1],grid[3],grid[4],grid[5]])
 
             if self.doStaticGut:
-                kdeggList = self.parseList(self.kdeggStatic.get())
                 if self.doPhysiological:
                     D = np.arange(self.D0Phys.get(), self.DFPhys.get(), (self.DFPhys.get()-self.D0Phys.get())/100)
                     Ig = self.Fa.get()*self.ka.get()*D/self.Qen.get()
@@ -314,68 +273,41 @@ class ProtPKPDSimulateDrugInteractions(ProtPKPD):
                     Ig = np.arange(self.Ig0.get(), self.IgF.get(), (self.IgF.get()-self.Ig0.get())/100)
                 Ig/= self.MWStatic.get()
                 fg=self.fg.get()
-                for Ki in KiList:
-                    for Emax in EmaxList:
-                        for EC50 in EC50List:
-                            for kinact in kinactList:
-                                for d in dList:
-                                    for kdegg in kdeggList:
-                                        Ag = kdegg/(kdegg+Ig*kinact/(Ig+Ki))
-                                        Bg = 1+d*Emax*Ig/(Ig+EC50)
-                                        Cg = 1/(1+Ig/Ki)
-
-                                        legend="Static Gut Ki=%f [uM], EC50=%f [uM], Emax=%f, kinact=%f [min^-1], d=%f, kdegg=%f [min^-1]"%\
-                                               (Ki,EC50,Emax,kinact,d,kdegg)
-                                        print("Simulating %s"%legend)
-                                        R.append((Ig,1/(Ag*Bg*Cg*fg+(1-fg))))
-                                        Rlegends.append(legend)
-                                        Type.append('StaticGut')
+                grid = factorialGrid(staticLists+[self.parseList(self.kdeggStatic.get())])
+                Ki, Emax, EC50, kinact, d, kdegg = [column[:,np.newaxis] for column in grid]
+                Ag = kdegg/(kdegg+Ig*kinact/(Ig+Ki))
+                Bg = 1+d*Emax*Ig/(Ig+EC50)
+                Cg = 1/(1+Ig/Ki)
+                self.addProfiles(R, 'StaticGut', Ig, 1/(Ag*Bg*Cg*fg+(1-fg)),
+                                 "Static Gut Ki=%f [uM], EC50=%f [uM], Emax=%f, kinact=%f [min^-1], d=%f, kdegg=%f [min^-1]",
+                                 [grid[0],grid[2],grid[1],grid[3],grid[4],grid[5]])
 
         if self.doTransporterGut:
             D = np.arange(self.D0TransporterGut.get(), self.DFTransporterGut.get(), (self.DFTransporterGut.get()-self.D0TransporterGut.get())/100)
             I = D/(250*self.MWTransporterGut.get())*1e6 # I [uM]
-            KiList = self.parseList(self.KiTransporterGut.get())
-            for Ki in KiList:
-                legend="Gut Transporter Ki=%f [uM]"%Ki
-                print("Simulating %s"%legend)
-                R.append((I,1+I/Ki))
-                Rlegends.append(legend)
-                Type.append('TransporterGut')
+            Ki, = factorialGrid([self.parseList(self.KiTransporterGut.get())])
+            self.addProfiles(R, 'TransporterGut', I, 1+I/Ki[:,np.newaxis],
+                             "Gut Transporter Ki=%f [uM]", [Ki])
 
         if self.doTransporterLiver:
             I = np.arange(self.I0TransporterLiver.get(), self.IFTransporterLiver.get(), (self.IFTransporterLiver.get()-self.I0TransporterLiver.get())/100)
-            KiList = self.parseList(self.KiTransporterLiver.get())
-            for Ki in KiList:
-                legend="Liver Transporter Ki=%f [uM]"%Ki
-                print("Simulating %s"%legend)
-                R.append((I,1+I/Ki))
-                Rlegends.append(legend)
-                Type.append('TransporterLiver')
+            Ki, = factorialGrid([self.parseList(self.KiTransporterLiver.get())])
+            self.addProfiles(R, 'TransporterLiver', I, 1+I/Ki[:,np.newaxis],
+                             "Liver Transporter Ki=%f [uM]", [Ki])
 
         if self.doTransporterRenal:
             I = np.arange(self.I0TransporterRenal.get(), self.IFTransporterRenal.get(), (self.IFTransporterRenal.get()-self.I0TransporterRenal.get())/100)
-            KiList = self.parseList(self.KiTransporterRenal.get())
-            for Ki in KiList:
-                legend="Renal Transporter Ki=%f [uM]"%Ki
-                print("Simulating %s"%legend)
-                R.append((I,1+I/Ki))
-                Rlegends.append(legend)
-                Type.append('TransporterRenal')
+            Ki, = factorialGrid([self.parseList(self.KiTransporterRenal.get())])
+            self.addProfiles(R, 'TransporterRenal', I, 1+I/Ki[:,np.newaxis],
+                             "Renal Transporter Ki=%f [uM]", [Ki])
 
         if len(R)>0:
             fh=open(self._getPath("profiles.txt"),'w')
             fhSummary=open(self._getPath("summary.txt"),"w")
-            for toPlot, legend, plotType in izip(R,Rlegends,Type):
+            for plotType, legend, I, Ri in R:
                 fh.write(plotType+"::"+legend+"\n")
                 fhSummary.write("Simulated %s:: %s\n"%(plotType,legend))
-                if len(toPlot)==2:
-                    I, Ri = toPlot
-                    for n in range(I.size):
-                        fh.write("%f %f\n"%(I[n],Ri[n]))
-                else:
-                    Ig, Ih, Ri = toPlot
-                    for n in range(Ig.size):
-                        fh.write("%f %f %f\n"%(Ig[n],Ih[n],Ri[n]))
+                np.savetxt(fh, np.column_stack((I,Ri)), fmt="%f")
                 fh.write("\n")
             fh.close()
             fhSummary.close()
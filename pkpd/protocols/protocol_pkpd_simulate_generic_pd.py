@@ -207,6 +207,7 @@ class ProtPKPDSimulateGenericPD(ProtPKPD):
 
     def createOutputStep(self):
         self.experiment.write(self._getPath("experiment.pkpd"))
+        self.waitForExcelExports()
         self._defineOutputs(outputFitting=self.experiment)
         self._defineSourceRelation(self.inputExperiment, self.experiment)
 
@@ -24,17 +24,16 @@
 # *
 # **************************************************************************
 
-try:
-    from itertools import izip
-except ImportError:
-    izip = zip
 import numpy as np
+from numpy.lib.format import open_memmap
 import os
 
 import pyworkflow.protocol.params as params
+from pyworkflow.protocol.constants import LEVEL_ADVANCED
 from .protocol_pkpd import ProtPKPD
 from pkpd.objects import PKPDODEModel
 from pkpd.biopharmaceutics import DrugSource, createDeltaDose, createVia
+from pkpd.utils import factorialGrid, factorialGridSize
 
 
 class PKPDLiver(PKPDODEModel):
@@ -58,15 +57,10 @@ class PKPDLiver(PKPDODEModel):
 
     def G(self, t, dD):
         Vinlet=self.parameters[4]
-        return np.array([0.0,dD/Vinlet,0.0],np.double)
+        return np.array([0.0*dD,dD/Vinlet,0.0*dD],np.double)
 
     def imposeConstraints(self, yt):
-        if yt[0]<0:
-            yt[0]=0
-        if yt[1]<0:
-            yt[1]=0
-        if yt[2]<0:
-            yt[2]=0
+        yt[yt<0]=0
 
     def getResponseDimension(self):
         return 3
@@ -94,6 +88,29 @@ class PKPDLiverEV1():
         self.drugSource.setParameters(params[0:self.NparametersSource])
         return self.model.forwardModel(params[self.NparametersSource:],t)
 
+    def simulateBatch(self,params,doseAmounts,t):
+        # One simulation per row of params, each one with its own dose. The release of a unit dose is computed
+        # once per distinct set of absorption parameters and it is scaled by the dose of each simulation
+        self.setDose(1.0)
+        self.batchSource = PKPDLiverReleaseTable(self.drugSource, params[:,0:self.NparametersSource], doseAmounts)
+        return self.model.forwardModelBatch(params[:,self.NparametersSource:],[t]*self.model.getResponseDimension(),
+                                            self.batchSource)
+
+
+class PKPDLiverReleaseTable():
+    def __init__(self, drugSource, sourceParameters, doseAmounts):
+        self.drugSource = drugSource
+        self.sourceParameters, self.sourceIdx = np.unique(sourceParameters, axis=0, return_inverse=True)
+        self.sourceIdx = self.sourceIdx.ravel()
+        self.doseAmounts = doseAmounts
+
+    def getAmountReleasedOnGrid(self, tgrid, dt):
+        unitRelease = np.zeros((len(tgrid),self.sourceParameters.shape[0]))
+        for n in range(self.sourceParameters.shape[0]):
+            self.drugSource.setParameters(self.sourceParameters[n])
+            unitRelease[:,n] = self.drugSource.getAmountReleasedOnGrid(tgrid,dt)
+        return unitRelease[:,self.sourceIdx]*self.doseAmounts
+
 
 class ProtPKPDSimulateLiverFlow(ProtPKPD):
     """ Simulate the concentration of a compound (typically an enzyme inhibitor) at liver.\n
@@ -105,6 +122,12 @@ class ProtPKPDSimulateLiverFlow(ProtPKPD):
     def _defineParams(self, form, fullForm=True):
         form.addSection('Input')
         form.addParam('tF', params.FloatParam, default=8, label='Max. simulation time [h]')
+        form.addParam('profileSampling', params.IntParam, default=10, label='Profile sampling [min]',
+                      expertLevel=LEVEL_ADVANCED,
+                      help='The simulations are always computed every minute and the Cmax, Tmax and AUC of each '
+                           'compartment are stored for all of them. The concentration profiles are also stored every '
+                           'this number of minutes. Set it to 0 to store only the summaries, which is the only option '
+                           'for large grids')
 
         group = form.addGroup("Absorption")
         group.addParam("weight", params.StringParam, default=70, label="Weight [kg]")
@@ -130,64 +153,109 @@ class ProtPKPDSimulateLiverFlow(ProtPKPD):
         self._insertFunctionStep('runSimulate')
 
     #--------------------------- STEPS functions --------------------------------------------
+    gridParameters = ['weight', 'dose', 'Fa', 'ka', 'Vsys', 'ClNH', 'fb', 'Kp', 'Vinlet', 'Vliver', 'Qh', 'Clint']
+    compartmentNames = ['Iliver', 'Iinlet', 'Isys']
+    summaryNames = ['Cmax [mg/mL]', 'Tmax [h]', 'AUC [mg/mL*h]']
+    blockSize = 512 # Simulations integrated at once
+    maxLegends = 1000 # Simulations that are listed in the summary
+    maxProfileBytes = 4*1024**3 # Largest profile file that can be written
+
     def parseList(self, strList):
-        return [float(v) for v in strList.split(' ')]
+        return [float(v) for v in str(strList).split()]
+
+    def getValueLists(self):
+        return [self.parseList(getattr(self,prmName).get()) for prmName in self.gridParameters]
+
+    def getLegend(self, values):
+        return "Weight=%f Dose=%f Fa=%f ka=%f Vsys=%f ClNH=%f fb=%f Kp=%f Vinlet=%f Vliver=%f Qh=%f Clint=%f"%\
+               tuple(values)
+
+    def getSimulationLegend(self, n):
+        """ Parameters of the n-th simulation (0-based), they are regenerated from the grid """
+        return self.getLegend([column[0] for column in factorialGrid(self.getValueLists(), n, n+1)])
+
+    def getTimeGrid(self):
+        return np.arange(0.0, self.tF.get()*60, 1)
+
+    def getProfileTimes(self):
+        """ Times [min] at which the profiles are stored """
+        return self.getTimeGrid()[::self.profileSampling.get()]
 
     def runSimulate(self):
         model = PKPDLiverEV1()
         model.setTimeRange(self.tF.get())
-        t = np.arange(0.0, self.tF.get()*60, 1)
-
-        I = []
-        legends = []
-        weightList = self.parseList(self.weight.get())
-        doseList = self.parseList(self.dose.get())
-        FaList = self.parseList(self.Fa.get())
-        kaList = self.parseList(self.ka.get())
-        VsysList = self.parseList(self.Vsys.get())
-        ClNHList = self.parseList(self.ClNH.get())
-        fbList = self.parseList(self.fb.get())
-        KpList = self.parseList(self.Kp.get())
-        VinletList = self.parseList(self.Vinlet.get())
-        VliverList = self.parseList(self.Vliver.get())
-        QhList = self.parseList(self.Qh.get())
-        ClintList = self.parseList(self.Clint.get())
-        for weight in weightList:
-            for dose in doseList:
-                for Fa in FaList:
-                    for ka in kaList:
-                        for Vsys in VsysList:
-                            for ClNH in ClNHList:
-                                for fb in fbList:
-                                    for Kp in KpList:
-                                        for Vinlet in VinletList:
-                                            for Vliver in VliverList:
-                                                for Qh in QhList:
-                                                    for Clint in ClintList:
-                                                        legend="Weight=%f Dose=%f Fa=%f ka=%f Vsys=%f ClNH=%f fb=%f Kp=%f Vinlet=%f Vliver=%f Qh=%f Clint=%f"%\
-                                                               (weight, dose, Fa, ka, Vsys, ClNH, fb, Kp, Vinlet, Vliver, Qh, Clint)
-                                                        print("Simulating %s"%legend)
-                                                        legends.append(legend)
-                                                        model.setDose(Fa*dose*weight)
-                                                        Ii = model.simulate([ka,Vsys*weight,ClNH*weight,fb,Kp,
-                                                                             Vinlet*weight,Vliver*weight,Qh*weight*model.model.deltaT,
-                                                                             Clint*weight],t)
-                                                        I.append((t,Ii))
-
-        if len(I)>0:
-            fh=open(self._getPath("profiles.txt"),'w')
-            fhSummary=open(self._getPath("summary.txt"),"w")
-            for toPlot, legend in izip(I,legends):
-                fh.write("SimulateLiver::"+legend+"\n")
-                fhSummary.write("Simulated %s\n"%(legend))
-                t, I3 = toPlot
-                for n in range(t.size):
-                    fh.write("%f %f %f %f\n"%(t[n],I3[0][n],I3[1][n],I3[2][n]))
-                fh.write("\n")
-            fh.close()
-            fhSummary.close()
+        t = self.getTimeGrid()
+
+        valueLists = self.getValueLists()
+        Nsimulations = factorialGridSize(valueLists)
+        if Nsimulations==0:
+            return
+
+        # The grid is simulated in blocks. Only the summaries of each simulation (and optionally its profile at a
+        # coarser sampling) are stored, the parameters of each simulation are regenerated from the grid when needed
+        Ncompartments = model.model.getResponseDimension()
+        summaries = open_memmap(self._getPath("summaries.npy"), mode='w+', dtype=np.float32,
+                                shape=(Nsimulations,Ncompartments,len(self.summaryNames)))
+        profiles = None
+        if self.profileSampling.get()>0:
+            profiles = open_memmap(self._getPath("profiles.npy"), mode='w+', dtype=np.float32,
+                                   shape=(Nsimulations,Ncompartments,self.getProfileTimes().size))
+        fhSummary=open(self._getPath("summary.txt"),"w")
+        fhSummary.write("Simulated %d combinations of parameters\n"%Nsimulations)
+        for i0 in range(0, Nsimulations, self.blockSize):
+            i1 = min(i0+self.blockSize, Nsimulations)
+            weight, dose, Fa, ka, Vsys, ClNH, fb, Kp, Vinlet, Vliver, Qh, Clint = factorialGrid(valueLists, i0, i1)
+            for i in range(i0, min(i1, self.maxLegends)):
+                legend = self.getLegend([column[i-i0] for column in (weight, dose, Fa, ka, Vsys, ClNH, fb, Kp,
+                                                                      Vinlet, Vliver, Qh, Clint)])
+                print("Simulating %s"%legend)
+                fhSummary.write("Simulation %d: %s\n"%(i+1,legend))
+            print("Simulating combinations %d to %d of %d"%(i0, i1-1, Nsimulations))
+            I3 = np.stack(model.simulateBatch(np.column_stack((ka,Vsys*weight,ClNH*weight,fb,Kp,
+                                                               Vinlet*weight,Vliver*weight,Qh*weight*model.model.deltaT,
+                                                               Clint*weight)),Fa*dose*weight,t), axis=1)
+            summaries[i0:i1,:,0] = np.max(I3, axis=2)
+            summaries[i0:i1,:,1] = t[np.argmax(I3, axis=2)]/60
+            summaries[i0:i1,:,2] = np.trapz(I3, t, axis=2)/60
+            if profiles is not None:
+                profiles[i0:i1] = I3[:,:,::self.profileSampling.get()]
+        if Nsimulations>self.maxLegends:
+            fhSummary.write("...\n")
+
+        # Simulations with the largest concentration at each compartment
+        for n, compartment in enumerate(self.compartmentNames):
+            iMax = 0
+            for i0 in range(0, Nsimulations, self.blockSize*self.blockSize):
+                i1 = min(i0+self.blockSize*self.blockSize, Nsimulations)
+                iBlock = i0+int(np.argmax(summaries[i0:i1,n,0]))
+                if summaries[iBlock,n,0]>summaries[iMax,n,0]:
+                    iMax = iBlock
+            fhSummary.write("Largest %s Cmax=%f mg/mL at simulation %d: %s\n"%
+                            (compartment, summaries[iMax,n,0], iMax+1, self.getSimulationLegend(iMax)))
+        fhSummary.close()
+        summaries.flush()
+        del summaries
+        if profiles is not None:
+            profiles.flush()
+            del profiles
 
     #--------------------------- INFO functions --------------------------------------------
+    def _validate(self):
+        errors = []
+        if self.profileSampling.get()<0:
+            errors.append("The profile sampling cannot be negative")
+        elif self.profileSampling.get()>0:
+            try:
+                profileBytes = 4*factorialGridSize(self.getValueLists())*len(self.compartmentNames)*\
+                               self.getProfileTimes().size
+            except ValueError:
+                return ["The values of the grid must be numbers separated by spaces"]
+            if profileBytes>self.maxProfileBytes:
+                errors.append("The profiles of all simulations would take %d GB. Increase the profile sampling or "
+                              "set it to 0 to store only the Cmax, Tmax and AUC of each simulation"%
+                              (profileBytes//1024**3))
+        return errors
+
     def _summary(self):
         msg=[]
         if os.path.exists(self._getPath("summary.txt")):
@@ -55,6 +55,7 @@ class ProtPKPDSplitGather(ProtPKPD):
     def createSubGroup(self, g, experiment, listOfSamples):
         newExperiment = experiment.subset(listOfSamples)
         self.writeExperiment(newExperiment, self._getPath("experiment%05d.pkpd"%g))
+        self.waitForExcelExports()
         self._defineOutputs(**{"outputExperiment%d"%g: newExperiment})
         self._defineSourceRelation(self.inputExperiment, newExperiment)
 
@@ -76,6 +77,7 @@ class ProtPKPDSplitGather(ProtPKPD):
             for ptrExperiment in self.inputExperiments:
                 newExperiment.gather(self.readExperiment(ptrExperiment.get().fnPKPD))
             self.writeExperiment(newExperiment, self._getPath("experiment.pkpd"))
+            self.waitForExcelExports()
             self._defineOutputs(outputExperiment=newExperiment)
             for ptrExperiment in self.inputExperiments:
                 self._defineSourceRelation(ptrExperiment, newExperiment)
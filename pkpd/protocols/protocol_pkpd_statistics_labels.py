@@ -55,22 +55,19 @@ class ProtPKPDStatisticsLabel(ProtPKPD):
         fnStatistics = self._getPath("statistics.txt")
         fhOut = open(fnStatistics,'w')
 
+        table = experiment.getDescriptorTable()
         for varName, variable in experiment.variables.items():
             if variable.role == PKPDVariable.ROLE_LABEL:
-                varValues = experiment.getSubGroupLabels("True",varName)
                 if variable.varType == PKPDVariable.TYPE_TEXT:
                     self.doublePrint(fhOut,"%s ------------"%varName)
-                    counter = {}
-                    for value in varValues:
-                        if value in counter:
-                            counter[value]+=1
-                        else:
-                            counter[value]=1
-                    for value in counter:
-                        self.doublePrint(fhOut,"Value=%s Total count=%d (%f%%)"%(value,counter[value],100*float(counter[value])/len(varValues)))
+                    keys, groupIdx = table.groupby(varName, dropMissing=False)
+                    counter = np.bincount(groupIdx, minlength=len(keys))
+                    for key, count in zip(keys, counter):
+                        self.doublePrint(fhOut,"Value=%s Total count=%d (%f%%)"%(key[0],count,100*float(count)/len(table)))
                 elif variable.varType == PKPDVariable.TYPE_NUMERIC:
                     self.doublePrint(fhOut,"%s [%s] ------------"%(varName,strUnit(variable.units.unit)))
-                    varValues = np.asarray(varValues,np.double)
+                    varValues, valid = table.getColumn(varName)
+                    varValues = varValues[valid]
                     self.doublePrint(fhOut,"Number of observations= %d"%len(varValues))
                     self.doublePrint(fhOut,"Range=    [%f,%f]"%(np.min(varValues),np.max(varValues)))
                     self.doublePrint(fhOut,"Mean=     %f"%np.mean(varValues))
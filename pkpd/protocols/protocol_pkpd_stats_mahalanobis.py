@@ -26,13 +26,14 @@
 
 import numpy as np
 from scipy import stats
-from scipy.interpolate import InterpolatedUnivariateSpline
+from scipy.linalg import solve_triangular
 from scipy.spatial import distance
 
 
 import pyworkflow.protocol.params as params
+from pyworkflow.protocol.constants import LEVEL_ADVANCED
 from .protocol_pkpd import ProtPKPD
-from pkpd.utils import upper_tri_masking, uniqueFloatValues
+from pkpd.utils import uniqueFloatValues, interpLinear
 
 # Tested in test_workflow_levyplot.py
 
@@ -66,6 +67,9 @@ class ProtPKPDStatsMahalanobis(ProtPKPD):
         form.addParam('resampleT', params.FloatParam, label="Resample profiles (time step)", default=-1,
                       help='Resample the input profiles at this time step (make sure it is in the same units as the input). '
                            'Leave it to -1 for no resampling. This is only valid when the label to compare is a measurement.')
+        form.addParam('maxPairs', params.IntParam, label="Maximum number of pairs", default=-1, expertLevel=LEVEL_ADVANCED,
+                      help='If there are more pairs of samples than this number, a random subset of pairs of this size '
+                           '(approximately) is used for the distance distributions. Leave it to -1 to use all pairs.')
 
     #--------------------------- INSERT steps functions --------------------------------------------
 
@@ -101,11 +105,7 @@ class ProtPKPDStatsMahalanobis(ProtPKPD):
     def getValues(self,experiment,expression):
         allX=[]
         if self.analysisType(experiment)==0: # All labels
-            for label in self.getLabels():
-                x1 = [float(x) for x in experiment.getSubGroupLabels(expression, label)]
-                allX.append(x1)
-            X = np.asarray(allX, dtype=np.double)
-            return np.transpose(X)
+            return experiment.getSubGroupColumns(expression, self.getLabels())
         else: # A measurement
             Ylabel=self.getLabels()[0]
             Xlabel=experiment.getTimeVariable()
@@ -118,12 +118,12 @@ class ProtPKPDStatsMahalanobis(ProtPKPD):
                 maxX=max(maxX,np.max(x))
                 temp.append((x[0],y[0]))
 
+            if self.resampleT.get()>0:
+                xp = np.arange(minX, maxX + self.resampleT.get(), self.resampleT.get())
             for x,y in temp:
                 if self.resampleT.get()>0:
                     x,y = uniqueFloatValues(x, y)
-                    B = InterpolatedUnivariateSpline(x, y, k=1)
-                    xp = np.arange(minX, maxX + self.resampleT.get(), self.resampleT.get())
-                    y = B(xp)
+                    y = interpLinear(xp, x, y)
                 allX.append(y)
             X = np.asarray(allX, dtype=np.double)
 
@@ -131,12 +131,22 @@ class ProtPKPDStatsMahalanobis(ProtPKPD):
             X=X[:,v>0] # Remove columns with no variance
             return X
 
+    # Distances are computed in blocks of about this number of pairs
+    blockPairs = 4000000
+    # Distributions with up to this number of distances are analyzed exactly, larger ones through histograms
+    maxPairsInMemory = 10000000
+    # Number of bins of the histograms used for large distributions
+    Nbins = 65536
+
     def printStats(self,allF,Fstr,explanation):
-        allF=[f for f in allF if not np.isnan(f)]
-        mu=np.mean(allF)
-        sigma = np.std(allF)
         alpha=1-95/100.0
-        percentiles = np.percentile(allF,[0, alpha/2*100, 25, 50, 75, (1-alpha/2)*100, 100])
+        if isinstance(allF, dict):
+            mu, sigma, percentiles = self.getHistogramStats(allF)
+        else:
+            allF=allF[~np.isnan(allF)]
+            mu=np.mean(allF)
+            sigma = np.std(allF)
+            percentiles = np.percentile(allF,[0, alpha/2*100, 25, 50, 75, (1-alpha/2)*100, 100])
         retval=""
         retval +="%s (%s)\n"%(Fstr,explanation)
         retval +="%s mean+-std: %f+-%f\n"%(Fstr,mu,sigma)
@@ -146,6 +156,101 @@ class ProtPKPDStatsMahalanobis(ProtPKPD):
         retval +="%s percentile 50%%: %f\n"%(Fstr,percentiles[3])
         return retval
 
+    def computeDistances(self, Za, Zb, fnOut, triangular, scale=1.0):
+        # Euclidean distances between the rows of Za and Zb (only i<j if triangular), computed in blocks of rows.
+        # They are written to fnOut (float32) and, if they are not too many, they are also returned in memory.
+        # Otherwise, a dictionary with the number of distances, their sum, sum of squares, minimum and maximum
+        # is returned
+        na = Za.shape[0]
+        nb = Zb.shape[0]
+        Npairs = na*(na-1)//2 if triangular else na*nb
+        pKeep = 1.0
+        if self.maxPairs.get()>0 and Npairs>self.maxPairs.get():
+            pKeep = float(self.maxPairs.get())/Npairs
+        inMemory = Npairs*pKeep<=self.maxPairsInMemory
+        Nrows = max(1, int(self.blockPairs//max(nb,1)))
+
+        allD = []
+        summary = {'fn': fnOut, 'N': 0, 'sum': 0.0, 'sum2': 0.0, 'min': np.inf, 'max': -np.inf}
+        fh = open(fnOut, 'wb')
+        for i0 in range(0, na, Nrows):
+            i1 = min(i0+Nrows, na)
+            if triangular:
+                D = distance.cdist(Za[i0:i1], Zb[i0:], 'euclidean')
+                D = D[np.arange(i0, i1)[:,None] < np.arange(i0, nb)[None,:]]
+            else:
+                D = distance.cdist(Za[i0:i1], Zb, 'euclidean').flatten()
+            if scale!=1.0:
+                D *= scale
+            if pKeep<1.0:
+                D = D[np.random.uniform(size=D.size)<pKeep]
+            D.astype(np.float32).tofile(fh)
+            if inMemory:
+                allD.append(D)
+            else:
+                Dvalid = D[~np.isnan(D)]
+                if Dvalid.size>0:
+                    summary['N'] += Dvalid.size
+                    summary['sum'] += np.sum(Dvalid)
+                    summary['sum2'] += np.sum(Dvalid*Dvalid)
+                    summary['min'] = min(summary['min'], np.min(Dvalid))
+                    summary['max'] = max(summary['max'], np.max(Dvalid))
+        fh.close()
+        if inMemory:
+            return np.concatenate(allD) if len(allD)>0 else np.zeros(0)
+        return summary
+
+    def getHistogram(self, summary, edges):
+        # Histogram of the distances stored in the file of the summary, read in blocks
+        counts = np.zeros(len(edges)-1, dtype=np.int64)
+        D = np.memmap(summary['fn'], dtype=np.float32, mode='r')
+        for i0 in range(0, D.size, self.blockPairs):
+            Di = np.asarray(D[i0:i0+self.blockPairs], dtype=np.float64)
+            counts += np.histogram(Di[~np.isnan(Di)], edges)[0]
+        return counts
+
+    def getHistogramStats(self, summary):
+        N = summary['N']
+        mu = summary['sum']/N
+        sigma = np.sqrt(max(summary['sum2']/N-mu*mu, 0.0))
+        edges = np.linspace(summary['min'], summary['max'], self.Nbins+1)
+        cdf = np.cumsum(self.getHistogram(summary, edges))
+        alpha=1-95/100.0
+        percentiles = [summary['min']]
+        for q in [alpha/2, 0.25, 0.5, 0.75, 1-alpha/2]:
+            # Linear interpolation within the bin where the quantile falls
+            target = q*(N-1)+1
+            k = min(int(np.searchsorted(cdf, target)), len(cdf)-1)
+            previous = cdf[k-1] if k>0 else 0
+            inBin = cdf[k]-previous
+            fraction = (target-previous)/inBin if inBin>0 else 0.0
+            percentiles.append(edges[k]+min(max(fraction,0.0),1.0)*(edges[k+1]-edges[k]))
+        percentiles.append(summary['max'])
+        return mu, sigma, percentiles
+
+    def ksTest(self, D11, D12):
+        if not isinstance(D11, dict) and not isinstance(D12, dict):
+            return stats.ks_2samp(D11, D12)
+        # Two-sample Kolmogorov-Smirnov test from the histograms of both distributions on the same bins
+        summaries = []
+        for Di in [D11, D12]:
+            if isinstance(Di, dict):
+                summaries.append(Di)
+            else:
+                Dvalid = Di[~np.isnan(Di)]
+                fn = self._getTmpPath("distances.bin")
+                Dvalid.astype(np.float32).tofile(fn)
+                summaries.append({'fn': fn, 'N': Dvalid.size, 'min': np.min(Dvalid), 'max': np.max(Dvalid)})
+        edges = np.linspace(min(summaries[0]['min'], summaries[1]['min']), max(summaries[0]['max'], summaries[1]['max']),
+                            self.Nbins+1)
+        cdf1 = np.cumsum(self.getHistogram(summaries[0], edges))/float(summaries[0]['N'])
+        cdf2 = np.cumsum(self.getHistogram(summaries[1], edges))/float(summaries[1]['N'])
+        D = np.max(np.abs(cdf1-cdf2))
+        n1 = summaries[0]['N']
+        n2 = summaries[1]['N']
+        pval = stats.kstwo.sf(D, np.round(n1*n2/float(n1+n2)))
+        return D, pval
+
     def runCompare(self, objId1, labels, expression1, expression2):
         fh = open(self._getPath("report.txt"),'w')
 
@@ -163,35 +268,38 @@ class ProtPKPDStatsMahalanobis(ProtPKPD):
 
         try:
             self.printSection("Results")
-            C1 = np.cov(np.transpose(X1))
-            if np.abs(np.linalg.det(C1))<1e-10:
+            C1 = np.atleast_2d(np.cov(np.transpose(X1)))
+            L1 = None
+            if np.abs(np.linalg.det(C1))>=1e-10:
+                try:
+                    L1 = np.linalg.cholesky(C1)
+                except np.linalg.LinAlgError:
+                    pass
+            if L1 is None:
                 distanceStr='Euclidean'
                 self.doublePrint(fh,"The covariance matrix is singular (either there is a column of the data that is always the same or not enough data to define the covariance)")
                 self.doublePrint(fh,"Using Euclidean distance instead")
-                D11 = upper_tri_masking(distance.cdist(X1, X1, 'euclidean'))
-                D11/= X1.shape[1]
+                scale = 1.0/X1.shape[1]
+                Z1 = X1
+                Z2 = X2
             else:
+                # With C1=L1*L1^T, the Mahalanobis distance is the Euclidean distance between the whitened
+                # vectors z=L1^-1*x
                 distanceStr='Mahalanobis'
-                C1inv = np.linalg.inv(C1)
-                D11 = upper_tri_masking(distance.cdist(X1,X1,'mahalanobis',VI=C1inv))
-
-            np.savetxt(self._getExtraPath("D11.txt"),D11)
+                scale = 1.0
+                Z1 = solve_triangular(L1, np.transpose(X1), lower=True).T
+                Z2 = solve_triangular(L1, np.transpose(X2), lower=True).T if X2 is not None else None
 
+            D11 = self.computeDistances(Z1, Z1, self._getExtraPath("D11.bin"), True, scale)
             str11 = self.printStats(D11, "D11", "%s distance Set 1 vs Set1"%distanceStr)
             self.doublePrint(fh, str11)
             if X2 is not None:
                 self.doublePrint(fh, "---------------------------")
-                if distanceStr=='Mahalanobis':
-                    D12 = distance.cdist(X1,X2,'mahalanobis',VI=C1inv).flatten()
-                    D12 /= X1.shape[1]
-                else:
-                    D12 = distance.cdist(X1, X2, 'euclidean').flatten()
-                np.savetxt(self._getExtraPath("D12.txt"),D12)
-
+                D12 = self.computeDistances(Z1, Z2, self._getExtraPath("D12.bin"), False, scale)
                 str12 = self.printStats(D12, "D12", "%s distance Set 1 vs Set2"%distanceStr)
                 self.doublePrint(fh, str12)
 
-                [D,pval] = stats.ks_2samp(D11, D12)
+                [D,pval] = self.ksTest(D11, D12)
                 self.doublePrint(fh, "---------------------------")
                 self.doublePrint(fh,"Kolmogorov-Smirnov test for the compatibility of D11 and D12: D-statistic=%f p-value=%f"%(D,pval))
             fh.close()
@@ -60,8 +60,8 @@ class ProtPKPDStatsExp1Subgroups2Mean(ProtPKPD):
         fh = open(self._getPath("report.txt"),'w')
 
         self.experiment = self.readExperiment(self.inputExperiment.get().fnPKPD)
-        x1 = [float(x) for x in self.experiment.getSubGroupLabels(self.expression1.get(),self.labelToCompare.get())]
-        x2 = [float(x) for x in self.experiment.getSubGroupLabels(self.expression2.get(),self.labelToCompare.get())]
+        x1 = self.experiment.getSubGroupColumns(self.expression1.get(),[self.labelToCompare.get()])[:,0].tolist()
+        x2 = self.experiment.getSubGroupColumns(self.expression2.get(),[self.labelToCompare.get()])[:,0].tolist()
         self.doublePrint(fh,"Values in SubGroup 1: %s"%str(x1))
         self.doublePrint(fh,"Values in SubGroup 2: %s"%str(x2))
         self.doublePrint(fh,"Testing H0: mu1=mu2")
@@ -84,8 +84,8 @@ class ProtPKPDStatsExp2Subgroups2Mean(ProtPKPD):
                     raise "Cannot find sample %s in Experiment 2"%sample.sampleName
         else:
             expression2ToUse = self.expression1.get() if self.expression2.get()=="" else self.expression2.get()
-            x1 = [float(x) for x in self.experiment1.getSubGroupLabels(self.expression1.get(),self.label1.get())]
-            x2 = [float(x) for x in self.experiment2.getSubGroupLabels(expression2ToUse,label2ToUse)]
+            x1 = self.experiment1.getSubGroupColumns(self.expression1.get(),[self.label1.get()])[:,0].tolist()
+            x2 = self.experiment2.getSubGroupColumns(expression2ToUse,[label2ToUse])[:,0].tolist()
         self.doublePrint(fh,"Values in SubGroup 1: %s"%str(x1))
         self.doublePrint(fh,"Values in SubGroup 2: %s"%str(x2))
         self.doublePrint(fh,"Testing H0: mu1=mu2")
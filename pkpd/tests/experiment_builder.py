@@ -0,0 +1,69 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (info@kinestat.com)
+# *
+# * Kinestat Pharma
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'info@kinestat.com'
+# *
+# **************************************************************************
+
+"""
+Small experiments built in memory for the unit tests.
+"""
+
+from pkpd.objects import PKPDExperiment, PKPDSample, PKPDVariable
+from pkpd.pkpd_units import createUnit
+
+
+def createVariable(varName, units, role, varType=PKPDVariable.TYPE_NUMERIC):
+    variable = PKPDVariable()
+    variable.varName = varName
+    variable.varType = varType
+    variable.role = role
+    variable.units = createUnit(units)
+    variable.comment = varName
+    return variable
+
+
+def addSample(experiment, sampleName, descriptors=None, measurements=None):
+    """ Add a sample with the given labels (dictionary of values) and measurements (dictionary of arrays, including
+        the time variable) """
+    sample = PKPDSample()
+    sample.sampleName = sampleName
+    sample.variableDictPtr = experiment.variables
+    sample.descriptors = dict(descriptors or {})
+    if measurements:
+        sample.addMeasurementPattern([varName for varName in measurements
+                                      if experiment.variables[varName].role!=PKPDVariable.ROLE_TIME])
+        for varName, values in measurements.items():
+            sample.addMeasurementColumn(varName, values)
+    experiment.samples[sampleName] = sample
+    return sample
+
+
+def createExperiment(variables, samples=None):
+    """ Experiment with the given variables and samples, samples is a list of (sampleName, descriptors,
+        measurements) as in addSample """
+    experiment = PKPDExperiment()
+    for variable in variables:
+        experiment.variables[variable.varName] = variable
+    for sampleName, descriptors, measurements in samples or []:
+        addSample(experiment, sampleName, descriptors, measurements)
+    return experiment
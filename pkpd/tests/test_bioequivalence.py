@@ -0,0 +1,123 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (info@kinestat.com)
+# *
+# * Kinestat Pharma
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'info@kinestat.com'
+# *
+# **************************************************************************
+
+import unittest
+
+import numpy as np
+
+from pkpd.bioequivalence import (BEPower, BESimulation, powerTOST, powerScABE, powerNTIDFDA, getDesignConstants,
+                                 getMinimumN)
+
+
+class TestPowerTOST(unittest.TestCase):
+    # (CV, theta0, n, power) of power.TOST and sampleN.TOST of the R package PowerTOST for the 2x2x2 design
+    REFERENCE_ABE = [(0.20, 0.95, 20, 0.834680),
+                     (0.25, 0.95, 28, 0.807439),
+                     (0.30, 0.95, 40, 0.815845)]
+
+    def testPowerReference(self):
+        for CV, theta0, n, power in self.REFERENCE_ABE:
+            self.assertAlmostEqual(float(powerTOST(CV, theta0, n)), power, places=5)
+
+    def testSampleSizeReference(self):
+        bePower = BEPower(BEPower.METHOD_ABE, '2x2x2')
+        for CV, theta0, n, power in self.REFERENCE_ABE:
+            nEstimated, powerEstimated = bePower.sampleSize(CV, theta0, 0.8)
+            self.assertEqual(nEstimated, n)
+            self.assertAlmostEqual(powerEstimated, power, places=5)
+
+    def testArrays(self):
+        # A power curve is the same as the powers computed one by one
+        CVs = np.array([0.1, 0.2, 0.3, 0.4])
+        power = powerTOST(CVs, 0.95, 24)
+        self.assertEqual(power.shape, CVs.shape)
+        for CV, powerCV in zip(CVs, power):
+            self.assertAlmostEqual(float(powerTOST(CV, 0.95, 24)), powerCV, places=12)
+        self.assertTrue(np.all(np.diff(power)<0))
+
+    def testLimits(self):
+        # Outside the acceptance limits the power is at most alpha
+        self.assertLessEqual(float(powerTOST(0.2, 1.3, 24)), 0.05)
+        self.assertLessEqual(float(powerTOST(0.2, 1.25, 200)), 0.05+1e-6)
+        self.assertEqual(float(powerTOST(0.2, 0.95, 1)), 0.0)
+
+    def testDesigns(self):
+        self.assertEqual(getDesignConstants(24, '2x2x2'), (22, 1.0/12))
+        self.assertEqual(getDesignConstants(24, '2x2x4')[0], 68)
+        self.assertEqual(getMinimumN('2x2x2'), 3)
+        self.assertRaises(Exception, getDesignConstants, 24, '5x5')
+
+        # Replicate designs need fewer subjects for the same power
+        self.assertGreater(float(powerTOST(0.3, 0.95, 24, '2x2x4')), float(powerTOST(0.3, 0.95, 24, '2x2x2')))
+
+
+class TestPowerScaled(unittest.TestCase):
+    def testScABELReference(self):
+        # sampleN.scABEL(CV=0.45, theta0=0.9, design="2x2x4") of PowerTOST: 28 subjects, power 0.8112.
+        # The key statistics are simulated with other random numbers, so the power only agrees within the
+        # simulation error
+        n, power = BEPower(BEPower.METHOD_scABE, '2x2x4', 'EMA').sampleSize(0.45, 0.9, 0.8)
+        self.assertEqual(n, 28)
+        self.assertAlmostEqual(power, 0.8112, delta=0.01)
+
+    def testFixedSeed(self):
+        # The simulated powers are reproducible and the same draws are used for all CVs and theta0s
+        power1 = powerScABE([0.3, 0.4, 0.5], 0.9, 24, '2x2x4', 'FDA')
+        power2 = powerScABE([0.3, 0.4, 0.5], 0.9, 24, '2x2x4', 'FDA')
+        np.testing.assert_array_equal(power1, power2)
+        self.assertEqual(float(powerScABE(0.4, 0.9, 24, '2x2x4', 'FDA')), power1[1])
+        power3 = powerNTIDFDA(0.1, 0.975, 24, simulation=BESimulation(24, '2x2x4', seed=1))
+        self.assertAlmostEqual(float(power3), float(powerNTIDFDA(0.1, 0.975, 24)), delta=0.01)
+
+    def testSwitchingCV(self):
+        # Well below the switching CV, scaled average bioequivalence is average bioequivalence
+        for regulator in ['EMA', 'FDA']:
+            self.assertAlmostEqual(float(powerScABE(0.15, 0.95, 12, '2x2x4', regulator)),
+                                   float(powerTOST(0.15, 0.95, 12, '2x2x4')), delta=0.01)
+
+    def testScaledLimits(self):
+        # Above the switching CV the limits are widened, and the point estimate must still be within 0.8-1.25
+        self.assertGreater(float(powerScABE(0.5, 0.9, 36, '2x2x4', 'EMA')), float(powerTOST(0.5, 0.9, 36, '2x2x4')))
+        self.assertLess(float(powerScABE(0.6, 1.4, 200, '2x2x4', 'FDA')), 0.05)
+
+    def testNTID(self):
+        # The narrow therapeutic index method also requires average bioequivalence, and its scaled limits shrink
+        # for small CVs
+        for CV in [0.05, 0.1, 0.2]:
+            self.assertLessEqual(float(powerNTIDFDA(CV, 0.975, 24)), float(powerTOST(CV, 0.975, 24, '2x2x4'))+0.01)
+        self.assertLess(float(powerNTIDFDA(0.05, 0.95, 24)), float(powerTOST(0.05, 0.95, 24, '2x2x4'))-0.1)
+        n, power = BEPower(BEPower.METHOD_NTIDFDA, '2x2x4').sampleSize(0.1, 0.975, 0.8)
+        self.assertEqual(n%2, 0)
+        self.assertGreaterEqual(power, 0.8)
+        self.assertLess(float(BEPower(BEPower.METHOD_NTIDFDA, '2x2x4').power(0.1, 0.975, n-2)), 0.8)
+
+    def testInvalid(self):
+        self.assertRaises(Exception, BEPower, BEPower.METHOD_scABE, '2x2x2')
+        self.assertRaises(Exception, BEPower, BEPower.METHOD_scABE, '2x2x4', 'XXX')
+
+
+if __name__ == '__main__':
+    unittest.main()
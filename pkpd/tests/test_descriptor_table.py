@@ -0,0 +1,159 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (info@kinestat.com)
+# *
+# * Kinestat Pharma
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'info@kinestat.com'
+# *
+# **************************************************************************
+
+import unittest
+
+import numpy as np
+
+from pkpd.objects import PKPDVariable
+from pkpd.tests.experiment_builder import addSample, createExperiment, createVariable
+
+LABEL_NAMES = ["weight", "sex", "arm"]
+
+
+def createLabelExperiment(labels):
+    """ Experiment with the labels weight (numeric), sex and arm (text), labels is a list of (weight, sex, arm) """
+    variables = [createVariable("weight", "kg", PKPDVariable.ROLE_LABEL),
+                 createVariable("sex", "none", PKPDVariable.ROLE_LABEL, PKPDVariable.TYPE_TEXT),
+                 createVariable("arm", "none", PKPDVariable.ROLE_LABEL, PKPDVariable.TYPE_TEXT)]
+    return createExperiment(variables, [("Individual%d"%n, dict(zip(LABEL_NAMES, values)), None)
+                                        for n, values in enumerate(labels)])
+
+
+def getDescriptor(experiment, sampleName, varName):
+    # Value of a label of a sample read one by one, None if it is missing
+    value = experiment.samples[sampleName].getDescriptorValue(varName)
+    if value is None or value=="NA":
+        return None
+    return float(value) if experiment.variables[varName].isNumeric() else value
+
+
+def referenceGroups(experiment, sampleNames, varNames):
+    # Groups built sample by sample, in order of first appearance
+    keys = []
+    groupIdx = []
+    for sampleName in sampleNames:
+        key = tuple(getDescriptor(experiment, sampleName, varName) for varName in varNames)
+        if None in key:
+            groupIdx.append(-1)
+            continue
+        if key not in keys:
+            keys.append(key)
+        groupIdx.append(keys.index(key))
+    return keys, groupIdx
+
+
+class TestDescriptorTable(unittest.TestCase):
+    def setUp(self):
+        self.experiment = createLabelExperiment([("70", "male", "A"), ("NA", "female", "B"), ("85", "female", "A"),
+                                                 ("60", "NA", "B"), ("70", "male", "B"), ("85", "female", "A"),
+                                                 ("55.5", "female", None)])
+
+    def assertAgrees(self, table, sampleNames=None):
+        # Every column and group of the table agrees with the descriptors of the samples
+        if sampleNames is None:
+            sampleNames = list(self.experiment.samples.keys())
+        self.assertEqual(table.sampleNames, sampleNames)
+        for varName in LABEL_NAMES:
+            column, valid = table.getColumn(varName)
+            for value, ok, sampleName in zip(column.tolist(), valid, sampleNames):
+                expected = getDescriptor(self.experiment, sampleName, varName)
+                self.assertEqual(bool(ok), expected is not None)
+                if ok:
+                    self.assertEqual(value, expected)
+        for varNames in [["sex"], ["weight"], ["sex", "arm"], ["arm", "weight", "sex"]]:
+            keys, groupIdx = table.groupby(varNames)
+            self.assertEqual((keys, groupIdx.tolist()), referenceGroups(self.experiment, sampleNames, varNames))
+
+    def testGroupBy(self):
+        table = self.experiment.getDescriptorTable()
+        self.assertAgrees(table)
+        keys, groupIdx = table.groupby("sex")
+        self.assertEqual(keys, [("male",), ("female",)])
+        self.assertEqual(groupIdx.tolist(), [0, 1, 1, -1, 0, 1, 1])
+
+        # Missing text labels are a group of their own when they are not dropped
+        keys, groupIdx = table.groupby("sex", dropMissing=False)
+        self.assertEqual(keys, [("male",), ("female",), ("NA",)])
+        self.assertEqual(groupIdx.tolist(), [0, 1, 1, 2, 0, 1, 1])
+        self.assertEqual(table.select([]).groupby("sex")[0], [])
+
+    def testSelect(self):
+        table = self.experiment.getDescriptorTable()
+        sampleNames = list(self.experiment.samples.keys())
+        for idx in [np.array([True, False, True, True, False, False, True]), [6, 2, 0], slice(1, 5)]:
+            selectedNames = np.array(sampleNames)[idx].tolist()
+            self.assertAgrees(table.select(idx), selectedNames)
+            self.assertAgrees(self.experiment.getDescriptorTable(sampleNames=selectedNames), selectedNames)
+
+        # The selection is the same as the subgroup of the equivalent condition
+        mask = self.experiment.getSubGroupMask('$(sex)=="female" and $(weight)>60')
+        self.assertEqual(table.select(mask).sampleNames, ["Individual2", "Individual5"])
+
+    def testAddRemoveSamples(self):
+        self.assertAgrees(self.experiment.getDescriptorTable())
+
+        # Samples added or removed after a table has been built
+        addSample(self.experiment, "Individual7", {"weight": "60", "sex": "male", "arm": "C"})
+        addSample(self.experiment, "Individual8", {"weight": "NA", "sex": "male", "arm": "A"})
+        self.assertAgrees(self.experiment.getDescriptorTable())
+        del self.experiment.samples["Individual0"]
+        del self.experiment.samples["Individual4"]
+        table = self.experiment.getDescriptorTable()
+        self.assertAgrees(table)
+        self.assertEqual(table.groupby("sex")[0], [("female",), ("male",)])
+
+        # Descriptors changed directly in a sample
+        self.experiment.samples["Individual3"].setDescriptorValue("sex", "male")
+        self.experiment.samples["Individual1"].descriptors["weight"] = "90"
+        self.assertAgrees(self.experiment.getDescriptorTable())
+
+    def testColumnUpdates(self):
+        self.experiment.getDescriptorTable()
+        sampleNames = list(self.experiment.samples.keys())
+
+        # Bulk updates are seen by the samples, and missing entries are written as None
+        self.experiment.setDescriptorColumn("arm", ["A", "A", "B", "B", "C", "C", "C"],
+                                            valid=[True, True, True, False, True, True, True])
+        self.assertIsNone(self.experiment.samples["Individual3"].getDescriptorValue("arm"))
+        self.experiment.addLabelColumn("site", "Hospital", ["H1", "H2", "H1"], sampleNames=sampleNames[:3])
+        self.assertEqual(self.experiment.samples["Individual2"].getDescriptorValue("site"), "H1")
+        self.assertIsNone(self.experiment.samples["Individual3"].getDescriptorValue("site"))
+        self.assertAgrees(self.experiment.getDescriptorTable())
+        keys, groupIdx = self.experiment.getDescriptorTable(["site", "sex"]).groupby(["site", "sex"])
+        self.assertEqual(keys, [("H1", "male"), ("H2", "female"), ("H1", "female")])
+        self.assertEqual(groupIdx.tolist(), [0, 1, 2, -1, -1, -1, -1])
+
+        # Updates of part of the samples keep the rest of the column
+        self.experiment.setDescriptorColumn("weight", [75.0, 50.0], sampleNames=["Individual6", "Individual1"])
+        self.assertEqual(self.experiment.samples["Individual1"].getDescriptorValue("weight"), 50.0)
+        self.assertAgrees(self.experiment.getDescriptorTable())
+        self.assertRaises(Exception, self.experiment.setDescriptorColumn, "weight", [1.0, 2.0])
+        self.assertRaises(Exception, self.experiment.setDescriptorColumn, "height", [1.0]*7)
+
+
+if __name__ == '__main__':
+    unittest.main()
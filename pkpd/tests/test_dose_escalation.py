@@ -0,0 +1,172 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (info@kinestat.com)
+# *
+# * Kinestat Pharma
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'info@kinestat.com'
+# *
+# **************************************************************************
+
+import unittest
+
+import numpy as np
+
+from pkpd.dose_escalation import (DESIGN_3PLUS3, DESIGN_BESTOF5, DESIGN_UPANDDOWN, DESIGN_STORERC, DESIGN_STORERBC,
+                                  DoseEscalationTrials, simulateCohortDesign, simulateSequentialDesign,
+                                  simulateDoseEscalation, getTrueMTD, operatingCharacteristics)
+
+
+class ScriptedRandom:
+    """ Random generator of a single trial whose numbers of DLTs are given in advance """
+    def __init__(self, dlts):
+        self.dlts = list(dlts)
+        self.cohorts = []
+
+    def binomial(self, n, p):
+        n = np.asarray(n)
+        self.cohorts.append(int(n[0]))
+        return np.full(n.shape, self.dlts.pop(0))
+
+
+class TestCohortDesigns(unittest.TestCase):
+    def simulate(self, design, Ndoses, dlts):
+        rng = ScriptedRandom(dlts)
+        trials = simulateCohortDesign(design, np.full(Ndoses, 0.5), 1, rng)
+        self.assertEqual(rng.dlts, [])
+        return trials, rng.cohorts
+
+    def assertTrial(self, trials, mtd, patientsPerDose, dltsPerDose):
+        self.assertEqual(trials.mtd.tolist(), [mtd])
+        self.assertEqual(trials.patientsPerDose.tolist(), [patientsPerDose])
+        self.assertEqual(trials.dltsPerDose.tolist(), [dltsPerDose])
+
+    def test3Plus3(self):
+        # 0/3 escalates, 1/3 adds 3 patients, 1/6 escalates and 2/3 stops
+        trials, cohorts = self.simulate(DESIGN_3PLUS3, 3, [0, 1, 0, 2])
+        self.assertTrial(trials, 1, [3, 6, 3], [0, 1, 2])
+        self.assertEqual(cohorts, [3, 3, 3, 3])
+
+        # 2/6 stops with the previous dose as MTD
+        trials, _ = self.simulate(DESIGN_3PLUS3, 3, [0, 1, 1])
+        self.assertTrial(trials, 0, [3, 6, 0], [0, 2, 0])
+
+        # All doses tolerated, or toxicity already at the first dose
+        trials, _ = self.simulate(DESIGN_3PLUS3, 3, [0, 1, 0, 0])
+        self.assertTrial(trials, 2, [3, 6, 3], [0, 1, 0])
+        trials, _ = self.simulate(DESIGN_3PLUS3, 3, [1, 1])
+        self.assertTrial(trials, -1, [6, 0, 0], [2, 0, 0])
+        trials, _ = self.simulate(DESIGN_3PLUS3, 3, [3])
+        self.assertTrial(trials, -1, [3, 0, 0], [3, 0, 0])
+
+    def testBestOf5(self):
+        # 1/3 adds one patient and 1/4 escalates
+        trials, cohorts = self.simulate(DESIGN_BESTOF5, 2, [1, 0, 0])
+        self.assertTrial(trials, 1, [4, 3], [1, 0])
+        self.assertEqual(cohorts, [3, 1, 3])
+
+        # 2/4 adds another patient, 2/5 escalates and 3/5 stops
+        trials, cohorts = self.simulate(DESIGN_BESTOF5, 2, [1, 1, 0, 1, 1, 1])
+        self.assertTrial(trials, 0, [5, 5], [2, 3])
+        self.assertEqual(cohorts, [3, 1, 1, 3, 1, 1])
+
+        # 2/3 and 3/4 stop
+        trials, _ = self.simulate(DESIGN_BESTOF5, 2, [2])
+        self.assertTrial(trials, -1, [3, 0], [2, 0])
+        trials, _ = self.simulate(DESIGN_BESTOF5, 2, [0, 1, 2])
+        self.assertTrial(trials, 0, [3, 4], [0, 3])
+
+    def testManyTrials(self):
+        # Trials without randomness: doses without toxicity are escalated and toxic doses stop all trials
+        for design, patientsPerDose in [(DESIGN_3PLUS3, [3, 3, 3, 0]), (DESIGN_BESTOF5, [3, 3, 3, 0])]:
+            trials = simulateDoseEscalation(design, [0, 0, 1, 1], Ntrials=50, seed=1)
+            self.assertTrue(np.all(trials.mtd==1))
+            self.assertTrue(np.all(trials.patientsPerDose==patientsPerDose))
+            self.assertTrue(np.all(trials.dltsPerDose==[0, 0, 3, 0]))
+
+
+class TestSequentialDesigns(unittest.TestCase):
+    def simulate(self, design, Ndoses, dlts):
+        rng = ScriptedRandom(dlts)
+        trials = simulateSequentialDesign(design, np.full(Ndoses, 0.5), 1, len(dlts), rng)
+        self.assertEqual(rng.cohorts, [1]*len(dlts))
+        return trials
+
+    def assertTrial(self, trials, mtd, patientsPerDose, dltsPerDose):
+        self.assertEqual(trials.mtd.tolist(), [mtd])
+        self.assertEqual(trials.patientsPerDose.tolist(), [patientsPerDose])
+        self.assertEqual(trials.dltsPerDose.tolist(), [dltsPerDose])
+
+    def testUpAndDown(self):
+        self.assertTrial(self.simulate(DESIGN_UPANDDOWN, 3, [0, 1, 0, 0, 0]), 2, [2, 2, 1], [0, 1, 0])
+        self.assertTrial(self.simulate(DESIGN_UPANDDOWN, 3, [1, 1, 0]), 1, [3, 0, 0], [2, 0, 0])
+
+    def testStorerC(self):
+        # Up after two consecutive patients without DLT at the same dose, down after a DLT
+        self.assertTrial(self.simulate(DESIGN_STORERC, 3, [0, 0, 1]), 0, [2, 1, 0], [0, 1, 0])
+        self.assertTrial(self.simulate(DESIGN_STORERC, 3, [0, 1, 0, 0, 0]), 1, [4, 1, 0], [1, 0, 0])
+
+    def testStorerBC(self):
+        # Stage 1 escalates one patient at a time up to the first DLT, then the rules of Storer's C apply and
+        # two consecutive DLTs go down two doses
+        self.assertTrial(self.simulate(DESIGN_STORERBC, 4, [0, 0, 1, 0, 0, 0, 1, 1]), 0, [1, 4, 3, 0],
+                         [0, 1, 2, 0])
+        self.assertTrial(self.simulate(DESIGN_STORERBC, 5, [0, 0, 0, 1, 1]), 0, [1, 1, 2, 1, 0], [0, 0, 1, 1, 0])
+
+        # Stage 1 stays at the last dose
+        self.assertTrial(self.simulate(DESIGN_STORERBC, 3, [0, 0, 0, 0, 0]), 2, [1, 1, 3], [0, 0, 0])
+
+    def testReproducible(self):
+        ptox = [0.05, 0.1, 0.2, 0.35, 0.5]
+        for design in [DESIGN_3PLUS3, DESIGN_UPANDDOWN, DESIGN_STORERBC]:
+            trials1 = simulateDoseEscalation(design, ptox, Ntrials=200, seed=3)
+            trials2 = simulateDoseEscalation(design, ptox, Ntrials=200, seed=3)
+            np.testing.assert_array_equal(trials1.mtd, trials2.mtd)
+            np.testing.assert_array_equal(trials1.patientsPerDose, trials2.patientsPerDose)
+        self.assertTrue(np.all(np.sum(trials1.patientsPerDose, axis=1)==24))
+        self.assertRaises(Exception, simulateDoseEscalation, "Unknown", ptox)
+
+
+class TestOperatingCharacteristics(unittest.TestCase):
+    def testSummary(self):
+        ptox = [0.05, 0.2, 0.5]
+        trials = DoseEscalationTrials(4, 3)
+        trials.mtd[:] = [-1, 1, 1, 2]
+        trials.patientsPerDose[:] = [[3, 0, 0], [3, 6, 3], [3, 3, 3], [3, 3, 6]]
+        trials.dltsPerDose[:] = [[2, 0, 0], [0, 1, 2], [0, 0, 2], [0, 1, 2]]
+        summary = operatingCharacteristics(trials, ptox, 0.25)
+        self.assertEqual(summary['trueMTD'], 1)
+        np.testing.assert_allclose(summary['selection'], [0.25, 0, 0.5, 0.25])
+        self.assertAlmostEqual(summary['correctSelection'], 0.5)
+        self.assertAlmostEqual(summary['overdoseSelection'], 0.25)
+        np.testing.assert_allclose(summary['patientsPerDose'], [3, 3, 3])
+        self.assertAlmostEqual(summary['sampleSize'], 9)
+        self.assertAlmostEqual(summary['sampleSizeStd'], np.sqrt(13.5))
+        self.assertAlmostEqual(summary['dlts'], 2.5)
+        self.assertAlmostEqual(summary['overdosedFraction'], (0+0.25+1.0/3+0.5)/4)
+        self.assertAlmostEqual(summary['overdosedTrials'], 0.75)
+
+    def testTrueMTD(self):
+        self.assertEqual(getTrueMTD([0.1, 0.2, 0.3], 0.25), 1)
+        self.assertEqual(getTrueMTD([0.1, 0.2, 0.3], 0.3), 2)
+        self.assertEqual(getTrueMTD([0.3, 0.5], 0.25), -1)
+
+
+if __name__ == '__main__':
+    unittest.main()
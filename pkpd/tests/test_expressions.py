@@ -0,0 +1,171 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (info@kinestat.com)
+# *
+# * Kinestat Pharma
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'info@kinestat.com'
+# *
+# **************************************************************************
+
+import unittest
+
+import numpy as np
+
+from pkpd.expressions import PKPDExpression, compileExpression, toColumn
+from pkpd.objects import PKPDVariable
+from pkpd.tests.experiment_builder import createExperiment, createVariable
+
+
+def createLabelExperiment(labels):
+    """ Experiment with the labels weight (numeric) and sex (text), labels is a list of (weight, sex) """
+    variables = [createVariable("weight", "kg", PKPDVariable.ROLE_LABEL),
+                 createVariable("sex", "none", PKPDVariable.ROLE_LABEL, PKPDVariable.TYPE_TEXT)]
+    return createExperiment(variables, [("Individual%d"%n, {"weight": weight, "sex": sex}, None)
+                                        for n, (weight, sex) in enumerate(labels)])
+
+
+class TestPKPDExpression(unittest.TestCase):
+    x = np.array([0.5, 1.0, 2.0, 3.0, 4.0])
+    sex = np.array(["male", "female", "female", "other", "male"])
+
+    def evaluate(self, expression, **values):
+        return PKPDExpression(expression).evaluate(values)
+
+    def assertElementwise(self, expression, pythonExpression):
+        # The vectorized expression gives, for each element, the value of the scalar Python expression
+        values = self.evaluate(expression, x=self.x, sex=self.sex)
+        expected = [eval(pythonExpression, {}, {"x": x, "sex": sex}) for x, sex in zip(self.x.tolist(), self.sex)]
+        self.assertEqual(np.asarray(values).tolist(), expected)
+
+    def testBooleanOperators(self):
+        self.assertElementwise('$(x)>1 and $(sex)=="male"', 'x>1 and sex=="male"')
+        self.assertElementwise('$(x)<1 or $(sex)=="female"', 'x<1 or sex=="female"')
+        self.assertElementwise('not $(x)>=2', 'not x>=2')
+        self.assertElementwise('$(x)<1 or $(x)>3 and not $(sex)=="male"', 'x<1 or x>3 and not sex=="male"')
+        self.assertElementwise('$(x)>0 and $(x)<4 and $(sex)!="other"', 'x>0 and x<4 and sex!="other"')
+
+    def testChainedComparisons(self):
+        self.assertElementwise('1<=$(x)<3', '1<=x<3')
+        self.assertElementwise('0<$(x)<=2<4', '0<x<=2<4')
+        self.assertElementwise('1<$(x)!=3>=2', '1<x!=3>=2')
+
+    def testIn(self):
+        self.assertElementwise('$(sex) in ["male", "other"]', 'sex in ["male", "other"]')
+        self.assertElementwise('$(sex) not in ("male",)', 'sex not in ("male",)')
+        self.assertElementwise('$(x) in [1, 3] or $(sex) in ["female"]', 'x in [1, 3] or sex in ["female"]')
+
+    def testConditional(self):
+        self.assertElementwise('$(x)*2 if $(sex)=="male" else -$(x)', 'x*2 if sex=="male" else -x')
+        self.assertElementwise('1 if $(x)<1 else (2 if $(x)<3 else 3)', '1 if x<1 else (2 if x<3 else 3)')
+
+    def testArithmetic(self):
+        values = self.evaluate('np.log($(x))+$[a]*$(x)**2-$(x)//2%3', x=self.x, a=0.5)
+        np.testing.assert_allclose(values, np.log(self.x)+0.5*self.x**2-self.x//2%3)
+        self.assertEqual(self.evaluate('$(x)+1', x=2.0), 3.0)
+
+        # Variables with a prefix, the same variable several times and names with spaces
+        expression = PKPDExpression('$re(x)*$re(x)+$re(total dose)', prefix="re")
+        self.assertEqual(expression.varList, ["x", "total dose"])
+        np.testing.assert_allclose(expression.evaluate({"x": self.x, "total dose": 1.0}), self.x*self.x+1.0)
+
+    def testBroadcast(self):
+        expression = PKPDExpression('$[a]>0')
+        np.testing.assert_array_equal(expression.evaluate({"a": 1.0}, N=3), [True, True, True])
+        self.assertEqual(PKPDExpression('$(x)>1').evaluate({"x": self.x}, N=5).shape, (5,))
+        self.assertRaises(Exception, PKPDExpression('$(x)>1').evaluate, {"x": self.x}, 4)
+        self.assertRaises(Exception, PKPDExpression('$(x)>$(y)').evaluate, {"x": self.x})
+
+    def testRejected(self):
+        for expression in ['__import__("os").system("ls")',
+                           'os.system("ls")',
+                           'open("file")',
+                           'abs($(x))',
+                           '$(x).__class__',
+                           'np._NoValue',
+                           'np.linalg.inv($(x))',
+                           '(lambda y: y)($(x))',
+                           '[y for y in $(x)]',
+                           '$(x)[0]',
+                           '{"a": $(x)}',
+                           'x>1',
+                           '$(x) := 1',
+                           '$(x)>']:
+            self.assertRaises(Exception, PKPDExpression, expression)
+
+    def testCompiledOnce(self):
+        self.assertIs(compileExpression('$(x)>1'), compileExpression('$(x)>1'))
+        self.assertIsNot(compileExpression('$[a]>1'), compileExpression('$[a]>1', "re"))
+
+
+class TestColumns(unittest.TestCase):
+    def testNumeric(self):
+        column, valid = toColumn(["1", "2.5", "-3e2"], True)
+        self.assertEqual(column.dtype, np.float64)
+        np.testing.assert_array_equal(column, [1.0, 2.5, -300.0])
+        self.assertTrue(np.all(valid))
+
+        column, valid = toColumn(["1", "NA", "LLOQ", "ULOQ", "NS", "", None, "abc", " 4 "], True)
+        np.testing.assert_array_equal(valid, [True, False, False, False, False, False, False, False, True])
+        self.assertEqual(column[0], 1.0)
+        self.assertEqual(column[-1], 4.0)
+        self.assertTrue(np.all(np.isnan(column[1:-1])))
+
+    def testText(self):
+        column, valid = toColumn(["male", "NA", " NA ", None, "female", "None"], False)
+        np.testing.assert_array_equal(valid, [True, False, False, False, True, False])
+        self.assertEqual(column.tolist(), ["male", "NA", " NA ", "", "female", "None"])
+        self.assertEqual(toColumn([], False)[0].size, 0)
+
+
+class TestExperimentExpressions(unittest.TestCase):
+    def setUp(self):
+        self.experiment = createLabelExperiment([("70", "male"), ("NA", "female"), ("85", "NA"), ("60", "female"),
+                                                 ("LLOQ", "male")])
+
+    def testMissingValues(self):
+        # A sample is only missing for an expression when a label used by it is missing
+        values, valid = self.experiment.evaluateExpression('$(weight)>65')
+        np.testing.assert_array_equal(valid, [True, False, True, True, False])
+        np.testing.assert_array_equal(values[valid], [True, True, False])
+        values, valid = self.experiment.evaluateExpression('$(sex)=="female"')
+        np.testing.assert_array_equal(valid, [True, True, False, True, True])
+        values, valid = self.experiment.evaluateExpression('$(weight)>65 or $(sex)=="female"')
+        np.testing.assert_array_equal(valid, [True, False, False, True, False])
+
+    def testSubGroups(self):
+        self.assertEqual(sorted(self.experiment.getSubGroup('$(weight)>65').keys()), ["Individual0", "Individual2"])
+        self.assertEqual(sorted(self.experiment.getSubGroup('$(sex) in ["female"]').keys()),
+                         ["Individual1", "Individual3"])
+        self.assertEqual(sorted(self.experiment.getSubGroup('not $(sex)=="female"').keys()),
+                         ["Individual0", "Individual4"])
+        self.assertEqual(len(self.experiment.getSubGroup('')), 5)
+        self.assertEqual(self.experiment.getSubGroupLabels('60<=$(weight)<80', 'sex'), ["male", "female"])
+        np.testing.assert_array_equal(self.experiment.getSubGroupMask('$(weight)>65', ["Individual2", "Individual1"]),
+                                      [True, False])
+        self.assertRaises(Exception, self.experiment.evaluateExpression, '$(height)>1')
+
+    def testSampleExpression(self):
+        self.assertEqual(self.experiment.samples["Individual0"].evaluateExpression('$(weight)*2'), 140.0)
+        self.assertIsNone(self.experiment.samples["Individual1"].evaluateExpression('$(weight)*2'))
+        self.assertEqual(self.experiment.samples["Individual1"].evaluateExpression('$(sex)'), "female")
+
+
+if __name__ == '__main__':
+    unittest.main()
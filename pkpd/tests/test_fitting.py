@@ -0,0 +1,238 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (info@kinestat.com)
+# *
+# * Kinestat Pharma
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'info@kinestat.com'
+# *
+# **************************************************************************
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from pkpd.objects import (PKPDFitting, PKPDSampleFit, PKPDSampleFitBootstrap, PKPDSampleFitList, PKPDVariable,
+                          formatSampleFit)
+from pkpd.pkpd_units import PKPDUnit
+from pkpd.tests.experiment_builder import createVariable
+
+
+def createSampleFit(sampleName, n):
+    sampleFit = PKPDSampleFit()
+    sampleFit.sampleName = sampleName
+    sampleFit.modelEquation = "Y=A*exp(-k*t)"
+    sampleFit.R2 = 0.9+0.001*n
+    sampleFit.R2adj = 0.89
+    sampleFit.AIC = -10.0-n
+    sampleFit.AICc = -9.0-n
+    sampleFit.BIC = -8.0-n
+    sampleFit.parameters = [10.0+n, 0.1*(n+1)]
+    sampleFit.lowerBound = ["9.000000", "0.050000"]
+    sampleFit.upperBound = ["11.000000", "0.200000"]
+    sampleFit.significance = ["True", "False"]
+    sampleFit.x = [[0.0, 1.0, 2.0]]
+    sampleFit.y = [[10.0+n, 9.0, 8.0]]
+    sampleFit.yp = [[10.0+n, 9.1, 7.9]]
+    sampleFit.yl = [["NA", "NA", "NA"]]
+    sampleFit.yu = [["NA", "NA", "NA"]]
+    return sampleFit
+
+
+def createBootstrapFit(sampleName, n, Nreplicates=4):
+    sampleFit = PKPDSampleFitBootstrap()
+    sampleFit.sampleName = sampleName
+    sampleFit.parameters = np.column_stack([10.0+n+np.arange(Nreplicates), 0.1*(n+1)+0.01*np.arange(Nreplicates)])
+    sampleFit.xB = [np.array([0.0, 1.0, 1.0+i]) for i in range(Nreplicates)]
+    sampleFit.yB = [np.array([10.0, 9.0, 8.0-i]) for i in range(Nreplicates)]
+    sampleFit.R2 = [0.9]*Nreplicates
+    sampleFit.R2adj = [0.89]*Nreplicates
+    sampleFit.AIC = [-10.0]*Nreplicates
+    sampleFit.AICc = [-9.0]*Nreplicates
+    sampleFit.BIC = [-8.0]*Nreplicates
+    return sampleFit
+
+
+def createFitting(sampleFits, cls=""):
+    fitting = PKPDFitting(cls)
+    fitting.fnExperiment.set("experiment.pkpd")
+    fitting.predictor = createVariable("t", "h", PKPDVariable.ROLE_TIME)
+    fitting.predicted = createVariable("C", "mg/L", PKPDVariable.ROLE_MEASUREMENT)
+    fitting.modelDescription = "Exponential"
+    fitting.modelParameters = ["A", "k"]
+    fitting.modelParameterUnits = [PKPDUnit.UNIT_CONC_mg_L, PKPDUnit.UNIT_INVTIME_H]
+    for sampleFit in sampleFits:
+        fitting.sampleFits.append(sampleFit)
+    return fitting
+
+
+def loadFitting(fnFitting, cls=""):
+    fitting = PKPDFitting(cls)
+    fitting.load(fnFitting)
+    return fitting
+
+
+class TestFittingFiles(unittest.TestCase):
+    SAMPLE_NAMES = ["Individual1", "Individual 2", "Paciente_ñandú", "患者3", "Individual5"]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def getPath(self, fn):
+        return os.path.join(self.directory, fn)
+
+    def assertSameFits(self, sampleFits1, sampleFits2):
+        self.assertEqual(len(sampleFits1), len(sampleFits2))
+        for sampleFit1, sampleFit2 in zip(sampleFits1, sampleFits2):
+            self.assertEqual(formatSampleFit(sampleFit1), formatSampleFit(sampleFit2))
+
+    def writeFitting(self, fn="fitting.pkpd"):
+        fitting = createFitting([createSampleFit(sampleName, n) for n, sampleName in enumerate(self.SAMPLE_NAMES)])
+        fitting.write(self.getPath(fn), writeToExcel=False)
+        return fitting
+
+    def testRoundTrip(self):
+        fitting = self.writeFitting()
+        fittingRead = loadFitting(self.getPath("fitting.pkpd"))
+        self.assertIsInstance(fittingRead.sampleFits, PKPDSampleFitList)
+        self.assertEqual(fittingRead.getSampleNames(), self.SAMPLE_NAMES)
+        self.assertEqual(fittingRead.modelParameters, ["A", "k"])
+        self.assertEqual(fittingRead.predictor.varName, "t")
+        self.assertSameFits(fitting.sampleFits, fittingRead.sampleFits)
+        np.testing.assert_allclose(fittingRead.getAllParameters(), fitting.getAllParameters())
+
+    def testLazyAccess(self):
+        # Every sample is found from its byte offset, also after non-ASCII names, and only that one is parsed
+        self.writeFitting()
+        fittingRead = loadFitting(self.getPath("fitting.pkpd"))
+        sampleFit = fittingRead.getSampleFit("Individual5")
+        self.assertEqual(sampleFit.parameters, [14.0, 0.5])
+        self.assertEqual(sum([fit is not None for fit in fittingRead.sampleFits._fits]), 1)
+        self.assertEqual(fittingRead.getSampleFit("患者3").parameters, [13.0, 0.4])
+        self.assertEqual(fittingRead.sampleFits[-3].sampleName, "Paciente_ñandú")
+        self.assertIsNone(fittingRead.getSampleFit("Individual6"))
+
+    def testLegacyFile(self):
+        # Files written before the sample index are read completely
+        fitting = self.writeFitting()
+        fh = open(self.getPath("legacy.pkpd"), "w", encoding="utf-8")
+        fh.write(fitting._formatHeader())
+        fh.write("[SAMPLE FITTINGS] ===================\n")
+        for sampleFit in fitting.sampleFits:
+            fh.write(formatSampleFit(sampleFit))
+        fh.close()
+
+        fittingRead = loadFitting(self.getPath("legacy.pkpd"))
+        self.assertIsInstance(fittingRead.sampleFits, list)
+        self.assertEqual(fittingRead.getSampleNames(), self.SAMPLE_NAMES)
+        self.assertSameFits(fitting.sampleFits, fittingRead.sampleFits)
+        self.assertEqual(fittingRead.getSampleFit("Individual 2").parameters, [11.0, 0.2])
+
+        # Rewriting a legacy file adds the index
+        fittingRead.write(self.getPath("legacy.pkpd"), writeToExcel=False)
+        fittingRewritten = loadFitting(self.getPath("legacy.pkpd"))
+        self.assertIsInstance(fittingRewritten.sampleFits, PKPDSampleFitList)
+        self.assertSameFits(fitting.sampleFits, fittingRewritten.sampleFits)
+
+    def testInPlaceRewrite(self):
+        # The fits that are not modified are copied from the file that is being overwritten
+        fitting = self.writeFitting()
+        fittingRead = loadFitting(self.getPath("fitting.pkpd"))
+        fittingRead.sampleFits[1].parameters = [1.0, 2.0]
+        fittingRead.sampleFits.append(createSampleFit("Individual6", 5))
+        fittingRead.write(self.getPath("fitting.pkpd"), writeToExcel=False)
+
+        fittingRewritten = loadFitting(self.getPath("fitting.pkpd"))
+        self.assertEqual(fittingRewritten.getSampleNames(), self.SAMPLE_NAMES+["Individual6"])
+        self.assertEqual(fittingRewritten.sampleFits[1].parameters, [1.0, 2.0])
+        self.assertSameFits([fitting.sampleFits[i] for i in [0, 2, 3, 4]],
+                            [fittingRewritten.sampleFits[i] for i in [0, 2, 3, 4]])
+        self.assertEqual(fittingRewritten.getSampleFit("Individual6").parameters, [15.0, 0.6])
+
+        # The fitting that was written can still be read after rewriting it
+        self.assertEqual(fittingRead.getSampleFit("Individual5").parameters, [14.0, 0.5])
+
+    def testRename(self):
+        self.writeFitting()
+        fittingRead = loadFitting(self.getPath("fitting.pkpd"))
+        self.assertIsNotNone(fittingRead.getSampleFit("Individual1"))
+        fittingRead.sampleFits[0].sampleName = "Individuo_ñ"
+        self.assertEqual(fittingRead.getSampleFit("Individuo_ñ").parameters, [10.0, 0.1])
+        self.assertIsNone(fittingRead.getSampleFit("Individual1"))
+        fittingRead.write(self.getPath("renamed.pkpd"), writeToExcel=False)
+
+        fittingRenamed = loadFitting(self.getPath("renamed.pkpd"))
+        self.assertEqual(fittingRenamed.getSampleNames()[0], "Individuo_ñ")
+        self.assertEqual(fittingRenamed.getSampleFit("Individuo_ñ").parameters, [10.0, 0.1])
+        self.assertEqual(fittingRenamed.getSampleFit("Individual5").parameters, [14.0, 0.5])
+
+    def testBootstrapStreaming(self):
+        fnFitting = self.getPath("bootstrapPopulation.pkpd")
+        bootstrapFits = [createBootstrapFit(sampleName, n) for n, sampleName in enumerate(self.SAMPLE_NAMES)]
+        fitting = createFitting([], "PKPDSampleFitBootstrap")
+        fitting.startStreaming(fnFitting)
+        for sampleFit in bootstrapFits:
+            fitting.addSampleFit(sampleFit)
+        self.assertTrue(os.path.exists(fnFitting+".samples"))
+        fitting.write(fnFitting, writeToExcel=False)
+        self.assertFalse(os.path.exists(fnFitting+".samples"))
+
+        fittingRead = loadFitting(fnFitting, "PKPDSampleFitBootstrap")
+        self.assertTrue(fittingRead.isPopulation())
+        self.assertEqual(fittingRead.getSampleNames(), self.SAMPLE_NAMES)
+        self.assertSameFits(bootstrapFits, fittingRead.sampleFits)
+        np.testing.assert_allclose(fittingRead.getSampleFit("患者3").parameters, bootstrapFits[3].parameters)
+        np.testing.assert_allclose(fittingRead.getAllParameters(), fitting.getAllParameters())
+        self.assertEqual(fittingRead.getAllParameters().shape, (4*len(self.SAMPLE_NAMES), 2))
+
+        # The file is the same as without streaming
+        fittingNotStreamed = createFitting(bootstrapFits, "PKPDSampleFitBootstrap")
+        fittingNotStreamed.write(self.getPath("notStreamed.pkpd"), writeToExcel=False)
+        self.assertEqual(open(fnFitting, "rb").read(), open(self.getPath("notStreamed.pkpd"), "rb").read())
+
+    def testStreamingModifiedList(self):
+        # If the list of fits changes after streaming them, or the file name changes, the fits are formatted again
+        fnFitting = self.getPath("fitting.pkpd")
+        fitting = createFitting([])
+        fitting.startStreaming(fnFitting)
+        for n, sampleName in enumerate(self.SAMPLE_NAMES):
+            fitting.addSampleFit(createSampleFit(sampleName, n))
+        fitting.sampleFits[2] = createSampleFit("Replaced", 7)
+        fitting.write(fnFitting, writeToExcel=False)
+        self.assertFalse(os.path.exists(fnFitting+".samples"))
+        fittingRead = loadFitting(fnFitting)
+        self.assertEqual(fittingRead.getSampleNames()[2], "Replaced")
+        self.assertSameFits(fitting.sampleFits, fittingRead.sampleFits)
+
+        fitting = createFitting([])
+        fitting.startStreaming(fnFitting)
+        fitting.addSampleFit(createSampleFit("Individual1", 0))
+        fitting.write(self.getPath("other.pkpd"), writeToExcel=False)
+        self.assertFalse(os.path.exists(fnFitting+".samples"))
+        self.assertSameFits(fitting.sampleFits, loadFitting(self.getPath("other.pkpd")).sampleFits)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (info@kinestat.com)
+# *
+# * Kinestat Pharma
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'info@kinestat.com'
+# *
+# **************************************************************************
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from pkpd.objects import PKPDVariable, formatSampleFit
+from pkpd.pipeline import createProtocol, _output
+from pkpd.protocols import ProtPKPDExponentialFit
+from pkpd.tests.experiment_builder import createExperiment, createVariable
+from pkpd.utils import PKPDResultCache
+
+
+def createDecayExperiment(Nsamples, timeUnits="min"):
+    variables = [createVariable("t", timeUnits, PKPDVariable.ROLE_TIME),
+                 createVariable("Cp", "mg/L", PKPDVariable.ROLE_MEASUREMENT)]
+    t = np.array([0.5, 1, 2, 4, 8, 12, 24, 36, 48])
+    return createExperiment(variables, [("Individual%d"%n, {}, {"t": t, "Cp": (2+0.5*n)*np.exp(-(0.05+0.01*n)*t)})
+                                        for n in range(Nsamples)])
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testKeys(self):
+        cache = PKPDResultCache(os.path.join(self.directory, "cache"))
+        key = cache.getKey("Individual1", [1.0, 2.0], np.array([1.0, 2.0]))
+        self.assertEqual(key, cache.getKey("Individual1", [1.0, 2.0], np.array([1.0, 2.0])))
+        self.assertEqual(cache.getKey({"a": 1, "b": 2}), cache.getKey({"b": 2, "a": 1}))
+
+        # Any change of the values, their types, order or shape gives another key
+        otherKeys = [cache.getKey("Individual2", [1.0, 2.0], np.array([1.0, 2.0])),
+                     cache.getKey("Individual1", [1.0, 2.5], np.array([1.0, 2.0])),
+                     cache.getKey("Individual1", [1, 2], np.array([1.0, 2.0])),
+                     cache.getKey("Individual1", (1.0, 2.0), np.array([1.0, 2.0])),
+                     cache.getKey("Individual1", [2.0, 1.0], np.array([1.0, 2.0])),
+                     cache.getKey("Individual1", [1.0, 2.0], np.array([1.0, 2.0+1e-12])),
+                     cache.getKey("Individual1", [1.0, 2.0], np.array([[1.0, 2.0]])),
+                     cache.getKey("Individual1", [1.0, 2.0], np.array([1.0, 2.0], dtype=np.float32)),
+                     cache.getKey("Individual1", [1.0, 2.0], [1.0, 2.0])]
+        self.assertEqual(len(set(otherKeys+[key])), len(otherKeys)+1)
+        self.assertNotEqual(cache.getKey("1"), cache.getKey(1))
+        self.assertNotEqual(cache.getKey(["a", "b"]), cache.getKey(["a b"]))
+
+    def testGetPut(self):
+        directory = os.path.join(self.directory, "cache")
+        cache = PKPDResultCache(directory)
+        key = cache.getKey("Individual1")
+        self.assertIsNone(cache.get(key))
+        cache.put(key, {"parameters": np.array([1.0, 2.0])})
+        np.testing.assert_array_equal(cache.get(key)["parameters"], [1.0, 2.0])
+
+        # Results are kept for the next executions, and damaged files are ignored
+        cache = PKPDResultCache(directory)
+        np.testing.assert_array_equal(cache.get(key)["parameters"], [1.0, 2.0])
+        fh = open(os.path.join(directory, key+".pkl"), "wb")
+        fh.write(b"damaged")
+        fh.close()
+        self.assertIsNone(cache.get(key))
+        self.assertEqual([fn for fn in os.listdir(directory) if fn.endswith(".tmp")], [])
+
+    def testPrune(self):
+        directory = os.path.join(self.directory, "cache")
+        cache = PKPDResultCache(directory)
+        keys = [cache.getKey("Individual%d"%n) for n in range(4)]
+        for n, key in enumerate(keys):
+            cache.put(key, n)
+
+        # Only the results read or written by this execution are kept
+        cache = PKPDResultCache(directory)
+        self.assertEqual(cache.get(keys[0]), 0)
+        cache.put(keys[2], 20)
+        self.assertIsNone(cache.get(cache.getKey("Individual5")))
+        cache.prune()
+        self.assertEqual(sorted(os.listdir(directory)), sorted([keys[0]+".pkl", keys[2]+".pkl"]))
+        cache = PKPDResultCache(directory)
+        self.assertEqual(cache.get(keys[2]), 20)
+        self.assertIsNone(cache.get(keys[1]))
+
+
+class TestFitResultCache(unittest.TestCase):
+    """ Fits reused by the fit protocols when they are executed again """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def fit(self, experiment, **kwargs):
+        """ Fitting and names of the samples that were fitted (not reused) """
+        args = dict(predictor="t", predicted="Cp", Nexp=1, bounds="(0.0,10.0);(0.0,1.0)")
+        args.update(kwargs)
+        protocol = createProtocol(ProtPKPDExponentialFit, **args)
+        protocol._getExtraPath = lambda *paths: os.path.join(self.directory, *paths)
+        protocol.experiment = experiment
+        cache = protocol.getResultCache()
+        fitted = []
+        put = cache.put
+        def putAndRecord(key, sampleFit):
+            fitted.append(sampleFit.sampleName)
+            put(key, sampleFit)
+        cache.put = putAndRecord
+        np.random.seed(1)
+        with _output(False):
+            fitting = protocol.fitExperiment(cache=cache)
+        cache.prune()
+        return fitting, fitted
+
+    def getCacheSize(self):
+        return len(os.listdir(os.path.join(self.directory, "resultCache")))
+
+    def testReuse(self):
+        fitting, fitted = self.fit(createDecayExperiment(4))
+        self.assertEqual(len(fitted), 4)
+        fittingAgain, fitted = self.fit(createDecayExperiment(4))
+        self.assertEqual(fitted, [])
+        self.assertEqual([formatSampleFit(sampleFit) for sampleFit in fitting.sampleFits],
+                         [formatSampleFit(sampleFit) for sampleFit in fittingAgain.sampleFits])
+
+        # Options that do not change the results do not invalidate them
+        _, fitted = self.fit(createDecayExperiment(4), writeToExcel=False, runName="Another name")
+        self.assertEqual(fitted, [])
+
+    def testInputChanges(self):
+        self.fit(createDecayExperiment(4))
+
+        # Only the sample whose measurements have changed is fitted again
+        experiment = createDecayExperiment(4)
+        sample = experiment.samples["Individual2"]
+        sample.addMeasurementColumn("Cp", np.asarray(sample.getValues("Cp"), dtype=np.float64)*1.1)
+        _, fitted = self.fit(experiment)
+        self.assertEqual(fitted, ["Individual2"])
+
+        # New samples are fitted, the units of the variables affect all samples
+        _, fitted = self.fit(createDecayExperiment(5))
+        self.assertEqual(fitted, ["Individual2", "Individual4"])
+        _, fitted = self.fit(createDecayExperiment(5, timeUnits="h"))
+        self.assertEqual(len(fitted), 5)
+
+    def testParameterChanges(self):
+        self.fit(createDecayExperiment(3))
+        _, fitted = self.fit(createDecayExperiment(3), bounds="(0.0,20.0);(0.0,1.0)")
+        self.assertEqual(len(fitted), 3)
+        _, fitted = self.fit(createDecayExperiment(3), bounds="(0.0,20.0);(0.0,1.0)", confidenceInterval=90)
+        self.assertEqual(len(fitted), 3)
+        _, fitted = self.fit(createDecayExperiment(3), bounds="(0.0,20.0);(0.0,1.0)", confidenceInterval=90)
+        self.assertEqual(fitted, [])
+
+    def testPrune(self):
+        # Only the results of the last execution are kept
+        self.fit(createDecayExperiment(4))
+        self.assertEqual(self.getCacheSize(), 4)
+        self.fit(createDecayExperiment(2))
+        self.assertEqual(self.getCacheSize(), 2)
+        _, fitted = self.fit(createDecayExperiment(4))
+        self.assertEqual(fitted, ["Individual2", "Individual3"])
+
+
+if __name__ == '__main__':
+    unittest.main()
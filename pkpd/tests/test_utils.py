@@ -0,0 +1,75 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (info@kinestat.com)
+# *
+# * Kinestat Pharma
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'info@kinestat.com'
+# *
+# **************************************************************************
+
+import unittest
+
+import numpy as np
+
+from pkpd.utils import averageProfiles
+
+
+class TestAverageProfiles(unittest.TestCase):
+    def testCommonGrid(self):
+        t = [0, 1, 2]
+        yList = [[1, 2, 8], [4, 8, 2], [16, 32, 4]]
+        for mode, expected in [("mean", [7, 14, 14.0/3]), ("median", [4, 8, 4]), ("geomean", [4, 8, 4])]:
+            x, yAvg, yPercentiles = averageProfiles([t, t, t], yList, mode)
+            np.testing.assert_array_equal(x, t)
+            np.testing.assert_allclose(yAvg, expected)
+            self.assertIsNone(yPercentiles)
+
+    def testDifferentGrids(self):
+        # Each profile is interpolated only within its own time range
+        x, yAvg, _ = averageProfiles([[0, 1, 2], [1, 3]], [[0, 2, 4], [2, 6]])
+        np.testing.assert_array_equal(x, [0, 1, 2, 3])
+        np.testing.assert_allclose(yAvg, [0, 2, 4, 6])
+
+        # Unsorted profiles with repeated times
+        x, yAvg, _ = averageProfiles([[2, 0, 1, 1], [0, 2]], [[4, 0, 2, 2], [2, 2]])
+        np.testing.assert_array_equal(x, [0, 1, 2])
+        np.testing.assert_allclose(yAvg, [1, 2, 3])
+
+    def testGeometricMeanNonPositive(self):
+        # The geometric mean is missing where any profile is zero or negative, it does not skip those values
+        x, yAvg, _ = averageProfiles([[0, 1, 2], [0, 1, 2]], [[1, -1, 0], [4, 2, 2]], "geomean")
+        np.testing.assert_allclose(yAvg[0], 2)
+        self.assertTrue(np.all(np.isnan(yAvg[1:])))
+
+        # Points outside the range of a profile are not missing values
+        x, yAvg, _ = averageProfiles([[0, 1], [1, 2]], [[4, 1], [4, 9]], "geomean")
+        np.testing.assert_allclose(yAvg, [4, 2, 9])
+
+    def testPercentiles(self):
+        t = [0, 1]
+        x, yAvg, yPercentiles = averageProfiles([t]*5, [[n, 10*n] for n in range(5)], "median", [5, 50, 95])
+        self.assertEqual(yPercentiles.shape, (3, 2))
+        np.testing.assert_allclose(yPercentiles[1], yAvg)
+        np.testing.assert_allclose(yPercentiles[0], [0.2, 2])
+        np.testing.assert_allclose(yPercentiles[2], [3.8, 38])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -33,12 +33,14 @@ except ImportError:
     izip = zip
 import numpy as np
 import math
-from scipy.interpolate import InterpolatedUnivariateSpline, pchip_interpolate
 import time
 import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import warnings
 from os.path import (exists, splitext, getmtime)
-from openpyxl.styles import Font, PatternFill
-from openpyxl.utils.cell import get_column_letter
 
 def parseRange(auxString):
     if auxString=="":
@@ -103,6 +105,67 @@ def verifyMD5(fn):
         fn=fnFile
     return getMD5String(fn)==md5StringFile
 
+def _updateHash(mhash, value):
+    # The type is hashed with the value so that, e.g., 1, 1.0 and "1" give different keys
+    if isinstance(value, np.ndarray) and value.dtype!=object:
+        mhash.update(("ndarray %s %s:"%(value.dtype.str,value.shape)).encode("utf-8"))
+        mhash.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple, np.ndarray)):
+        mhash.update(("%s %d:"%(type(value).__name__,len(value))).encode("utf-8"))
+        for item in value:
+            _updateHash(mhash, item)
+    elif isinstance(value, dict):
+        mhash.update(("dict %d:"%len(value)).encode("utf-8"))
+        for key in sorted(value.keys()):
+            _updateHash(mhash, key)
+            _updateHash(mhash, value[key])
+    else:
+        mhash.update(("%s %r;"%(type(value).__name__,value)).encode("utf-8"))
+
+class PKPDResultCache:
+    """ Results of previous executions of a protocol, one pickle file per result in a directory. Each result is
+        stored under a hash of everything it depends on, so that a new execution only computes the results whose
+        inputs are new or have changed """
+    def __init__(self, directory):
+        self.directory = directory
+        if not exists(directory):
+            os.makedirs(directory)
+        self.usedKeys = set()
+
+    def getKey(self, *dependencies):
+        mhash = hashlib.md5()
+        _updateHash(mhash, dependencies)
+        return mhash.hexdigest()
+
+    def _getFilename(self, key):
+        return os.path.join(self.directory, key+".pkl")
+
+    def get(self, key):
+        """ Result stored with this key (None if there is none) """
+        self.usedKeys.add(key)
+        fn = self._getFilename(key)
+        if not exists(fn):
+            return None
+        try:
+            with open(fn, "rb") as fh:
+                return pickle.load(fh)
+        except Exception:
+            # A damaged file is computed again
+            return None
+
+    def put(self, key, result):
+        self.usedKeys.add(key)
+        fn = self._getFilename(key)
+        with open(fn+".tmp", "wb") as fh:
+            pickle.dump(result, fh, pickle.HIGHEST_PROTOCOL)
+        os.replace(fn+".tmp", fn)
+
+    def prune(self):
+        """ Remove the results that have not been used since the cache was opened """
+        for fn in os.listdir(self.directory):
+            if splitext(fn)[0] not in self.usedKeys:
+                os.remove(os.path.join(self.directory, fn))
+
 def uniqueFloatValues(x,y, TOL=-1):
     xp=np.asarray(x,dtype=np.float64)
     yp=np.asarray(y,dtype=np.float64)
@@ -149,23 +212,134 @@ def twoWayUniqueFloatValues(x,y):
     x2,y2=uniqueFloatValues(x1,y1)
     return x2,y2
 
+def stackProfiles(xList, yList):
+    """ Matrices with one profile per row and a mask of the valid entries. Shorter profiles are padded with their
+        last point, so that the time and concentration increments beyond their end are 0 """
+    N = len(xList)
+    T = max([len(x) for x in xList]) if N>0 else 0
+    X = np.zeros((N,T))
+    Y = np.zeros((N,T))
+    mask = np.zeros((N,T),dtype=bool)
+    for i in range(N):
+        n = len(xList[i])
+        X[i,:n] = xList[i]
+        Y[i,:n] = yList[i]
+        X[i,n:] = X[i,n-1]
+        Y[i,n:] = Y[i,n-1]
+        mask[i,:n] = True
+    return X, Y, mask
+
+def averageProfiles(xList, yList, mode="mean", percentiles=None):
+    """ Average of several profiles on the union of all their x values. Each profile is linearly interpolated
+        only within its own x range, and the aggregation (mean, median or geomean) along the profiles ignores
+        the missing values. The geometric mean is NaN at the x values where any profile is zero or negative.
+        It returns the x grid, the aggregated profile and the requested percentiles (one row per percentile,
+        or None) """
+    xList = [np.asarray(x,dtype=np.float64).ravel() for x in xList if len(x)>0]
+    yList = [np.asarray(y,dtype=np.float64).ravel() for y in yList if len(y)>0]
+    xAll = np.unique(np.concatenate(xList)) if len(xList)>0 else np.zeros(0)
+    xAll = xAll[np.isfinite(xAll)]
+
+    # The profiles are sorted and their repeated x values removed all at once
+    X, Yprofiles, mask = stackProfiles(xList, yList)
+    X[np.logical_not(mask)] = np.nan
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        i0 = np.searchsorted(xAll,np.nanmin(X,axis=1),side="left")
+        iF = np.searchsorted(xAll,np.nanmax(X,axis=1),side="right")
+    X, Yprofiles, valid = uniqueFloatRows(X, Yprofiles)
+    if np.all(valid) and X.shape[1]==xAll.size and np.all(X==xAll):
+        # All profiles are measured at the same x
+        Y = Yprofiles
+    else:
+        Y = np.full((len(xList),xAll.size),np.nan)
+        for i in range(len(xList)):
+            if np.any(valid[i]):
+                Y[i,i0[i]:iF[i]] = np.interp(xAll[i0[i]:iF[i]],X[i][valid[i]],Yprofiles[i][valid[i]])
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning) # Points without any profile are NaN
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if mode=="median":
+                yAvg = np.nanmedian(Y,axis=0)
+            elif mode=="geomean":
+                yAvg = np.exp(np.nanmean(np.log(np.where(Y>0,Y,np.nan)),axis=0))
+                yAvg[np.any(Y<=0,axis=0)] = np.nan
+            else:
+                yAvg = np.nanmean(Y,axis=0)
+            yPercentiles = None
+            if percentiles is not None and len(percentiles)>0:
+                yPercentiles = np.atleast_2d(np.nanpercentile(Y,percentiles,axis=0))
+    return xAll, yAvg, yPercentiles
+
 def calculateAUC0t(t, C):
     # Make sure that the (0,0) sample is present
-    AUC0t = np.zeros(t.shape[0])
-    for idx in range(1,t.shape[0]):
-        dt = (t[idx]-t[idx-1])
-        if C[idx]>=C[idx-1]: # Trapezoidal in the raise
-            AUC0t[idx] = AUC0t[idx-1]+0.5*dt*(C[idx-1]+C[idx])
-        else: # Log-trapezoidal in the decay
-            if C[idx-1]>0 and C[idx]>0:
-                decrement = C[idx-1]/C[idx]
-                K = math.log(decrement)
-                # B = K/dt
-                AUC0t[idx] = AUC0t[idx-1]+dt*(C[idx-1]-C[idx])/K
-            else:
-                AUC0t[idx] = AUC0t[idx-1]
+    # t and C may be matrices with one profile per row (t may also be a single row common to all profiles)
+    t = np.asarray(t,dtype=np.float64)
+    C = np.asarray(C,dtype=np.float64)
+    dt = np.diff(t,axis=-1)
+    C0 = C[...,:-1]
+    C1 = C[...,1:]
+    decay = (C1<C0) & (C0>0) & (C1>0)
+    K = np.log(np.divide(C0, C1, out=np.ones(np.broadcast(C0,C1).shape), where=decay))
+    increment = np.where(C1>=C0, 0.5*dt*(C0+C1), # Trapezoidal in the raise
+                         np.divide(dt*(C0-C1), K, out=np.zeros(K.shape), where=decay)) # Log-trapezoidal in the decay
+    AUC0t = np.zeros(np.broadcast(t,C).shape)
+    AUC0t[...,1:] = np.cumsum(increment,axis=-1)
     return AUC0t
 
+def _asColumn(k):
+    # Rate constants are scalars or one value per profile
+    k = np.asarray(k,dtype=np.float64)
+    return k[...,np.newaxis] if k.ndim>0 else k
+
+def calculateCperipheral(t, Cp, k12, k21):
+    """ Concentration in the peripheral compartment of the Loo-Riegelman method, one profile per row.
+        Cperipheral(t_n)=k12*Delta Cp*Delta t/2+k12/k21 * Cp(t_n-1)(1-exp(-k21*Delta t))+Cperipheral(t_n-1)*exp(-k21*Delta t)
+        The recursion runs over time for all profiles at once """
+    t = np.asarray(t,dtype=np.float64)
+    Cp = np.asarray(Cp,dtype=np.float64)
+    k12 = _asColumn(k12)
+    k21 = _asColumn(k21)
+    DeltaT = np.diff(t,axis=-1)
+    decay = np.exp(-k21*DeltaT)
+    inflow = k12*np.abs(np.diff(Cp,axis=-1))*DeltaT*0.5 + k12/k21*Cp[...,:-1]*(1-decay)
+    inflow, decay = np.broadcast_arrays(inflow, decay)
+    Cperipheral = np.zeros(inflow.shape[:-1]+(inflow.shape[-1]+1,))
+    for n in range(1,Cperipheral.shape[-1]):
+        Cperipheral[...,n] = np.maximum(inflow[...,n-1]+Cperipheral[...,n-1]*decay[...,n-1],0.0)
+    return Cperipheral
+
+def calculateWagnerNelson(t, Cp, Ke):
+    """ Amount absorbed (Cp(t)+Ke*AUC0t(t))/Ke and AUC0t, one profile per row with one Ke per profile """
+    Ke = _asColumn(Ke)
+    AUC0t = calculateAUC0t(t,Cp)
+    return (Cp + Ke * AUC0t) / Ke, AUC0t
+
+def calculateLooRiegelman(t, Cp, k10, k12, k21):
+    """ Amount absorbed (Cp(t)+Cperipheral(t)+k10*AUC0t(t))/k10 and AUC0t, one profile per row with one set of
+        rate constants per profile """
+    k10 = _asColumn(k10)
+    AUC0t = calculateAUC0t(t,Cp)
+    Cperipheral = calculateCperipheral(t,Cp,k12,k21)
+    return (Cp + Cperipheral + k10 * AUC0t) / k10, AUC0t
+
+def calculateInverseLooRiegelman(t, A, k10, k12, k21, V, Vp):
+    """ Central and peripheral concentrations that produce the amount absorbed A, one profile per row """
+    t = np.asarray(t,dtype=np.float64)
+    A = np.asarray(A,dtype=np.float64)
+    k10, k12, k21, V, Vp = [_asColumn(k) for k in (k10, k12, k21, V, Vp)]
+    DeltaA = np.abs(np.diff(A,axis=-1))/V
+    DeltaT = np.broadcast_to(np.diff(t,axis=-1),DeltaA.shape)
+    k10, k12, k21, V, Vp = [np.broadcast_to(k,DeltaA.shape[:-1]+(1,))[...,0] for k in (k10, k12, k21, V, Vp)]
+    C = np.zeros(DeltaA.shape[:-1]+(DeltaA.shape[-1]+1,))
+    Cp = np.zeros(C.shape)
+    for n in range(1,C.shape[-1]):
+        dt = DeltaT[...,n-1]
+        C[...,n] = np.maximum(C[...,n-1]-k10*C[...,n-1]*dt-k12*C[...,n-1]*dt+k21*Vp/V*Cp[...,n-1]*dt+DeltaA[...,n-1],0.0)
+        Cp[...,n] = np.maximum(Cp[...,n-1]+k12*V/Vp*C[...,n-1]*dt-k21*Cp[...,n-1]*dt,0.0)
+    return C, Cp
+
 def upper_tri_masking(A):
     # Extract the upper triangular matrix without the diagonal
     r = np.arange(A.shape[0])
@@ -202,7 +376,184 @@ def parseOperation(operation):
         parsedOperation=ldict['parsedOperation']
     return parsedOperation, varList, coeffList
 
+# Excel export mode: "sync" (default), "background" or "none". It can be changed globally with the
+# environment variable PKPD_EXCEL_EXPORT or with setExcelExportMode
+EXCEL_EXPORT_BACKGROUND = "background"
+EXCEL_EXPORT_SYNC = "sync"
+EXCEL_EXPORT_NONE = "none"
+_excelExportMode = os.environ.get("PKPD_EXCEL_EXPORT", EXCEL_EXPORT_SYNC).strip().lower()
+_excelExportThreads = [] # (fnXls, thread, errors) of the files being written in the background
+
+def setExcelExportMode(mode):
+    global _excelExportMode
+    if mode not in (EXCEL_EXPORT_BACKGROUND, EXCEL_EXPORT_SYNC, EXCEL_EXPORT_NONE):
+        raise Exception("Unknown Excel export mode %s"%mode)
+    _excelExportMode = mode
+
+def excelExportEnabled():
+    return _excelExportMode not in (EXCEL_EXPORT_NONE, "no", "0", "false", "off")
+
+def excelWaitForExports(fnXls=None):
+    """ Wait for the Excel files that are being written in the background (only fnXls if it is given).
+        Errors of the background exports are raised here """
+    pending = [export for export in _excelExportThreads if fnXls is None or export[0]==fnXls]
+    errors = []
+    for export in pending:
+        export[1].join()
+        _excelExportThreads.remove(export)
+        errors += export[2]
+    if errors:
+        raise Exception("Cannot write the Excel file %s: %s"%(errors[0][0],errors[0][1]))
+
+class _ExcelSheetSpool:
+    # Rows of a sheet are kept in a temporary file until the workbook is saved. Only the last row is in memory
+    def __init__(self, title):
+        self.title = title
+        self.fh = tempfile.TemporaryFile()
+        self.row = 0
+        self.cells = {}
+        self.fill = None
+        self.widths = {}
+        self.adjustWidths = False
+
+    def goToRow(self, row):
+        if row<self.row:
+            raise Exception("Excel rows must be written in increasing order (row %d after row %d)"%(row,self.row))
+        if row>self.row:
+            self.flush()
+            self.row = row
+
+    def flush(self):
+        if self.cells or self.fill:
+            pickle.dump((self.row, self.cells, self.fill), self.fh, pickle.HIGHEST_PROTOCOL)
+        self.cells = {}
+        self.fill = None
+
+    def rows(self):
+        self.flush()
+        self.fh.seek(0)
+        while True:
+            try:
+                yield pickle.load(self.fh)
+            except EOFError:
+                break
+
+    def close(self):
+        self.fh.close()
+
+class ExcelStreamWriter:
+    """ Write-only workbook. Rows must be produced in increasing order (several calls may fill different
+        columns of the same row). They are spooled to disk and, on save, streamed with openpyxl write-only
+        worksheets so that the whole workbook is never held in memory """
+    def __init__(self, sheetName="Sheet"):
+        self.defaultSheet = sheetName
+        self.sheets = {}
+        self.sheetnames = []
+        self.getSheet(sheetName)
+
+    def getSheet(self, sheetName=""):
+        if sheetName=="":
+            sheetName=self.defaultSheet
+        if not sheetName in self.sheets:
+            self.sheets[sheetName] = _ExcelSheetSpool(sheetName)
+            self.sheetnames.append(sheetName)
+        return self.sheets[sheetName]
+
+    def writeRow(self, msgList, row, col=1, sheetName="", bold=False):
+        sheet = self.getSheet(sheetName)
+        sheet.goToRow(row)
+        for msg in msgList:
+            if isinstance(msg,bool):
+                msg = str(msg)
+            elif not isinstance(msg,(str,int,float)) and msg is not None:
+                from openpyxl.cell import WriteOnlyCell
+                try:
+                    msg = WriteOnlyCell(None, value=msg).value
+                except:
+                    print("Cannot convert the cell row=%d, col=%d"%(row,col),msg)
+                    msg = None
+            sheet.cells[col] = (msg, bold)
+            sheet.widths[col] = max(sheet.widths.get(col, 0), len(as_text(msg)))
+            col+=1
+
+    def fillCells(self, row, col0=1, colF=10, sheetName="", fillColor="54B948"):
+        sheet = self.getSheet(sheetName)
+        sheet.goToRow(row)
+        sheet.fill = (col0, colF, fillColor)
+
+    def adjustColumnWidths(self, sheetName=""):
+        self.getSheet(sheetName).adjustWidths = True
+
+    def _save(self, fnXls):
+        import openpyxl
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font, PatternFill
+        from openpyxl.utils.cell import get_column_letter
+
+        wb = openpyxl.Workbook(write_only=True)
+        for sheetName in self.sheetnames:
+            spool = self.sheets[sheetName]
+            ws = wb.create_sheet(sheetName)
+            if spool.adjustWidths:
+                for col, width in spool.widths.items():
+                    ws.column_dimensions[get_column_letter(col)].width = width
+            lastRow = 0
+            for row, cells, fill in spool.rows():
+                for _ in range(lastRow+1, row):
+                    ws.append([])
+                lastRow = row
+                Ncols = max(cells.keys()) if cells else 0
+                if fill is not None:
+                    Ncols = max(Ncols, fill[1])
+                rowCells = []
+                for col in range(1, Ncols+1):
+                    value, bold = cells.get(col, (None, False))
+                    filled = fill is not None and fill[0]<=col<=fill[1]
+                    if bold or filled:
+                        cell = WriteOnlyCell(ws, value=value)
+                        if bold:
+                            cell.font = Font(bold=True)
+                        if filled:
+                            cell.fill = PatternFill(bgColor=fill[2], fill_type="solid")
+                        rowCells.append(cell)
+                    else:
+                        rowCells.append(value)
+                ws.append(rowCells)
+            spool.close()
+        wb.save(fnXls)
+
+    def save(self, fnXls, background=None):
+        """ The spooled rows are converted into an Excel file. This is done in a background thread if
+            background is True or the export mode is "background" (see PKPD_EXCEL_EXPORT), then
+            excelWaitForExports must be called before the file is used """
+        for sheetName in self.sheetnames:
+            self.sheets[sheetName].flush()
+        if background is None:
+            background = _excelExportMode==EXCEL_EXPORT_BACKGROUND
+        # A previous export of the same file must finish before this one starts
+        excelWaitForExports(fnXls)
+        if background:
+            errors = []
+            def saveInBackground():
+                try:
+                    self._save(fnXls)
+                except Exception as e:
+                    errors.append((fnXls, e))
+            thread = threading.Thread(target=saveInBackground)
+            thread.start()
+            _excelExportThreads.append((fnXls, thread, errors))
+        else:
+            self._save(fnXls)
+
 def excelWriteRow(msgList, workbook, row, col=1, sheetName="", bold=False):
+    from openpyxl.styles import Font
+    if type(msgList)!=list:
+        msgList2=[msgList]
+    else:
+        msgList2=msgList
+    if isinstance(workbook, ExcelStreamWriter):
+        workbook.writeRow(msgList2, row, col, sheetName, bold)
+        return
     currentCol=col
     if sheetName!="":
         if not sheetName in workbook.sheetnames:
@@ -210,10 +561,6 @@ def excelWriteRow(msgList, workbook, row, col=1, sheetName="", bold=False):
         sheet=workbook[sheetName]
     else:
         sheet=workbook.active
-    if type(msgList)!=list:
-        msgList2=[msgList]
-    else:
-        msgList2=msgList
     for msg in msgList2:
         c = sheet.cell(row=row, column=currentCol)
         try:
@@ -228,6 +575,10 @@ def excelWriteRow(msgList, workbook, row, col=1, sheetName="", bold=False):
         currentCol+=1
 
 def excelFillCells(workbook, row, col0=1, colF=10, sheetName="", fillColor="54B948"):
+    from openpyxl.styles import PatternFill
+    if isinstance(workbook, ExcelStreamWriter):
+        workbook.fillCells(row, col0, colF, sheetName, fillColor)
+        return
     if sheetName!="":
         if not sheetName in workbook.sheetnames:
             workbook.create_sheet(sheetName)
@@ -245,6 +596,10 @@ def as_text(value):
     return str(value)
 
 def excelAdjustColumnWidths(workbook, sheetName=""):
+    from openpyxl.utils.cell import get_column_letter
+    if isinstance(workbook, ExcelStreamWriter):
+        workbook.adjustColumnWidths(sheetName)
+        return
     if sheetName!="":
         if not sheetName in workbook.sheetnames:
             workbook.create_sheet(sheetName)
@@ -257,6 +612,7 @@ def excelAdjustColumnWidths(workbook, sheetName=""):
         sheet.column_dimensions[get_column_letter(column_cells[0].column)].width = length
 
 def computeXYmean(XYlist, Nxsteps=300, common=False):
+    from scipy.interpolate import InterpolatedUnivariateSpline
     xmin = None
     xmax = None
     for x,_ in XYlist:
@@ -302,10 +658,12 @@ def computeXYmean(XYlist, Nxsteps=300, common=False):
     return sortedX, Y
 
 def smoothPchip(x,y):
-    d=np.insert(np.diff(y),0,0)
+    # y may have one profile per row
+    y=np.asarray(y,dtype=np.float64)
+    d=np.diff(y,axis=-1,prepend=y[...,:1])
     d[d<0]=0
-    ypos=np.cumsum(d)
-    ypos=ypos*np.sum(y)/np.sum(ypos)
+    ypos=np.cumsum(d,axis=-1)
+    ypos=ypos*np.sum(y,axis=-1,keepdims=True)/np.sum(ypos,axis=-1,keepdims=True)
     return ypos
     #xunique, yunique = uniqueFloatValues(x,ypos)
     #yInterpolated = pchip_interpolate(xunique,yunique,x)
@@ -321,3 +679,112 @@ def int_dx1dx2(x1, x2, y):
     dx1 = np.diff(x1)
     dx2 = np.diff(x2)
     return np.sum(np.multiply(np.sum(np.multiply(y,dx2),axis=1),dx1))
+
+def interpLinear(x, xp, fp):
+    # Piecewise linear interpolation of the monotone table (xp,fp) evaluated at all x at once.
+    # Outside [xp[0],xp[-1]] the first/last segment is extrapolated, as
+    # InterpolatedUnivariateSpline(xp, fp, k=1) does. xp must be strictly increasing.
+    x = np.asarray(x, dtype=np.float64)
+    xp = np.asarray(xp, dtype=np.float64)
+    fp = np.asarray(fp, dtype=np.float64)
+    if xp.size==1:
+        return np.full(x.shape, fp[0])
+    idx = np.clip(np.searchsorted(xp, x, side="right")-1, 0, xp.size-2)
+    slope = (fp[idx+1]-fp[idx])/(xp[idx+1]-xp[idx])
+    return fp[idx]+slope*(x-xp[idx])
+
+def uniqueFloatRows(x, y):
+    # Row-wise uniqueFloatValues: each row of (x,y) is sorted by x (and y for ties) and the points that are
+    # closer than the tolerance of uniqueFloatValues to the previous one, or are NaN, are marked as not valid.
+    # x may be a matrix and y a row common to all of them
+    x = np.asarray(x, dtype=np.float64)
+    y = np.broadcast_to(np.asarray(y, dtype=np.float64), x.shape)
+    idx = np.lexsort((y, x), axis=-1)
+    xs = np.take_along_axis(x, idx, axis=-1)
+    ys = np.take_along_axis(y, idx, axis=-1)
+    finite = np.logical_not(np.logical_or(np.isnan(xs), np.isnan(ys)))
+    with np.errstate(invalid="ignore"):
+        TOL = np.nanmax(np.where(finite, xs, np.nan), axis=-1, keepdims=True)/(np.sum(finite, axis=-1, keepdims=True)*1e3)
+    # Distance to the previous finite value
+    previous = np.maximum.accumulate(np.where(finite, np.arange(xs.shape[-1]), -1), axis=-1)
+    previous = np.concatenate([np.full(previous.shape[:-1]+(1,), -1), previous[...,:-1]], axis=-1)
+    d = xs-np.take_along_axis(xs, np.maximum(previous, 0), axis=-1)
+    valid = np.logical_and(finite, np.logical_or(previous<0, d>TOL))
+    return xs, ys, valid
+
+def interpLinearRows(x, xp, fp, valid=None):
+    # Row-wise interpLinear: row i of the result interpolates x (or its row i) in the table (xp[i],fp[i]).
+    # Each row of xp must be sorted, the points that are not valid (see uniqueFloatRows) are skipped.
+    # Rows with a single valid point are constant and rows without valid points are NaN
+    xp = np.atleast_2d(np.asarray(xp, dtype=np.float64))
+    fp = np.atleast_2d(np.asarray(fp, dtype=np.float64))
+    Nrows, N = xp.shape
+    x = np.asarray(x, dtype=np.float64)
+    x = np.broadcast_to(x, (Nrows, x.shape[-1]))
+    if valid is None:
+        valid = np.ones(xp.shape, dtype=bool)
+    Nvalid = np.sum(valid, axis=1)
+    rows = np.arange(Nrows)[:,np.newaxis]
+
+    # Move the valid points to the beginning of each row
+    order = np.argsort(np.logical_not(valid), axis=1, kind="stable")
+    xp = np.take_along_axis(xp, order, axis=1)
+    fp = np.take_along_axis(fp, order, axis=1)
+    isValid = np.arange(N)<Nvalid[:,np.newaxis]
+
+    # Search all rows at once: each row is mapped to [3*row,3*row+1] and the invalid points to 3*row+2
+    xmin = xp[:,0]
+    span = xp[np.arange(Nrows), np.maximum(Nvalid-1, 0)]-xmin
+    span[np.logical_not(span>0)] = 1.0
+    with np.errstate(invalid="ignore"):
+        xpRows = np.where(isValid, (xp-xmin[:,np.newaxis])/span[:,np.newaxis], 2.0)+3*rows
+        xRows = np.clip((x-xmin[:,np.newaxis])/span[:,np.newaxis], 0.0, 1.0)+3*rows
+    xRows[np.isnan(xRows)] = 0.0
+    idx = np.searchsorted(xpRows.ravel(), xRows.ravel(), side="right").reshape(x.shape)-1-N*rows
+    idx = np.clip(idx, 0, np.maximum(Nvalid-2, 0)[:,np.newaxis])
+    idx1 = np.minimum(idx+1, N-1)
+
+    x0 = np.take_along_axis(xp, idx, axis=1)
+    f0 = np.take_along_axis(fp, idx, axis=1)
+    dx = np.take_along_axis(xp, idx1, axis=1)-x0
+    df = np.take_along_axis(fp, idx1, axis=1)-f0
+    segment = np.logical_and(np.take_along_axis(isValid, idx1, axis=1), dx>0)
+    slope = np.where(segment, df/np.where(segment, dx, 1.0), 0.0)
+    retval = f0+slope*(x-x0)
+    retval[Nvalid==0] = np.nan
+    return retval
+
+def polyfitAllDegrees(x, y, maxDegree):
+    # Least squares polynomial fits of degrees 1..maxDegree from a single QR factorization
+    # of the (column normalized) Vandermonde matrix: the fit of degree d only uses the first
+    # d+1 columns, whose QR factorization is the leading block of the full one.
+    # The coefficients are returned as in np.polyfit (highest power first).
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    maxDegree = min(maxDegree, x.size-1)
+    if maxDegree<1:
+        return []
+    V = np.vander(x, maxDegree+1, increasing=True)
+    scale = np.sqrt(np.sum(V*V, axis=0))
+    scale[scale==0] = 1.0
+    Q, R = np.linalg.qr(V/scale)
+    Qty = np.dot(Q.T, y)
+    retval = []
+    for degree in range(1, maxDegree+1):
+        n = degree+1
+        coeffs = np.linalg.lstsq(R[:n,:n], Qty[:n], rcond=None)[0]/scale[:n]
+        retval.append(coeffs[::-1])
+    return retval
+
+def factorialGridSize(valueLists):
+    return int(np.prod([len(values) for values in valueLists],dtype=np.int64))
+
+def factorialGrid(valueLists, start=0, stop=None):
+    # Combinations start..stop-1 of all the values in valueLists, in the same order as nested loops over
+    # the lists (the last list changes fastest). One column per list is returned, so that the grid can be
+    # evaluated in blocks without building all the combinations
+    shape = [len(values) for values in valueLists]
+    if stop is None:
+        stop = factorialGridSize(valueLists)
+    idx = np.unravel_index(np.arange(start, stop, dtype=np.int64), shape)
+    return [np.asarray(values, dtype=np.float64)[idxn] for values, idxn in zip(valueLists, idx)]
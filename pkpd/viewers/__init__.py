@@ -25,15 +25,43 @@
 # *
 # **************************************************************************
 
-from .viewer import (PKPDExperimentViewer, PKPDFittingViewer, PKPDCSVViewer,
-                     PKPDAnalysisViewer, PKPDStatisticsLabelViewer,
-                     PKPDRegressionLabelsViewer, PKPDPopulationViewer,
-                     PKPDAllometricScalingViewer)
-from .viewer_pkpd_BE_power_analysis import PKPDBEPowerAnalysisViewer
-from .viewer_pkpd_compare_experiments import PKPDCompareExperimentsViewer
-from .viewer_pkpd_dissolution_f2 import PKPDDissolutionF2Viewer
-from .viewer_pkpd_dissolution_ivivc_internal_validity import PKPDDissolutionIVIVCInternalValidityViewer
-from .viewer_pkpd_particle_size import PKPDParticleSizeViewer
-from .viewer_pkpd_simulate_drug_interactions import PKPDSimulateDrugInteractionsViewer
-from .viewer_pkpd_simulate_liver_flow import PKPDSimulateLiverFlowViewer
-from .viewer_pkpd_stats_mahalanobis import PKPDStatsMahalanobisViewer
+"""
+Viewers of the plugin. They are imported the first time that they are accessed, so that the plotting and
+graphical libraries are only loaded when a viewer is actually needed.
+"""
+import importlib
+
+# Name -> module that defines it
+_LAZY_IMPORTS = {
+    'PKPDExperimentViewer':                      'viewer',
+    'PKPDFittingViewer':                         'viewer',
+    'PKPDCSVViewer':                             'viewer',
+    'PKPDAnalysisViewer':                        'viewer',
+    'PKPDStatisticsLabelViewer':                 'viewer',
+    'PKPDRegressionLabelsViewer':                'viewer',
+    'PKPDPopulationViewer':                      'viewer',
+    'PKPDAllometricScalingViewer':               'viewer',
+    'PKPDBEPowerAnalysisViewer':                 'viewer_pkpd_BE_power_analysis',
+    'PKPDCompareExperimentsViewer':              'viewer_pkpd_compare_experiments',
+    'PKPDDissolutionF2Viewer':                   'viewer_pkpd_dissolution_f2',
+    'PKPDDissolutionIVIVCInternalValidityViewer':'viewer_pkpd_dissolution_ivivc_internal_validity',
+    'PKPDParticleSizeViewer':                    'viewer_pkpd_particle_size',
+    'PKPDSimulateDrugInteractionsViewer':        'viewer_pkpd_simulate_drug_interactions',
+    'PKPDSimulateLiverFlowViewer':               'viewer_pkpd_simulate_liver_flow',
+    'PKPDStatsMahalanobisViewer':                'viewer_pkpd_stats_mahalanobis',
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_IMPORTS:
+        value = getattr(importlib.import_module("." + _LAZY_IMPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module %s has no attribute %s" % (__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_IMPORTS))
+
+
+__all__ = list(_LAZY_IMPORTS)
@@ -25,8 +25,11 @@
 # **************************************************************************
 
 import numpy as np
+import os
 
 from pyworkflow.viewer import Viewer, DESKTOP_TKINTER
+from pyworkflow.gui.dialog import askString
+from pyworkflow.utils import getListFromRangeString
 from pwem.viewers.plotter import EmPlotter
 
 from pkpd.protocols import ProtPKPDSimulateLiverFlow
@@ -36,12 +39,79 @@ class PKPDSimulateLiverFlowViewer(Viewer):
     _environments = [DESKTOP_TKINTER]
 
 
+    maxProfilePlots = 10 # Profiles that can be plotted at once
+    Nbins = 50
+    blockSize = 1024*1024 # Simulations whose summaries are read at once
+
+    def plotProfile(self, t, I3, legends, title="Simulation"):
+        plotter = EmPlotter(style='seaborn-whitegrid')
+        ax = plotter.createSubPlot(title, "t [h]", "[I] [mg/mL]")
+        for n in range(len(I3)):
+            ax.plot(t, I3[n], label=legends[n])
+        ax.legend()
+        plotter.show()
+
+    def histogram(self, values):
+        # The summaries may not fit in memory, the histogram is accumulated in blocks
+        vmin = min(float(np.min(values[i0:i0+self.blockSize])) for i0 in range(0, values.shape[0], self.blockSize))
+        vmax = max(float(np.max(values[i0:i0+self.blockSize])) for i0 in range(0, values.shape[0], self.blockSize))
+        edges = np.linspace(vmin, vmax if vmax>vmin else vmin+1, self.Nbins+1)
+        counts = np.zeros(self.Nbins)
+        for i0 in range(0, values.shape[0], self.blockSize):
+            counts += np.histogram(values[i0:i0+self.blockSize], bins=edges)[0]
+        return edges, counts
+
+    def plotSummaries(self, prot, summaries):
+        plotter = EmPlotter(x=len(prot.compartmentNames), y=2, style='seaborn-whitegrid',
+                            windowTitle="Summary of %d simulations"%summaries.shape[0])
+        for n, compartment in enumerate(prot.compartmentNames):
+            for m in [0, 2]: # Cmax and AUC
+                edges, counts = self.histogram(summaries[:,n,m])
+                ax = plotter.createSubPlot(compartment, prot.summaryNames[m], "Number of simulations")
+                ax.hist(edges[:-1], bins=edges, weights=counts)
+        plotter.show()
+
+    def askSimulations(self, Nsimulations):
+        """ Simulations (1-based, as in the protocol summary) whose profiles are plotted """
+        simulations = askString("Profiles to plot", "Simulations (e.g. 1-3 7, at most %d)"%self.maxProfilePlots,
+                                self.getTkRoot(), defaultValue="1-%d"%min(Nsimulations, 3))
+        if not simulations:
+            return []
+        try:
+            simulations = [n for n in getListFromRangeString(simulations) if 1<=n<=Nsimulations]
+        except ValueError:
+            return []
+        return simulations[:self.maxProfilePlots]
+
     def visualize(self, obj, **kwargs):
         prot = obj
+        legends = prot.compartmentNames
+        fnSummaries = prot._getPath("summaries.npy")
+        if os.path.exists(fnSummaries):
+            summaries = np.load(fnSummaries, mmap_mode='r')
+            self.plotSummaries(prot, summaries)
+            fnProfiles = prot._getPath("profiles.npy")
+            if os.path.exists(fnProfiles):
+                profiles = np.load(fnProfiles, mmap_mode='r')
+                t = prot.getProfileTimes()/60.0
+                for n in self.askSimulations(profiles.shape[0]):
+                    self.plotProfile(t, profiles[n-1], legends, "Simulation %d"%n)
+            return
+
+        fnProfiles = prot._getPath("profiles.npy")
+        if os.path.exists(fnProfiles):
+            # Profiles sampled every minute without summaries
+            profiles = np.load(fnProfiles, mmap_mode='r')
+            t = np.arange(profiles.shape[2])/60.0
+            for n in self.askSimulations(profiles.shape[0]):
+                self.plotProfile(t, profiles[n-1], legends, "Simulation %d"%n)
+            return
+
+        # Profiles written by previous versions of the protocol
         fnProfiles = prot._getPath("profiles.txt")
         fh = open(fnProfiles,"r")
         state = 0
-        legends = ['Iliver', 'Iinlet', 'Isys']
+        Nplots = 0
         for line in fh:
             if state==0:
                 tokens = line.split("::")
@@ -51,15 +121,12 @@ class PKPDSimulateLiverFlowViewer(Viewer):
             elif state==1:
                 tokens=line.strip().split()
                 if len(tokens)==0:
-                    plotter = EmPlotter(style='seaborn-whitegrid')
-                    ax = plotter.createSubPlot("Simulation", "t [h]", "[I] [mg/mL]")
                     t = np.asarray(I3[0],dtype=np.float64)/60
-                    for n in range(1,len(I3)):
-                        y = np.asarray(I3[n],dtype=np.float64)
-                        ax.plot(t, y, label=legends[n-1])
-                    ax.legend()
-                    plotter.show()
+                    self.plotProfile(t, [np.asarray(y,dtype=np.float64) for y in I3[1:]], legends, title)
                     state=0
+                    Nplots+=1
+                    if Nplots==self.maxProfilePlots:
+                        break
                 else:
                     if len(I3)==0:
                         for n in range(len(tokens)):
@@ -25,7 +25,7 @@
 # **************************************************************************
 
 import os
-from numpy import genfromtxt, isnan
+from numpy import float32, genfromtxt, histogram, isnan, linspace, memmap, zeros
 
 from pyworkflow.viewer import Viewer, DESKTOP_TKINTER
 from pwem.viewers.plotter import EmPlotter
@@ -36,20 +36,44 @@ class PKPDStatsMahalanobisViewer(Viewer):
     _targets = [ProtPKPDStatsMahalanobis]
     _environments = [DESKTOP_TKINTER]
 
-    def visualize(self, obj, **kwargs):
-        prot = obj
-        fn = prot._getExtraPath('D11.txt')
+    def plotDistances(self, prot, name):
+        fn = prot._getExtraPath('%s.bin'%name)
         if os.path.exists(fn):
-            D11 = genfromtxt(fn)
+            # Histogram computed by blocks, the distances may not fit in memory
+            D = memmap(fn, dtype=float32, mode='r')
+            blockSize = 4000000
+            Dmin = None
+            for i0 in range(0, D.size, blockSize):
+                Di = D[i0:i0+blockSize]
+                Di = Di[~isnan(Di)]
+                if Di.size>0:
+                    if Dmin is None:
+                        Dmin, Dmax = Di.min(), Di.max()
+                    else:
+                        Dmin, Dmax = min(Dmin, Di.min()), max(Dmax, Di.max())
+            if Dmin is None:
+                return
+            edges = linspace(Dmin, Dmax, 51)
+            counts = zeros(50)
+            for i0 in range(0, D.size, blockSize):
+                Di = D[i0:i0+blockSize]
+                counts += histogram(Di[~isnan(Di)], edges)[0]
             plotter = EmPlotter(style='seaborn-whitegrid')
-            plotter.createSubPlot("Histogram of D11", "D11", "Count")
-            plotter.plotHist(D11[~isnan(D11)], 50)
+            ax = plotter.createSubPlot("Histogram of %s"%name, name, "Count")
+            ax.hist(edges[:-1], edges, weights=counts, facecolor='blue')
             plotter.show()
+            return
 
-        fn = prot._getExtraPath('D12.txt')
+        # Distances written by previous versions of the protocol
+        fn = prot._getExtraPath('%s.txt'%name)
         if os.path.exists(fn):
-            D12 = genfromtxt(fn)
+            D = genfromtxt(fn)
             plotter = EmPlotter(style='seaborn-whitegrid')
-            plotter.createSubPlot("Histogram of D12", "D12", "Count")
-            plotter.plotHist(D12[~isnan(D12)], 50)
+            plotter.createSubPlot("Histogram of %s"%name, name, "Count")
+            plotter.plotHist(D[~isnan(D)], 50)
             plotter.show()
+
+    def visualize(self, obj, **kwargs):
+        prot = obj
+        self.plotDistances(prot, 'D11')
+        self.plotDistances(prot, 'D12')
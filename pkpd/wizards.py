@@ -25,6 +25,7 @@
 # *
 # **************************************************************************
 
+import os
 import tkinter as tk
 import tkinter.ttk as ttk
 from pyworkflow.wizard import Wizard
@@ -32,8 +33,21 @@ import pyworkflow.gui.dialog as dialog
 from pyworkflow.gui.tree import TreeProvider, BoundTree
 from pyworkflow.gui.dialog import ListDialog
 import pyworkflow.gui as gui
-
-from pkpd.protocols import *
+import pyworkflow.object as pwobj
+import pyworkflow.protocol.params as params
+
+from pkpd.protocols import (ProtPKPDChangeUnits, ProtPKPDChangeVia, ProtPKPDDissolutionFit, ProtPKPDDropMeasurements,
+                            ProtPKPDEliminationRate, ProtPKPDExponentialFit, ProtPKPDExportToCSV, ProtPKPDGenericFit,
+                            ProtPKPDImportFromText, ProtPKPDMonoCompartment, ProtPKPDMonoCompartmentClint,
+                            ProtPKPDMonoCompartmentConv, ProtPKPDMonoCompartmentLinkPD, ProtPKPDMonoCompartmentPD,
+                            ProtPKPDMonoCompartmentUrine, ProtPKPDNCANumeric, ProtPKPDODESimulate,
+                            ProtPKPDRegressionLabel, ProtPKPDScaleToCommonDose, ProtPKPDSimulateGenericPD,
+                            ProtPKPDStatsExp1Subgroups2Mean, ProtPKPDThreeCompartments, ProtPKPDTwoCompartments,
+                            ProtPKPDTwoCompartmentsAutoinduction, ProtPKPDTwoCompartmentsBoth,
+                            ProtPKPDTwoCompartmentsBothPD, ProtPKPDTwoCompartmentsClint,
+                            ProtPKPDTwoCompartmentsClintCl, ProtPKPDTwoCompartmentsClintMetabolite,
+                            ProtPKPDTwoCompartmentsConv, ProtPKPDTwoCompartmentsUrine, getVarNamesFromCSVfile,
+                            getSampleNamesFromCSVfile)
 from pkpd.viewers.tk_ode import PKPDODEDialog, PKPDFitDialog
 
 
@@ -381,7 +395,7 @@ class PKPDVariableTemplateWizard(Wizard):
         if not os.path.exists(fnCSV):
             form.showError("Select a valid CSV input file first.")
         else:
-            varNames = getVarNamesFromCSVfile(fnCSV)
+            varNames = getVarNamesFromCSVfile(fnCSV, protocol.getAttributeValue('delimiter', ';'))
             tp = SimpleListTreeProvider(varNames, name="Variables")
             dlg = dialog.ListDialog(form.root, "Choose variable(s)", tp,
                                     selectmode='extended')
@@ -440,7 +454,7 @@ class PKPDDosesToSamplesTemplateWizard(Wizard):
                 if len(tokens)==4:
                     doseNames.append(tokens[0].strip())
 
-            sampleNamesInCSV = getSampleNamesFromCSVfile(fnCSV)
+            sampleNamesInCSV = getSampleNamesFromCSVfile(fnCSV, protocol.getAttributeValue('delimiter', ';'))
             currentValue = protocol.getAttributeValue(label, "")
             sampleNamesAssigned = []
             for line in currentValue.replace('\n',';;').split(';;'):